@@ -31,6 +31,15 @@ class Customer(models.Model):
         verbose_name_plural = _('العملاء')
         ordering = ['name']
     
+    def save(self, *args, **kwargs):
+        # الرصيد يتغير فقط عبر قيود سجل الرصيد (F-expression)، فلا يُكتب من نسخة قديمة عند حفظ باقي البيانات
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'balance'
+            ]
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return self.name
     
@@ -42,6 +51,29 @@ class Customer(models.Model):
         return self.credit_limit - self.balance
 
 
+class CustomerBalanceEntry(models.Model):
+    """
+    قيد في سجل رصيد العميل (سجل إضافة فقط)
+    
+    كل تغيير في رصيد العميل يُسجل كقيد بقيمة التغيير، والرصيد المخزن في العميل
+    يساوي دائماً مجموع قيوده.
+    """
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, verbose_name=_('العميل'),
+                                 related_name='balance_entries')
+    amount = models.DecimalField(_('قيمة التغيير'), max_digits=12, decimal_places=2)
+    source = models.CharField(_('المصدر'), max_length=50)
+    reference = models.CharField(_('المرجع'), max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('قيد رصيد العميل')
+        verbose_name_plural = _('قيود أرصدة العملاء')
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.customer} - {self.amount} - {self.source}"
+
+
 class CustomerPayment(models.Model):
     """
     نموذج لتسجيل المدفوعات المستلمة من العملاء
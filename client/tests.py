@@ -1,3 +1,159 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from client.models import Customer, CustomerPayment
+from product.models import Warehouse
+from sale.models import Sale, SaleReturn
+from utils.balances import post_balance_entry, verify_balances
+from utils.statements import customer_statement
+
+User = get_user_model()
+
+
+class CustomerStatementTest(TestCase):
+    """
+    اختبارات كشف حساب العميل
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='accountant', password='testpassword123')
+        self.customer = Customer.objects.create(name='عميل', code='C-1')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+
+        # فاتورة وحركتان في كل يوم من الأيام العشرة الأولى
+        for day in range(1, 11):
+            sale = self.sale(day, '100')
+            self.pay(day, '30')
+            if day % 5 == 0:
+                SaleReturn.objects.create(
+                    date=datetime.date(2024, 1, day), sale=sale, warehouse=self.warehouse,
+                    subtotal=20, total=20, status='confirmed', created_by=self.user,
+                )
+
+    def sale(self, day, total):
+        return Sale.objects.create(
+            date=datetime.date(2024, 1, day), customer=self.customer, warehouse=self.warehouse,
+            subtotal=Decimal(total), total=Decimal(total), payment_method='credit', created_by=self.user,
+        )
+
+    def pay(self, day, amount):
+        return CustomerPayment.objects.create(
+            customer=self.customer, amount=Decimal(amount), payment_date=datetime.date(2024, 1, day),
+            payment_method='cash', created_by=self.user,
+        )
+
+    def all_entries(self, **kwargs):
+        entries, cursor = [], None
+        while True:
+            statement = customer_statement(self.customer, cursor=cursor, limit=4, **kwargs)
+            entries.extend(statement.entries)
+            cursor = statement.next_cursor
+            if not cursor:
+                return entries, statement
+
+    def test_running_balance_across_pages(self):
+        entries, _ = self.all_entries()
+        self.assertEqual(len(entries), 22)
+
+        # من الأحدث للأقدم: الرصيد التراكمي يطابق الحساب اليدوي
+        balance = Decimal('0')
+        for entry in reversed(entries):
+            balance += entry['debit'] - entry['credit']
+            self.assertEqual(entry['balance'], balance)
+        self.assertEqual(entries[0]['balance'], Decimal('660'))
+        self.assertEqual(
+            [entry['type'] for entry in entries[:3]],
+            ['payment', 'return', 'invoice'],
+        )
+        self.assertEqual(entries[1]['description'], f"مرتجع مبيعات رقم {entries[1]['reference']}")
+
+    def test_date_range_with_opening_balance(self):
+        entries, statement = self.all_entries(
+            date_from=datetime.date(2024, 1, 4), date_to=datetime.date(2024, 1, 6),
+        )
+        self.assertEqual(statement.opening_balance, Decimal('210'))
+        self.assertEqual(len(entries), 7)
+        self.assertEqual(entries[-1]['balance'], Decimal('310'))
+        self.assertEqual(entries[0]['balance'], Decimal('400'))
+
+    def test_page_size_queries(self):
+        # حركات الصفحة والرصيد قبلها
+        with self.assertNumQueries(2):
+            statement = customer_statement(self.customer, limit=5)
+        self.assertEqual(len(statement.entries), 5)
+        self.assertIsNotNone(statement.next_cursor)
+
+    def test_detail_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('client:customer_detail', kwargs={'pk': self.customer.pk}), {
+            'statement_from': '2024-01-09',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['statement'].opening_balance, Decimal('540'))
+        self.assertEqual(len(response.context['transactions']), 5)
+
+
+class CustomerBalanceLedgerTest(TestCase):
+    """
+    اختبارات سجل قيود رصيد العميل
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='cashier', password='testpassword123')
+        self.customer = Customer.objects.create(name='عميل آجل', code='C-2')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+
+    def test_sale_and_payment_post_entries(self):
+        Sale.objects.create(
+            date=datetime.date(2024, 1, 1), customer=self.customer, warehouse=self.warehouse,
+            subtotal=Decimal('250'), total=Decimal('250'), payment_method='credit', created_by=self.user,
+        )
+        CustomerPayment.objects.create(
+            customer=self.customer, amount=Decimal('100'), payment_date=datetime.date(2024, 1, 2),
+            payment_method='cash', created_by=self.user,
+        )
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('client:customer_payment_add_for_customer', kwargs={'customer_id': self.customer.pk}), {
+            'customer': self.customer.pk, 'amount': '40', 'payment_date': '2024-01-03',
+            'payment_method': 'cash', 'reference_number': 'R-1',
+        })
+        self.assertEqual(response.status_code, 302)
+
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('210'))
+        self.assertEqual(
+            list(self.customer.balance_entries.values_list('source', 'amount')),
+            [('sale', Decimal('250')), ('payment', Decimal('-40'))],
+        )
+        self.assertEqual(verify_balances(Customer), [])
+
+    def test_stale_instance_does_not_overwrite_balance(self):
+        stale = Customer.objects.get(pk=self.customer.pk)
+        post_balance_entry(self.customer, Decimal('75'), 'sale', 'S-1')
+
+        stale.name = 'اسم جديد'
+        stale.save()
+
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.name, 'اسم جديد')
+        self.assertEqual(self.customer.balance, Decimal('75'))
+
+    def test_verify_command_fixes_mismatch(self):
+        post_balance_entry(self.customer, Decimal('120'), 'sale', 'S-2')
+        Customer.objects.filter(pk=self.customer.pk).update(balance=Decimal('999'))
+
+        out = StringIO()
+        call_command('verify_party_balances', '--party', 'customer', stdout=out)
+        self.assertIn('999', out.getvalue())
+        self.assertEqual(len(verify_balances(Customer)), 1)
 
-# Create your tests here.
+        call_command('verify_party_balances', '--party', 'customer', '--fix', stdout=StringIO())
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('120'))
+        self.assertEqual(verify_balances(Customer), [])
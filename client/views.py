@@ -9,6 +9,8 @@ from django.urls import reverse
 from .models import Customer, CustomerPayment
 from .forms import CustomerForm, CustomerPaymentForm
 from sale.models import Sale
+from utils.balances import post_balance_entry
+from utils.statements import customer_statement, statement_filters
 
 # Create your views here.
 
@@ -155,7 +157,7 @@ def customer_detail(request, pk):
     payments = customer.payments.all().order_by('-payment_date')
     
     # جلب فواتير البيع المرتبطة بالعميل
-    invoices = Sale.objects.filter(customer=customer).order_by('-date')
+    invoices = Sale.objects.filter(customer=customer).with_payment_totals().order_by('-date')
     invoices_count = invoices.count()
     
     # حساب إجمالي المبيعات
@@ -183,44 +185,9 @@ def customer_detail(request, pk):
     
     total_payments = payments.aggregate(total=Sum('amount'))['total'] or 0
     
-    # تجهيز بيانات المعاملات لكشف الحساب
-    transactions = []
-    
-    # إضافة الفواتير
-    for invoice in invoices:
-        transactions.append({
-            'date': invoice.date,
-            'reference': invoice.number,
-            'type': 'invoice',
-            'description': f'فاتورة بيع رقم {invoice.number}',
-            'debit': invoice.total,
-            'credit': 0,
-            'balance': 0  # سيتم حسابه لاحقاً
-        })
-    
-    # إضافة المدفوعات
-    for payment in payments:
-        transactions.append({
-            'date': payment.payment_date,
-            'reference': payment.reference_number,
-            'type': 'payment',
-            'description': f'دفعة {payment.get_payment_method_display()}',
-            'debit': 0,
-            'credit': payment.amount,
-            'balance': 0  # سيتم حسابه لاحقاً
-        })
-    
-    # ترتيب المعاملات حسب التاريخ (من الأقدم للأحدث)
-    transactions.sort(key=lambda x: x['date'])
-    
-    # حساب الرصيد التراكمي
-    running_balance = 0
-    for transaction in transactions:
-        running_balance = running_balance + transaction['debit'] - transaction['credit']
-        transaction['balance'] = running_balance
-    
-    # عكس ترتيب المعاملات (من الأحدث للأقدم) للعرض
-    transactions.reverse()
+    # كشف الحساب: صفحة من الحركات والرصيد التراكمي محسوب في قاعدة البيانات
+    filters = statement_filters(request.GET)
+    statement = customer_statement(customer, **filters)
     
     context = {
         'customer': customer,
@@ -231,7 +198,10 @@ def customer_detail(request, pk):
         'total_sales': total_sales,
         'total_products': total_products,
         'last_transaction_date': last_transaction_date,
-        'transactions': transactions,
+        'transactions': statement.entries,
+        'statement': statement,
+        'statement_from': filters['date_from'],
+        'statement_to': filters['date_to'],
         'page_title': f'بيانات العميل: {customer.name}',
         'page_icon': 'fas fa-user',
         'breadcrumb_items': [
@@ -262,8 +232,7 @@ def customer_payment_add(request, customer_id=None):
             with transaction.atomic():
                 payment.save()
                 # تحديث رصيد العميل
-                payment.customer.balance -= payment.amount
-                payment.customer.save()
+                post_balance_entry(payment.customer, -payment.amount, 'payment', payment.reference_number)
                 
             messages.success(request, _('تم إضافة الدفعة بنجاح'))
             
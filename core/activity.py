@@ -0,0 +1,195 @@
+"""
+مخزن مؤقت لتسجيل نشاط المستخدمين
+
+يجمع أحداث النشاط في الذاكرة (مخزن دائري محدود الحجم) ويكتبها عامل في
+الخلفية دفعة واحدة كل فترة أو عند امتلاء الدفعة، بدلاً من عمليتي كتابة
+متزامنتين في كل طلب:
+- إنشاء سجلات النشاط باستخدام bulk_create
+- تحديث آخر نشاط لكل مستخدم مرة واحدة في كل دفعة (آخر توقيت فقط)
+
+يتم تفريغ المخزن عند إيقاف العملية، ويتم حساب الأحداث المكتوبة والمفقودة.
+"""
+import atexit
+import logging
+import threading
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Case, DateTimeField, Value, When
+
+logger = logging.getLogger(__name__)
+
+# الحجم الأقصى للمخزن (تُفقد أقدم الأحداث عند امتلائه)
+DEFAULT_BUFFER_SIZE = 10000
+
+# الفترة بين كل عمليتي كتابة (بالثانية)
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# عدد الأحداث الذي يوقظ العامل قبل انتهاء الفترة
+DEFAULT_FLUSH_BATCH_SIZE = 500
+
+# حدث نشاط واحد
+ActivityEvent = namedtuple('ActivityEvent', [
+    'user_id', 'path', 'method', 'ip_address', 'user_agent', 'timestamp',
+])
+
+
+class ActivityBuffer:
+    """
+    مخزن دائري لأحداث النشاط مع عامل كتابة في الخلفية
+    """
+
+    def __init__(self, max_size=None, flush_interval=None, batch_size=None):
+        self.max_size = max_size or getattr(settings, 'ACTIVITY_BUFFER_SIZE', DEFAULT_BUFFER_SIZE)
+        self.flush_interval = flush_interval or getattr(settings, 'ACTIVITY_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        self.batch_size = batch_size or getattr(settings, 'ACTIVITY_FLUSH_BATCH_SIZE', DEFAULT_FLUSH_BATCH_SIZE)
+
+        self._events = deque(maxlen=self.max_size)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._worker = None
+
+        self._enqueued = 0
+        self._flushed = 0
+        self._dropped = 0
+        self._failed = 0
+        self._flushes = 0
+
+    def add(self, event):
+        """
+        إضافة حدث إلى المخزن (بدون أي عملية على قاعدة البيانات)
+        """
+        with self._lock:
+            if len(self._events) == self.max_size:
+                # المخزن ممتلئ: الحدث الأقدم سيُفقد
+                self._dropped += 1
+            self._events.append(event)
+            self._enqueued += 1
+            pending = len(self._events)
+
+        if pending >= self.batch_size:
+            self._wakeup.set()
+
+    def start(self):
+        """
+        تشغيل عامل الكتابة في الخلفية (مرة واحدة لكل عملية)
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._stopped.clear()
+            first_start = self._worker is None
+            self._worker = threading.Thread(target=self._run, name='activity-flusher', daemon=True)
+            self._worker.start()
+
+        if first_start:
+            # تفريغ الأحداث المتبقية عند إيقاف العملية
+            atexit.register(self.stop)
+
+    def stop(self, timeout=None):
+        """
+        إيقاف العامل وتفريغ الأحداث المتبقية
+        """
+        self._stopped.set()
+        self._wakeup.set()
+        worker = self._worker
+        if worker is not None and worker.is_alive() and worker is not threading.current_thread():
+            worker.join(timeout)
+        self.flush()
+        logger.info('Activity buffer drained: %s', self.metrics())
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                # اتصالات قاعدة البيانات خاصة بكل خيط، ويتم إغلاقها بعد كل دفعة
+                connections.close_all()
+
+    def _take(self):
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def flush(self):
+        """
+        كتابة الأحداث المتراكمة في قاعدة البيانات
+
+        تُرجع: عدد الأحداث التي تمت كتابتها
+        """
+        with self._flush_lock:
+            events = self._take()
+            if not events:
+                return 0
+
+            try:
+                write_events(events)
+            except Exception:
+                logger.exception('Failed to flush %s activity events', len(events))
+                with self._lock:
+                    self._failed += len(events)
+                return 0
+
+            with self._lock:
+                self._flushed += len(events)
+                self._flushes += 1
+            return len(events)
+
+    def metrics(self):
+        """
+        إحصائيات المخزن (الأحداث المضافة والمكتوبة والمفقودة والمعلقة)
+        """
+        with self._lock:
+            return {
+                'enqueued': self._enqueued,
+                'flushed': self._flushed,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'flushes': self._flushes,
+                'pending': len(self._events),
+            }
+
+
+def write_events(events):
+    """
+    كتابة مجموعة أحداث: سجلات النشاط دفعة واحدة، وآخر نشاط لكل مستخدم بعبارة UPDATE واحدة
+    """
+    from django.contrib.auth import get_user_model
+    from users.models import ActivityLog
+
+    # دمج تحديثات آخر نشاط: آخر توقيت فقط لكل مستخدم
+    last_activity = {}
+    for event in events:
+        if event.user_id not in last_activity or event.timestamp > last_activity[event.user_id]:
+            last_activity[event.user_id] = event.timestamp
+
+    with transaction.atomic():
+        ActivityLog.objects.bulk_create([
+            ActivityLog(
+                user_id=event.user_id,
+                action=f"{event.method} {event.path}"[:255],
+                ip_address=event.ip_address or None,
+                user_agent=event.user_agent,
+                timestamp=event.timestamp,
+                extra_data={
+                    'url': event.path,
+                    'method': event.method,
+                },
+            )
+            for event in events
+        ])
+
+        get_user_model().objects.filter(pk__in=last_activity).update(last_activity=Case(
+            *[When(pk=user_id, then=Value(timestamp)) for user_id, timestamp in last_activity.items()],
+            output_field=DateTimeField(),
+        ))
+
+
+# المخزن المشترك للعملية الحالية
+activity_buffer = ActivityBuffer()
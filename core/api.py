@@ -5,19 +5,16 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
-from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import timedelta
+from decimal import Decimal
 from django.http import JsonResponse
 from django.utils.translation import gettext_lazy as _
 
 from utils.throttling import SustainedRateThrottle, BurstRateThrottle
-from sale.models import Sale
-from purchase.models import Purchase
-from client.models import Customer
-from supplier.models import Supplier
-from product.models import Product
+from .dashboard_stats import dashboard_stats
 from .models import DashboardStat, Notification
+from .page_chrome import invalidate_notifications, user_notifications
 
 
 class DashboardStatsAPIView(APIView):
@@ -28,41 +25,27 @@ class DashboardStatsAPIView(APIView):
     throttle_classes = [BurstRateThrottle, SustainedRateThrottle]
 
     def get(self, request):
-        today = timezone.now().date()
-        this_month_start = today.replace(day=1)
-        
-        # إحصائيات المبيعات
-        sales_this_month = Sale.objects.filter(date__gte=this_month_start).aggregate(
-            count=Count('id'),
-            total=Sum('total')
-        )
-        
-        # إحصائيات المشتريات
-        purchases_this_month = Purchase.objects.filter(date__gte=this_month_start).aggregate(
-            count=Count('id'),
-            total=Sum('total')
-        )
-        
-        # إحصائيات العملاء والموردين والمنتجات
-        customers_count = Customer.objects.filter(is_active=True).count()
-        suppliers_count = Supplier.objects.filter(is_active=True).count()
-        products_count = Product.objects.filter(is_active=True).count()
+        # الإحصائيات المحسوبة مسبقاً (قراءة واحدة من الذاكرة المؤقتة)
+        stats = dashboard_stats()
+        sales_this_month = stats['sales_this_month'].data
+        purchases_this_month = stats['purchases_this_month'].data
         
         # إعداد البيانات للاستجابة
         data = {
             'sales': {
-                'this_month_count': sales_this_month['count'] or 0,
-                'this_month_total': sales_this_month['total'] or 0,
+                'this_month_count': sales_this_month['count'],
+                'this_month_total': Decimal(sales_this_month['total']),
             },
             'purchases': {
-                'this_month_count': purchases_this_month['count'] or 0,
-                'this_month_total': purchases_this_month['total'] or 0,
+                'this_month_count': purchases_this_month['count'],
+                'this_month_total': Decimal(purchases_this_month['total']),
             },
             'counts': {
-                'customers': customers_count,
-                'suppliers': suppliers_count,
-                'products': products_count,
+                'customers': stats['customers_count'].data['count'],
+                'suppliers': stats['suppliers_count'].data['count'],
+                'products': stats['products_count'].data['count'],
             },
+            'computed_at': min(stat.computed_at for stat in stats.values()),
             'timestamp': timezone.now(),
         }
         
@@ -215,6 +198,8 @@ def mark_all_notifications_read(request):
     try:
         # تحديث جميع الإشعارات غير المقروءة للمستخدم
         Notification.objects.filter(user=request.user, is_read=False).update(is_read=True)
+        # التحديث الجماعي لا يرسل إشارات الحفظ
+        invalidate_notifications(request.user.pk)
         
         return JsonResponse({
             'success': True,
@@ -238,8 +223,8 @@ def get_notifications_count(request):
         })
     
     try:
-        # حساب عدد الإشعارات غير المقروءة
-        unread_count = Notification.objects.filter(user=request.user, is_read=False).count()
+        # عدد الإشعارات غير المقروءة من الذاكرة المؤقتة
+        unread_count = user_notifications(request.user.pk)['unread_count']
         
         return JsonResponse({
             'success': True,
@@ -8,7 +8,13 @@ class CoreConfig(AppConfig):
     
     def ready(self):
         """
-        تحميل templatetags عند بدء التطبيق
+        تحميل templatetags والإشارات عند بدء التطبيق
         """
         # استيراد ال templatetags
-        import core.templatetags 
\ No newline at end of file
+        import core.templatetags 
+        
+        # استيراد الإشارات
+        import core.signals
+
+        # تسجيل فحوص النظام
+        import core.checks
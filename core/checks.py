@@ -0,0 +1,48 @@
+"""
+فحوص النظام الخاصة بالتطبيق الرئيسي
+"""
+import os
+
+from django.conf import settings
+from django.core.checks import Error, Tags, Warning, register
+
+# الذاكرة المؤقتة داخل العملية: لا تصل إليها عمليات الإبطال من العمليات الأخرى
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+DATABASE_CACHE_BACKEND = 'django.core.cache.backends.db.DatabaseCache'
+
+
+def worker_count():
+    """
+    عدد عمليات الخادم من المتغير WEB_CONCURRENCY (يقرؤه gunicorn)
+    """
+    try:
+        return int(os.environ.get('WEB_CONCURRENCY') or 1)
+    except ValueError:
+        return 1
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    الذاكرة المؤقتة الافتراضية يجب أن تكون مشتركة عند تشغيل أكثر من عملية،
+    وإلا لا يصل إبطال الإعدادات ودليل الحسابات وإطار الصفحة إلى باقي العمليات
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    errors = []
+    if backend in LOCAL_CACHE_BACKENDS and worker_count() > 1:
+        errors.append(Error(
+            'الذاكرة المؤقتة الافتراضية داخل العملية بينما WEB_CONCURRENCY=%s' % worker_count(),
+            hint='عيّن CACHE_URL لذاكرة مشتركة (مثل redis://127.0.0.1:6379/1).',
+            id='core.E001',
+        ))
+    elif backend == DATABASE_CACHE_BACKEND:
+        errors.append(Warning(
+            'الذاكرة المؤقتة الافتراضية جدول في قاعدة البيانات، فكل قراءة منها استعلام في كل صفحة',
+            hint='استخدم Redis أو Memcached عبر CACHE_URL.',
+            id='core.W001',
+        ))
+    return errors
@@ -0,0 +1,311 @@
+"""
+إحصائيات لوحة التحكم المحسوبة مسبقاً
+
+مؤشرات لوحة التحكم (مبيعات ومشتريات اليوم والشهر، الأعداد، المنتجات منخفضة
+المخزون، مبيعات الشهر حسب طريقة الدفع) تُحسب مسبقاً وتُخزن في DashboardStat مع
+وقت حسابها، ونسخة منها في الذاكرة المؤقتة المشتركة بين العمليات (CACHES)،
+فتقرأها لوحة التحكم وواجهة API بعملية واحدة على الذاكرة المؤقتة بدلاً من
+عشرة استعلامات تجميع.
+
+المؤشرات مقسمة إلى مجموعات حسب النماذج التي تؤثر عليها:
+- حفظ أو حذف سجل من نموذج المجموعة يعلّمها كقديمة في الذاكرة المؤقتة
+  المشتركة بعد تأكيد المعاملة، فتراها كل العمليات
+- المجموعة القديمة، أو التي مر على حسابها أكثر من DASHBOARD_STATS_MAX_AGE،
+  أو التي حُسبت في يوم سابق، يُعاد حسابها وحدها عند أول قراءة
+- الأمر refresh_dashboard_stats يعيد حساب كل المجموعات (للتشغيل المجدول)
+"""
+import threading
+import weakref
+from collections import namedtuple
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+CACHE_PREFIX = 'core:dashboard_stats'
+
+# أقصى عمر للإحصائيات قبل إعادة حسابها عند القراءة (بالثانية)
+DEFAULT_MAX_AGE = 300
+
+# عدد المنتجات منخفضة المخزون المعروضة
+LOW_STOCK_LIMIT = 5
+
+# إحصائية محسوبة: value للعرض، data للقيم التفصيلية، computed_at وقت الحساب
+Stat = namedtuple('Stat', ['key', 'value', 'data', 'computed_at'])
+
+# تعريف إحصائية: group مجموعتها، type و period من اختيارات DashboardStat
+StatDefinition = namedtuple('StatDefinition', ['title', 'group', 'type', 'period', 'compute'])
+
+# النماذج التي تؤثر على كل مجموعة {المجموعة: النماذج}
+GROUP_MODELS = {
+    'sales': ('sale.Sale',),
+    'purchases': ('purchase.Purchase',),
+    'customers': ('client.Customer',),
+    'suppliers': ('supplier.Supplier',),
+    'inventory': ('product.Product', 'product.Stock'),
+}
+
+
+def _totals(queryset):
+    totals = queryset.aggregate(count=Count('id'), total=Sum('total'))
+    data = {'count': totals['count'] or 0, 'total': str(totals['total'] or Decimal('0'))}
+    return data['total'], data
+
+
+def _sales_today(today):
+    from sale.models import Sale
+    return _totals(Sale.objects.filter(date=today))
+
+
+def _sales_this_month(today):
+    from sale.models import Sale
+    return _totals(Sale.objects.filter(date__gte=today.replace(day=1)))
+
+
+def _sales_by_payment_method(today):
+    from sale.models import Sale
+    # مبيعات الشهر الحالي فقط حتى لا يمر إعادة الحساب على كل الفواتير
+    rows = Sale.objects.filter(date__gte=today.replace(day=1)).order_by().values('payment_method').annotate(
+        count=Count('id'),
+        total=Sum('total'),
+    ).order_by('-total')
+    data = {'rows': [
+        {'payment_method': row['payment_method'], 'count': row['count'], 'total': str(row['total'] or 0)}
+        for row in rows
+    ]}
+    return len(data['rows']), data
+
+
+def _purchases_today(today):
+    from purchase.models import Purchase
+    return _totals(Purchase.objects.filter(date=today))
+
+
+def _purchases_this_month(today):
+    from purchase.models import Purchase
+    return _totals(Purchase.objects.filter(date__gte=today.replace(day=1)))
+
+
+def _active_count(label):
+    def compute(today):
+        from django.apps import apps
+        count = apps.get_model(label).objects.filter(is_active=True).count()
+        return count, {'count': count}
+    return compute
+
+
+def _low_stock_products(today):
+    from product.models import Product
+    # المنتجات التي إجمالي مخزونها أقل من الحد الأدنى أو نفد مخزونها
+    low = Q(total_stock__lt=F('min_stock')) | Q(total_stock=0)
+    products = Product.objects.filter(low, is_active=True).order_by('total_stock', 'name')
+    rows = list(products.values('id', 'name', 'total_stock')[:LOW_STOCK_LIMIT])
+    data = {'products': [
+        {'id': row['id'], 'name': row['name'], 'quantity': row['total_stock']} for row in rows
+    ]}
+    return len(rows), data
+
+
+# الإحصائيات المحسوبة مسبقاً {المفتاح: التعريف}
+STATS = {
+    'sales_today': StatDefinition('مبيعات اليوم', 'sales', 'sales', 'daily', _sales_today),
+    'sales_this_month': StatDefinition('مبيعات الشهر', 'sales', 'sales', 'monthly', _sales_this_month),
+    'sales_by_payment_method': StatDefinition(
+        'مبيعات الشهر حسب طريقة الدفع', 'sales', 'sales', 'monthly', _sales_by_payment_method,
+    ),
+    'purchases_today': StatDefinition('مشتريات اليوم', 'purchases', 'purchases', 'daily', _purchases_today),
+    'purchases_this_month': StatDefinition(
+        'مشتريات الشهر', 'purchases', 'purchases', 'monthly', _purchases_this_month,
+    ),
+    'customers_count': StatDefinition(
+        'العملاء النشطون', 'customers', 'customers', 'current', _active_count('client.Customer'),
+    ),
+    'suppliers_count': StatDefinition(
+        'الموردون النشطون', 'suppliers', 'suppliers', 'current', _active_count('supplier.Supplier'),
+    ),
+    'products_count': StatDefinition(
+        'المنتجات النشطة', 'inventory', 'inventory', 'current', _active_count('product.Product'),
+    ),
+    'low_stock_products': StatDefinition(
+        'منتجات منخفضة المخزون', 'inventory', 'inventory', 'current', _low_stock_products,
+    ),
+}
+
+
+def _group_keys(group):
+    return [key for key, definition in STATS.items() if definition.group == group]
+
+
+def _snapshot_key(group):
+    return f'{CACHE_PREFIX}:{group}'
+
+
+def _stale_key(group):
+    return f'{CACHE_PREFIX}:stale:{group}'
+
+
+def _is_fresh(stats, now):
+    """
+    هل كل إحصائيات المجموعة حديثة (داخل أقصى عمر وفي نفس اليوم)
+    """
+    max_age = timedelta(seconds=getattr(settings, 'DASHBOARD_STATS_MAX_AGE', DEFAULT_MAX_AGE))
+    today = timezone.localdate(now)
+    for stat in stats.values():
+        if stat.computed_at is None or now - stat.computed_at > max_age:
+            return False
+        if timezone.localdate(stat.computed_at) != today:
+            return False
+    return True
+
+
+def refresh_stats(groups=None):
+    """
+    إعادة حساب مجموعات الإحصائيات وتخزينها في DashboardStat والذاكرة المؤقتة
+
+    المعلمات:
+    groups (list): المجموعات المطلوبة (الافتراضي كل المجموعات)
+
+    تُرجع: قاموس {المفتاح: Stat} للإحصائيات المحسوبة
+    """
+    from core.models import DashboardStat
+
+    groups = list(groups or GROUP_MODELS)
+    now = timezone.now()
+    today = timezone.localdate(now)
+    keys = [key for group in groups for key in _group_keys(group)]
+
+    rows, stats = [], {}
+    for key in keys:
+        definition = STATS[key]
+        value, data = definition.compute(today)
+        stats[key] = Stat(key, str(value), data, now)
+        rows.append(DashboardStat(
+            key=key, title=definition.title, value=str(value), data=data,
+            type=definition.type, period=definition.period, computed_at=now,
+        ))
+
+    # صف واحد لكل إحصائية يُحدث في مكانه بعبارة INSERT ... ON CONFLICT واحدة
+    unique_fields = ['key'] if connection.features.supports_update_conflicts_with_target else None
+    DashboardStat.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=unique_fields,
+        update_fields=['title', 'value', 'data', 'type', 'period', 'computed_at', 'updated_at'],
+    )
+
+    cache.set_many({
+        _snapshot_key(group): {key: stats[key] for key in _group_keys(group)} for group in groups
+    }, None)
+    cache.delete_many([_stale_key(group) for group in groups])
+    return stats
+
+
+def _load_stored(groups):
+    """
+    قراءة إحصائيات مجموعات من DashboardStat (بعد فقدها من الذاكرة المؤقتة)
+    """
+    from core.models import DashboardStat
+
+    keys = [key for group in groups for key in _group_keys(group)]
+    stored = {
+        key: Stat(key, value, data, computed_at)
+        for key, value, data, computed_at in DashboardStat.objects.filter(key__in=keys).values_list(
+            'key', 'value', 'data', 'computed_at'
+        )
+    }
+    return {
+        group: {key: stored[key] for key in _group_keys(group) if key in stored}
+        for group in groups
+    }
+
+
+def dashboard_stats(groups=None):
+    """
+    الإحصائيات المحسوبة مسبقاً
+
+    تُقرأ من الذاكرة المؤقتة بعملية واحدة، ويُعاد حساب المجموعات القديمة فقط.
+
+    المعلمات:
+    groups (list): المجموعات المطلوبة (الافتراضي كل المجموعات)
+
+    تُرجع: قاموس {المفتاح: Stat}
+    """
+    groups = list(groups or GROUP_MODELS)
+    cached = cache.get_many(
+        [_snapshot_key(group) for group in groups] + [_stale_key(group) for group in groups]
+    )
+    now = timezone.now()
+
+    snapshots, missing = {}, []
+    for group in groups:
+        snapshot = cached.get(_snapshot_key(group))
+        if snapshot is None:
+            missing.append(group)
+        else:
+            snapshots[group] = snapshot
+
+    if missing:
+        stored = _load_stored(missing)
+        for group in missing:
+            snapshots[group] = stored[group]
+            if len(stored[group]) == len(_group_keys(group)) and _is_fresh(stored[group], now):
+                cache.set(_snapshot_key(group), stored[group], None)
+
+    stale = [
+        group for group in groups
+        if _stale_key(group) in cached
+        or len(snapshots[group]) != len(_group_keys(group))
+        or not _is_fresh(snapshots[group], now)
+    ]
+    result = {}
+    for group in groups:
+        result.update(snapshots[group])
+    if stale:
+        result.update(refresh_stats(stale))
+    return result
+
+
+def _set_stale(group):
+    cache.set(_stale_key(group), True, None)
+
+
+class _StaleMark:
+    """
+    تعليم مجموعة كقديمة، يُسجل في transaction.on_commit
+
+    المعاملة وحدها تحتفظ بهذا الكائن حتى تأكيدها، وتتخلص منه إذا أُلغيت هي
+    أو نقطة الحفظ التي سُجل فيها، فيبقى المرجع الضعيف إليه حياً فقط طالما
+    التعليم مسجل في المعاملة الحالية.
+    """
+
+    def __init__(self, group):
+        self.group = group
+
+    def __call__(self):
+        _set_stale(self.group)
+
+
+# التعليمات المسجلة في معاملة كل خيط {(قاعدة البيانات، المجموعة): مرجع ضعيف}
+_pending = threading.local()
+
+
+def mark_stale(group):
+    """
+    تعليم مجموعة إحصائيات كقديمة بعد تأكيد المعاملة الحالية
+
+    يُسجل مرة واحدة لكل مجموعة في المعاملة مهما تكرر الاستدعاء.
+    """
+    db = transaction.get_connection()
+    marks = getattr(_pending, 'marks', None)
+    if marks is None:
+        marks = _pending.marks = {}
+
+    key = (db.alias, group)
+    registered = marks.get(key)
+    if db.in_atomic_block and registered is not None and registered() is not None:
+        return
+    mark = _StaleMark(group)
+    marks[key] = weakref.ref(mark)
+    transaction.on_commit(mark)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.dashboard_stats import GROUP_MODELS, refresh_stats
+
+
+class Command(BaseCommand):
+    help = 'إعادة حساب إحصائيات لوحة التحكم المحسوبة مسبقاً (للتشغيل المجدول)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--group', choices=sorted(GROUP_MODELS), action='append', dest='groups',
+                            help='مجموعة الإحصائيات (يمكن تكرارها، الافتراضي الكل)')
+
+    def handle(self, *args, **options):
+        stats = refresh_stats(options['groups'])
+        for key, stat in stats.items():
+            self.stdout.write(f'{key}: {stat.value}')
+        self.stdout.write(self.style.SUCCESS(f'تم تحديث {len(stats)} إحصائية'))
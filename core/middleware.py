@@ -120,6 +120,9 @@ class ActivityTrackingMiddleware(MiddlewareMixin):
     def process_request(self, request):
         """
         معالجة الطلب وتتبع النشاط
+
+        لا تتم أي كتابة في قاعدة البيانات أثناء الطلب، بل يُضاف الحدث إلى
+        المخزن المؤقت ويكتبه عامل الخلفية دفعة واحدة (انظر core.activity).
         """
         if request.user.is_authenticated:
             path = request.path_info
@@ -129,19 +132,24 @@ class ActivityTrackingMiddleware(MiddlewareMixin):
                 if re.match(exempt_url, path):
                     return None
             
-            # تحديث آخر نشاط للمستخدم
-            request.user.last_activity = timezone.now()
-            request.user.save(update_fields=['last_activity'])
+            # تحديث آخر نشاط للمستخدم في الذاكرة (يُحفظ مع الدفعة التالية)
+            now = timezone.now()
+            request.user.last_activity = now
             
-            # تسجيل النشاط في قاعدة البيانات
-            from core.models import UserActivity
-            UserActivity.objects.create(
-                user=request.user,
-                url=path,
+            # إضافة النشاط إلى المخزن المؤقت
+            from core.activity import ActivityEvent, activity_buffer
+            activity_buffer.add(ActivityEvent(
+                user_id=request.user.pk,
+                path=path,
                 method=request.method,
                 ip_address=self.get_client_ip(request),
-                user_agent=request.META.get('HTTP_USER_AGENT', '')
-            )
+                user_agent=request.META.get('HTTP_USER_AGENT', ''),
+                timestamp=now,
+            ))
+            if getattr(settings, 'ACTIVITY_BUFFER_ASYNC', True):
+                activity_buffer.start()
+            else:
+                activity_buffer.flush()
         
         return None
     
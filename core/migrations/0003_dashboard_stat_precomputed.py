@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboardstat',
+            name='computed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='وقت الحساب'),
+        ),
+        migrations.AddField(
+            model_name='dashboardstat',
+            name='data',
+            field=models.JSONField(blank=True, default=dict, verbose_name='البيانات التفصيلية'),
+        ),
+        migrations.AddField(
+            model_name='dashboardstat',
+            name='key',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True, verbose_name='المفتاح'),
+        ),
+    ]
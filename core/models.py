@@ -47,23 +47,10 @@ class SystemSetting(models.Model):
     @classmethod
     def get_setting(cls, key, default=None):
         """
-        الحصول على قيمة إعداد معين
+        الحصول على قيمة إعداد معين (من سجل الإعدادات المحمل في الذاكرة)
         """
-        try:
-            setting = cls.objects.get(key=key, is_active=True)
-            if setting.data_type == 'integer':
-                return int(setting.value)
-            elif setting.data_type == 'decimal':
-                return float(setting.value)
-            elif setting.data_type == 'boolean':
-                return setting.value.lower() in ('true', '1', 'yes')
-            elif setting.data_type == 'json':
-                import json
-                return json.loads(setting.value)
-            else:
-                return setting.value
-        except cls.DoesNotExist:
-            return default
+        from core.settings_registry import settings_registry
+        return settings_registry.get(key, default)
 
 
 class DashboardStat(models.Model):
@@ -95,8 +82,11 @@ class DashboardStat(models.Model):
         ('no_change', _('لا تغيير')),
     )
     
+    key = models.CharField(_('المفتاح'), max_length=50, unique=True, blank=True, null=True)
     title = models.CharField(_('العنوان'), max_length=100)
     value = models.CharField(_('القيمة'), max_length=100)
+    data = models.JSONField(_('البيانات التفصيلية'), default=dict, blank=True)
+    computed_at = models.DateTimeField(_('وقت الحساب'), blank=True, null=True)
     icon = models.CharField(_('الأيقونة'), max_length=50, blank=True, null=True)
     color = models.CharField(_('اللون'), max_length=20, blank=True, null=True)
     order = models.PositiveIntegerField(_('الترتيب'), default=0)
@@ -0,0 +1,233 @@
+"""
+صندوق أحداث المستندات (outbox)
+
+بدلاً من تنفيذ الآثار الجانبية للمستند (إعادة حساب المبلغ المدفوع وحالة
+الدفع، ترحيل المعاملات المالية) مباشرة من كل save وكل إشارة، يتم نشر حدث
+باسم الأثر والمستند:
+- داخل outbox.atomic() تُجمع الأحداث المنشورة، والحدث الواحد لنفس المستند
+  يُنفذ مرة واحدة فقط مهما تكرر نشره (يستلم المعالج أول نسخة منشورة من
+  المستند) في نهاية الكتلة، داخل نفس معاملة قاعدة البيانات وقبل تأكيدها؛
+  فإذا فشل معالج أُلغيت المعاملة كلها ولا يُؤكد مستند بدون آثاره
+- خارج outbox.atomic() يُنفذ المعالج فوراً عند النشر (داخل المعاملة الحالية
+  إن وجدت)
+- المعالجات المؤجلة (deferred) للأعمال غير الحرجة فقط تُنفذ بعد تأكيد
+  المعاملة، ويمكن تنفيذها في عامل خلفية داخل العملية (OUTBOX_ASYNC)؛ هذه
+  الأحداث لا تُحفظ في قاعدة البيانات فيضيع المعلق منها إذا توقفت العملية،
+  لذلك لا يُستخدم التأجيل لأي أثر يجب أن يُؤكد مع المستند
+
+أحداث كتلة ملغاة (أو كتلة داخلية أُلغيت نقطة حفظها) لا تُنفذ.
+"""
+import atexit
+import logging
+import queue
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+
+class _Batch:
+    """
+    الأحداث المعلقة في كتلة outbox.atomic() حتى نهايتها
+    """
+
+    def __init__(self):
+        self.events = {}
+
+
+class Outbox:
+    """
+    ناشر أحداث المستندات مع دمج الأحداث المكررة وعامل خلفية للمعالجات المؤجلة
+    """
+
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        self._published = 0
+        self._merged = 0
+        self._handled = 0
+        self._deferred = 0
+        self._failed = 0
+
+    def subscribe(self, event, deferred=False):
+        """
+        تسجيل معالج لحدث (يُستخدم كمزخرف)
+
+        المعلمات:
+        event (str): اسم الحدث
+        deferred (bool): معالج غير حرج يُنفذ بعد تأكيد المعاملة (ويمكن تنفيذه في عامل الخلفية)
+
+        المعالج يستلم المستند المنشور كمعامل وحيد.
+        """
+        def decorator(handler):
+            self._handlers[event].append((handler, deferred))
+            return handler
+        return decorator
+
+    def _batches(self):
+        batches = getattr(self._local, 'batches', None)
+        if batches is None:
+            batches = self._local.batches = {}
+        return batches
+
+    @contextmanager
+    def atomic(self, using=None):
+        """
+        معاملة قاعدة بيانات تجمع الأحداث المنشورة داخلها وتنفذ معالجاتها مرة
+        واحدة لكل مستند في نهايتها قبل تأكيد المعاملة
+
+        الكتل المتداخلة تنضم إلى الكتلة الخارجية، وأحداث الكتلة الداخلية
+        تُحذف إذا أُلغيت نقطة حفظها.
+        """
+        using = using or DEFAULT_DB_ALIAS
+        batches = self._batches()
+        batch = batches.get(using)
+        outermost = batch is None
+        if outermost:
+            batch = batches[using] = _Batch()
+        published = list(batch.events)
+
+        try:
+            with transaction.atomic(using=using):
+                yield
+                if outermost:
+                    self._flush(batch, using)
+        except BaseException:
+            if not outermost:
+                batch.events = {key: batch.events[key] for key in published}
+            raise
+        finally:
+            if outermost:
+                del batches[using]
+
+    def publish(self, event, instance, using=None):
+        """
+        نشر حدث لمستند
+
+        المعلمات:
+        event (str): اسم الحدث
+        instance (Model): المستند
+        using (str): اسم قاعدة البيانات (الافتراضي default)
+        """
+        using = using or DEFAULT_DB_ALIAS
+        with self._lock:
+            self._published += 1
+
+        batch = self._batches().get(using)
+        if batch is None:
+            self._dispatch([(event, instance)], using)
+            return
+
+        key = (event, instance._meta.label, instance.pk)
+        if key in batch.events:
+            with self._lock:
+                self._merged += 1
+            return
+        batch.events[key] = (event, instance)
+
+    def _flush(self, batch, using):
+        # المعالجات قد تنشر أحداثاً جديدة تُنفذ في نفس الكتلة (مرة واحدة لكل مستند)
+        done = set()
+        while True:
+            pending = [(key, item) for key, item in batch.events.items() if key not in done]
+            if not pending:
+                return
+            done.update(key for key, _ in pending)
+            self._dispatch([item for _, item in pending], using)
+
+    def _dispatch(self, events, using):
+        for event, instance in events:
+            for handler, deferred in self._handlers.get(event, ()):
+                if not deferred:
+                    handler(instance)
+                    with self._lock:
+                        self._handled += 1
+                elif transaction.get_connection(using).in_atomic_block:
+                    transaction.on_commit(partial(self._defer, event, handler, instance), using=using)
+                else:
+                    self._defer(event, handler, instance)
+
+    def _defer(self, event, handler, instance):
+        if getattr(settings, 'OUTBOX_ASYNC', False):
+            self._queue.put((event, handler, instance))
+            self.start()
+            with self._lock:
+                self._deferred += 1
+        else:
+            self._run(event, handler, instance)
+
+    def _run(self, event, handler, instance):
+        try:
+            handler(instance)
+        except Exception:
+            logger.exception('Outbox handler %s failed for %s %s', handler.__name__, event, instance.pk)
+            with self._lock:
+                self._failed += 1
+            return
+        with self._lock:
+            self._handled += 1
+
+    def start(self):
+        """
+        تشغيل عامل الخلفية للمعالجات المؤجلة (مرة واحدة لكل عملية)
+        """
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            first_start = self._worker is None
+            self._worker = threading.Thread(target=self._work, name='outbox-worker', daemon=True)
+            self._worker.start()
+
+        if first_start:
+            # تنفيذ المعالجات المتبقية عند إيقاف العملية
+            atexit.register(self.drain)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._run(*item)
+            finally:
+                self._queue.task_done()
+                if self._queue.empty():
+                    # اتصالات قاعدة البيانات خاصة بكل خيط، ويتم إغلاقها عند فراغ الطابور
+                    connections.close_all()
+
+    def drain(self, timeout=None):
+        """
+        إيقاف العامل بعد تنفيذ كل المعالجات المؤجلة المتبقية
+        """
+        worker = self._worker
+        if worker is not None and worker.is_alive() and worker is not threading.current_thread():
+            self._queue.put(None)
+            worker.join(timeout)
+        logger.info('Outbox drained: %s', self.metrics())
+
+    def metrics(self):
+        """
+        إحصائيات الصندوق (الأحداث المنشورة والمدمجة والمعالجات المنفذة والمؤجلة والفاشلة)
+        """
+        with self._lock:
+            return {
+                'published': self._published,
+                'merged': self._merged,
+                'handled': self._handled,
+                'deferred': self._deferred,
+                'failed': self._failed,
+                'pending': self._queue.qsize(),
+            }
+
+
+# الصندوق المشترك للعملية الحالية
+outbox = Outbox()
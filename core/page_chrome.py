@@ -0,0 +1,258 @@
+"""
+ذاكرة مؤقتة لعناصر إطار الصفحة
+
+عناصر الإطار (أعداد الكيانات الرئيسية وإشعارات المستخدم وخريطة صلاحياته)
+تُعرض في كل صفحة، فيتم حفظها في الذاكرة المؤقتة المشتركة بين العمليات
+(CACHES) وإبطالها عبر الإشارات عند تغير بياناتها، فيصل الإبطال من أي عملية
+إلى كل العمليات، ولا تنفذ الصفحات أي استعلام لها في الحالة المستقرة:
+- أعداد الكيانات: تُحسب عند أول طلب بعد الإبطال أو انتهاء المهلة
+- الإشعارات: قائمة وعدد غير المقروء لكل مستخدم، تُبطل عند أي كتابة على إشعاراته
+- الصلاحيات: خريطة لكل مستخدم، تُبطل عند تغير صلاحياته أو مجموعاته
+
+يجب أن تكون الذاكرة المؤقتة الافتراضية في الذاكرة (locmem لعملية واحدة أو
+Redis/Memcached عبر CACHE_URL لعدة عمليات، انظر core.checks)، فالذاكرة المؤقتة
+في قاعدة البيانات تنفذ استعلاماً لكل قراءة.
+"""
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+CACHE_PREFIX = 'core:page_chrome'
+
+# مهلة صلاحية أعداد الكيانات (بالثانية)
+DEFAULT_COUNTS_TIMEOUT = 300
+
+# مهلة صلاحية إشعارات المستخدم (بالثانية) حتى تخرج الإشعارات المقروءة القديمة من القائمة
+DEFAULT_NOTIFICATIONS_TIMEOUT = 300
+
+# مهلة صلاحية خريطة الصلاحيات (بالثانية)
+DEFAULT_PERMISSIONS_TIMEOUT = 3600
+
+# الكيانات المعروضة في إطار الصفحة {اسم المتغير: النموذج}
+COUNTED_MODELS = {
+    'products_count': 'product.Product',
+    'customers_count': 'client.Customer',
+    'suppliers_count': 'supplier.Supplier',
+    'sales_count': 'sale.Sale',
+    'purchases_count': 'purchase.Purchase',
+}
+
+# عدد الإشعارات المعروضة في القائمة المنسدلة
+NOTIFICATIONS_LIMIT = 10
+
+# روابط الإشعارات حسب النوع
+NOTIFICATION_LINKS = {
+    'inventory_alert': '/product/inventory/',
+    'payment_received': '/financial/payments/',
+    'new_invoice': '/sale/invoices/',
+    'return_request': '/sale/returns/',
+}
+
+# الإجراءات والنماذج الشائعة في خريطة صلاحيات القوالب
+COMMON_ACTIONS = ['view', 'add', 'change', 'delete']
+COMMON_MODELS = [
+    'user', 'group', 'permission',
+    'customer', 'supplier',
+    'product', 'category', 'brand',
+    'sale', 'saleinvoice', 'payment',
+    'purchase', 'purchaseinvoice',
+    'expense', 'expensecategory',
+    'report', 'settings',
+]
+
+
+def _count_key(name):
+    return f'{CACHE_PREFIX}:count:{name}'
+
+
+def _notifications_key(user_id):
+    return f'{CACHE_PREFIX}:notifications:{user_id}'
+
+
+def _permissions_version_key():
+    return f'{CACHE_PREFIX}:permissions:version'
+
+
+def _permissions_key(user_id, version):
+    return f'{CACHE_PREFIX}:permissions:{version}:{user_id}'
+
+
+def _on_commit(func):
+    # الإبطال بعد تأكيد المعاملة حتى لا يعيد طلب آخر حفظ القيمة القديمة قبل التأكيد
+    transaction.on_commit(func)
+
+
+def _installed_models():
+    for name, label in COUNTED_MODELS.items():
+        app_label, model_name = label.split('.')
+        if apps.is_installed(app_label):
+            yield name, apps.get_model(app_label, model_name)
+
+
+def entity_counts():
+    """
+    أعداد الكيانات الرئيسية (المنتجات والعملاء والموردين والمبيعات والمشتريات)
+
+    تُقرأ كلها بعملية واحدة من الذاكرة المؤقتة، ويُحسب فقط ما تم إبطاله أو انتهت مهلته.
+
+    تُرجع: قاموس {اسم المتغير: العدد}
+    """
+    models = dict(_installed_models())
+    counts = cache.get_many([_count_key(name) for name in models])
+    result = {}
+    missing = {}
+    for name, model in models.items():
+        key = _count_key(name)
+        if key in counts:
+            result[name] = counts[key]
+        else:
+            result[name] = missing[key] = model.objects.count()
+
+    if missing:
+        cache.set_many(missing, getattr(settings, 'PAGE_CHROME_COUNTS_TIMEOUT', DEFAULT_COUNTS_TIMEOUT))
+    return result
+
+
+def invalidate_entity_count(model):
+    """
+    إبطال عدد كيان معين بعد إضافة أو حذف سجل منه
+    """
+    label = model._meta.label
+    keys = [_count_key(name) for name, counted in COUNTED_MODELS.items() if counted == label]
+    if keys:
+        _on_commit(lambda: cache.delete_many(keys))
+
+
+def _notification_link(notification_type):
+    return NOTIFICATION_LINKS.get(notification_type, '#')
+
+
+def _load_notifications(user_id):
+    from core.models import Notification
+
+    user_notifications = Notification.objects.filter(user_id=user_id)
+    unread = list(user_notifications.filter(is_read=False).order_by('-created_at')[:NOTIFICATIONS_LIMIT])
+    unread_count = len(unread)
+    if unread_count == NOTIFICATIONS_LIMIT:
+        unread_count = user_notifications.filter(is_read=False).count()
+        items = unread
+    else:
+        # إكمال القائمة بالإشعارات المقروءة خلال آخر 7 أيام
+        one_week_ago = timezone.now() - timedelta(days=7)
+        items = unread + list(user_notifications.filter(
+            is_read=True,
+            created_at__gte=one_week_ago,
+        ).order_by('-created_at')[:NOTIFICATIONS_LIMIT - len(unread)])
+
+    return {
+        'items': [
+            {
+                'id': notification.id,
+                'title': notification.title,
+                'message': notification.message,
+                'notification_type': notification.type,
+                'read': notification.is_read,
+                'created_at': notification.created_at,
+                'link': _notification_link(notification.type),
+            }
+            for notification in items
+        ],
+        'unread_count': unread_count,
+    }
+
+
+def user_notifications(user_id):
+    """
+    أحدث إشعارات المستخدم وعدد غير المقروء منها
+
+    المعلمات:
+    user_id (int): معرف المستخدم
+
+    تُرجع: قاموس بالمفتاحين items (قائمة قواميس الإشعارات) و unread_count
+    """
+    key = _notifications_key(user_id)
+    data = cache.get(key)
+    if data is None:
+        data = _load_notifications(user_id)
+        cache.set(key, data, getattr(settings, 'PAGE_CHROME_NOTIFICATIONS_TIMEOUT', DEFAULT_NOTIFICATIONS_TIMEOUT))
+    return data
+
+
+def invalidate_notifications(user_id):
+    """
+    إبطال إشعارات مستخدم بعد أي كتابة عليها
+
+    يجب استدعاؤها بعد التحديث الجماعي (update) لأنه لا يرسل إشارات الحفظ.
+    """
+    key = _notifications_key(user_id)
+    _on_commit(lambda: cache.delete(key))
+
+
+def _new_version():
+    # رقم إصدار مبني على الوقت حتى لا تعود خرائط قديمة إذا حُذف المفتاح من الذاكرة المؤقتة
+    return time.time_ns()
+
+
+def _permissions_version():
+    version = cache.get(_permissions_version_key())
+    if version is None:
+        cache.add(_permissions_version_key(), _new_version(), None)
+        version = cache.get(_permissions_version_key())
+    return version
+
+
+def _build_permissions(user):
+    user_perms = {
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+    }
+    if user.is_superuser:
+        # المدير العام لديه جميع الصلاحيات
+        granted = None
+    else:
+        # استعلام واحد لكل صلاحيات المستخدم ومجموعاته بدلاً من has_perm لكل صلاحية
+        granted = {perm.split('.', 1)[1] for perm in user.get_all_permissions()}
+
+    for model in COMMON_MODELS:
+        for action in COMMON_ACTIONS:
+            codename = f'{action}_{model}'
+            user_perms[codename] = granted is None or codename in granted
+    return user_perms
+
+
+def user_permission_map(user):
+    """
+    خريطة صلاحيات المستخدم للقوالب {اسم الصلاحية: True/False}
+
+    تُحسب مرة واحدة لكل مستخدم حتى تتغير صلاحياته أو مجموعاته.
+    """
+    key = _permissions_key(user.pk, _permissions_version())
+    user_perms = cache.get(key)
+    if user_perms is None:
+        user_perms = _build_permissions(user)
+        cache.set(key, user_perms, getattr(settings, 'PAGE_CHROME_PERMISSIONS_TIMEOUT', DEFAULT_PERMISSIONS_TIMEOUT))
+    return user_perms
+
+
+def invalidate_user_permissions(user_ids):
+    """
+    إبطال خريطة صلاحيات مستخدمين معينين
+    """
+    def delete():
+        version = _permissions_version()
+        cache.delete_many([_permissions_key(user_id, version) for user_id in user_ids])
+
+    if user_ids:
+        _on_commit(delete)
+
+
+def invalidate_all_permissions():
+    """
+    إبطال خرائط صلاحيات كل المستخدمين (عند تغير صلاحيات مجموعة أو حذف صلاحية)
+    """
+    _on_commit(lambda: cache.set(_permissions_version_key(), _new_version(), None))
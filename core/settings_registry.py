@@ -0,0 +1,140 @@
+"""
+سجل إعدادات النظام
+
+يحمل كل إعدادات النظام النشطة مرة واحدة في نسخة ثابتة داخل العملية بعد
+تحويل كل قيمة إلى نوعها، ويعيد التحميل فقط عند تغير رقم الإصدار المخزن
+في الذاكرة المؤقتة المشتركة (يتم زيادته عند حفظ أو حذف أي إعداد)، فتعرف
+كل العمليات بالتغيير بدون أي استعلام على قاعدة البيانات في كل طلب.
+"""
+import json
+import logging
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+from types import MappingProxyType
+
+from django.core.cache import cache
+from django.utils.dateparse import parse_date, parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# مفتاح رقم إصدار الإعدادات في الذاكرة المؤقتة المشتركة
+VERSION_CACHE_KEY = 'core:system_settings:version'
+
+# القيم المعتبرة صحيحة للإعدادات المنطقية
+TRUE_VALUES = ('true', '1', 'yes', 'نعم')
+
+
+def convert_value(value, data_type):
+    """
+    تحويل قيمة الإعداد النصية إلى النوع المناسب
+
+    المعلمات:
+    value (str): القيمة المخزنة
+    data_type (str): نوع البيانات
+
+    تُرجع: القيمة بعد التحويل (أو قيمة افتراضية للنوع إذا كانت غير صالحة)
+    """
+    if data_type == 'boolean':
+        return str(value).strip().lower() in TRUE_VALUES
+    if data_type == 'integer':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+    if data_type in ('decimal', 'float'):
+        try:
+            return float(Decimal(value))
+        except (TypeError, ValueError, InvalidOperation):
+            return 0.0
+    if data_type == 'json':
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError):
+            return {}
+    if data_type == 'date':
+        return parse_date(value or '') or value
+    if data_type == 'datetime':
+        return parse_datetime(value or '') or value
+    # النص والأنواع الأخرى
+    return value
+
+
+def _new_version():
+    # رقم إصدار مبني على الوقت حتى لا يتكرر رقم قديم إذا حُذف المفتاح من الذاكرة المؤقتة
+    return time.time_ns()
+
+
+def current_version():
+    """
+    رقم إصدار الإعدادات الحالي من الذاكرة المؤقتة المشتركة
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, _new_version(), None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def bump_version():
+    """
+    زيادة رقم إصدار الإعدادات لإبطال النسخ المحملة في كل العمليات
+    """
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, _new_version(), None)
+
+
+class SettingsRegistry:
+    """
+    نسخة ثابتة من إعدادات النظام النشطة داخل العملية الحالية
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._version = None
+
+    def _load(self):
+        from core.models import SystemSetting
+
+        rows = SystemSetting.objects.filter(is_active=True).values_list('key', 'value', 'data_type')
+        return MappingProxyType({
+            key: convert_value(value, data_type) for key, value, data_type in rows
+        })
+
+    def snapshot(self):
+        """
+        كل الإعدادات النشطة كقاموس للقراءة فقط
+
+        يتم التحميل من قاعدة البيانات فقط عند أول استخدام أو عند تغير رقم الإصدار.
+        """
+        version = current_version()
+        snapshot = self._snapshot
+        if snapshot is not None and version == self._version:
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None or version != self._version:
+                self._snapshot = self._load()
+                self._version = version
+            return self._snapshot
+
+    def get(self, key, default=None):
+        """
+        قيمة إعداد معين بعد تحويلها إلى نوعها
+        """
+        return self.snapshot().get(key, default)
+
+    def invalidate(self):
+        """
+        إبطال النسخة المحملة في كل العمليات
+        """
+        bump_version()
+        with self._lock:
+            self._snapshot = None
+
+
+# السجل المشترك للعملية الحالية
+settings_registry = SettingsRegistry()
@@ -0,0 +1,117 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete
+from django.dispatch import receiver
+
+from .dashboard_stats import GROUP_MODELS, mark_stale
+from .models import Notification, SystemSetting
+from .page_chrome import (
+    COUNTED_MODELS, invalidate_entity_count, invalidate_notifications,
+    invalidate_user_permissions, invalidate_all_permissions,
+)
+from .settings_registry import settings_registry
+
+User = get_user_model()
+
+# حقول المستخدم التي لا تؤثر على صلاحياته (تتغير مع كل تسجيل دخول أو نشاط)
+NON_PERMISSION_USER_FIELDS = {'last_login', 'last_activity'}
+
+
+@receiver(post_save, sender=SystemSetting)
+@receiver(post_delete, sender=SystemSetting)
+def invalidate_settings_registry(sender, instance, **kwargs):
+    """
+    إبطال سجل الإعدادات في كل العمليات بعد تأكيد تعديل أي إعداد
+    """
+    transaction.on_commit(settings_registry.invalidate)
+
+
+def invalidate_entity_count_on_save(sender, instance, created, **kwargs):
+    """
+    إبطال عدد الكيان المعروض في إطار الصفحة عند إضافة سجل جديد
+    """
+    if created:
+        invalidate_entity_count(sender)
+
+
+def invalidate_entity_count_on_delete(sender, instance, **kwargs):
+    """
+    إبطال عدد الكيان المعروض في إطار الصفحة عند حذف سجل
+    """
+    invalidate_entity_count(sender)
+
+
+for _label in COUNTED_MODELS.values():
+    post_save.connect(invalidate_entity_count_on_save, sender=_label)
+    post_delete.connect(invalidate_entity_count_on_delete, sender=_label)
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def invalidate_user_notifications(sender, instance, **kwargs):
+    """
+    إبطال إشعارات المستخدم المخزنة عند إضافة أو تعديل أو حذف أحد إشعاراته
+    """
+    invalidate_notifications(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+def invalidate_permissions_on_user_save(sender, instance, update_fields=None, **kwargs):
+    """
+    إبطال خريطة صلاحيات المستخدم عند تعديل بياناته (مثل مدير عام أو موظف أو نشط)
+    """
+    if update_fields and set(update_fields) <= NON_PERMISSION_USER_FIELDS:
+        return
+    invalidate_user_permissions([instance.pk])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_permissions_on_user_change(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    إبطال خريطة الصلاحيات عند تغيير مجموعات المستخدم أو صلاحياته المباشرة
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate_user_permissions([instance.pk])
+    elif pk_set:
+        # التعديل من جهة المجموعة أو الصلاحية: pk_set هي معرفات المستخدمين
+        invalidate_user_permissions(list(pk_set))
+    else:
+        invalidate_all_permissions()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_permissions_on_group_change(sender, action, **kwargs):
+    """
+    إبطال خرائط الصلاحيات لكل المستخدمين عند تغيير صلاحيات مجموعة
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_all_permissions()
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_permissions_on_delete(sender, instance, **kwargs):
+    """
+    إبطال خرائط الصلاحيات لكل المستخدمين عند حذف مجموعة أو صلاحية
+    """
+    invalidate_all_permissions()
+
+
+# مجموعة إحصائيات لوحة التحكم لكل نموذج {النموذج: المجموعة}
+DASHBOARD_GROUPS = {label: group for group, labels in GROUP_MODELS.items() for label in labels}
+
+
+def mark_dashboard_stats_stale(sender, instance, **kwargs):
+    """
+    تعليم مجموعة إحصائيات لوحة التحكم المتأثرة كقديمة عند حفظ أو حذف سجل
+    """
+    mark_stale(DASHBOARD_GROUPS[sender._meta.label])
+
+
+for _label in DASHBOARD_GROUPS:
+    post_save.connect(mark_dashboard_stats_stale, sender=_label)
+    post_delete.connect(mark_dashboard_stats_stale, sender=_label)
@@ -0,0 +1,32 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from core.checks import check_shared_cache
+
+DATABASE_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}}
+REDIS_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'}}
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+    """
+    اختبارات فحص الذاكرة المؤقتة المشتركة بين عمليات الخادم
+    """
+
+    def check_ids(self, workers):
+        with mock.patch.dict('os.environ', {'WEB_CONCURRENCY': workers}):
+            return [message.id for message in check_shared_cache(None)]
+
+    def test_local_cache_is_enough_for_one_process(self):
+        self.assertEqual(self.check_ids('1'), [])
+
+    def test_local_cache_fails_with_several_workers(self):
+        self.assertEqual(self.check_ids('4'), ['core.E001'])
+
+    @override_settings(CACHES=REDIS_CACHES)
+    def test_shared_cache_passes_with_several_workers(self):
+        self.assertEqual(self.check_ids('4'), [])
+
+    @override_settings(CACHES=DATABASE_CACHES)
+    def test_database_cache_warns(self):
+        self.assertEqual(self.check_ids('4'), ['core.W001'])
@@ -0,0 +1,111 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+User = get_user_model()
+
+
+class DashboardStatsTest(TestCase):
+    """
+    اختبارات إحصائيات لوحة التحكم المحسوبة مسبقاً
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        from client.models import Customer
+
+        cache.clear()
+        # بدون إشارات حتى لا يبقى تعليم المجموعة معلقاً في معاملة الاختبار التي لا تُؤكد
+        Customer.objects.bulk_create([Customer(name='عميل أول', code='C-1')])
+
+    def test_precomputed_stats_are_read_without_queries(self):
+        from core.dashboard_stats import dashboard_stats, refresh_stats
+        from core.models import DashboardStat
+
+        refresh_stats()
+        self.assertEqual(DashboardStat.objects.get(key='customers_count').value, '1')
+        with self.assertNumQueries(0):
+            stats = dashboard_stats()
+        self.assertEqual(stats['customers_count'].data, {'count': 1})
+        self.assertEqual(stats['sales_today'].data, {'count': 0, 'total': '0'})
+        self.assertIsNotNone(stats['sales_today'].computed_at)
+
+    def test_commit_marks_only_affected_group_stale(self):
+        from client.models import Customer
+        from core.dashboard_stats import dashboard_stats, refresh_stats
+
+        refresh_stats()
+        with self.captureOnCommitCallbacks(execute=True):
+            Customer.objects.create(name='عميل ثاني', code='C-2')
+            Customer.objects.create(name='عميل ثالث', code='C-3')
+
+        # إعادة حساب مجموعة العملاء وحدها: استعلام العد ثم حفظ الصف
+        with self.assertNumQueries(2):
+            stats = dashboard_stats()
+        self.assertEqual(stats['customers_count'].data, {'count': 3})
+        with self.assertNumQueries(0):
+            dashboard_stats()
+
+    def test_cold_cache_and_expired_stats(self):
+        from django.core.cache import cache
+        from core.dashboard_stats import dashboard_stats, refresh_stats
+
+        refresh_stats()
+        cache.clear()
+        # بعد فقد الذاكرة المؤقتة تُقرأ الإحصائيات من DashboardStat باستعلام واحد
+        with self.assertNumQueries(1):
+            stats = dashboard_stats(['customers'])
+        self.assertEqual(stats['customers_count'].data, {'count': 1})
+
+        with override_settings(DASHBOARD_STATS_MAX_AGE=-1):
+            with self.assertNumQueries(2):
+                dashboard_stats(['customers'])
+
+    def test_stale_mark_is_registered_once_per_transaction(self):
+        from django.db import transaction
+        from core.dashboard_stats import mark_stale
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    mark_stale('customers')
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            # التعليم المسجل في نقطة الحفظ الملغاة لا يمنع تسجيله من جديد
+            mark_stale('customers')
+            mark_stale('customers')
+        self.assertEqual(len(callbacks), 1)
+
+    def test_refresh_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from core.models import DashboardStat
+
+        out = StringIO()
+        call_command('refresh_dashboard_stats', '--group', 'customers', stdout=out)
+        self.assertIn('customers_count: 1', out.getvalue())
+        self.assertEqual(list(DashboardStat.objects.values_list('key', flat=True)), ['customers_count'])
+
+    def test_payment_method_stats_cover_current_month(self):
+        from datetime import timedelta
+        from decimal import Decimal
+        from django.utils import timezone
+        from core.dashboard_stats import refresh_stats
+        from sale.models import Sale
+        from client.models import Customer
+        from product.models import Warehouse
+
+        user = User.objects.create_user(username='stats_user', email='stats@example.com', password='testpassword123')
+        customer = Customer.objects.get(code='C-1')
+        warehouse = Warehouse.objects.create(name='المخزن', code='W-1')
+        today = timezone.localdate()
+        Sale.objects.bulk_create([
+            Sale(number='S-1', date=today, customer=customer, warehouse=warehouse, payment_method='cash',
+                 subtotal=100, total=100, created_by=user),
+            Sale(number='S-2', date=today.replace(day=1) - timedelta(days=1), customer=customer,
+                 warehouse=warehouse, payment_method='credit', subtotal=50, total=50, created_by=user),
+        ])
+
+        rows = refresh_stats(['sales'])['sales_by_payment_method'].data['rows']
+        self.assertEqual([(row['payment_method'], row['count']) for row in rows], [('cash', 1)])
+        self.assertEqual(Decimal(rows[0]['total']), Decimal('100'))
@@ -0,0 +1,129 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+User = get_user_model()
+
+
+class OutboxTest(TestCase):
+    """
+    اختبارات صندوق أحداث المستندات
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        from core.outbox import Outbox
+
+        # معرفات الحسابات المحفوظة من اختبارات سابقة أُلغيت معاملاتها
+        cache.clear()
+        self.outbox = Outbox()
+        self.calls = []
+        self.outbox.subscribe('user.touched')(lambda user: self.calls.append(('sync', user.pk)))
+        self.user = User.objects.create_user(
+            username='outbox_user', email='outbox@example.com', password='testpassword123'
+        )
+
+    def test_events_are_merged_and_run_inside_transaction(self):
+        from django.db import connection
+
+        self.outbox.subscribe('user.touched')(
+            lambda user: self.calls.append(('atomic', connection.in_atomic_block))
+        )
+        with self.outbox.atomic():
+            for _ in range(3):
+                self.outbox.publish('user.touched', self.user)
+            # لا شيء يُنفذ قبل نهاية الكتلة
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [('sync', self.user.pk), ('atomic', True)])
+        self.assertEqual(self.outbox.metrics()['merged'], 2)
+
+        # خارج الكتلة يُنفذ الحدث فوراً
+        self.outbox.publish('user.touched', self.user)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_rolled_back_events_are_dropped(self):
+        with self.outbox.atomic():
+            try:
+                with self.outbox.atomic():
+                    self.outbox.publish('user.touched', self.user)
+                    raise ValueError
+            except ValueError:
+                pass
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [])
+
+    def test_failed_handler_rolls_back_document(self):
+        from client.models import Customer
+
+        def fail(user):
+            raise RuntimeError
+
+        self.outbox.subscribe('user.touched')(fail)
+        with self.assertRaises(RuntimeError):
+            with self.outbox.atomic():
+                Customer.objects.create(name='عميل', code='C-1')
+                self.outbox.publish('user.touched', self.user)
+        self.assertFalse(Customer.objects.filter(code='C-1').exists())
+
+    def test_deferred_handlers_run_in_background(self):
+        import threading
+
+        threads = []
+        self.outbox.subscribe('user.touched', deferred=True)(
+            lambda user: threads.append(threading.current_thread().name)
+        )
+        with override_settings(OUTBOX_ASYNC=True), self.captureOnCommitCallbacks(execute=True):
+            with self.outbox.atomic():
+                self.outbox.publish('user.touched', self.user)
+            # المعالج المؤجل ينتظر تأكيد المعاملة
+            self.assertEqual(threads, [])
+        self.outbox.drain(timeout=5)
+        self.assertEqual(self.calls, [('sync', self.user.pk)])
+        self.assertEqual(threads, ['outbox-worker'])
+
+    def test_sale_payment_status_is_computed_once(self):
+        from unittest import mock
+        from client.models import Customer
+        from core.outbox import outbox
+        from product.models import Warehouse
+        from sale.models import Sale, SalePayment
+
+        customer = Customer.objects.create(name='عميل', code='C-1')
+        warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+        with mock.patch.object(Sale, 'update_payment_status', autospec=True) as update:
+            with outbox.atomic():
+                # إنشاء الفاتورة وتسجيل دفعة وإعادة حفظها في نفس المعاملة
+                sale = Sale.objects.create(
+                    date=timezone.now().date(), customer=customer, warehouse=warehouse,
+                    subtotal=100, total=100, payment_method='credit', created_by=self.user,
+                )
+                SalePayment.objects.create(
+                    sale=sale, amount=Decimal('40'), payment_date=sale.date,
+                    payment_method='cash', created_by=self.user,
+                )
+                sale.save()
+        self.assertEqual(update.call_count, 1)
+
+    def test_payment_and_posting_commit_with_sale(self):
+        from client.models import Customer
+        from core.outbox import outbox
+        from product.models import Warehouse
+        from sale.models import Sale, SalePayment
+
+        sale = Sale.objects.create(
+            date=timezone.now().date(), customer=Customer.objects.create(name='عميل', code='C-1'),
+            warehouse=Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN'),
+            subtotal=100, total=100, payment_method='credit', created_by=self.user,
+        )
+        # المبلغ المدفوع وحالة الدفع والقيد المالي داخل معاملة الدفعة نفسها (بدون تنفيذ on_commit)
+        with self.captureOnCommitCallbacks(), outbox.atomic():
+            payment = SalePayment.objects.create(
+                sale=sale, amount=Decimal('100'), payment_date=sale.date,
+                payment_method='cash', created_by=self.user,
+            )
+        sale.refresh_from_db()
+        payment.refresh_from_db()
+        self.assertEqual((sale.paid_amount, sale.payment_status), (Decimal('100'), 'paid'))
+        self.assertIsNotNone(payment.financial_transaction_id)
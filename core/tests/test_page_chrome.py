@@ -0,0 +1,92 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+User = get_user_model()
+
+
+class PageChromeCacheTest(TestCase):
+    """
+    اختبارات الذاكرة المؤقتة لعناصر إطار الصفحة (الأعداد والإشعارات والصلاحيات)
+    """
+
+    def setUp(self):
+        from django.core.cache import cache
+        from django.test import RequestFactory
+
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='chrome_user', email='chrome@example.com', password='testpassword123'
+        )
+        self.request = RequestFactory().get('/')
+        self.request.user = self.user
+
+    def render_chrome(self):
+        from core.context_processors import notifications
+        from utils.context_processors import common_variables, user_permissions
+
+        context = {}
+        for processor in (common_variables, user_permissions, notifications):
+            context.update(processor(self.request))
+        return context
+
+    def test_steady_state_runs_no_queries(self):
+        # بالذاكرة المؤقتة الافتراضية للمشروع كما هي (دون تجاوز CACHES)
+        self.render_chrome()
+        with self.assertNumQueries(0):
+            context = self.render_chrome()
+        self.assertEqual(context['main_models']['customers_count'], 0)
+        self.assertFalse(context['user_perms']['view_customer'])
+
+    def test_counts_refresh_after_create_and_delete(self):
+        from client.models import Customer
+
+        self.render_chrome()
+        with self.captureOnCommitCallbacks(execute=True):
+            customer = Customer.objects.create(name='عميل', code='C-1', created_by=self.user)
+        self.assertEqual(self.render_chrome()['main_models']['customers_count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            customer.delete()
+        self.assertEqual(self.render_chrome()['main_models']['customers_count'], 0)
+
+    def test_notifications_invalidated_on_write(self):
+        from core.models import Notification
+
+        self.assertEqual(self.render_chrome()['unread_notifications_count'], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Notification.objects.create(user=self.user, title='تنبيه', message='رسالة', type='inventory_alert')
+        context = self.render_chrome()
+        self.assertEqual(context['unread_notifications_count'], 1)
+        self.assertEqual(context['notifications'][0]['link'], '/product/inventory/')
+
+        self.client.force_login(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('core:mark_all_notifications_read'))
+        self.assertEqual(response.status_code, 200)
+        context = self.render_chrome()
+        self.assertEqual(context['unread_notifications_count'], 0)
+        self.assertTrue(context['notifications'][0]['read'])
+
+    def test_permission_map_invalidated_on_change(self):
+        from django.contrib.auth.models import Group, Permission
+
+        self.assertFalse(self.render_chrome()['user_perms']['view_customer'])
+
+        group = Group.objects.create(name='المبيعات')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(group)
+        with self.captureOnCommitCallbacks(execute=True):
+            group.permissions.add(Permission.objects.get(codename='view_customer'))
+
+        # صلاحيات المستخدم محفوظة على الكائن نفسه، لذلك يتم تحميله من جديد كما في طلب جديد
+        self.request.user = User.objects.get(pk=self.user.pk)
+        self.assertTrue(self.render_chrome()['user_perms']['view_customer'])
+
+    def test_cache_errors_are_not_hidden(self):
+        from unittest import mock
+
+        # تعطل الذاكرة المؤقتة يظهر كخطأ بدلاً من إطار صفحة فارغ
+        with mock.patch('django.core.cache.cache.get_many', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                self.render_chrome()
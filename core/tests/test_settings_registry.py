@@ -0,0 +1,77 @@
+from django.test import TestCase
+
+
+class SettingsRegistryTest(TestCase):
+    """
+    اختبارات سجل إعدادات النظام المحمل في الذاكرة
+    """
+
+    def setUp(self):
+        from core.models import SystemSetting
+        from core.settings_registry import settings_registry
+
+        self.registry = settings_registry
+        self.registry.invalidate()
+        SystemSetting.objects.create(key='site_name', value='موهبة', data_type='string')
+        SystemSetting.objects.create(key='items_per_page', value='25', data_type='integer')
+        SystemSetting.objects.create(key='allow_negative', value='نعم', data_type='boolean')
+        SystemSetting.objects.create(key='disabled', value='x', is_active=False)
+
+    def test_values_are_typed_and_read_only(self):
+        from core.models import SystemSetting
+
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['items_per_page'], 25)
+        self.assertIs(snapshot['allow_negative'], True)
+        self.assertNotIn('disabled', snapshot)
+        with self.assertRaises(TypeError):
+            snapshot['site_name'] = 'x'
+
+        with self.assertNumQueries(0):
+            self.assertEqual(SystemSetting.get_setting('site_name'), 'موهبة')
+            self.assertEqual(SystemSetting.get_setting('missing', 'default'), 'default')
+
+    def test_save_and_delete_invalidate_snapshot(self):
+        from core.models import SystemSetting
+
+        self.registry.snapshot()
+        setting = SystemSetting.objects.get(key='items_per_page')
+        setting.value = '50'
+        # الإبطال يتم بعد تأكيد المعاملة
+        with self.captureOnCommitCallbacks(execute=True):
+            setting.save()
+        self.assertEqual(SystemSetting.get_setting('items_per_page'), 50)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            setting.delete()
+        self.assertIsNone(SystemSetting.get_setting('items_per_page'))
+
+    def test_change_reaches_other_processes(self):
+        from core.models import SystemSetting
+        from core.settings_registry import SettingsRegistry
+
+        # سجل مستقل يمثل عاملاً آخر يشارك نفس الذاكرة المؤقتة (CACHE_URL)
+        other = SettingsRegistry()
+        self.assertEqual(other.get('items_per_page'), 25)
+        setting = SystemSetting.objects.get(key='items_per_page')
+        setting.value = '40'
+        with self.captureOnCommitCallbacks(execute=True):
+            setting.save()
+        self.assertEqual(other.get('items_per_page'), 40)
+
+    def test_context_processor_uses_registry(self):
+        from core.context_processors import global_settings
+
+        self.registry.snapshot()
+        with self.assertNumQueries(0):
+            context = global_settings(None)
+        self.assertEqual(context['SITE_NAME'], 'موهبة')
+
+    def test_context_processor_does_not_hide_errors(self):
+        from unittest import mock
+        from core.context_processors import global_settings
+
+        # الذاكرة المؤقتة غير المتاحة تظهر كخطأ بدلاً من إعدادات فارغة
+        with mock.patch.object(self.registry, 'snapshot', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                global_settings(None)
@@ -1,17 +1,13 @@
 from django.shortcuts import render, redirect
-from django.db.models import Sum, Count, Avg, F, Q
 from django.contrib.auth.decorators import login_required
-from django.utils import timezone
-from datetime import timedelta
 from django.urls import reverse
 from django.contrib import messages
 
 from sale.models import Sale
 from purchase.models import Purchase
-from client.models import Customer
-from supplier.models import Supplier
-from product.models import Product, Stock
+from .dashboard_stats import dashboard_stats
 from .models import SystemSetting, Notification
+from .page_chrome import invalidate_notifications
 from utils import create_breadcrumb_item
 
 
@@ -20,53 +16,23 @@ def dashboard(request):
     """
     View for the main dashboard
     """
-    # تجميع بيانات الإحصائيات
-    
-    # إحصائيات المبيعات اليوم
-    sales_today = Sale.objects.filter(date=timezone.now().date())
-    sales_today_count = sales_today.count()
-    sales_today_total = sales_today.aggregate(total=Sum('total'))['total'] or 0
-    
-    # إحصائيات المشتريات اليوم
-    purchases_today = Purchase.objects.filter(date=timezone.now().date())
-    purchases_today_count = purchases_today.count()
-    purchases_today_total = purchases_today.aggregate(total=Sum('total'))['total'] or 0
-    
-    # إحصائيات العملاء والمنتجات
-    customers_count = Customer.objects.filter(is_active=True).count()
-    products_count = Product.objects.filter(is_active=True).count()
+    # الإحصائيات المحسوبة مسبقاً (قراءة واحدة من الذاكرة المؤقتة)
+    stats = dashboard_stats()
     
     # أحدث المبيعات والمشتريات
     recent_sales = Sale.objects.order_by('-date', '-id')[:5]
     recent_purchases = Purchase.objects.order_by('-date', '-id')[:5]
     
-    # المنتجات منخفضة المخزون
-    stock_condition = Q(stocks__quantity__lt=F('min_stock')) | Q(stocks__quantity=0)
-    low_stock_products = Product.objects.filter(
-        is_active=True
-    ).filter(stock_condition).distinct()[:5]
-    
-    # المبيعات حسب طريقة الدفع
-    sales_by_payment_method = Sale.objects.values('payment_method').annotate(
-        count=Count('id'),
-        total=Sum('total')
-    ).order_by('-total')
-    
     context = {
-        'sales_today': {
-            'count': sales_today_count,
-            'total': sales_today_total
-        },
-        'purchases_today': {
-            'count': purchases_today_count,
-            'total': purchases_today_total
-        },
-        'customers_count': customers_count,
-        'products_count': products_count,
+        'sales_today': stats['sales_today'].data,
+        'purchases_today': stats['purchases_today'].data,
+        'customers_count': stats['customers_count'].data['count'],
+        'products_count': stats['products_count'].data['count'],
         'recent_sales': recent_sales,
         'recent_purchases': recent_purchases,
-        'low_stock_products': low_stock_products,
-        'sales_by_payment_method': sales_by_payment_method,
+        'low_stock_products': stats['low_stock_products'].data['products'],
+        'sales_by_payment_method': stats['sales_by_payment_method'].data['rows'],
+        'stats_computed_at': min(stat.computed_at for stat in stats.values()),
         # إضافة متغيرات عنوان الصفحة
         'page_title': 'لوحة التحكم',
         'page_icon': 'fas fa-tachometer-alt',
@@ -189,6 +155,8 @@ def notifications_list(request):
     # عمل تعليم الكل كمقروء إذا كان هناك طلب POST
     if request.method == 'POST' and 'mark_all_read' in request.POST:
         unread_notifications.update(is_read=True)
+        # التحديث الجماعي لا يرسل إشارات الحفظ
+        invalidate_notifications(request.user.pk)
         messages.success(request, 'تم تعليم جميع الإشعارات كمقروءة بنجاح.')
         return redirect('core:notifications_list')
     
@@ -6,3 +6,9 @@ class FinancialConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'financial'
     verbose_name = _('الحسابات المالية')
+    
+    def ready(self):
+        """
+        استدعاء الإشارات عند تشغيل التطبيق
+        """
+        import financial.signals
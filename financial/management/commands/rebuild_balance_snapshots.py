@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from financial.services.balance_snapshots import rebuild_snapshots
+
+
+class Command(BaseCommand):
+    help = 'بناء أو إصلاح لقطات الأرصدة الشهرية للحسابات من بنود المعاملات'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='معرف الحساب المراد إعادة بناء لقطاته (يمكن تكراره)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='عدد اللقطات في كل دفعة إنشاء')
+
+    def handle(self, *args, **options):
+        created = rebuild_snapshots(
+            account_ids=options['accounts'],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'تم بناء {created} لقطة رصيد شهرية بنجاح'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from financial.services.running_balance import rebuild_running_balances
+
+
+class Command(BaseCommand):
+    help = 'إعادة حساب الأرصدة الجارية للمعاملات المالية (بعد إدخال معاملات بتاريخ سابق أو استيراد بيانات)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', type=int, action='append', dest='accounts',
+                            help='معرف الحساب المراد إعادة حسابه (يمكن تكراره)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='عدد المعاملات في كل دفعة تحديث')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='عرض عدد المعاملات المختلفة بدون حفظ')
+
+    def handle(self, *args, **options):
+        updated = rebuild_running_balances(
+            account_ids=options['accounts'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'عدد المعاملات التي تحتاج إلى تصحيح الرصيد: {updated}')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'تم تصحيح الرصيد الجاري لعدد {updated} معاملة بنجاح'))
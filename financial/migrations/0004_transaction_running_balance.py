@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:57
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def populate_running_balances(apps, schema_editor):
+    """
+    حساب الأرصدة الجارية للمعاملات الموجودة
+    """
+    Transaction = apps.get_model('financial', 'Transaction')
+    balances = defaultdict(Decimal)
+    pending = []
+
+    for txn in Transaction.objects.order_by('date', 'id').iterator(chunk_size=1000):
+        if txn.account_id:
+            if txn.transaction_type == 'income':
+                balances[txn.account_id] += txn.amount
+            elif txn.transaction_type in ('expense', 'transfer'):
+                balances[txn.account_id] -= txn.amount
+            txn.running_balance = balances[txn.account_id]
+        if txn.transaction_type == 'transfer' and txn.to_account_id and txn.to_account_id != txn.account_id:
+            balances[txn.to_account_id] += txn.amount
+            txn.to_running_balance = balances[txn.to_account_id]
+        pending.append(txn)
+
+        if len(pending) >= 1000:
+            Transaction.objects.bulk_update(pending, ['running_balance', 'to_running_balance'])
+            pending = []
+
+    if pending:
+        Transaction.objects.bulk_update(pending, ['running_balance', 'to_running_balance'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial', '0003_bankreconciliation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='running_balance',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=14, null=True, verbose_name='رصيد الحساب بعد المعاملة'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='to_running_balance',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=14, null=True, verbose_name='رصيد الحساب المستلم بعد المعاملة'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'date', 'id'], name='financial_txn_account_date'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['to_account', 'date', 'id'], name='financial_txn_to_account_date'),
+        ),
+        migrations.RunPython(populate_running_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:02
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def build_snapshots(apps, schema_editor):
+    """
+    بناء لقطات الأرصدة الشهرية من البنود الموجودة
+    """
+    TransactionLine = apps.get_model('financial', 'TransactionLine')
+    AccountBalanceSnapshot = apps.get_model('financial', 'AccountBalanceSnapshot')
+
+    monthly = TransactionLine.objects.annotate(
+        period=TruncMonth('transaction__date')
+    ).values('account_id', 'period').annotate(
+        total_debit=Sum('debit'),
+        total_credit=Sum('credit'),
+    ).order_by('account_id', 'period')
+
+    running = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+    rows = []
+    for row in monthly:
+        totals = running[row['account_id']]
+        totals[0] += row['total_debit'] or 0
+        totals[1] += row['total_credit'] or 0
+        rows.append(AccountBalanceSnapshot(
+            account_id=row['account_id'],
+            period=row['period'],
+            total_debit=totals[0],
+            total_credit=totals[1],
+        ))
+    AccountBalanceSnapshot.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('financial', '0004_transaction_running_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='أول يوم في الشهر', verbose_name='الشهر')),
+                ('total_debit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='إجمالي المدين')),
+                ('total_credit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='إجمالي الدائن')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاريخ التحديث')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='financial.account', verbose_name='الحساب')),
+            ],
+            options={
+                'verbose_name': 'لقطة رصيد حساب',
+                'verbose_name_plural': 'لقطات أرصدة الحسابات',
+                'ordering': ['account', '-period'],
+                'unique_together': {('account', 'period')},
+            },
+        ),
+        migrations.RunPython(build_snapshots, migrations.RunPython.noop),
+    ]
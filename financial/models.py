@@ -1,8 +1,7 @@
-from django.db import models
+from django.db import models, transaction as db_transaction
 from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Q
 
 User = settings.AUTH_USER_MODEL
 
@@ -191,6 +190,11 @@ class Transaction(models.Model):
     reference_number = models.CharField(_('رقم المرجع'), max_length=100, blank=True, null=True)
     reference = models.CharField(_('المرجع'), max_length=100, blank=True, null=True)
     is_reconciled = models.BooleanField(_('تمت التسوية'), default=False)
+    # الرصيد الجاري بعد المعاملة (يُحدث تلقائياً، انظر financial.services.running_balance)
+    running_balance = models.DecimalField(_('رصيد الحساب بعد المعاملة'), max_digits=14, decimal_places=2,
+                                          null=True, blank=True, editable=False)
+    to_running_balance = models.DecimalField(_('رصيد الحساب المستلم بعد المعاملة'), max_digits=14, decimal_places=2,
+                                             null=True, blank=True, editable=False)
     
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
@@ -200,9 +204,26 @@ class Transaction(models.Model):
         verbose_name = _('معاملة')
         verbose_name_plural = _('المعاملات')
         ordering = ['-date', '-id']
+        indexes = [
+            models.Index(fields=['account', 'date', 'id'], name='financial_txn_account_date'),
+            models.Index(fields=['to_account', 'date', 'id'], name='financial_txn_to_account_date'),
+        ]
     
     def __str__(self):
         return f"{self.get_transaction_type_display()} - {self.amount}"
+    
+    def save(self, *args, **kwargs):
+        """
+        حفظ المعاملة مع تحديث الأرصدة الجارية للمعاملة وما بعدها
+        """
+        from financial.services.running_balance import save_with_running_balance
+        from financial.services.balance_snapshots import move_transaction_lines
+        
+        with db_transaction.atomic():
+            previous = save_with_running_balance(self, lambda: super(Transaction, self).save(*args, **kwargs))
+            # تغيير تاريخ المعاملة ينقل بنودها إلى لقطة الشهر الجديد
+            if previous is not None:
+                move_transaction_lines(self, previous.date)
         
     def get_type_class(self):
         """
@@ -247,45 +268,22 @@ class Transaction(models.Model):
     @property
     def balance_after(self):
         """
-        استرجاع الرصيد بعد العملية
+        استرجاع رصيد الحساب بعد العملية (مخزن مع المعاملة)
         """
-        if not self.account:
+        if not self.account_id:
             return None
-            
-        # الحصول على الرصيد الحالي للحساب
-        current_balance = self.account.balance
-        
-        # الحصول على تاريخ المعاملة
-        transaction_date = self.date
-        
-        # الحصول على معرف المعاملة الحالية
-        transaction_id = self.id or 0
-        
-        # الحصول على جميع المعاملات للحساب حتى هذه المعاملة (بما فيها هذه المعاملة)
-        all_transactions = Transaction.objects.filter(
-            Q(account=self.account) | Q(to_account=self.account),
-            Q(date__lt=transaction_date) | (Q(date=transaction_date) & Q(id__lte=transaction_id))
-        ).order_by('date', 'id')
-        
-        # حساب الرصيد بعد كل معاملة
-        running_balance = 0
-        for trans in all_transactions:
-            # إذا كانت المعاملة إيرادًا والحساب هو حساب المستلم، أضف المبلغ
-            if trans.transaction_type == 'income' and trans.account == self.account:
-                running_balance += trans.amount
-            # إذا كانت المعاملة مصروفًا والحساب هو حساب المصدر، اطرح المبلغ
-            elif trans.transaction_type == 'expense' and trans.account == self.account:
-                running_balance -= trans.amount
-            # إذا كانت المعاملة تحويلًا
-            elif trans.transaction_type == 'transfer':
-                # إذا كان الحساب هو حساب المصدر، اطرح المبلغ
-                if trans.account == self.account:
-                    running_balance -= trans.amount
-                # إذا كان الحساب هو حساب المستلم، أضف المبلغ
-                elif trans.to_account == self.account:
-                    running_balance += trans.amount
-        
-        return running_balance
+        return self.running_balance
+    
+    def balance_after_for(self, account):
+        """
+        استرجاع رصيد حساب معين بعد العملية (الحساب المصدر أو المستلم)
+        """
+        account_id = getattr(account, 'pk', account)
+        if account_id == self.account_id:
+            return self.running_balance
+        if account_id == self.to_account_id:
+            return self.to_running_balance
+        return None
 
 
 class TransactionLine(models.Model):
@@ -307,6 +305,36 @@ class TransactionLine(models.Model):
     
     def __str__(self):
         return f"{self.account.name} - {self.debit or self.credit}"
+    
+    def save(self, *args, **kwargs):
+        """
+        حفظ البند مع تحديث لقطات الأرصدة الشهرية للحساب
+        """
+        from financial.services.balance_snapshots import save_line_with_snapshots
+        save_line_with_snapshots(self, lambda: super(TransactionLine, self).save(*args, **kwargs))
+
+
+class AccountBalanceSnapshot(models.Model):
+    """
+    لقطة الرصيد الختامي للحساب في نهاية كل شهر
+
+    تحفظ إجمالي المدين والدائن التراكمي للحساب حتى نهاية الشهر، ويتم
+    تحديثها تلقائياً عند ترحيل بنود المعاملات.
+    """
+    account = models.ForeignKey(Account, on_delete=models.CASCADE, related_name='balance_snapshots', verbose_name=_('الحساب'))
+    period = models.DateField(_('الشهر'), help_text=_('أول يوم في الشهر'))
+    total_debit = models.DecimalField(_('إجمالي المدين'), max_digits=14, decimal_places=2, default=0)
+    total_credit = models.DecimalField(_('إجمالي الدائن'), max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
+    
+    class Meta:
+        verbose_name = _('لقطة رصيد حساب')
+        verbose_name_plural = _('لقطات أرصدة الحسابات')
+        ordering = ['account', '-period']
+        unique_together = ['account', 'period']
+    
+    def __str__(self):
+        return f"{self.account.name} - {self.period:%Y-%m}"
 
 
 class Expense(models.Model):
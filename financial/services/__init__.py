@@ -0,0 +1,18 @@
+"""
+خدمات الحسابات المالية
+"""
+from financial.services.running_balance import (
+    save_with_running_balance, remove_running_balance, rebuild_running_balances,
+)
+from financial.services.trial_balance import (
+    trial_balance, account_totals, normal_balance, balances_by_type,
+)
+from financial.services.balance_snapshots import (
+    totals_as_of, period_totals, rebuild_snapshots,
+)
+from financial.services.chart_of_accounts import (
+    chart_of_accounts, payment_account_code,
+)
+from financial.services.posting import (
+    post_transaction, debit, credit, update_account_balances,
+)
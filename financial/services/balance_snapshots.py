@@ -0,0 +1,260 @@
+"""
+خدمة لقطات الأرصدة الشهرية للحسابات
+
+تحفظ لكل حساب إجمالي المدين والدائن التراكمي حتى نهاية كل شهر فيه حركة،
+ويتم تحديث اللقطات تزايدياً عند ترحيل بنود المعاملات. رصيد الحساب في أي
+تاريخ = آخر لقطة قبل شهر التاريخ + بنود الشهر نفسه حتى التاريخ، فلا يتم
+قراءة أكثر من شهر واحد من البنود مهما طال تاريخ الحساب.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncMonth
+
+from financial.models import AccountBalanceSnapshot, Transaction, TransactionLine
+from financial.services.running_balance import lock_accounts
+
+ZERO = Decimal('0')
+
+
+def month_start(date):
+    """
+    أول يوم في شهر التاريخ
+    """
+    return date.replace(day=1)
+
+
+def _to_date(value):
+    return Transaction._meta.get_field('date').to_python(value)
+
+
+def _transaction_date(transaction_id):
+    return Transaction.objects.filter(pk=transaction_id).values_list('date', flat=True).first()
+
+
+def _line_date(line):
+    if TransactionLine.transaction.is_cached(line):
+        return _to_date(line.transaction.date)
+    return _transaction_date(line.transaction_id)
+
+
+def apply_line_delta(account_id, date, debit, credit):
+    """
+    إضافة مبلغ مدين ودائن إلى لقطات الحساب من شهر التاريخ وما بعده
+
+    المعلمات:
+    account_id (int): معرف الحساب
+    date (date): تاريخ المعاملة
+    debit (Decimal): المبلغ المدين (سالب للإلغاء)
+    credit (Decimal): المبلغ الدائن (سالب للإلغاء)
+    """
+    if not account_id or date is None or (not debit and not credit):
+        return
+
+    period = month_start(date)
+    with db_transaction.atomic(savepoint=False):
+        lock_accounts([account_id])
+        snapshots = AccountBalanceSnapshot.objects.filter(account_id=account_id)
+        snapshots.filter(period__gte=period).update(
+            total_debit=F('total_debit') + debit,
+            total_credit=F('total_credit') + credit,
+        )
+
+        if not snapshots.filter(period=period).exists():
+            # أول حركة في هذا الشهر: اللقطة تبدأ من رصيد آخر شهر سابق
+            previous = snapshots.filter(period__lt=period).order_by('-period').values_list(
+                'total_debit', 'total_credit'
+            ).first() or (ZERO, ZERO)
+            AccountBalanceSnapshot.objects.create(
+                account_id=account_id,
+                period=period,
+                total_debit=previous[0] + debit,
+                total_credit=previous[1] + credit,
+            )
+
+
+def save_line_with_snapshots(line, save):
+    """
+    حفظ بند المعاملة مع تحديث لقطات الأرصدة تزايدياً
+
+    المعلمات:
+    line (TransactionLine): البند المراد حفظه
+    save (callable): دالة الحفظ الفعلية للنموذج
+    """
+    current = (
+        line.account_id,
+        line.transaction_id,
+        Decimal(str(line.debit or 0)),
+        Decimal(str(line.credit or 0)),
+    )
+    with db_transaction.atomic():
+        previous = None
+        if line.pk:
+            previous = TransactionLine.objects.filter(pk=line.pk).values_list(
+                'account_id', 'transaction_id', 'debit', 'credit'
+            ).first()
+
+        save()
+        if previous == current:
+            return
+
+        if previous is not None:
+            account_id, transaction_id, debit, credit = previous
+            apply_line_delta(account_id, _transaction_date(transaction_id), -debit, -credit)
+        apply_line_delta(line.account_id, _line_date(line), current[2], current[3])
+
+
+def remove_line(line):
+    """
+    إزالة تأثير بند محذوف من لقطات الأرصدة
+    """
+    apply_line_delta(
+        line.account_id,
+        _transaction_date(line.transaction_id),
+        -Decimal(str(line.debit or 0)),
+        -Decimal(str(line.credit or 0)),
+    )
+
+
+def move_transaction_lines(txn, previous_date):
+    """
+    نقل تأثير بنود المعاملة إلى لقطة الشهر الجديد عند تغيير تاريخ المعاملة
+    """
+    date = _to_date(txn.date)
+    if previous_date is None or month_start(previous_date) == month_start(date):
+        return
+
+    totals = TransactionLine.objects.filter(transaction_id=txn.pk).values('account_id').annotate(
+        total_debit=Sum('debit'),
+        total_credit=Sum('credit'),
+    ).order_by()
+    for row in totals:
+        debit, credit = row['total_debit'] or ZERO, row['total_credit'] or ZERO
+        apply_line_delta(row['account_id'], previous_date, -debit, -credit)
+        apply_line_delta(row['account_id'], date, debit, credit)
+
+
+def _filter_accounts(queryset, account_types=None, account_ids=None, prefix=''):
+    if account_types:
+        queryset = queryset.filter(**{f'{prefix}account__account_type__in': account_types})
+    if account_ids is not None:
+        queryset = queryset.filter(**{f'{prefix}account_id__in': account_ids})
+    return queryset
+
+
+def line_totals(date_from=None, date_to=None, account_types=None, account_ids=None):
+    """
+    إجمالي المدين والدائن لكل حساب من البنود مباشرة باستعلام تجميع واحد
+
+    تُرجع: قاموس {معرف الحساب: (إجمالي المدين، إجمالي الدائن)}
+    """
+    lines = _filter_accounts(TransactionLine.objects.all(), account_types, account_ids)
+    if date_from:
+        lines = lines.filter(transaction__date__gte=date_from)
+    if date_to:
+        lines = lines.filter(transaction__date__lte=date_to)
+
+    rows = lines.values('account_id').annotate(
+        total_debit=Sum('debit'),
+        total_credit=Sum('credit'),
+    ).order_by()
+
+    return {
+        row['account_id']: (row['total_debit'] or ZERO, row['total_credit'] or ZERO)
+        for row in rows
+    }
+
+
+def totals_as_of(as_of=None, account_types=None, account_ids=None):
+    """
+    إجمالي المدين والدائن التراكمي لكل حساب حتى تاريخ معين (شامل)
+
+    يُقرأ آخر لقطة قبل شهر التاريخ ثم تُضاف بنود الشهر حتى التاريخ فقط.
+    بدون تاريخ تُستخدم آخر لقطة لكل حساب (كل الحركات).
+
+    تُرجع: قاموس {معرف الحساب: (إجمالي المدين، إجمالي الدائن)}
+    """
+    latest = AccountBalanceSnapshot.objects.filter(account=OuterRef('account'))
+    if as_of is not None:
+        latest = latest.filter(period__lt=month_start(as_of))
+    snapshots = AccountBalanceSnapshot.objects.filter(
+        period=Subquery(latest.order_by('-period').values('period')[:1])
+    )
+    snapshots = _filter_accounts(snapshots, account_types, account_ids)
+
+    totals = {
+        account_id: (total_debit, total_credit)
+        for account_id, total_debit, total_credit in snapshots.values_list(
+            'account_id', 'total_debit', 'total_credit'
+        )
+    }
+
+    if as_of is not None:
+        delta = line_totals(month_start(as_of), as_of, account_types, account_ids)
+        for account_id, (debit, credit) in delta.items():
+            total_debit, total_credit = totals.get(account_id, (ZERO, ZERO))
+            totals[account_id] = (total_debit + debit, total_credit + credit)
+
+    return totals
+
+
+def period_totals(date_from=None, date_to=None, account_types=None, account_ids=None):
+    """
+    إجمالي المدين والدائن لكل حساب خلال فترة باستخدام اللقطات
+
+    الفترة = الرصيد التراكمي في نهايتها - الرصيد التراكمي قبل بدايتها.
+    """
+    totals = totals_as_of(date_to, account_types, account_ids)
+    if not date_from:
+        return totals
+
+    opening = totals_as_of(date_from - timedelta(days=1), account_types, account_ids)
+    result = {}
+    for account_id in set(totals) | set(opening):
+        total_debit, total_credit = totals.get(account_id, (ZERO, ZERO))
+        opening_debit, opening_credit = opening.get(account_id, (ZERO, ZERO))
+        result[account_id] = (total_debit - opening_debit, total_credit - opening_credit)
+    return result
+
+
+def rebuild_snapshots(account_ids=None, batch_size=1000):
+    """
+    إعادة بناء لقطات الأرصدة من بنود المعاملات
+
+    المعلمات:
+    account_ids (list): حصر إعادة البناء في حسابات معينة (الافتراضي كل الحسابات)
+    batch_size (int): عدد اللقطات في كل دفعة إنشاء
+
+    تُرجع: عدد اللقطات التي تم إنشاؤها
+    """
+    monthly = TransactionLine.objects.annotate(
+        period=TruncMonth('transaction__date')
+    ).values('account_id', 'period').annotate(
+        total_debit=Sum('debit'),
+        total_credit=Sum('credit'),
+    ).order_by('account_id', 'period')
+    snapshots = AccountBalanceSnapshot.objects.all()
+    if account_ids:
+        monthly = monthly.filter(account_id__in=account_ids)
+        snapshots = snapshots.filter(account_id__in=account_ids)
+
+    running = defaultdict(lambda: [ZERO, ZERO])
+    rows = []
+    for row in monthly:
+        totals = running[row['account_id']]
+        totals[0] += row['total_debit'] or ZERO
+        totals[1] += row['total_credit'] or ZERO
+        rows.append(AccountBalanceSnapshot(
+            account_id=row['account_id'],
+            period=row['period'],
+            total_debit=totals[0],
+            total_credit=totals[1],
+        ))
+
+    with db_transaction.atomic():
+        snapshots.delete()
+        AccountBalanceSnapshot.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
@@ -0,0 +1,172 @@
+"""
+سجل دليل الحسابات
+
+يحل أكواد الحسابات المعروفة (الصندوق والبنك والعملاء والموردين والمبيعات
+والمشتريات) إلى معرفاتها مرة واحدة ويحفظها داخل العملية، بدلاً من استعلام
+get_or_create لكل حساب عند ترحيل كل فاتورة أو دفعة.
+
+يُعاد التحميل عند تغير رقم الإصدار المخزن في الذاكرة المؤقتة المشتركة بين
+العمليات (يتم زيادته عند حفظ أو حذف أي حساب)، ولا يُحفظ معرف حساب إلا بعد
+تأكيد المعاملة التي قرأته حتى لا يبقى معرف حساب أُلغي إنشاؤه. وإذا فشل
+الترحيل بمعرف محفوظ لحساب لم يعد موجوداً (post) تُبطل المعرفات ويُعاد الحل
+من قاعدة البيانات.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+from financial.models import Account
+
+# مفتاح رقم إصدار دليل الحسابات في الذاكرة المؤقتة المشتركة
+VERSION_CACHE_KEY = 'financial:chart_of_accounts:version'
+
+# الحسابات المعروفة وبيانات إنشائها إذا لم تكن موجودة
+WELL_KNOWN_ACCOUNTS = {
+    'CASH001': {'name': 'الصندوق', 'account_type': 'asset', 'type': 'cash'},
+    'BANK001': {'name': 'البنك', 'account_type': 'asset', 'type': 'bank'},
+    'AR001': {'name': 'حسابات العملاء', 'account_type': 'asset'},
+    'AP001': {'name': 'حسابات الموردين', 'account_type': 'liability'},
+    'INC002': {'name': 'إيرادات المبيعات', 'account_type': 'income'},
+    'EXP001': {'name': 'مشتريات', 'account_type': 'expense'},
+}
+
+# حساب الدفع حسب طريقة الدفع (الافتراضي الصندوق)
+PAYMENT_METHOD_ACCOUNTS = {
+    'cash': 'CASH001',
+    'bank_transfer': 'BANK001',
+}
+
+
+def _new_version():
+    # رقم إصدار مبني على الوقت حتى لا يتكرر رقم قديم إذا حُذف المفتاح من الذاكرة المؤقتة
+    return time.time_ns()
+
+
+def current_version():
+    """
+    رقم إصدار دليل الحسابات الحالي من الذاكرة المؤقتة المشتركة
+    """
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(VERSION_CACHE_KEY, _new_version(), None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+def bump_version():
+    """
+    زيادة رقم إصدار دليل الحسابات لإبطال المعرفات المحفوظة في كل العمليات
+    """
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, _new_version(), None)
+
+
+class ChartOfAccountsRegistry:
+    """
+    معرفات الحسابات المعروفة داخل العملية الحالية
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._version = None
+
+    def _cached(self, version):
+        with self._lock:
+            if version != self._version:
+                self._ids = {}
+                self._version = version
+            return dict(self._ids)
+
+    def _remember(self, version, ids):
+        with self._lock:
+            if version == self._version:
+                self._ids.update(ids)
+
+    def resolve(self, *codes, created_by=None, create=True):
+        """
+        معرفات الحسابات حسب أكوادها
+
+        المعلمات:
+        codes (str): أكواد الحسابات
+        created_by (User): منشئ الحسابات المعروفة غير الموجودة
+        create (bool): إنشاء الحسابات المعروفة غير الموجودة
+
+        تُرجع: قاموس {الكود: معرف الحساب}
+
+        يرفع Account.DoesNotExist إذا لم يوجد أحد الحسابات ولم يمكن إنشاؤه.
+        """
+        version = current_version()
+        cached = self._cached(version)
+        ids = {code: cached[code] for code in codes if code in cached}
+        missing = [code for code in codes if code not in ids]
+        if not missing:
+            return ids
+
+        found = dict(Account.objects.filter(code__in=missing).values_list('code', 'pk'))
+        for code in missing:
+            if code in found:
+                continue
+            if not create or code not in WELL_KNOWN_ACCOUNTS:
+                raise Account.DoesNotExist(f'الحساب {code} غير موجود')
+            account, _ = Account.objects.get_or_create(code=code, defaults={
+                **WELL_KNOWN_ACCOUNTS[code],
+                'is_active': True,
+                'created_by': created_by,
+            })
+            found[code] = account.pk
+
+        ids.update(found)
+        transaction.on_commit(lambda: self._remember(version, found))
+        return ids
+
+    def post(self, post, *codes, created_by=None, create=True):
+        """
+        تنفيذ ترحيل بمعرفات الحسابات، مع إعادة المحاولة مرة واحدة بعد إبطال
+        المعرفات المحفوظة إذا فشل بسبب معرف لحساب حُذف أو أُعيد إنشاؤه
+
+        المعلمات:
+        post (callable): دالة تستقبل قاموس {الكود: معرف الحساب} وتنفذ الترحيل
+        codes (str): أكواد الحسابات
+        created_by (User): منشئ الحسابات المعروفة غير الموجودة
+        create (bool): إنشاء الحسابات المعروفة غير الموجودة
+
+        تُرجع: نتيجة post
+        """
+        accounts = self.resolve(*codes, created_by=created_by, create=create)
+        try:
+            with transaction.atomic():
+                return post(accounts)
+        except Account.DoesNotExist:
+            self.invalidate()
+        return post(self.resolve(*codes, created_by=created_by, create=create))
+
+    def account_id(self, code, created_by=None):
+        """
+        معرف حساب واحد حسب كوده
+        """
+        return self.resolve(code, created_by=created_by)[code]
+
+    def invalidate(self):
+        """
+        إبطال المعرفات المحفوظة في كل العمليات
+        """
+        bump_version()
+        with self._lock:
+            self._ids = {}
+            self._version = None
+
+
+def payment_account_code(payment_method):
+    """
+    كود حساب الدفع (الصندوق أو البنك) حسب طريقة الدفع
+    """
+    return PAYMENT_METHOD_ACCOUNTS.get(payment_method, 'CASH001')
+
+
+# السجل المشترك للعملية الحالية
+chart_of_accounts = ChartOfAccountsRegistry()
@@ -0,0 +1,104 @@
+"""
+ترحيل المعاملات المالية من الفواتير والدفعات والمرتجعات
+
+تُحفظ المعاملة نفسها بالحفظ العادي (لتحديث الأرصدة الجارية)، وتُنشأ كل
+بنودها بعبارة INSERT واحدة (bulk_create) ثم تُحدث لقطات الأرصدة الشهرية
+مرة لكل حساب، وتُطبق تغييرات أرصدة الحسابات بعبارات UPDATE مع F-expression
+بدلاً من قراءة كل حساب وتعديله ثم حفظه.
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from financial.models import Account, Transaction, TransactionLine
+from financial.services.balance_snapshots import apply_line_delta
+from financial.services.running_balance import lock_accounts
+
+ZERO = Decimal('0')
+
+# بند في قيد المعاملة
+JournalLine = namedtuple('JournalLine', ['account_id', 'debit', 'credit', 'description'])
+
+
+def debit(account_id, amount, description=''):
+    """
+    بند مدين
+    """
+    return JournalLine(account_id, amount, ZERO, description)
+
+
+def credit(account_id, amount, description=''):
+    """
+    بند دائن
+    """
+    return JournalLine(account_id, ZERO, amount, description)
+
+
+def update_account_balances(changes):
+    """
+    تطبيق تغييرات أرصدة الحسابات بعبارة UPDATE لكل حساب
+
+    المعلمات:
+    changes (list): قائمة (معرف الحساب، المبلغ، العملية 'add' أو 'subtract')
+
+    الخصم لا ينزل بالرصيد عن الصفر كما في Account.update_balance.
+    """
+    for account_id, amount, operation in changes:
+        amount = Decimal(str(amount or 0))
+        if operation == 'add':
+            balance = F('balance') + amount
+        else:
+            balance = Greatest(F('balance') - amount, Value(ZERO))
+        Account.objects.filter(pk=account_id).update(balance=balance)
+
+
+def post_transaction(lines, balance_changes=(), **fields):
+    """
+    ترحيل معاملة مالية مع بنودها
+
+    المعلمات:
+    lines (list): بنود القيد (JournalLine)
+    balance_changes (list): تغييرات أرصدة الحسابات (انظر update_account_balances)
+    fields: حقول المعاملة (account_id و transaction_type و amount و date ...)
+
+    تُرجع: المعاملة المنشأة
+
+    يرفع Account.DoesNotExist إذا كان أحد حسابات القيد غير موجود (معرف محفوظ
+    لحساب حُذف) قبل كتابة أي شيء.
+    """
+    with db_transaction.atomic():
+        account_ids = {line.account_id for line in lines}
+        if fields.get('account_id'):
+            account_ids.add(fields['account_id'])
+        missing = account_ids - lock_accounts(account_ids)
+        if missing:
+            raise Account.DoesNotExist(f'الحسابات {sorted(missing)} غير موجودة')
+
+        txn = Transaction(**fields)
+        txn.save()
+
+        TransactionLine.objects.bulk_create([
+            TransactionLine(
+                transaction=txn,
+                account_id=line.account_id,
+                debit=line.debit,
+                credit=line.credit,
+                description=line.description,
+            )
+            for line in lines
+        ])
+
+        # تحديث لقطات الأرصدة مرة لكل حساب في القيد
+        totals = defaultdict(lambda: [ZERO, ZERO])
+        for line in lines:
+            totals[line.account_id][0] += Decimal(str(line.debit or 0))
+            totals[line.account_id][1] += Decimal(str(line.credit or 0))
+        date = Transaction._meta.get_field('date').to_python(txn.date)
+        for account_id, (total_debit, total_credit) in totals.items():
+            apply_line_delta(account_id, date, total_debit, total_credit)
+
+        update_account_balances(balance_changes)
+    return txn
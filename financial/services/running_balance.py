@@ -0,0 +1,230 @@
+"""
+خدمة الرصيد الجاري للمعاملات المالية
+
+يُخزن الرصيد بعد كل معاملة في سجل المعاملة نفسه ويُحدث تزايدياً عند
+الإضافة والتعديل والحذف، بدلاً من جمع كل المعاملات السابقة للحساب عند
+عرض كل سطر في كشف الحساب.
+
+ترتيب المعاملات داخل الحساب حسب (التاريخ، المعرف)، ولكل معاملة حقلان:
+- running_balance: رصيد الحساب المصدر (account) بعد المعاملة
+- to_running_balance: رصيد الحساب المستلم (to_account) بعد التحويل
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Q
+
+from financial.models import Account, Transaction
+
+# الحقول التي تؤثر على الرصيد الجاري
+BALANCE_FIELDS = ('account_id', 'to_account_id', 'transaction_type', 'amount', 'date')
+
+# حالة المعاملة من حيث تأثيرها على الأرصدة
+TransactionState = namedtuple('TransactionState', BALANCE_FIELDS)
+
+
+def get_state(txn):
+    """
+    حالة المعاملة الحالية (في الذاكرة) من حيث تأثيرها على الأرصدة
+    """
+    return TransactionState(
+        txn.account_id,
+        txn.to_account_id,
+        txn.transaction_type,
+        Decimal(str(txn.amount or 0)),
+        Transaction._meta.get_field('date').to_python(txn.date),
+    )
+
+
+def get_stored_state(pk):
+    """
+    حالة المعاملة المحفوظة في قاعدة البيانات، أو None إذا لم تكن موجودة
+    """
+    values = Transaction.objects.filter(pk=pk).values_list(*BALANCE_FIELDS).first()
+    return TransactionState(*values) if values else None
+
+
+def transaction_effects(state):
+    """
+    تأثير المعاملة على أرصدة الحسابات
+
+    تُرجع: قائمة من (معرف الحساب، حقل الرصيد الجاري، مقدار التغيير)
+    """
+    effects = []
+    if state.account_id:
+        if state.transaction_type == 'income':
+            effects.append((state.account_id, 'running_balance', state.amount))
+        elif state.transaction_type in ('expense', 'transfer'):
+            effects.append((state.account_id, 'running_balance', -state.amount))
+
+    if (state.transaction_type == 'transfer' and state.to_account_id
+            and state.to_account_id != state.account_id):
+        effects.append((state.to_account_id, 'to_running_balance', state.amount))
+    return effects
+
+
+def _account_rows(account_id):
+    """
+    معاملات الحساب مع حقل الرصيد الجاري الخاص به في كل منها
+    """
+    return (
+        (Transaction.objects.filter(account_id=account_id), 'running_balance'),
+        (Transaction.objects.filter(
+            to_account_id=account_id, transaction_type='transfer'
+        ).exclude(account_id=account_id), 'to_running_balance'),
+    )
+
+
+def _before(date, pk):
+    return Q(date__lt=date) | Q(date=date, pk__lt=pk)
+
+
+def _after(date, pk):
+    return Q(date__gt=date) | Q(date=date, pk__gt=pk)
+
+
+def balance_before(account_id, date, pk):
+    """
+    رصيد الحساب قبل موضع معين (التاريخ، المعرف) في ترتيب المعاملات
+    """
+    latest = None
+    for rows, field in _account_rows(account_id):
+        row = rows.filter(_before(date, pk)).order_by('-date', '-id').values_list(
+            'date', 'id', field
+        ).first()
+        if row and (latest is None or row[:2] > latest[:2]):
+            latest = row
+    if latest is None or latest[2] is None:
+        return Decimal('0')
+    return latest[2]
+
+
+def _shift_after(account_id, date, pk, delta):
+    """
+    إزاحة الرصيد الجاري لكل معاملات الحساب اللاحقة لموضع معين بعبارة UPDATE واحدة
+    """
+    for rows, field in _account_rows(account_id):
+        rows.filter(_after(date, pk)).update(**{field: F(field) + delta})
+
+
+def lock_accounts(account_ids):
+    """
+    قفل سجلات الحسابات لتسلسل ترحيل المعاملات المتزامنة على نفس الحساب
+
+    تُرجع: معرفات الحسابات الموجودة التي تم قفلها
+    """
+    account_ids = sorted({account_id for account_id in account_ids if account_id})
+    if not account_ids:
+        return set()
+    return set(Account.objects.select_for_update().filter(pk__in=account_ids).values_list('pk', flat=True))
+
+
+def unapply_state(pk, state):
+    """
+    إزالة تأثير حالة معاملة سابقة من أرصدة المعاملات اللاحقة لها
+    """
+    for account_id, field, delta in transaction_effects(state):
+        _shift_after(account_id, state.date, pk, -delta)
+
+
+def apply_state(txn, state):
+    """
+    حساب الرصيد الجاري للمعاملة وإضافة تأثيرها إلى المعاملات اللاحقة لها
+    """
+    values = {'running_balance': None, 'to_running_balance': None}
+    for account_id, field, delta in transaction_effects(state):
+        values[field] = balance_before(account_id, state.date, txn.pk) + delta
+        _shift_after(account_id, state.date, txn.pk, delta)
+
+    Transaction.objects.filter(pk=txn.pk).update(**values)
+    txn.running_balance = values['running_balance']
+    txn.to_running_balance = values['to_running_balance']
+
+
+def save_with_running_balance(txn, save):
+    """
+    حفظ المعاملة مع تحديث الأرصدة الجارية تزايدياً
+
+    المعلمات:
+    txn (Transaction): المعاملة المراد حفظها
+    save (callable): دالة الحفظ الفعلية للنموذج
+
+    تُرجع: حالة المعاملة المحفوظة قبل التعديل، أو None للمعاملة الجديدة
+    """
+    with db_transaction.atomic():
+        previous = get_stored_state(txn.pk) if txn.pk else None
+        current = get_state(txn)
+        lock_accounts([
+            current.account_id, current.to_account_id,
+            previous and previous.account_id, previous and previous.to_account_id,
+        ])
+
+        if previous is not None and previous == current:
+            # لم يتغير أي حقل مؤثر على الرصيد
+            save()
+            return previous
+
+        if previous is not None:
+            unapply_state(txn.pk, previous)
+        save()
+        apply_state(txn, current)
+    return previous
+
+
+def remove_running_balance(txn):
+    """
+    إزالة تأثير معاملة محذوفة من أرصدة المعاملات اللاحقة لها
+    """
+    state = get_state(txn)
+    with db_transaction.atomic():
+        lock_accounts([state.account_id, state.to_account_id])
+        unapply_state(txn.pk, state)
+
+
+def rebuild_running_balances(account_ids=None, batch_size=1000, dry_run=False):
+    """
+    إعادة حساب الأرصدة الجارية دفعة واحدة (بعد إدخال معاملات بتاريخ سابق أو استيراد بيانات)
+
+    المعلمات:
+    account_ids (list): حصر إعادة الحساب في حسابات معينة (الافتراضي كل الحسابات)
+    batch_size (int): عدد المعاملات في كل دفعة تحديث
+    dry_run (bool): حساب عدد المعاملات المختلفة بدون حفظ
+
+    تُرجع: عدد المعاملات التي تم تصحيح رصيدها
+    """
+    rows = Transaction.objects.order_by('date', 'id').only(
+        'id', 'account', 'to_account', 'transaction_type', 'amount', 'date',
+        'running_balance', 'to_running_balance'
+    )
+    if account_ids:
+        account_ids = set(account_ids)
+        rows = rows.filter(Q(account_id__in=account_ids) | Q(to_account_id__in=account_ids))
+
+    balances = defaultdict(Decimal)
+    pending = []
+    updated = 0
+
+    with db_transaction.atomic():
+        for txn in rows.iterator(chunk_size=batch_size):
+            changed = False
+            for account_id, field, delta in transaction_effects(get_state(txn)):
+                if account_ids and account_id not in account_ids:
+                    continue
+                balances[account_id] += delta
+                if getattr(txn, field) != balances[account_id]:
+                    setattr(txn, field, balances[account_id])
+                    changed = True
+
+            if changed:
+                updated += 1
+                pending.append(txn)
+            if len(pending) >= batch_size:
+                if not dry_run:
+                    Transaction.objects.bulk_update(pending, ['running_balance', 'to_running_balance'])
+                pending = []
+
+        if pending and not dry_run:
+            Transaction.objects.bulk_update(pending, ['running_balance', 'to_running_balance'])
+
+    return updated
@@ -0,0 +1,91 @@
+"""
+محرك ميزان المراجعة
+
+يحسب إجمالي المدين والدائن لكل الحسابات باستعلامات تجميع (GROUP BY)
+على لقطات الأرصدة وبنود المعاملات بدلاً من استعلامين لكل حساب، ويستخدم
+في دفتر الأستاذ والميزانية العمومية وقائمة الإيرادات والمصروفات.
+"""
+from decimal import Decimal
+
+from financial.models import Account
+from financial.services.balance_snapshots import period_totals
+
+# أنواع الحسابات ذات الرصيد المدين (باقي الأنواع رصيدها دائن)
+DEBIT_NORMAL_TYPES = ('asset', 'expense')
+
+# أنواع الحسابات ذات الرصيد الدائن
+CREDIT_NORMAL_TYPES = ('liability', 'equity', 'income')
+
+ZERO = Decimal('0')
+
+
+def normal_balance(account_type, total_debit, total_credit):
+    """
+    رصيد الحساب حسب طبيعته (مدين للأصول والمصروفات، ودائن لغيرها)
+    """
+    if account_type in DEBIT_NORMAL_TYPES:
+        return total_debit - total_credit
+    return total_credit - total_debit
+
+
+def account_totals(date_from=None, date_to=None, account_types=None, account_ids=None):
+    """
+    إجمالي المدين والدائن لكل حساب خلال فترة
+
+    يتم الحساب من لقطات الأرصدة الشهرية مع بنود شهر بداية الفترة ونهايتها
+    فقط، بعدد ثابت من الاستعلامات مهما كان عدد الحسابات أو طول تاريخها.
+
+    المعلمات:
+    date_from (date): بداية الفترة (شاملة)
+    date_to (date): نهاية الفترة (شاملة)
+    account_types (list): حصر الحسابات في أنواع معينة
+    account_ids (list): حصر الحسابات في معرفات معينة
+
+    تُرجع: قاموس {معرف الحساب: (إجمالي المدين، إجمالي الدائن)}
+    """
+    return period_totals(date_from, date_to, account_types, account_ids)
+
+
+def trial_balance(date_from=None, date_to=None, account_types=None, active_only=True):
+    """
+    ميزان المراجعة لكل الحسابات خلال فترة (عدد ثابت من الاستعلامات مهما كان عدد الحسابات)
+
+    المعلمات:
+    date_from (date): بداية الفترة (شاملة)
+    date_to (date): نهاية الفترة (شاملة)
+    account_types (list): حصر الحسابات في أنواع معينة
+    active_only (bool): الحسابات النشطة فقط
+
+    تُرجع: قائمة قواميس بالمفاتيح account و total_debit و total_credit و balance
+    مرتبة حسب نوع الحساب ثم الاسم
+    """
+    accounts = Account.objects.order_by('account_type', 'name')
+    if active_only:
+        accounts = accounts.filter(is_active=True)
+    if account_types:
+        accounts = accounts.filter(account_type__in=account_types)
+
+    totals = account_totals(date_from, date_to, account_types)
+
+    rows = []
+    for account in accounts:
+        total_debit, total_credit = totals.get(account.pk, (ZERO, ZERO))
+        rows.append({
+            'account': account,
+            'total_debit': total_debit,
+            'total_credit': total_credit,
+            'balance': normal_balance(account.account_type, total_debit, total_credit),
+        })
+    return rows
+
+
+def balances_by_type(rows):
+    """
+    تقسيم صفوف ميزان المراجعة حسب نوع الحساب
+
+    تُرجع: قاموس {نوع الحساب: قائمة الصفوف}
+    """
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row['account'].account_type, []).append(row)
+    return grouped
@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Account, Transaction, TransactionLine
+from .services.running_balance import remove_running_balance
+from .services.balance_snapshots import remove_line
+from .services.chart_of_accounts import chart_of_accounts
+
+# حقول الحساب التي لا تؤثر على دليل الحسابات (تتغير مع كل ترحيل)
+NON_CHART_ACCOUNT_FIELDS = {'balance', 'updated_at'}
+
+
+@receiver(post_delete, sender=Transaction)
+def update_running_balance_on_delete(sender, instance, **kwargs):
+    """
+    إزالة تأثير المعاملة المحذوفة من الأرصدة الجارية للمعاملات اللاحقة لها
+    """
+    remove_running_balance(instance)
+
+
+@receiver(post_delete, sender=TransactionLine)
+def update_balance_snapshots_on_delete(sender, instance, **kwargs):
+    """
+    إزالة تأثير البند المحذوف من لقطات الأرصدة الشهرية
+    """
+    remove_line(instance)
+
+
+@receiver(post_save, sender=Account)
+@receiver(post_delete, sender=Account)
+def invalidate_chart_of_accounts(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    إبطال معرفات الحسابات المحفوظة في كل العمليات بعد تأكيد تعديل أو حذف أي حساب
+
+    إضافة حساب جديد لا تغير أي معرف محفوظ، لأن السجل لا يحفظ الأكواد غير الموجودة.
+    """
+    if created or (update_fields and set(update_fields) <= NON_CHART_ACCOUNT_FIELDS):
+        return
+    transaction.on_commit(chart_of_accounts.invalidate)
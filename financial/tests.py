@@ -1,3 +1,331 @@
+import datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+
+from financial.models import Account, Transaction, TransactionLine, AccountBalanceSnapshot
+from financial.services.balance_snapshots import totals_as_of, line_totals
+from financial.services.chart_of_accounts import chart_of_accounts
+from financial.services.posting import credit, debit, post_transaction
+from financial.services.trial_balance import trial_balance, account_totals
+
+
+class RunningBalanceTest(TestCase):
+    """
+    اختبارات الرصيد الجاري المخزن للمعاملات المالية
+    """
+
+    def setUp(self):
+        self.cash = Account.objects.create(name='الخزينة', code='CASH', type='cash')
+        self.bank = Account.objects.create(name='البنك', code='BANK', type='bank')
+
+    def create_transaction(self, transaction_type, amount, day, account=None, **kwargs):
+        return Transaction.objects.create(
+            account=account or self.cash,
+            transaction_type=transaction_type,
+            amount=Decimal(amount),
+            date=datetime.date(2024, 1, day),
+            **kwargs
+        )
+
+    def balances(self, account=None):
+        account = account or self.cash
+        return [
+            txn.balance_after_for(account)
+            for txn in Transaction.objects.filter(pk__in=self.ids).order_by('date', 'id')
+            if txn.account_id == account.pk or txn.to_account_id == account.pk
+        ]
+
+    def test_balance_is_stored_on_insert(self):
+        first = self.create_transaction('income', '100', 1)
+        second = self.create_transaction('expense', '30', 2)
+        self.assertEqual(first.balance_after, Decimal('100'))
+        self.assertEqual(second.balance_after, Decimal('70'))
+
+    def test_back_dated_insert_shifts_later_balances(self):
+        self.ids = [
+            self.create_transaction('income', '100', 1).pk,
+            self.create_transaction('expense', '30', 5).pk,
+        ]
+        self.ids.append(self.create_transaction('income', '50', 3).pk)
+        self.assertEqual(self.balances(), [Decimal('100'), Decimal('150'), Decimal('120')])
+
+    def test_edit_and_delete_update_later_balances(self):
+        first = self.create_transaction('income', '100', 1)
+        middle = self.create_transaction('expense', '30', 2)
+        last = self.create_transaction('income', '10', 3)
+        self.ids = [first.pk, middle.pk, last.pk]
+
+        middle.amount = Decimal('40')
+        middle.save()
+        self.assertEqual(self.balances(), [Decimal('100'), Decimal('60'), Decimal('70')])
+
+        # نقل المعاملة إلى تاريخ لاحق
+        middle.date = datetime.date(2024, 1, 4)
+        middle.save()
+        self.assertEqual(self.balances(), [Decimal('100'), Decimal('110'), Decimal('70')])
+
+        self.ids.remove(middle.pk)
+        middle.delete()
+        self.assertEqual(self.balances(), [Decimal('100'), Decimal('110')])
+
+    def test_transfer_updates_both_accounts(self):
+        self.ids = [
+            self.create_transaction('income', '100', 1).pk,
+            self.create_transaction('income', '20', 1, account=self.bank).pk,
+            self.create_transaction('transfer', '40', 2, to_account=self.bank).pk,
+        ]
+        self.assertEqual(self.balances(), [Decimal('100'), Decimal('60')])
+        self.assertEqual(self.balances(self.bank), [Decimal('20'), Decimal('60')])
+
+    def test_rebuild_command_repairs_balances(self):
+        self.ids = [
+            self.create_transaction('income', '100', 1).pk,
+            self.create_transaction('expense', '30', 2).pk,
+        ]
+        Transaction.objects.update(running_balance=0)
+
+        out = StringIO()
+        call_command('rebuild_running_balances', '--dry-run', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertEqual(self.balances(), [Decimal('0'), Decimal('0')])
+
+        call_command('rebuild_running_balances', stdout=StringIO())
+        self.assertEqual(self.balances(), [Decimal('100'), Decimal('70')])
+
+
+class LedgerTestMixin:
+    """
+    دليل حسابات وقيود أساسية مشتركة لاختبارات التقارير المالية
+    """
+
+    def setUp(self):
+        self.cash = Account.objects.create(name='الخزينة', code='1000', account_type='asset')
+        self.capital = Account.objects.create(name='رأس المال', code='3000', account_type='equity')
+        self.sales = Account.objects.create(name='المبيعات', code='4000', account_type='income')
+        self.rent = Account.objects.create(name='الإيجار', code='5000', account_type='expense')
+
+        self.post(1, self.cash, self.capital, '1000')
+        self.post(10, self.cash, self.sales, '300')
+        self.post(20, self.rent, self.cash, '100')
+
+    def post(self, day, debit_account, credit_account, amount):
+        txn = Transaction.objects.create(
+            transaction_type='transfer',
+            amount=Decimal(amount),
+            date=datetime.date(2024, 1, day),
+        )
+        TransactionLine.objects.create(transaction=txn, account=debit_account, debit=Decimal(amount))
+        TransactionLine.objects.create(transaction=txn, account=credit_account, credit=Decimal(amount))
+
+
+class TrialBalanceTest(LedgerTestMixin, TestCase):
+    """
+    اختبارات محرك ميزان المراجعة
+    """
+
+    def balances(self, **kwargs):
+        return {row['account'].code: row['balance'] for row in trial_balance(**kwargs)}
+
+    def test_sign_conventions(self):
+        self.assertEqual(self.balances(), {
+            '1000': Decimal('1200'),
+            '3000': Decimal('1000'),
+            '4000': Decimal('300'),
+            '5000': Decimal('100'),
+        })
+
+    def test_date_window(self):
+        balances = self.balances(
+            date_from=datetime.date(2024, 1, 5),
+            date_to=datetime.date(2024, 1, 15),
+            account_types=['asset', 'income'],
+        )
+        self.assertEqual(balances, {'1000': Decimal('300'), '4000': Decimal('300')})
+
+    def test_constant_number_of_queries(self):
+        for index in range(20):
+            account = Account.objects.create(name=f'حساب {index}', code=f'9{index:03d}', account_type='asset')
+            self.post(2, account, self.capital, '1')
+
+        with self.assertNumQueries(1):
+            totals = account_totals()
+        self.assertEqual(len(totals), 24)
+
+        with self.assertNumQueries(2):
+            trial_balance()
+
+    def test_reports_render(self):
+        user = get_user_model().objects.create_user(username='accountant', password='testpassword123')
+        self.client.force_login(user)
+        for name in ('ledger_report', 'balance_sheet', 'income_statement'):
+            response = self.client.get(reverse(f'financial:{name}'), {'date_from': '2024-01-01'})
+            self.assertEqual(response.status_code, 200)
+
+
+class BalanceSnapshotTest(LedgerTestMixin, TestCase):
+    """
+    اختبارات لقطات الأرصدة الشهرية
+    """
+
+    def setUp(self):
+        super().setUp()
+        # حركات في شهور لاحقة
+        self.post_on(datetime.date(2024, 2, 15), self.cash, self.sales, '200')
+        self.post_on(datetime.date(2024, 4, 5), self.rent, self.cash, '50')
+
+    def post_on(self, date, debit_account, credit_account, amount):
+        txn = Transaction.objects.create(transaction_type='transfer', amount=Decimal(amount), date=date)
+        TransactionLine.objects.create(transaction=txn, account=debit_account, debit=Decimal(amount))
+        TransactionLine.objects.create(transaction=txn, account=credit_account, credit=Decimal(amount))
+        return txn
+
+    def assert_matches_lines(self):
+        for day in (datetime.date(2024, 1, 5), datetime.date(2024, 2, 28),
+                    datetime.date(2024, 3, 10), datetime.date(2024, 4, 30)):
+            self.assertEqual(totals_as_of(day), line_totals(date_to=day))
+
+    def test_snapshots_are_cumulative(self):
+        periods = list(AccountBalanceSnapshot.objects.filter(account=self.cash).order_by('period').values_list(
+            'period', 'total_debit', 'total_credit'
+        ))
+        self.assertEqual(periods, [
+            (datetime.date(2024, 1, 1), Decimal('1300'), Decimal('100')),
+            (datetime.date(2024, 2, 1), Decimal('1500'), Decimal('100')),
+            (datetime.date(2024, 4, 1), Decimal('1500'), Decimal('150')),
+        ])
+        self.assert_matches_lines()
+
+    def test_as_of_reads_at_most_one_month_of_lines(self):
+        with self.assertNumQueries(2):
+            totals = totals_as_of(datetime.date(2024, 3, 10))
+        self.assertEqual(totals[self.cash.pk], (Decimal('1500'), Decimal('100')))
+
+    def test_back_dated_edit_and_delete(self):
+        txn = self.post_on(datetime.date(2024, 1, 25), self.cash, self.sales, '10')
+        self.assert_matches_lines()
+
+        line = txn.lines.get(account=self.cash)
+        line.debit = Decimal('15')
+        line.save()
+        txn.lines.filter(account=self.sales).update(credit=Decimal('15'))
+        call_command('rebuild_balance_snapshots', '--account', str(self.sales.pk), stdout=StringIO())
+        self.assert_matches_lines()
+
+        txn.date = datetime.date(2024, 3, 1)
+        txn.save()
+        self.assert_matches_lines()
+
+        txn.delete()
+        self.assert_matches_lines()
+
+    def test_rebuild_command(self):
+        AccountBalanceSnapshot.objects.all().delete()
+        call_command('rebuild_balance_snapshots', stdout=StringIO())
+        self.assertEqual(AccountBalanceSnapshot.objects.filter(account=self.cash).count(), 3)
+        self.assert_matches_lines()
+
+
+class ChartOfAccountsPostingTest(TestCase):
+    """
+    اختبارات سجل دليل الحسابات وترحيل المعاملات ببنودها دفعة واحدة
+    """
+
+    def setUp(self):
+        cache.clear()
+        chart_of_accounts.invalidate()
+        self.user = get_user_model().objects.create_user(username='poster', password='testpassword123')
+
+    def test_codes_resolve_once_per_process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ids = chart_of_accounts.resolve('CASH001', 'AR001', created_by=self.user)
+        self.assertEqual(Account.objects.get(code='AR001').pk, ids['AR001'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(chart_of_accounts.resolve('AR001', 'CASH001'), ids)
+
+        # تعديل أي حساب يبطل المعرفات المحفوظة
+        account = Account.objects.get(code='CASH001')
+        account.name = 'الخزينة'
+        with self.captureOnCommitCallbacks(execute=True):
+            account.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(chart_of_accounts.account_id('CASH001'), account.pk)
+
+        with self.assertRaises(Account.DoesNotExist):
+            chart_of_accounts.resolve('INC002', create=False)
+
+    def test_post_transaction_updates_snapshots_and_balances(self):
+        cash = Account.objects.create(name='الخزينة', code='1000', account_type='asset', balance=Decimal('50'))
+        sales = Account.objects.create(name='المبيعات', code='4000', account_type='income')
+
+        txn = post_transaction(
+            [debit(cash.pk, Decimal('120'), 'نقدية'), credit(sales.pk, Decimal('120'), 'مبيعات')],
+            balance_changes=[(cash.pk, Decimal('200'), 'subtract'), (sales.pk, Decimal('120'), 'add')],
+            account_id=sales.pk, transaction_type='income', amount=Decimal('120'),
+            date=datetime.date(2024, 3, 5),
+        )
+
+        self.assertEqual(txn.running_balance, Decimal('120'))
+        self.assertEqual(
+            sorted(txn.lines.values_list('account_id', 'debit', 'credit')),
+            sorted([(cash.pk, Decimal('120'), Decimal('0')), (sales.pk, Decimal('0'), Decimal('120'))]),
+        )
+        day = datetime.date(2024, 3, 31)
+        self.assertEqual(totals_as_of(day), line_totals(date_to=day))
+
+        # الخصم لا ينزل بالرصيد عن الصفر
+        cash.refresh_from_db()
+        sales.refresh_from_db()
+        self.assertEqual((cash.balance, sales.balance), (Decimal('0'), Decimal('120')))
+
+    def test_sale_payment_posts_balanced_transaction(self):
+        from client.models import Customer
+        from product.models import Warehouse
+        from sale.models import Sale, SalePayment
+
+        sale = Sale.objects.create(
+            date=datetime.date(2024, 1, 1), customer=Customer.objects.create(name='عميل', code='C-1'),
+            warehouse=Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN'),
+            subtotal=100, total=100, payment_method='credit', created_by=self.user,
+        )
+        payment = SalePayment.objects.create(
+            sale=sale, amount=Decimal('40'), payment_date=datetime.date(2024, 1, 2),
+            payment_method='bank_transfer', created_by=self.user,
+        )
+
+        payment.refresh_from_db()
+        lines = dict(payment.financial_transaction.lines.values_list('account__code', 'debit'))
+        self.assertEqual(lines, {'BANK001': Decimal('40'), 'AR001': Decimal('0')})
+        self.assertEqual(Account.objects.get(code='BANK001').balance, Decimal('40'))
+        self.assertEqual(totals_as_of(), line_totals())
+
+    def test_stale_cached_id_is_resolved_again(self):
+        from client.models import Customer
+        from product.models import Warehouse
+        from sale.models import Sale, SalePayment
+
+        with self.captureOnCommitCallbacks(execute=True):
+            chart_of_accounts.resolve('AR001', 'CASH001', created_by=self.user)
+        cash = Account.objects.get(code='CASH001')
+        # معرف محفوظ لحساب حُذف في عملية أخرى دون أن يصل الإبطال
+        chart_of_accounts._remember(chart_of_accounts._version, {'CASH001': cash.pk + 1000})
+
+        sale = Sale.objects.create(
+            date=datetime.date(2024, 1, 1), customer=Customer.objects.create(name='عميل', code='C-1'),
+            warehouse=Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN'),
+            subtotal=100, total=100, payment_method='credit', created_by=self.user,
+        )
+        payment = SalePayment.objects.create(
+            sale=sale, amount=Decimal('40'), payment_date=datetime.date(2024, 1, 2),
+            payment_method='cash', created_by=self.user,
+        )
 
-# Create your tests here.
+        payment.refresh_from_db()
+        self.assertEqual(payment.financial_transaction.account_id, cash.pk)
+        self.assertEqual(chart_of_accounts.account_id('CASH001'), cash.pk)
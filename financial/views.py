@@ -1,7 +1,7 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, HttpResponse
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Q, F, Case, When
 from django.core.paginator import Paginator
 from django.contrib import messages
 from django.urls import reverse
@@ -13,6 +13,7 @@ import json
 
 from .models import Account, Transaction, Expense, Income, Category, TransactionLine, BankReconciliation
 from .forms import AccountForm, TransactionForm, ExpenseForm, IncomeForm, BankReconciliationForm, CategoryForm
+from .services.trial_balance import trial_balance, balances_by_type
 
 
 @login_required
@@ -246,8 +247,14 @@ def account_transactions(request, pk):
     عرض معاملات حساب محدد
     """
     account = get_object_or_404(Account, pk=pk)
+    # رصيد هذا الحساب بعد كل معاملة مخزن مع المعاملة (في حقل المصدر أو المستلم)
     transactions = Transaction.objects.filter(
         Q(account=account) | Q(to_account=account)
+    ).annotate(
+        account_balance_after=Case(
+            When(account=account, then=F('running_balance')),
+            default=F('to_running_balance'),
+        )
     ).order_by('-date', '-id')
     
     # تعريف رؤوس الأعمدة للجدول الموحد
@@ -297,7 +304,7 @@ def account_transactions(request, pk):
             'decimals': 2
         },
         {
-            'key': 'balance_after', 
+            'key': 'account_balance_after', 
             'label': 'الرصيد بعد', 
             'sortable': False, 
             'format': 'currency', 
@@ -398,7 +405,7 @@ def transaction_list(request):
     عرض قائمة المعاملات المالية باستخدام نظام الجداول الموحد
     """
     # بدء الاستعلام بدون أخذ شريحة
-    transactions = Transaction.objects.all().order_by('-date', '-id')
+    transactions = Transaction.objects.select_related('account').order_by('-date', '-id')
     accounts = Account.objects.filter(is_active=True)
     
     # فلترة
@@ -1551,24 +1558,29 @@ def ledger_report(request):
     date_from = request.GET.get('date_from')
     date_to = request.GET.get('date_to')
     
+    if date_from:
+        date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+    
+    if date_to:
+        date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+    
     # في حالة تحديد حساب معين، نعرض التفاصيل من خلال بنود المعاملات
     if account_id:
         account = get_object_or_404(Account, id=account_id)
         transaction_lines = TransactionLine.objects.filter(account=account).select_related('transaction')
         
         if date_from:
-            date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
             transaction_lines = transaction_lines.filter(transaction__date__gte=date_from)
         
         if date_to:
-            date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
             transaction_lines = transaction_lines.filter(transaction__date__lte=date_to)
         
         transactions = transaction_lines.order_by('transaction__date', 'transaction__id')
         
         # حساب المجاميع
-        total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-        total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
+        totals = transaction_lines.aggregate(total_debit=Sum('debit'), total_credit=Sum('credit'))
+        total_debit = totals['total_debit'] or 0
+        total_credit = totals['total_credit'] or 0
         balance = total_debit - total_credit
         
         context = {
@@ -1583,39 +1595,11 @@ def ledger_report(request):
             'title': f'دفتر الأستاذ - {account.name}',
         }
     else:
-        # إذا لم يتم تحديد حساب، نعرض ملخص لكل الحسابات
-        account_balances = []
-        
-        for account in accounts:
-            # حساب الإجماليات لكل حساب
-            transaction_lines = TransactionLine.objects.filter(account=account)
-            
-            if date_from:
-                date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
-                transaction_lines = transaction_lines.filter(transaction__date__gte=date_from)
-            
-            if date_to:
-                date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
-                transaction_lines = transaction_lines.filter(transaction__date__lte=date_to)
-            
-            total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-            total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-            
-            # حساب الرصيد النهائي حسب نوع الحساب
-            if account.account_type in ['asset', 'expense']:
-                # الأصول والمصروفات لها رصيد مدين
-                balance = total_debit - total_credit
-            else:
-                # الخصوم والإيرادات وحقوق الملكية لها رصيد دائن
-                balance = total_credit - total_debit
-            
-            if total_debit > 0 or total_credit > 0:  # عرض الحسابات النشطة فقط
-                account_balances.append({
-                    'account': account,
-                    'total_debit': total_debit,
-                    'total_credit': total_credit,
-                    'balance': balance
-                })
+        # إذا لم يتم تحديد حساب، نعرض ملخص لكل الحسابات (عرض الحسابات النشطة فقط)
+        account_balances = [
+            row for row in trial_balance(date_from, date_to)
+            if row['total_debit'] > 0 or row['total_credit'] > 0
+        ]
         
         context = {
             'account_balances': account_balances,
@@ -1628,6 +1612,17 @@ def ledger_report(request):
     return render(request, 'financial/ledger_report.html', context)
 
 
+def _report_section(rows, key='balance'):
+    """
+    بنود قسم من التقرير المالي (الحسابات ذات الرصيد فقط) وإجماليها
+    """
+    items = [
+        {'account': row['account'], key: row['balance']}
+        for row in rows if row['balance'] != 0
+    ]
+    return items, sum((item[key] for item in items), 0)
+
+
 @login_required
 def balance_sheet(request):
     """
@@ -1640,106 +1635,24 @@ def balance_sheet(request):
     else:
         balance_date = timezone.now().date()
     
-    # جمع الأصول
-    assets = []
-    assets_total = 0
-    asset_accounts = Account.objects.filter(account_type='asset', is_active=True)
-    
-    for account in asset_accounts:
-        transaction_lines = TransactionLine.objects.filter(
-            account=account,
-            transaction__date__lte=balance_date
-        )
-        
-        total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-        total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-        balance = total_debit - total_credit
-        
-        if balance != 0:  # عرض الحسابات ذات الرصيد فقط
-            assets.append({
-                'account': account,
-                'balance': balance
-            })
-            assets_total += balance
-    
-    # جمع الخصوم
-    liabilities = []
-    liabilities_total = 0
-    liability_accounts = Account.objects.filter(account_type='liability', is_active=True)
-    
-    for account in liability_accounts:
-        transaction_lines = TransactionLine.objects.filter(
-            account=account,
-            transaction__date__lte=balance_date
-        )
-        
-        total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-        total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-        balance = total_credit - total_debit  # الخصوم لها رصيد دائن
-        
-        if balance != 0:  # عرض الحسابات ذات الرصيد فقط
-            liabilities.append({
-                'account': account,
-                'balance': balance
-            })
-            liabilities_total += balance
+    # صافي الربح/الخسارة يتم حسابه فقط إذا كان تاريخ الميزانية العمومية هو تاريخ اليوم
+    include_net_income = balance_date == timezone.now().date()
+    account_types = ['asset', 'liability', 'equity']
+    if include_net_income:
+        account_types += ['income', 'expense']
     
-    # جمع حقوق الملكية
-    equity = []
-    equity_total = 0
-    equity_accounts = Account.objects.filter(account_type='equity', is_active=True)
+    # أرصدة كل الحسابات حتى تاريخ الميزانية باستعلام تجميع واحد
+    balances = balances_by_type(trial_balance(date_to=balance_date, account_types=account_types))
     
-    for account in equity_accounts:
-        transaction_lines = TransactionLine.objects.filter(
-            account=account,
-            transaction__date__lte=balance_date
-        )
-        
-        total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-        total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-        balance = total_credit - total_debit  # حقوق الملكية لها رصيد دائن
-        
-        if balance != 0:  # عرض الحسابات ذات الرصيد فقط
-            equity.append({
-                'account': account,
-                'balance': balance
-            })
-            equity_total += balance
+    assets, assets_total = _report_section(balances.get('asset', []))
+    liabilities, liabilities_total = _report_section(balances.get('liability', []))
+    equity, equity_total = _report_section(balances.get('equity', []))
     
     # حساب صافي الربح/الخسارة من حسابات الإيرادات والمصروفات
-    # (يتم حسابه فقط إذا كان تاريخ الميزانية العمومية هو تاريخ اليوم)
     net_income = 0
-    if balance_date == timezone.now().date():
-        # حساب إجمالي الإيرادات
-        income_accounts = Account.objects.filter(account_type='income', is_active=True)
-        total_income = 0
-        
-        for account in income_accounts:
-            transaction_lines = TransactionLine.objects.filter(
-                account=account,
-                transaction__date__lte=balance_date
-            )
-            
-            total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-            total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-            balance = total_credit - total_debit  # الإيرادات لها رصيد دائن
-            total_income += balance
-        
-        # حساب إجمالي المصروفات
-        expense_accounts = Account.objects.filter(account_type='expense', is_active=True)
-        total_expense = 0
-        
-        for account in expense_accounts:
-            transaction_lines = TransactionLine.objects.filter(
-                account=account,
-                transaction__date__lte=balance_date
-            )
-            
-            total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-            total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-            balance = total_debit - total_credit  # المصروفات لها رصيد مدين
-            total_expense += balance
-        
+    if include_net_income:
+        total_income = sum((row['balance'] for row in balances.get('income', [])), 0)
+        total_expense = sum((row['balance'] for row in balances.get('expense', [])), 0)
         net_income = total_income - total_expense
         
         # إضافة صافي الربح/الخسارة إلى حقوق الملكية
@@ -1791,51 +1704,13 @@ def income_statement(request):
         # افتراضيًا، تاريخ اليوم
         date_to = timezone.now().date()
     
-    # جمع الإيرادات
-    income_items = []
-    total_income = 0
-    income_accounts = Account.objects.filter(account_type='income', is_active=True)
-    
-    for account in income_accounts:
-        transaction_lines = TransactionLine.objects.filter(
-            account=account,
-            transaction__date__gte=date_from,
-            transaction__date__lte=date_to
-        )
-        
-        total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-        total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-        balance = total_credit - total_debit  # الإيرادات لها رصيد دائن
-        
-        if balance != 0:  # عرض الحسابات ذات الرصيد فقط
-            income_items.append({
-                'account': account,
-                'amount': balance
-            })
-            total_income += balance
-    
-    # جمع المصروفات
-    expense_items = []
-    total_expense = 0
-    expense_accounts = Account.objects.filter(account_type='expense', is_active=True)
+    # أرصدة حسابات الإيرادات والمصروفات خلال الفترة باستعلام تجميع واحد
+    balances = balances_by_type(
+        trial_balance(date_from, date_to, account_types=['income', 'expense'])
+    )
     
-    for account in expense_accounts:
-        transaction_lines = TransactionLine.objects.filter(
-            account=account,
-            transaction__date__gte=date_from,
-            transaction__date__lte=date_to
-        )
-        
-        total_debit = transaction_lines.aggregate(Sum('debit'))['debit__sum'] or 0
-        total_credit = transaction_lines.aggregate(Sum('credit'))['credit__sum'] or 0
-        balance = total_debit - total_credit  # المصروفات لها رصيد مدين
-        
-        if balance != 0:  # عرض الحسابات ذات الرصيد فقط
-            expense_items.append({
-                'account': account,
-                'amount': balance
-            })
-            total_expense += balance
+    income_items, total_income = _report_section(balances.get('income', []), key='amount')
+    expense_items, total_expense = _report_section(balances.get('expense', []), key='amount')
     
     # حساب صافي الربح/الخسارة
     net_income = total_income - total_expense
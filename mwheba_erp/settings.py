@@ -152,6 +152,17 @@ else:
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# الذاكرة المؤقتة تحفظ إعدادات النظام ودليل الحسابات وإطار الصفحة وإحصائيات لوحة التحكم
+# والبحث بالباركود، ويتم إبطالها عبرها في كل العمليات. الافتراضي ذاكرة داخل العملية
+# (عملية واحدة فقط)، ومع أكثر من عامل (WEB_CONCURRENCY) يجب تعيين CACHE_URL لذاكرة
+# مشتركة (Redis أو Memcached، مثل redis://127.0.0.1:6379/1) وإلا يفشل فحص النظام core.E001
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+
 
 
 # Password validation
@@ -247,6 +258,61 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # MPTT settings
 MPTT_ADMIN_LEVEL_INDENT = 20
 
+# Activity tracking settings
+# الحجم الأقصى لمخزن أحداث النشاط في الذاكرة
+ACTIVITY_BUFFER_SIZE = 10000
+# الفترة بين كل عمليتي كتابة لأحداث النشاط (بالثانية)
+ACTIVITY_FLUSH_INTERVAL = 5.0
+# عدد الأحداث الذي يؤدي إلى الكتابة قبل انتهاء الفترة
+ACTIVITY_FLUSH_BATCH_SIZE = 500
+# كتابة أحداث النشاط في عامل خلفية (False: كتابتها أثناء الطلب نفسه)
+ACTIVITY_BUFFER_ASYNC = True
+
+# Page chrome cache settings
+# مهلة صلاحية أعداد الكيانات المعروضة في كل صفحة (بالثانية)
+PAGE_CHROME_COUNTS_TIMEOUT = 300
+# مهلة صلاحية إشعارات المستخدم المخزنة (بالثانية)
+PAGE_CHROME_NOTIFICATIONS_TIMEOUT = 300
+# مهلة صلاحية خريطة صلاحيات المستخدم (بالثانية)
+PAGE_CHROME_PERMISSIONS_TIMEOUT = 3600
+
+# Import settings
+# عدد الصفوف في كل دفعة من دفعات الاستيراد الجماعي
+IMPORT_CHUNK_SIZE = 1000
+
+# Statement settings
+# عدد الحركات في كل صفحة من كشف حساب العميل أو المورد
+STATEMENT_PAGE_SIZE = 50
+
+# Document events settings
+# تنفيذ المعالجات المؤجلة غير الحرجة لأحداث المستندات في عامل خلفية بعد تأكيد المعاملة
+# بدلاً من تنفيذها داخل الطلب (انظر core.outbox)
+OUTBOX_ASYNC = False
+
+# Dashboard statistics settings
+# أقصى عمر لإحصائيات لوحة التحكم المحسوبة مسبقاً قبل إعادة حسابها عند القراءة (بالثانية)
+# (انظر core.dashboard_stats والأمر refresh_dashboard_stats)
+DASHBOARD_STATS_MAX_AGE = 300
+
+# Inventory valuation settings
+# طريقة تقييم المخزون وتكلفة البضاعة المباعة: 'average' (المتوسط المرجح) أو 'fifo'
+# (انظر product.services.valuation)
+INVENTORY_COSTING_METHOD = 'average'
+
+# Product lookup settings
+# عدد رموز الباركود/المنتج المحفوظة في ذاكرة كل عملية، وأقصى عدد رموز في طلب واحد
+# (انظر product.services.lookup)
+PRODUCT_LOOKUP_CACHE_SIZE = 2048
+PRODUCT_LOOKUP_MAX_CODES = 200
+# أقصى عمر لبيانات المنتج المحفوظة في ذاكرة العملية حتى لو لم يصل الإبطال (بالثانية)
+PRODUCT_LOOKUP_CACHE_MAX_AGE = 60
+
+# Document numbering settings
+# عدد الأرقام التي يحجزها كل عامل دفعة واحدة للمستندات التي تسمح بالفجوات
+DOCUMENT_NUMBER_BLOCK_SIZE = 50
+# المستندات التي يجب ترقيمها بدون فجوات (يُحجز الرقم داخل معاملة المستند)
+DOCUMENT_NUMBER_GAPLESS_TYPES = ('sale', 'purchase', 'sale_return', 'purchase_return')
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -57,6 +57,7 @@ class ProductAdmin(admin.ModelAdmin):
     def current_stock(self, obj):
         return obj.current_stock
     current_stock.short_description = _('المخزون الحالي')
+    current_stock.admin_order_field = 'total_stock'
     
     def profit_margin(self, obj):
         return f"{obj.profit_margin:.2f}%"
@@ -103,10 +104,10 @@ class StockAdmin(admin.ModelAdmin):
     """
     إدارة المخزون
     """
-    list_display = ('product', 'warehouse', 'quantity', 'updated_at')
+    list_display = ('product', 'warehouse', 'quantity', 'total_value', 'updated_at')
     list_filter = ('warehouse',)
     search_fields = ('product__name', 'product__sku', 'warehouse__name')
-    readonly_fields = ('updated_at',)
+    readonly_fields = ('total_value', 'updated_at')
     
 
 @admin.register(StockMovement)
@@ -119,7 +120,7 @@ class StockMovementAdmin(admin.ModelAdmin):
     search_fields = ('product__name', 'product__sku', 'reference_number', 'notes')
     readonly_fields = ('timestamp', 'created_by')
     fieldsets = (
-        (None, {'fields': ('product', 'warehouse', 'movement_type', 'quantity')}),
+        (None, {'fields': ('product', 'warehouse', 'movement_type', 'quantity', 'unit_cost')}),
         (_('معلومات إضافية'), {'fields': ('reference_number', 'notes', 'destination_warehouse')}),
         (_('معلومات النظام'), {'fields': ('timestamp', 'created_by')}),
     )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from product.services.inventory import build_checkpoints, rebuild_checkpoints
+
+
+class Command(BaseCommand):
+    help = 'بناء لقطات المخزون الشهرية للأشهر المغلقة من حركات المخزون (للتشغيل المجدول)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=parse_date,
+                            help='آخر شهر تُبنى لقطته بصيغة YYYY-MM-DD (الافتراضي آخر شهر مغلق)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='حذف كل اللقطات وإعادة بنائها من البداية')
+
+    def handle(self, *args, **options):
+        build = rebuild_checkpoints if options['rebuild'] else build_checkpoints
+        created = build(options['until'])
+        self.stdout.write(self.style.SUCCESS(f'تم بناء {created} لقطة مخزون شهرية بنجاح'))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from product.models import StockMovement, Stock
+from product.models import StockMovement
+from product.services.stock_rebuild import rebuild_stock
 import re
 
 
@@ -27,15 +28,7 @@ class Command(BaseCommand):
         duplicate_count = StockMovement.objects.filter(id__in=movements_to_delete).count()
         StockMovement.objects.filter(id__in=movements_to_delete).delete()
         
-        # إعادة حساب أرصدة المخزون
-        stocks = Stock.objects.all()
-        for stock in stocks:
-            # إعادة ضبط الكمية إلى صفر
-            stock.quantity = 0
-            stock.save()
-        
-        # إعادة حساب الكميات بناءً على حركات المخزون المتبقية
-        for movement in StockMovement.objects.all():
-            movement.update_stock()
+        # إعادة حساب أرصدة المخزون بناءً على حركات المخزون المتبقية
+        rebuild_stock()
         
         self.stdout.write(self.style.SUCCESS(f'تم حذف {duplicate_count} حركة مكررة وإعادة حساب أرصدة المخزون بنجاح')) 
\ No newline at end of file
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from product.services.search import fts_enabled, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'إعادة بناء فهرس البحث في المنتجات (بعد الاستيراد الجماعي أو تغيير قواعد توحيد النص)'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            indexed = rebuild_index()
+        engine = 'FTS5' if fts_enabled() else 'LIKE'
+        self.stdout.write(self.style.SUCCESS(f'تمت فهرسة {indexed} منتج بنجاح ({engine})'))
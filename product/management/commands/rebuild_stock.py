@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from product.services.stock_rebuild import rebuild_stock
+
+
+class Command(BaseCommand):
+    help = 'إعادة حساب أرصدة المخزون وكميات الحركات قبل وبعد من حركات المخزون'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help='معرف المنتج المراد إعادة حسابه (يمكن تكراره، الافتراضي الكل)')
+        parser.add_argument('--warehouse', type=int, action='append', dest='warehouses',
+                            help='معرف المخزن المراد إعادة حسابه (يمكن تكراره، الافتراضي الكل)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='عدد السجلات في كل دفعة قراءة وتحديث')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='عرض الفروق بدون حفظ')
+
+    def handle(self, *args, **options):
+        result = rebuild_stock(
+            product_ids=options['products'],
+            warehouse_ids=options['warehouses'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+
+        for diff in result.stock_diffs:
+            self.stdout.write(
+                f'product {diff.product_id} warehouse {diff.warehouse_id}: '
+                f'الكمية الحالية {diff.quantity} والمحسوبة {diff.rebuilt}'
+            )
+
+        if options['dry_run']:
+            self.stdout.write(
+                f'عدد أرصدة المخزون المختلفة: {len(result.stock_diffs)}، '
+                f'وعدد الحركات التي تحتاج إلى تصحيح الكمية قبل وبعد: {result.movements_updated}'
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'تم تصحيح {len(result.stock_diffs)} رصيد مخزون و {result.movements_updated} حركة بنجاح'
+            ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from product.services.stock import rebuild_total_stock, verify_total_stock
+
+
+class Command(BaseCommand):
+    help = 'التحقق من تطابق إجمالي مخزون المنتجات مع مجموع كمياتها في المخازن وإصلاحه'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', dest='products',
+                            help='معرف منتج محدد (يمكن تكراره، الافتراضي الكل)')
+        parser.add_argument('--fix', action='store_true',
+                            help='إعادة حساب الإجماليات غير المتطابقة من المخازن')
+
+    def handle(self, *args, **options):
+        rows = verify_total_stock(options['products'])
+        for pk, total, stock_sum in rows:
+            self.stdout.write(f'product {pk}: الإجمالي المخزن {total} ومجموع المخازن {stock_sum}')
+
+        if rows and options['fix']:
+            rebuild_total_stock([pk for pk, _, _ in rows])
+
+        if not rows:
+            self.stdout.write(self.style.SUCCESS('إجمالي مخزون كل المنتجات مطابق للمخازن'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'تم إصلاح إجمالي مخزون {len(rows)} منتج'))
+        else:
+            self.stdout.write(self.style.WARNING(f'يوجد {len(rows)} منتج غير مطابق (استخدم --fix للإصلاح)'))
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='serialnumber',
+            unique_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='serialnumber',
+            name='document_type',
+            field=models.CharField(choices=[('sale', 'فاتورة مبيعات'), ('purchase', 'فاتورة مشتريات'), ('sale_return', 'مرتجع مبيعات'), ('purchase_return', 'مرتجع مشتريات'), ('stock_movement', 'حركة مخزون')], max_length=20, verbose_name='نوع المستند'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='serialnumber',
+            unique_together={('document_type', 'prefix', 'year')},
+        ),
+    ]
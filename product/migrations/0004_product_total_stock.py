@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:51
+
+from django.db import migrations, models
+from django.db.models import IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_total_stock(apps, schema_editor):
+    """
+    تعبئة إجمالي مخزون كل منتج من مجموع كمياته في المخازن
+    """
+    Product = apps.get_model('product', 'Product')
+    Stock = apps.get_model('product', 'Stock')
+    totals = (
+        Stock.objects.filter(product_id=OuterRef('pk')).order_by()
+        .values('product_id').annotate(total=Sum('quantity')).values('total')
+    )
+    Product.objects.update(total_stock=Coalesce(Subquery(totals, output_field=IntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_serialnumber_prefix_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='total_stock',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='إجمالي المخزون'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['total_stock'], name='product_total_stock'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'total_stock'], name='product_active_total_stock'),
+        ),
+        migrations.RunPython(populate_total_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0004_product_total_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(help_text='أول يوم في الشهر', verbose_name='الشهر')),
+                ('quantity', models.IntegerField(default=0, verbose_name='الكمية')),
+            ],
+            options={
+                'verbose_name': 'لقطة مخزون',
+                'verbose_name_plural': 'لقطات المخزون',
+                'ordering': ['product', 'warehouse', '-period'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['timestamp'], name='product_movement_timestamp'),
+        ),
+        migrations.AddField(
+            model_name='stockcheckpoint',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='product.product', verbose_name='المنتج'),
+        ),
+        migrations.AddField(
+            model_name='stockcheckpoint',
+            name='warehouse',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='product.warehouse', verbose_name='المخزن'),
+        ),
+        migrations.AddIndex(
+            model_name='stockcheckpoint',
+            index=models.Index(fields=['warehouse', 'period'], name='product_checkpoint_wh_period'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='stockcheckpoint',
+            unique_together={('product', 'warehouse', 'period')},
+        ),
+    ]
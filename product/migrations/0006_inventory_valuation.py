@@ -0,0 +1,56 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:03
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def populate_total_value(apps, schema_editor):
+    """
+    تقييم المخزون الحالي بسعر تكلفة المنتج (لا توجد تكلفة للحركات السابقة)
+    """
+    Product = apps.get_model('product', 'Product')
+    Stock = apps.get_model('product', 'Stock')
+    cost_price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('cost_price')[:1])
+    Stock.objects.update(total_value=ExpressionWrapper(
+        F('quantity') * cost_price, output_field=DecimalField(max_digits=14, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_stock_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='total_value',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=14, verbose_name='قيمة المخزون'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='unit_cost',
+            field=models.DecimalField(blank=True, decimal_places=4, max_digits=14, null=True, verbose_name='تكلفة الوحدة'),
+        ),
+        migrations.CreateModel(
+            name='CostLayer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='الكمية الواردة')),
+                ('remaining', models.PositiveIntegerField(verbose_name='الكمية المتبقية')),
+                ('unit_cost', models.DecimalField(decimal_places=4, max_digits=14, verbose_name='تكلفة الوحدة')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='product.product', verbose_name='المنتج')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cost_layers', to='product.warehouse', verbose_name='المخزن')),
+            ],
+            options={
+                'verbose_name': 'طبقة تكلفة',
+                'verbose_name_plural': 'طبقات التكلفة',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['product', 'warehouse', 'remaining'], name='product_costlayer_open')],
+            },
+        ),
+        migrations.RunPython(populate_total_value, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,114 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:13
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# نسخة ثابتة من utils.helpers.normalize_arabic وقت إنشاء الترحيل، حتى لا
+# يتغير ناتج الترحيل بتغير الدالة لاحقاً (تغييرها يتطلب rebuild_product_search)
+ARABIC_DIACRITICS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+
+ARABIC_LETTER_FORMS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ی': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    'ک': 'ك',
+    **{digit: str(index) for index, digit in enumerate('٠١٢٣٤٥٦٧٨٩')},
+    **{digit: str(index) for index, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+})
+
+
+def normalize_arabic(text):
+    if not text:
+        return ''
+    text = ARABIC_DIACRITICS.sub('', str(text)).translate(ARABIC_LETTER_FORMS)
+    return ' '.join(text.lower().split())
+
+
+def create_search_backend(apps, schema_editor):
+    """
+    جدول FTS5 على SQLite، أو فهرس trigram لنص البحث على PostgreSQL
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA compile_options")
+            options = {row[0] for row in cursor.fetchall()}
+        if 'ENABLE_FTS5' in options:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS product_search_fts "
+                "USING fts5(document, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS product_search_document_trgm "
+            "ON product_productsearchindex USING gin (document gin_trgm_ops)"
+        )
+
+
+def drop_search_backend(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS product_search_fts")
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS product_search_document_trgm")
+
+
+def populate_search_index(apps, schema_editor):
+    """
+    فهرسة المنتجات الحالية (نفس نص product.services.search.product_document
+    وقت إنشاء الترحيل)
+    """
+    Product = apps.get_model('product', 'Product')
+    ProductSearchIndex = apps.get_model('product', 'ProductSearchIndex')
+    connection = schema_editor.connection
+
+    rows = []
+    for product in Product.objects.select_related('brand', 'category').iterator():
+        parts = [
+            product.name, product.sku, product.barcode,
+            product.brand.name if product.brand_id else '',
+            product.category.name if product.category_id else '',
+        ]
+        text = normalize_arabic(' '.join(part for part in parts if part))
+        stems = [word[2:] for word in text.split() if word.startswith('ال') and len(word) > 4]
+        rows.append(ProductSearchIndex(
+            product_id=product.pk,
+            name=normalize_arabic(product.name)[:255],
+            document=' '.join([text] + stems),
+        ))
+    ProductSearchIndex.objects.bulk_create(rows, batch_size=500)
+
+    if connection.vendor == 'sqlite' and 'product_search_fts' in connection.introspection.table_names():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                "INSERT INTO product_search_fts (rowid, document) VALUES (%s, %s)",
+                [(row.product_id, row.document) for row in rows],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0006_inventory_valuation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_index', serialize=False, to='product.product', verbose_name='المنتج')),
+                ('name', models.CharField(db_index=True, max_length=255, verbose_name='الاسم الموحد')),
+                ('document', models.TextField(verbose_name='نص البحث')),
+            ],
+            options={
+                'verbose_name': 'فهرس بحث المنتج',
+                'verbose_name_plural': 'فهرس بحث المنتجات',
+            },
+        ),
+        migrations.RunPython(create_search_backend, drop_search_backend),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
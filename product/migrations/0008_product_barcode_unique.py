@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:17
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def clean_barcodes(apps, schema_editor):
+    """
+    تحويل الباركود الفارغ إلى NULL وإزالة الباركود المكرر من المنتجات الأحدث
+
+    المنتج الأقدم يحتفظ بالباركود المكرر، وتُزال القيمة من باقي المنتجات
+    (وتُسجل في ملاحظات الوصف) حتى يمكن إنشاء قيد التفرد.
+    """
+    Product = apps.get_model('product', 'Product')
+    Product.objects.filter(barcode='').update(barcode=None)
+
+    duplicates = (
+        Product.objects.filter(barcode__isnull=False).order_by()
+        .values('barcode').annotate(count=Count('id')).filter(count__gt=1)
+    )
+    for row in list(duplicates):
+        products = Product.objects.filter(barcode=row['barcode']).order_by('pk')
+        for product in products[1:]:
+            note = f"باركود مكرر أُزيل: {product.barcode}"
+            product.description = f"{product.description}\n{note}" if product.description else note
+            product.barcode = None
+            product.save(update_fields=['barcode', 'description'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0007_product_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(clean_barcodes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='barcode',
+            field=models.CharField(blank=True, max_length=50, null=True, unique=True, verbose_name='الباركود'),
+        ),
+    ]
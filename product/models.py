@@ -1,8 +1,9 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from django.conf import settings
-from django.utils import timezone
 
 
 class Category(models.Model):
@@ -79,7 +80,8 @@ class Product(models.Model):
                              verbose_name=_('العلامة التجارية'), blank=True, null=True)
     description = models.TextField(_('الوصف'), blank=True, null=True)
     sku = models.CharField(_('رمز المنتج'), max_length=50, unique=True)
-    barcode = models.CharField(_('الباركود'), max_length=50, blank=True, null=True)
+    # فريد ومفهرس للبحث بالماسح الضوئي (القيم الفارغة تُحفظ NULL)
+    barcode = models.CharField(_('الباركود'), max_length=50, blank=True, null=True, unique=True)
     unit = models.ForeignKey(Unit, on_delete=models.PROTECT, related_name='products',
                             verbose_name=_('وحدة القياس'))
     cost_price = models.DecimalField(_('سعر التكلفة'), max_digits=12, decimal_places=2,
@@ -88,6 +90,8 @@ class Product(models.Model):
                                        validators=[MinValueValidator(0)])
     min_stock = models.PositiveIntegerField(_('الحد الأدنى للمخزون'), default=0)
     max_stock = models.PositiveIntegerField(_('الحد الأقصى للمخزون'), default=0)
+    # مجموع الكميات في كل المخازن، تحدثه خدمة ترحيل المخزون مع كل تغيير في Stock
+    total_stock = models.PositiveIntegerField(_('إجمالي المخزون'), default=0, editable=False)
     is_active = models.BooleanField(_('نشط'), default=True)
     is_featured = models.BooleanField(_('مميز'), default=False)
     tax_rate = models.DecimalField(_('نسبة الضريبة'), max_digits=5, decimal_places=2,
@@ -103,6 +107,22 @@ class Product(models.Model):
         verbose_name = _('منتج')
         verbose_name_plural = _('المنتجات')
         ordering = ['name']
+        indexes = [
+            models.Index(fields=['total_stock'], name='product_total_stock'),
+            models.Index(fields=['is_active', 'total_stock'], name='product_active_total_stock'),
+        ]
+    
+    def save(self, *args, **kwargs):
+        # الباركود الفارغ يُحفظ NULL حتى لا يتعارض مع قيد التفرد
+        if not self.barcode:
+            self.barcode = None
+        # إجمالي المخزون يتغير فقط مع تغيير المخزون (F-expression)، فلا يُكتب من نسخة قديمة عند حفظ باقي البيانات
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'total_stock'
+            ]
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.name} ({self.sku})"
@@ -110,12 +130,9 @@ class Product(models.Model):
     @property
     def current_stock(self):
         """
-        حساب المخزون الحالي في جميع المستودعات
+        المخزون الحالي في جميع المستودعات (إجمالي المخزون المحدث مع كل حركة)
         """
-        from django.db.models import Sum
-        # معالجة حالة عدم وجود مخزون
-        stock = self.stocks.aggregate(Sum('quantity'))
-        return stock['quantity__sum'] or 0
+        return self.total_stock
     
     @property
     def profit_margin(self):
@@ -206,6 +223,9 @@ class Stock(models.Model):
     warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='stocks',
                                  verbose_name=_('المخزن'))
     quantity = models.PositiveIntegerField(_('الكمية'), default=0)
+    # قيمة الكمية الحالية بالتكلفة (تُحدث مع ترحيل كل حركة)
+    total_value = models.DecimalField(_('قيمة المخزون'), max_digits=14, decimal_places=2, default=0,
+                                      editable=False)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
     
     class Meta:
@@ -215,6 +235,15 @@ class Stock(models.Model):
     
     def __str__(self):
         return f"{self.product} - {self.warehouse} ({self.quantity})"
+    
+    @property
+    def average_cost(self):
+        """
+        متوسط تكلفة الوحدة في المخزن
+        """
+        if self.quantity > 0:
+            return self.total_value / self.quantity
+        return Decimal('0')
 
 
 class StockMovement(models.Model):
@@ -265,6 +294,10 @@ class StockMovement(models.Model):
     quantity_before = models.PositiveIntegerField(_('الكمية قبل'), default=0)
     quantity_after = models.PositiveIntegerField(_('الكمية بعد'), default=0)
     
+    # تكلفة الوحدة: تكلفة الشراء للوارد، وتكلفة الصرف المحسوبة للصادر
+    unit_cost = models.DecimalField(_('تكلفة الوحدة'), max_digits=14, decimal_places=4,
+                                    blank=True, null=True)
+    
     # خاصية لتخطي تحديث المخزون (للاستخدام الداخلي)
     _skip_update = False
     
@@ -274,79 +307,103 @@ class StockMovement(models.Model):
         verbose_name = _('حركة المخزون')
         verbose_name_plural = _('حركات المخزون')
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='product_movement_timestamp'),
+        ]
     
     def __str__(self):
         return f"{self.product} - {self.movement_type} - {self.quantity} - {self.timestamp}"
     
     def save(self, *args, **kwargs):
         """
-        تحديث كمية المخزون عند إنشاء حركة جديدة
+        ترحيل الحركة على المخزون عند إنشائها ثم حفظها
         """
-        # تحقق من عدم تخطي التحديث (للاستخدام عند استعادة البيانات)
-        if not self._skip_update:
-            try:
-                # الحصول على مخزون المنتج في المخزن المحدد أو إنشاء سجل جديد إذا لم يكن موجوداً
-                stock, created = Stock.objects.get_or_create(
-                    product=self.product,
-                    warehouse=self.warehouse,
-                    defaults={'quantity': 0}
-                )
-                
-                # تخزين قيمة المخزون قبل التحديث
-                self.quantity_before = stock.quantity
-                
-                # تحديث الكمية حسب نوع الحركة
-                if self.movement_type == 'in' or self.movement_type == 'return_in':
-                    # إضافة للمخزون (شراء أو مرتجع مبيعات)
-                    stock.quantity += self.quantity
-                elif self.movement_type == 'out' or self.movement_type == 'return_out':
-                    # خصم من المخزون (بيع أو مرتجع مشتريات)
-                    # تأكد من عدم طرح أكثر من المخزون الحالي
-                    if stock.quantity >= self.quantity:
-                        stock.quantity -= self.quantity
-                    else:
-                        stock.quantity = 0
-                elif self.movement_type == 'transfer':
-                    # خصم من المخزن الحالي
-                    if stock.quantity >= self.quantity:
-                        stock.quantity -= self.quantity
-                    else:
-                        stock.quantity = 0
-                    
-                    # إضافة للمخزن المستلم
-                    if self.destination_warehouse:
-                        dest_stock, created = Stock.objects.get_or_create(
-                            product=self.product,
-                            warehouse=self.destination_warehouse,
-                            defaults={'quantity': 0}
-                        )
-                        dest_stock.quantity += self.quantity
-                        dest_stock.save()
-                elif self.movement_type == 'adjustment':
-                    # تعديل المخزون للوصول إلى كمية محددة
-                    stock.quantity = self.quantity
-                
-                # تخزين قيمة المخزون بعد التحديث
-                self.quantity_after = stock.quantity
-                
-                # حفظ التغييرات على المخزون
-                stock.save()
-            except Exception as e:
-                # تسجيل الأخطاء دون إيقاف العملية
-                print(f"خطأ في تحديث المخزون: {e}")
-        
-        # استمرار في عملية الحفظ الطبيعية
-        if not self.number:
-            # الحصول على الرقم التسلسلي
-            serial = SerialNumber.objects.get_or_create(
-                document_type='stock_movement',
-                year=timezone.now().year,
-                defaults={'prefix': 'MOV'}
-            )[0]
-            next_number = serial.get_next_number()
-            self.number = f"{serial.prefix}{next_number:04d}"
-        
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            # الترحيل يتم مرة واحدة فقط عند الإنشاء (ويمكن تخطيه عند استعادة البيانات)
+            if self._state.adding and not self._skip_update:
+                from product.services.stock import post_movement
+                post_movement(self)
+            
+            if not self.number:
+                # حجز الرقم التالي من عداد حركات المخزون
+                from product.services.numbering import allocate_number
+                self.number = allocate_number('stock_movement')
+            
+            super().save(*args, **kwargs)
+
+
+class StockCheckpoint(models.Model):
+    """
+    لقطة كمية المنتج في المخزن في نهاية شهر
+
+    تحفظ الكمية المحسوبة من حركات المخزون حتى نهاية كل شهر مغلق فيه حركة
+    للمنتج في المخزن، وتُستخدم للاستعلام عن المخزون في أي تاريخ سابق.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='checkpoints',
+                               verbose_name=_('المنتج'))
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='checkpoints',
+                                 verbose_name=_('المخزن'))
+    period = models.DateField(_('الشهر'), help_text=_('أول يوم في الشهر'))
+    quantity = models.IntegerField(_('الكمية'), default=0)
+    
+    class Meta:
+        verbose_name = _('لقطة مخزون')
+        verbose_name_plural = _('لقطات المخزون')
+        ordering = ['product', 'warehouse', '-period']
+        unique_together = ['product', 'warehouse', 'period']
+        indexes = [
+            models.Index(fields=['warehouse', 'period'], name='product_checkpoint_wh_period'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product} - {self.warehouse} - {self.period:%Y-%m} ({self.quantity})"
+
+
+class CostLayer(models.Model):
+    """
+    طبقة تكلفة وارد لتقييم المخزون بطريقة الوارد أولاً صادر أولاً (FIFO)
+
+    تُنشأ طبقة مع كل كمية واردة بتكلفتها، والصرف يستهلك الطبقات الأقدم أولاً.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='cost_layers',
+                               verbose_name=_('المنتج'))
+    warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name='cost_layers',
+                                 verbose_name=_('المخزن'))
+    quantity = models.PositiveIntegerField(_('الكمية الواردة'))
+    remaining = models.PositiveIntegerField(_('الكمية المتبقية'))
+    unit_cost = models.DecimalField(_('تكلفة الوحدة'), max_digits=14, decimal_places=4)
+    created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('طبقة تكلفة')
+        verbose_name_plural = _('طبقات التكلفة')
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['product', 'warehouse', 'remaining'], name='product_costlayer_open'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product} - {self.warehouse} ({self.remaining}/{self.quantity} @ {self.unit_cost})"
+
+
+class ProductSearchIndex(models.Model):
+    """
+    نص البحث الموحد لكل منتج
+
+    يجمع الاسم والرمز والباركود والعلامة التجارية والفئة بعد توحيد النص العربي،
+    ويُحدث مع حفظ المنتج أو فئته أو علامته التجارية (انظر product.services.search).
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True,
+                                   related_name='search_index', verbose_name=_('المنتج'))
+    name = models.CharField(_('الاسم الموحد'), max_length=255, db_index=True)
+    document = models.TextField(_('نص البحث'))
+    
+    class Meta:
+        verbose_name = _('فهرس بحث المنتج')
+        verbose_name_plural = _('فهرس بحث المنتجات')
+    
+    def __str__(self):
+        return self.name
 
 
 class SerialNumber(models.Model):
@@ -356,6 +413,8 @@ class SerialNumber(models.Model):
     DOCUMENT_TYPES = (
         ('sale', _('فاتورة مبيعات')),
         ('purchase', _('فاتورة مشتريات')),
+        ('sale_return', _('مرتجع مبيعات')),
+        ('purchase_return', _('مرتجع مشتريات')),
         ('stock_movement', _('حركة مخزون')),
     )
     
@@ -367,40 +426,16 @@ class SerialNumber(models.Model):
     class Meta:
         verbose_name = _('رقم تسلسلي')
         verbose_name_plural = _('الأرقام التسلسلية')
-        unique_together = ['document_type', 'year']
+        unique_together = ['document_type', 'prefix', 'year']
     
     def get_next_number(self):
         """
         الحصول على الرقم التالي في التسلسل
+
+        يتم الحجز بزيادة ذرية للعداد في قاعدة البيانات (انظر product.services.numbering)
         """
-        # البحث عن آخر رقم مستخدم في هذا النوع من المستندات
-        from django.db.models import Max
-        from django.apps import apps
-        
-        # تحديد النموذج المناسب حسب نوع المستند
-        if self.document_type == 'sale':
-            model = apps.get_model('sale', 'Sale')
-        elif self.document_type == 'purchase':
-            model = apps.get_model('purchase', 'Purchase')
-        else:
-            model = apps.get_model('product', 'StockMovement')
-        
-        # استخراج الرقم من آخر مستند
-        last_doc = model.objects.filter(
-            number__startswith=self.prefix
-        ).order_by('-number').first()
-        
-        if last_doc:
-            # استخراج الرقم من آخر مستند
-            try:
-                last_number = int(last_doc.number.replace(self.prefix, ''))
-                self.last_number = max(self.last_number, last_number)
-            except ValueError:
-                pass
-        
-        # زيادة الرقم
-        self.last_number += 1
-        self.save()
+        from product.services.numbering import next_value
+        self.last_number = next_value(self.document_type, self.prefix, self.year)
         return self.last_number
     
     def __str__(self):
@@ -0,0 +1,22 @@
+"""
+خدمات المنتجات والمخزون
+"""
+from product.services.stock import (
+    StockPosting, increase_stock, decrease_stock, set_stock,
+    post_movement, reverse_movement, post_movements, create_movements,
+    verify_total_stock, rebuild_total_stock,
+)
+from product.services.stock_rebuild import rebuild_stock
+from product.services.inventory import (
+    quantities_as_of, quantity_as_of, build_checkpoints, rebuild_checkpoints,
+)
+from product.services.valuation import (
+    costing_method, revalue_stock, inventory_valuation, inventory_value, cogs_by_sale, sale_cogs, sale_unit_costs,
+)
+from product.services.search import (
+    SearchPage, search_products, matching_products, index_products, rebuild_index,
+)
+from product.services.lookup import lookup_codes, lookup_code, invalidate_lookup_cache
+from product.services.numbering import (
+    allocate_number, allocate_numbers, next_value, peek_number, format_number,
+)
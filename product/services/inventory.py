@@ -0,0 +1,275 @@
+"""
+خدمة المخزون في تاريخ سابق
+
+كمية المنتج في المخزن في أي تاريخ تُحسب من حركات المخزون نفسها وليس من
+quantity_before و quantity_after (لا تُملأ للحركات المحفوظة بـ _skip_update
+ولا تشمل المخزن المستلم في التحويل):
+- الوارد والمرتجع الوارد والتحويل الوارد يضيف الكمية
+- الصادر والمرتجع الصادر والتحويل يخصم الكمية، والتحويل يضيفها للمخزن المستلم
+- التسوية تعين الكمية المطلقة، فلا يُحسب ما قبل آخر تسوية
+
+وتُحفظ لقطة لكل (منتج، مخزن) في نهاية كل شهر مغلق فيه حركة (StockCheckpoint)،
+فالكمية في أي تاريخ = آخر لقطة قبل التاريخ + حركات ما بعد اللقطة حتى التاريخ،
+بعدد ثابت من الاستعلامات المجمعة مهما كان عدد المنتجات.
+
+ترتيب الحركات بالمعرف، والحد الأدنى للمخزون الفعلي (عدم النزول تحت الصفر
+عند الصرف) لا يُطبق في الحساب التاريخي.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from product.models import StockCheckpoint, StockMovement
+from product.services.stock import INBOUND_MOVEMENTS, OUTBOUND_MOVEMENTS
+
+# عدد اللقطات في كل دفعة إنشاء
+CHECKPOINT_BATCH_SIZE = 1000
+
+
+def month_start(date):
+    """
+    أول يوم في شهر التاريخ
+    """
+    return date.replace(day=1)
+
+
+def next_month(period):
+    """
+    أول يوم في الشهر التالي
+    """
+    return (period.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _day_start(date):
+    # بداية اليوم بالتوقيت المحلي (الحركات مخزنة بوقتها الكامل)
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def _month_of(timestamp):
+    # شهر وقت الحركة بالتوقيت المحلي
+    return month_start(timezone.localtime(timestamp).date() if timezone.is_aware(timestamp) else timestamp.date())
+
+
+def _first_month(start, end):
+    """
+    شهر أول حركة في الفترة [start, end)، أو None إذا لم توجد حركات
+
+    يُحسب في Python وليس بـ TruncMonth (يُرجع NULL على MySQL بدون جداول
+    المناطق الزمنية).
+    """
+    first = _window(start, end).aggregate(first=Min('timestamp'))['first']
+    return _month_of(first) if first is not None else None
+
+
+def _filter(movements, product_ids=None, warehouse_ids=None, warehouse_field='warehouse_id'):
+    if product_ids is not None:
+        movements = movements.filter(product_id__in=product_ids)
+    if warehouse_ids is not None:
+        movements = movements.filter(**{f'{warehouse_field}__in': warehouse_ids})
+    return movements
+
+
+def _window(start=None, end=None):
+    """
+    الحركات في الفترة [start, end) حسب وقت الحركة
+    """
+    movements = StockMovement.objects.order_by()
+    if start is not None:
+        movements = movements.filter(timestamp__gte=start)
+    if end is not None:
+        movements = movements.filter(timestamp__lt=end)
+    return movements
+
+
+def _last_adjustment(window, warehouse_field):
+    # معرف آخر تسوية في الفترة لنفس المنتج والمخزن (المخزن من حقل الحركة الخارجية)
+    return Coalesce(Subquery(
+        window.filter(
+            movement_type='adjustment',
+            product_id=OuterRef('product_id'),
+            warehouse_id=OuterRef(warehouse_field),
+        ).order_by('-id').values('id')[:1]
+    ), Value(0))
+
+
+def _window_changes(window, product_ids=None, warehouse_ids=None):
+    """
+    تأثير حركات فترة على الكميات بثلاثة استعلامات مجمعة
+
+    تُرجع: (قاموس {(المنتج، المخزن): كمية آخر تسوية}، قاموس {(المنتج، المخزن): صافي الحركات بعدها})
+    """
+    adjustments = _filter(window.filter(movement_type='adjustment'), product_ids, warehouse_ids)
+    adjusted = {
+        (product_id, warehouse_id): quantity
+        for product_id, warehouse_id, quantity in adjustments.filter(
+            id=_last_adjustment(window, 'warehouse_id')
+        ).values_list('product_id', 'warehouse_id', 'quantity')
+    }
+
+    signed = Case(
+        When(movement_type__in=INBOUND_MOVEMENTS, then=F('quantity')),
+        When(movement_type__in=OUTBOUND_MOVEMENTS, then=-F('quantity')),
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    source = _filter(window.exclude(movement_type='adjustment'), product_ids, warehouse_ids).filter(
+        id__gt=_last_adjustment(window, 'warehouse_id')
+    ).values('product_id', 'warehouse_id').annotate(delta=Sum(signed))
+    deltas = {(row['product_id'], row['warehouse_id']): row['delta'] or 0 for row in source}
+
+    # الكمية المحولة تدخل المخزن المستلم
+    destination = _filter(
+        window.filter(movement_type='transfer', destination_warehouse__isnull=False),
+        product_ids, warehouse_ids, 'destination_warehouse_id',
+    ).filter(
+        id__gt=_last_adjustment(window, 'destination_warehouse_id')
+    ).values('product_id', 'destination_warehouse_id').annotate(delta=Sum('quantity'))
+    for row in destination:
+        key = (row['product_id'], row['destination_warehouse_id'])
+        deltas[key] = deltas.get(key, 0) + (row['delta'] or 0)
+
+    return adjusted, deltas
+
+
+def _apply(state, adjusted, deltas):
+    """
+    تطبيق تأثير فترة على الكميات في الذاكرة
+
+    تُرجع: المفاتيح التي تغيرت في الفترة
+    """
+    for key, quantity in adjusted.items():
+        state[key] = quantity
+    for key, delta in deltas.items():
+        state[key] = state.get(key, 0) + delta
+    return set(adjusted) | set(deltas)
+
+
+def checkpoint_watermark():
+    """
+    آخر شهر محفوظة له لقطات (الأشهر حتى هذا الشهر محسوبة في اللقطات)
+    """
+    return StockCheckpoint.objects.aggregate(period=Max('period'))['period']
+
+
+def _checkpoint_state(period, product_ids=None, warehouse_ids=None):
+    """
+    الكميات من آخر لقطة لكل (منتج، مخزن) حتى الشهر (شامل)
+    """
+    latest = StockCheckpoint.objects.filter(
+        product=OuterRef('product'), warehouse=OuterRef('warehouse'), period__lte=period,
+    ).order_by('-period').values('period')[:1]
+    checkpoints = _filter(
+        StockCheckpoint.objects.filter(period=Subquery(latest)), product_ids, warehouse_ids
+    )
+    return {
+        (product_id, warehouse_id): quantity
+        for product_id, warehouse_id, quantity in checkpoints.values_list('product_id', 'warehouse_id', 'quantity')
+    }
+
+
+def quantities_as_of(as_of, product_ids=None, warehouse_ids=None):
+    """
+    كميات المخزون في نهاية تاريخ معين
+
+    المعلمات:
+    as_of (date): التاريخ (شامل)
+    product_ids (list): حصر المنتجات (اختياري)
+    warehouse_ids (list): حصر المخازن (اختياري)
+
+    تُرجع: قاموس {(معرف المنتج، معرف المخزن): الكمية}
+    """
+    # آخر لقطة يمكن استخدامها: لا تتجاوز الشهر السابق لشهر التاريخ
+    period = checkpoint_watermark()
+    if period is not None:
+        period = min(period, month_start(as_of) - timedelta(days=1))
+        period = month_start(period)
+
+    state = {}
+    start = None
+    if period is not None:
+        state = _checkpoint_state(period, product_ids, warehouse_ids)
+        start = _day_start(next_month(period))
+
+    window = _window(start, _day_start(as_of + timedelta(days=1)))
+    _apply(state, *_window_changes(window, product_ids, warehouse_ids))
+    return state
+
+
+def quantity_as_of(product_id, warehouse_id, as_of):
+    """
+    كمية منتج في مخزن في نهاية تاريخ معين
+    """
+    return quantities_as_of(as_of, [product_id], [warehouse_id]).get((product_id, warehouse_id), 0)
+
+
+def last_closed_month(today=None):
+    """
+    أول يوم في آخر شهر مغلق (الشهر السابق للشهر الحالي)
+    """
+    today = today or timezone.localdate()
+    return month_start(month_start(today) - timedelta(days=1))
+
+
+def build_checkpoints(until=None):
+    """
+    إنشاء لقطات الأشهر المغلقة التي لم تُحفظ لقطاتها بعد
+
+    يبدأ من الكميات في آخر لقطة محفوظة ثم يطبق حركات كل شهر بعدها في الذاكرة
+    ويحفظ لقطة لكل (منتج، مخزن) تغير في الشهر.
+
+    المعلمات:
+    until (date): آخر شهر تُحفظ لقطته (الافتراضي آخر شهر مغلق)
+
+    تُرجع: عدد اللقطات التي تم إنشاؤها
+    """
+    until = month_start(min(until or last_closed_month(), last_closed_month()))
+    watermark = checkpoint_watermark()
+    if watermark is not None and watermark >= until:
+        return 0
+
+    state = _checkpoint_state(watermark) if watermark is not None else {}
+    start = _day_start(next_month(watermark)) if watermark is not None else None
+    end = _day_start(next_month(until))
+
+    # الانتقال من شهر فيه حركات إلى الشهر التالي الذي فيه حركات مباشرة
+    rows = []
+    period = _first_month(start, end)
+    while period is not None:
+        period_end = _day_start(next_month(period))
+        window = _window(_day_start(period), period_end)
+        for key in sorted(_apply(state, *_window_changes(window))):
+            rows.append(StockCheckpoint(
+                product_id=key[0], warehouse_id=key[1], period=period, quantity=state[key],
+            ))
+        period = _first_month(period_end, end)
+
+    with transaction.atomic():
+        StockCheckpoint.objects.bulk_create(rows, batch_size=CHECKPOINT_BATCH_SIZE)
+    return len(rows)
+
+
+def rebuild_checkpoints(until=None):
+    """
+    حذف كل اللقطات وإعادة بنائها من حركات المخزون
+    """
+    with transaction.atomic():
+        StockCheckpoint.objects.all().delete()
+        return build_checkpoints(until)
+
+
+def invalidate_checkpoints(timestamp):
+    """
+    حذف اللقطات من شهر حركة أُضيفت أو حُذفت في شهر مغلق
+
+    تُحذف لقطات كل المنتجات من هذا الشهر حتى تبقى اللقطات المحفوظة كاملة
+    حتى آخر شهر فيها، ويُعاد بناؤها بـ build_checkpoints.
+    """
+    if timestamp is None:
+        return
+    period = _month_of(timestamp)
+    if period > last_closed_month():
+        return
+    StockCheckpoint.objects.filter(period__gte=period).delete()
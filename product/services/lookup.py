@@ -0,0 +1,216 @@
+"""
+خدمة البحث بالباركود أو رمز المنتج لنقاط البيع
+
+يحول مجموعة رموز ممسوحة (باركود أو SKU) إلى بيانات المنتجات وأسعارها
+وضرائبها ومخزونها في كل مخزن بطلب واحد:
+- بيانات المنتج لكل رمز محفوظة في ذاكرة LRU داخل العملية، فالمسح المتكرر
+  لنفس المنتجات لا يصل إلى قاعدة البيانات
+- الرموز غير المحفوظة تُجلب باستعلام واحد على الحقلين الفريدين المفهرسين
+- المخزون يُقرأ دائماً من قاعدة البيانات باستعلام واحد لكل الطلب (يتغير
+  مع كل عملية بيع فلا يُحفظ في الذاكرة)
+
+حفظ أو حذف أي منتج يغير رقم الجيل في الذاكرة المؤقتة المشتركة بين العمليات
+بعد تأكيد المعاملة، فتفرغ كل عملية ذاكرتها المحلية عند أول طلب بعد تغير
+الجيل. ولا يُستخدم أي منتج محفوظ مر عليه أكثر من PRODUCT_LOOKUP_CACHE_MAX_AGE
+ثانية، فلا يبقى سعر قديم بعد إبطال مفقود (مثل التعديل الجماعي بدون إشارات).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from product.models import Product, Stock
+
+CACHE_GENERATION_KEY = 'product:lookup:generation'
+
+# عدد الرموز المحفوظة في ذاكرة كل عملية
+DEFAULT_CACHE_SIZE = 2048
+
+# أقصى عمر للمنتج المحفوظ في ذاكرة العملية (بالثانية)
+DEFAULT_CACHE_MAX_AGE = 60
+
+# أقصى عدد رموز في طلب واحد
+DEFAULT_MAX_CODES = 200
+
+
+class _LRUCache:
+    """
+    ذاكرة LRU محدودة الحجم والعمر وآمنة مع الخيوط مرتبطة بجيل الذاكرة المشتركة
+    """
+
+    def __init__(self):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = None
+
+    def sync(self, generation):
+        # تفريغ الذاكرة إذا تغير الجيل منذ ملئها
+        with self._lock:
+            if self.generation != generation:
+                self._items.clear()
+                self.generation = generation
+
+    def get(self, key, max_age):
+        with self._lock:
+            if key not in self._items:
+                return None
+            stored_at, value = self._items[key]
+            if time.monotonic() - stored_at > max_age:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, maxsize):
+        with self._lock:
+            self._items[key] = (time.monotonic(), value)
+            self._items.move_to_end(key)
+            while len(self._items) > maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.generation = None
+
+
+_cache = _LRUCache()
+
+
+def max_codes():
+    """
+    أقصى عدد رموز مسموح في طلب بحث واحد
+    """
+    return getattr(settings, 'PRODUCT_LOOKUP_MAX_CODES', DEFAULT_MAX_CODES)
+
+
+def _bump_generation():
+    # رقم جيل مبني على الوقت حتى لا يعود رقم قديم إذا حُذف المفتاح من الذاكرة المؤقتة
+    cache.set(CACHE_GENERATION_KEY, time.time_ns(), None)
+    _cache.clear()
+
+
+def invalidate_lookup_cache():
+    """
+    إبطال ذاكرة البحث بالرموز في كل العمليات بعد تأكيد المعاملة الحالية
+    """
+    transaction.on_commit(_bump_generation)
+
+
+def _product_payload(product):
+    return {
+        'id': product.pk,
+        'name': product.name,
+        'sku': product.sku,
+        'barcode': product.barcode or '',
+        'unit': product.unit.symbol if product.unit_id else '',
+        'selling_price': str(product.selling_price),
+        'discount_rate': str(product.discount_rate),
+        'tax_rate': str(product.tax_rate),
+    }
+
+
+def _clean_codes(codes):
+    # إزالة المسافات والرموز الفارغة والمكررة مع الحفاظ على الترتيب
+    cleaned = []
+    for code in codes:
+        code = str(code or '').strip()
+        if code and code not in cleaned:
+            cleaned.append(code)
+    return cleaned
+
+
+def _load_products(codes):
+    """
+    جلب المنتجات النشطة المطابقة لرموز باستعلام واحد
+
+    تُرجع: قاموس {الرمز: بيانات المنتج} (الباركود مقدم على رمز المنتج عند التعارض)
+    """
+    products = Product.objects.filter(
+        Q(barcode__in=codes) | Q(sku__in=codes), is_active=True
+    ).select_related('unit')
+
+    wanted = set(codes)
+    by_sku, by_barcode = {}, {}
+    for product in products:
+        payload = _product_payload(product)
+        if product.sku in wanted:
+            by_sku[product.sku] = payload
+        if product.barcode in wanted:
+            by_barcode[product.barcode] = payload
+    return {**by_sku, **by_barcode}
+
+
+def _stock_by_product(product_ids, warehouse_id=None):
+    stocks = Stock.objects.filter(product_id__in=product_ids)
+    if warehouse_id:
+        stocks = stocks.filter(warehouse_id=warehouse_id)
+
+    result = {product_id: [] for product_id in product_ids}
+    rows = stocks.order_by('warehouse__name').values_list(
+        'product_id', 'warehouse_id', 'warehouse__name', 'quantity'
+    )
+    for product_id, stock_warehouse_id, warehouse_name, quantity in rows:
+        result[product_id].append({
+            'warehouse_id': stock_warehouse_id, 'warehouse': warehouse_name, 'quantity': quantity,
+        })
+    return result
+
+
+def lookup_codes(codes, warehouse_id=None):
+    """
+    تحويل رموز ممسوحة (باركود أو رمز منتج) إلى بيانات المنتجات ومخزونها
+
+    المعلمات:
+    codes (list): الرموز الممسوحة
+    warehouse_id (int): حصر المخزون في مخزن معين (اختياري، الافتراضي كل المخازن)
+
+    تُرجع: قاموس {الرمز: بيانات المنتج مع stock و total_stock، أو None إذا لم يوجد}
+    """
+    codes = _clean_codes(codes)
+    if not codes:
+        return {}
+
+    _cache.sync(cache.get(CACHE_GENERATION_KEY, 0))
+    maxsize = getattr(settings, 'PRODUCT_LOOKUP_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+    max_age = getattr(settings, 'PRODUCT_LOOKUP_CACHE_MAX_AGE', DEFAULT_CACHE_MAX_AGE)
+
+    found, missing = {}, []
+    for code in codes:
+        payload = _cache.get(code, max_age)
+        if payload is None:
+            missing.append(code)
+        else:
+            found[code] = payload
+
+    if missing:
+        loaded = _load_products(missing)
+        for code, payload in loaded.items():
+            _cache.set(code, payload, maxsize)
+        found.update(loaded)
+
+    stocks = _stock_by_product({payload['id'] for payload in found.values()}, warehouse_id)
+    results = {}
+    for code in codes:
+        payload = found.get(code)
+        if payload is None:
+            results[code] = None
+            continue
+        product_stock = stocks[payload['id']]
+        results[code] = {
+            **payload,
+            'stock': product_stock,
+            'total_stock': sum(row['quantity'] for row in product_stock),
+        }
+    return results
+
+
+def lookup_code(code, warehouse_id=None):
+    """
+    بيانات منتج برمز واحد (باركود أو رمز منتج)، أو None
+    """
+    return lookup_codes([code], warehouse_id).get(str(code or '').strip())
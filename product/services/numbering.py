@@ -0,0 +1,281 @@
+"""
+خدمة ترقيم المستندات
+
+تخصص أرقام المستندات (المبيعات، المشتريات، المرتجعات، حركات المخزون) من
+عداد ذري في جدول الأرقام التسلسلية بدلاً من البحث عن آخر رقم مستخدم في
+جدول المستندات عند كل حفظ.
+
+يدعم وضعين:
+- بدون فجوات: يتم حجز الرقم داخل معاملة المستند نفسها، فيبقى سجل العداد
+  مقفلاً حتى انتهاء المعاملة ويعود الرقم عند التراجع عنها.
+- بفجوات مسموحة: يحجز كل عامل مجموعة من الأرقام دفعة واحدة ويوزعها من
+  الذاكرة، وقد تضيع بعض الأرقام عند إعادة تشغيل العامل.
+"""
+import threading
+import weakref
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from product.models import SerialNumber
+
+# البادئة الافتراضية لكل نوع مستند
+DEFAULT_PREFIXES = {
+    'sale': 'SALE',
+    'purchase': 'PUR',
+    'sale_return': 'SRET',
+    'purchase_return': 'PRET',
+    'stock_movement': 'MOV',
+}
+
+# النموذج الذي يحمل أرقام كل نوع مستند (لتهيئة العداد من البيانات الموجودة)
+DOCUMENT_MODELS = {
+    'sale': 'sale.Sale',
+    'purchase': 'purchase.Purchase',
+    'sale_return': 'sale.SaleReturn',
+    'purchase_return': 'purchase.PurchaseReturn',
+    'stock_movement': 'product.StockMovement',
+}
+
+# عدد الأرقام التي يحجزها العامل في المرة الواحدة في الوضع الذي يسمح بالفجوات
+DEFAULT_BLOCK_SIZE = 50
+
+# أنواع المستندات التي يجب ترقيمها بدون فجوات
+DEFAULT_GAPLESS_TYPES = ('sale', 'purchase', 'sale_return', 'purchase_return')
+
+_local = threading.local()
+
+
+class _NumberBlock:
+    """
+    مجموعة أرقام محجوزة لدى العامل الحالي
+    """
+
+    def __init__(self, first, last):
+        self.next = first
+        self.last = last
+        self.confirmed = False
+        self.pending = None
+
+
+class _BlockConfirmation:
+    """
+    تأكيد مجموعة محجوزة داخل معاملة، يُسجل في transaction.on_commit
+
+    المعاملة وحدها تحتفظ بهذا الكائن حتى تأكيدها، وتتخلص منه إذا أُلغيت هي
+    أو نقطة الحفظ التي حُجزت فيها المجموعة، فيبقى المرجع الضعيف إليه في
+    المجموعة حياً فقط طالما الحجز قائم في المعاملة الحالية.
+    """
+
+    def __init__(self, block):
+        self.block = block
+        block.pending = weakref.ref(self)
+
+    def __call__(self):
+        self.block.confirmed = True
+
+
+def _block_size():
+    return getattr(settings, 'DOCUMENT_NUMBER_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
+
+
+def is_gapless(document_type):
+    """
+    هل يجب ترقيم نوع المستند بدون فجوات
+    """
+    return document_type in getattr(settings, 'DOCUMENT_NUMBER_GAPLESS_TYPES', DEFAULT_GAPLESS_TYPES)
+
+
+def format_number(prefix, number):
+    """
+    تنسيق رقم المستند بالبادئة
+    """
+    return f"{prefix}{number:04d}"
+
+
+def _sequence_key(document_type, prefix, year):
+    if prefix is None:
+        prefix = DEFAULT_PREFIXES.get(document_type, '')
+    if year is None:
+        year = timezone.now().year
+    return document_type, prefix, year
+
+
+def _seed_number(document_type, prefix):
+    """
+    أعلى رقم مستخدم حالياً بنفس البادئة (يُحسب مرة واحدة عند إنشاء العداد)
+    """
+    model_label = DOCUMENT_MODELS.get(document_type)
+    if not model_label or not prefix:
+        return 0
+
+    model = apps.get_model(model_label)
+    # الترتيب حسب الطول ثم القيمة يعطي أكبر رقم حتى لو تجاوز عدد الخانات الأربع
+    last_number = model.objects.filter(
+        number__startswith=prefix
+    ).order_by(Length('number').desc(), '-number').values_list('number', flat=True).first()
+
+    if last_number:
+        try:
+            return int(last_number[len(prefix):])
+        except ValueError:
+            return 0
+    return 0
+
+
+def _sequence_id(key):
+    """
+    معرف سجل العداد الخاص بالتسلسل (مع التخزين المؤقت داخل العامل)
+    """
+    cache = getattr(_local, 'sequence_ids', None)
+    if cache is None:
+        cache = _local.sequence_ids = {}
+
+    if key not in cache:
+        document_type, prefix, year = key
+        sequence = SerialNumber.objects.filter(
+            document_type=document_type, prefix=prefix, year=year
+        ).only('pk').first()
+        if sequence is None:
+            sequence, _ = SerialNumber.objects.get_or_create(
+                document_type=document_type,
+                prefix=prefix,
+                year=year,
+                defaults={'last_number': _seed_number(document_type, prefix)}
+            )
+        cache[key] = sequence.pk
+    return cache[key]
+
+
+def _advance(key, count):
+    """
+    زيادة عداد التسلسل ذرياً بمقدار count وإرجاع آخر رقم محجوز
+
+    سجل العداد يبقى مقفلاً من عبارة UPDATE حتى نهاية المعاملة الحالية.
+    """
+    with transaction.atomic(savepoint=False):
+        sequence_id = _sequence_id(key)
+        updated = SerialNumber.objects.filter(pk=sequence_id).update(last_number=F('last_number') + count)
+        if not updated:
+            # سجل العداد المخزن مؤقتاً لم يعد موجوداً (حُذف أو تم التراجع عن إنشائه)
+            _local.sequence_ids.pop(key, None)
+            sequence_id = _sequence_id(key)
+            SerialNumber.objects.filter(pk=sequence_id).update(last_number=F('last_number') + count)
+        return SerialNumber.objects.filter(pk=sequence_id).values_list('last_number', flat=True).get()
+
+
+def _block_usable(block):
+    """
+    هل يمكن استخدام المجموعة المحجوزة
+
+    المجموعة المحجوزة داخل معاملة لم تُؤكد بعد صالحة فقط داخل نفس المعاملة،
+    لأن التراجع عن المعاملة يعيد العداد إلى قيمته السابقة.
+    """
+    if block.next > block.last:
+        return False
+    if block.confirmed:
+        return True
+    return connection.in_atomic_block and block.pending is not None and block.pending() is not None
+
+
+def _take_from_block(key):
+    blocks = getattr(_local, 'blocks', None)
+    if blocks is None:
+        blocks = _local.blocks = {}
+
+    block = blocks.get(key)
+    if block is None or not _block_usable(block):
+        size = _block_size()
+        last = _advance(key, size)
+        block = blocks[key] = _NumberBlock(last - size + 1, last)
+        # المجموعة تصبح متاحة لكل المعاملات اللاحقة بعد تأكيد المعاملة الحالية
+        transaction.on_commit(_BlockConfirmation(block))
+
+    number = block.next
+    block.next += 1
+    return number
+
+
+def next_value(document_type, prefix=None, year=None):
+    """
+    حجز الرقم التالي في التسلسل وإرجاعه كعدد صحيح
+
+    المعلمات:
+    document_type (str): نوع المستند
+    prefix (str): بادئة الرقم (الافتراضية حسب نوع المستند)
+    year (int): سنة التسلسل (الافتراضية السنة الحالية)
+
+    تُرجع: العدد التالي في التسلسل
+    """
+    key = _sequence_key(document_type, prefix, year)
+    if is_gapless(document_type) or _block_size() <= 1:
+        return _advance(key, 1)
+    return _take_from_block(key)
+
+
+def allocate_number(document_type, prefix=None, year=None):
+    """
+    حجز رقم المستند التالي منسقاً بالبادئة (مثل SALE0001)
+
+    يجب استدعاؤها داخل معاملة المستند حتى يعود الرقم عند التراجع في وضع
+    الترقيم بدون فجوات.
+    """
+    document_type, prefix, year = _sequence_key(document_type, prefix, year)
+    return format_number(prefix, next_value(document_type, prefix, year))
+
+
+def allocate_numbers(document_type, count, prefix=None, year=None):
+    """
+    حجز عدة أرقام متتالية لنوع مستند بعملية واحدة على العداد
+
+    في وضع الفجوات المسموحة تُستخدم الأرقام المتبقية في مجموعة العامل أولاً،
+    ثم يُحجز الباقي دفعة واحدة من العداد.
+
+    المعلمات:
+    document_type (str): نوع المستند
+    count (int): عدد الأرقام المطلوبة
+
+    تُرجع: قائمة الأرقام منسقة بالبادئة
+    """
+    document_type, prefix, year = key = _sequence_key(document_type, prefix, year)
+    if count <= 0:
+        return []
+
+    values = []
+    if not is_gapless(document_type) and _block_size() > 1:
+        block = getattr(_local, 'blocks', {}).get(key)
+        while block is not None and len(values) < count and _block_usable(block):
+            values.append(block.next)
+            block.next += 1
+
+    remaining = count - len(values)
+    if remaining:
+        last = _advance(key, remaining)
+        values.extend(range(last - remaining + 1, last + 1))
+
+    return [format_number(prefix, value) for value in values]
+
+
+def peek_number(document_type, prefix=None, year=None):
+    """
+    الرقم المتوقع للمستند التالي للعرض فقط (لا يتم حجزه)
+    """
+    document_type, prefix, year = _sequence_key(document_type, prefix, year)
+    last_number = SerialNumber.objects.filter(
+        document_type=document_type, prefix=prefix, year=year
+    ).values_list('last_number', flat=True).first()
+    if last_number is None:
+        last_number = _seed_number(document_type, prefix)
+    return format_number(prefix, last_number + 1)
+
+
+def reset_local_cache():
+    """
+    مسح الأرقام والمعرفات المخزنة لدى العامل الحالي
+    """
+    _local.sequence_ids = {}
+    _local.blocks = {}
@@ -0,0 +1,229 @@
+"""
+خدمة البحث في المنتجات
+
+يُحفظ لكل منتج نص بحث موحد (ProductSearchIndex) من الاسم والرمز والباركود
+والعلامة التجارية والفئة بعد توحيد النص العربي (normalize_arabic)، ويُحدث
+من إشارات حفظ المنتج والفئة والعلامة التجارية.
+
+محرك البحث حسب قاعدة البيانات:
+- SQLite: جدول FTS5 افتراضي (product_search_fts) بنفس النص ومعرف المنتج
+  كـ rowid، والبحث بمطابقة بادئات الكلمات مرتباً بـ bm25
+- غير ذلك: LIKE على نص البحث الموحد لكل كلمة (مع فهرس trigram على
+  PostgreSQL)، مرتباً بمطابقة بداية الاسم ثم الاسم
+
+الاستيراد الجماعي (utils.importers.bulk_upsert) لا يرسل إشارات الحفظ، فتُفهرس
+المنتجات المستوردة عند الإشارة bulk_imported، والفهرس يُعاد بناؤه بالكامل
+بالأمر rebuild_product_search.
+"""
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+from product.models import Product, ProductSearchIndex
+from utils.helpers import normalize_arabic
+
+# جدول FTS5 الافتراضي (يُنشأ في الترحيل على SQLite فقط)
+FTS_TABLE = 'product_search_fts'
+
+# حجم الصفحة الافتراضي والأقصى لنتائج البحث
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+# عدد المنتجات في كل دفعة فهرسة
+INDEX_BATCH_SIZE = 500
+
+# صفحة نتائج بحث: المنتجات مرتبة حسب الصلة
+SearchPage = namedtuple('SearchPage', ['products', 'total', 'page', 'page_size', 'has_next'])
+
+_fts_tables = {}
+
+
+def fts_enabled():
+    """
+    هل جدول FTS5 موجود في قاعدة البيانات الحالية
+    """
+    if connection.vendor != 'sqlite':
+        return False
+    key = (connection.alias, str(connection.settings_dict['NAME']))
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            _fts_tables[key] = cursor.fetchone() is not None
+    return _fts_tables[key]
+
+
+def product_document(product):
+    """
+    نص البحث الموحد لمنتج (يتطلب تحميل الفئة والعلامة التجارية)
+    """
+    parts = [
+        product.name,
+        product.sku,
+        product.barcode,
+        product.brand.name if product.brand_id else '',
+        product.category.name if product.category_id else '',
+    ]
+    text = normalize_arabic(' '.join(part for part in parts if part))
+    # الكلمات المعرفة تُفهرس أيضاً بدون "ال" حتى تطابق البحث ببداية الكلمة
+    stems = [word[2:] for word in text.split() if word.startswith('ال') and len(word) > 4]
+    return ' '.join([text] + stems)
+
+
+def index_products(product_ids):
+    """
+    تحديث نص البحث لمجموعة منتجات بعدد ثابت من الاستعلامات لكل دفعة
+
+    المعلمات:
+    product_ids (list): معرفات المنتجات (المحذوفة تُزال من الفهرس)
+    """
+    product_ids = list(product_ids)
+    for start in range(0, len(product_ids), INDEX_BATCH_SIZE):
+        batch = product_ids[start:start + INDEX_BATCH_SIZE]
+        products = Product.objects.filter(pk__in=batch).select_related('brand', 'category').only(
+            'pk', 'name', 'sku', 'barcode', 'brand__name', 'category__name',
+        )
+        rows = [
+            ProductSearchIndex(
+                product_id=product.pk,
+                name=normalize_arabic(product.name)[:255],
+                document=product_document(product),
+            )
+            for product in products
+        ]
+
+        unique_fields = ['product'] if connection.features.supports_update_conflicts_with_target else None
+        ProductSearchIndex.objects.bulk_create(
+            rows, update_conflicts=True, unique_fields=unique_fields, update_fields=['name', 'document'],
+        )
+        indexed = {row.product_id for row in rows}
+        missing = [pk for pk in batch if pk not in indexed]
+        if missing:
+            ProductSearchIndex.objects.filter(product_id__in=missing).delete()
+
+        if fts_enabled():
+            table = connection.ops.quote_name(FTS_TABLE)
+            with connection.cursor() as cursor:
+                placeholders = ', '.join(['%s'] * len(batch))
+                cursor.execute(f"DELETE FROM {table} WHERE rowid IN ({placeholders})", batch)
+                cursor.executemany(
+                    f"INSERT INTO {table} (rowid, document) VALUES (%s, %s)",
+                    [(row.product_id, row.document) for row in rows],
+                )
+
+
+def remove_products(product_ids):
+    """
+    إزالة منتجات محذوفة من جدول FTS5 (سجلات ProductSearchIndex تُحذف مع المنتج)
+    """
+    product_ids = list(product_ids)
+    if product_ids and fts_enabled():
+        table = connection.ops.quote_name(FTS_TABLE)
+        placeholders = ', '.join(['%s'] * len(product_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {table} WHERE rowid IN ({placeholders})", product_ids)
+
+
+def rebuild_index():
+    """
+    إعادة بناء فهرس البحث لكل المنتجات
+
+    تُرجع: عدد المنتجات المفهرسة
+    """
+    product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+    ProductSearchIndex.objects.exclude(product_id__in=product_ids).delete()
+    if fts_enabled():
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {connection.ops.quote_name(FTS_TABLE)}")
+    index_products(product_ids)
+    return len(product_ids)
+
+
+def _tokens(query):
+    return normalize_arabic(query).split()
+
+
+def _match_expression(tokens):
+    # كل كلمة كبادئة بين علامتي تنصيص (تُضاعف علامات التنصيص داخلها)
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+
+def matching_products(query):
+    """
+    فلتر المنتجات المطابقة لنص بحث (بدون ترتيب) لاستخدامه مع QuerySet المنتجات
+
+    تُرجع: كائن Q على معرف المنتج
+    """
+    tokens = _tokens(query)
+    if not tokens:
+        return Q()
+    if fts_enabled():
+        table = connection.ops.quote_name(FTS_TABLE)
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [_match_expression(tokens)]))
+    return Q(pk__in=_fallback_index(tokens).values('product_id'))
+
+
+def _fallback_index(tokens):
+    index = ProductSearchIndex.objects.all()
+    for token in tokens:
+        index = index.filter(document__contains=token)
+    return index
+
+
+def _ranked_ids_fts(tokens, offset, limit, active_only):
+    table = connection.ops.quote_name(FTS_TABLE)
+    products = connection.ops.quote_name(Product._meta.db_table)
+    where = f"{table} MATCH %s" + (f" AND {products}.is_active" if active_only else '')
+    params = [_match_expression(tokens)]
+    join = f"FROM {table} JOIN {products} ON {products}.id = {table}.rowid WHERE {where}"
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) {join}", params)
+        total = cursor.fetchone()[0]
+        cursor.execute(
+            f"SELECT {table}.rowid {join} ORDER BY bm25({table}), {products}.name LIMIT %s OFFSET %s",
+            params + [limit, offset],
+        )
+        return [row[0] for row in cursor.fetchall()], total
+
+
+def _ranked_ids_fallback(tokens, offset, limit, active_only):
+    phrase = ' '.join(tokens)
+    index = _fallback_index(tokens)
+    if active_only:
+        index = index.filter(product__is_active=True)
+    ranked = index.annotate(rank=Case(
+        When(name__startswith=phrase, then=Value(0)),
+        When(name__contains=phrase, then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    )).order_by('rank', 'name', 'product_id')
+    return list(ranked.values_list('product_id', flat=True)[offset:offset + limit]), index.count()
+
+
+def search_products(query, page=1, page_size=DEFAULT_PAGE_SIZE, active_only=True):
+    """
+    البحث في المنتجات مرتباً حسب الصلة مع ترقيم الصفحات
+
+    المعلمات:
+    query (str): نص البحث (الاسم أو الرمز أو الباركود أو العلامة التجارية أو الفئة)
+    page (int): رقم الصفحة (يبدأ من 1)
+    page_size (int): عدد النتائج في الصفحة (بحد أقصى MAX_PAGE_SIZE)
+    active_only (bool): المنتجات النشطة فقط
+
+    تُرجع: SearchPage
+    """
+    page = max(int(page or 1), 1)
+    page_size = min(max(int(page_size or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    tokens = _tokens(query)
+    if not tokens:
+        return SearchPage([], 0, page, page_size, False)
+
+    offset = (page - 1) * page_size
+    ranked_ids = _ranked_ids_fts if fts_enabled() else _ranked_ids_fallback
+    ids, total = ranked_ids(tokens, offset, page_size, active_only)
+
+    products = Product.objects.select_related('category', 'brand', 'unit').in_bulk(ids)
+    return SearchPage(
+        [products[pk] for pk in ids if pk in products], total, page, page_size, offset + len(ids) < total,
+    )
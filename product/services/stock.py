@@ -0,0 +1,488 @@
+"""
+خدمة ترحيل حركات المخزون
+
+تطبق تأثير حركات المخزون على جدول المخزون بعبارات UPDATE شرطية ذرية
+بدلاً من قراءة الكمية في بايثون وتعديلها ثم حفظها، حتى لا تضيع التحديثات
+عند تزامن عمليات البيع من أكثر من نقطة بيع.
+
+مع كل تغيير في كمية مخزن يُحدث إجمالي مخزون المنتج (Product.total_stock)
+بفرق الكمية في نفس المعاملة، ويمكن مطابقته مع مجموع المخزون بـ
+verify_total_stock و rebuild_total_stock.
+
+وتُقيم الحركات في نفس المعاملة بعد ترحيل كمياتها (خدمة valuation)، فتُحدث
+قيمة المخزون وتُملأ تكلفة الوحدة في كل حركة.
+"""
+import logging
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models import Case, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from core.dashboard_stats import mark_stale
+from product.models import Product, Stock, StockMovement
+
+logger = logging.getLogger(__name__)
+
+# أنواع الحركات التي تضيف إلى مخزون المخزن
+INBOUND_MOVEMENTS = ('in', 'return_in', 'transfer_in')
+
+# أنواع الحركات التي تخصم من مخزون المخزن (مع عدم النزول تحت الصفر)
+OUTBOUND_MOVEMENTS = ('out', 'return_out', 'transfer')
+
+# الحد الأقصى لعدد السجلات في عبارة UPDATE واحدة عند الترحيل الجماعي
+BULK_UPDATE_BATCH_SIZE = 300
+
+# نتيجة ترحيل واحد على سجل مخزون
+StockPosting = namedtuple('StockPosting', ['quantity_before', 'quantity_after'])
+
+
+def _supports_update_returning():
+    """
+    هل تدعم قاعدة البيانات الحالية عبارة UPDATE ... RETURNING
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def _update_stock_row(product_id, warehouse_id, set_sql, set_params, where_sql='', where_params=()):
+    """
+    تنفيذ عبارة UPDATE واحدة على سجل المخزون وإرجاع الكمية بعد التحديث
+
+    تُرجع: الكمية الجديدة، أو None إذا لم يطابق الشرط أي سجل
+    """
+    table = connection.ops.quote_name(Stock._meta.db_table)
+    sql = (
+        f"UPDATE {table} SET quantity = {set_sql}, updated_at = %s "
+        f"WHERE product_id = %s AND warehouse_id = %s{where_sql}"
+    )
+    params = [
+        *set_params,
+        connection.ops.adapt_datetimefield_value(timezone.now()),
+        product_id,
+        warehouse_id,
+        *where_params,
+    ]
+
+    with connection.cursor() as cursor:
+        if _supports_update_returning():
+            cursor.execute(f"{sql} RETURNING quantity", params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+        cursor.execute(sql, params)
+        if cursor.rowcount == 0:
+            return None
+
+    # السجل مقفل من عبارة UPDATE السابقة حتى نهاية المعاملة، لذا القراءة هنا متسقة
+    return Stock.objects.filter(
+        product_id=product_id, warehouse_id=warehouse_id
+    ).values_list('quantity', flat=True).first()
+
+
+def _ensure_stock_row(product_id, warehouse_id):
+    """
+    إنشاء سجل المخزون بكمية صفر إذا لم يكن موجوداً
+    """
+    Stock.objects.get_or_create(
+        product_id=product_id,
+        warehouse_id=warehouse_id,
+        defaults={'quantity': 0}
+    )
+
+
+def _locked_quantity(product_id, warehouse_id):
+    """
+    قراءة كمية المخزون مع قفل السجل (للمسارات الاستثنائية فقط)
+    """
+    _ensure_stock_row(product_id, warehouse_id)
+    return Stock.objects.select_for_update().filter(
+        product_id=product_id, warehouse_id=warehouse_id
+    ).values_list('quantity', flat=True).get()
+
+
+def _adjust_total_stock(product_id, delta):
+    """
+    تطبيق فرق الكمية على إجمالي مخزون المنتج بعبارة UPDATE واحدة
+    """
+    if delta:
+        Product.objects.filter(pk=product_id).update(total_stock=F('total_stock') + delta)
+
+
+def _increase_stock(product_id, warehouse_id, quantity):
+    quantity = int(quantity)
+    with transaction.atomic(savepoint=False):
+        after = _update_stock_row(product_id, warehouse_id, 'quantity + %s', [quantity])
+        if after is None:
+            _ensure_stock_row(product_id, warehouse_id)
+            after = _update_stock_row(product_id, warehouse_id, 'quantity + %s', [quantity])
+        _adjust_total_stock(product_id, quantity)
+    return StockPosting(after - quantity, after)
+
+
+def _decrease_stock(product_id, warehouse_id, quantity):
+    # المسار السريع عبارة واحدة مشروطة بكفاية الرصيد، وعند عدم الكفاية
+    # يتم تصفير الرصيد بعد قفل السجل لمعرفة الكمية السابقة بدقة
+    quantity = int(quantity)
+    with transaction.atomic(savepoint=False):
+        after = _update_stock_row(
+            product_id, warehouse_id, 'quantity - %s', [quantity],
+            where_sql=' AND quantity >= %s', where_params=[quantity]
+        )
+        if after is not None:
+            _adjust_total_stock(product_id, -quantity)
+            return StockPosting(after + quantity, after)
+
+        # الرصيد غير كافٍ (أو السجل غير موجود): تصفير الرصيد
+        before = _locked_quantity(product_id, warehouse_id)
+        after = _update_stock_row(product_id, warehouse_id, '%s', [0])
+        _adjust_total_stock(product_id, after - before)
+        logger.warning(
+            'Stock floored at zero for product %s in warehouse %s (requested %s, available %s)',
+            product_id, warehouse_id, quantity, before
+        )
+    return StockPosting(before, after)
+
+
+def _set_stock(product_id, warehouse_id, quantity):
+    quantity = int(quantity)
+    with transaction.atomic(savepoint=False):
+        before = _locked_quantity(product_id, warehouse_id)
+        after = _update_stock_row(product_id, warehouse_id, '%s', [quantity])
+        _adjust_total_stock(product_id, after - before)
+    return StockPosting(before, after)
+
+
+def _mark_inventory_stale():
+    # الكميات تتغير دون إشارات، لذا تُعلم إحصائيات المخزون كقديمة مرة واحدة لكل عملية ترحيل
+    mark_stale('inventory')
+
+
+def increase_stock(product_id, warehouse_id, quantity):
+    """
+    إضافة كمية إلى المخزون بعبارة UPDATE ذرية
+
+    المعلمات:
+    product_id (int): معرف المنتج
+    warehouse_id (int): معرف المخزن
+    quantity (int): الكمية المضافة
+
+    تُرجع: StockPosting بالكمية قبل وبعد
+    """
+    with transaction.atomic(savepoint=False):
+        _mark_inventory_stale()
+        return _increase_stock(product_id, warehouse_id, quantity)
+
+
+def decrease_stock(product_id, warehouse_id, quantity):
+    """
+    خصم كمية من المخزون بعبارة UPDATE شرطية ذرية، مع عدم النزول تحت الصفر
+
+    المعلمات:
+    product_id (int): معرف المنتج
+    warehouse_id (int): معرف المخزن
+    quantity (int): الكمية المخصومة
+
+    تُرجع: StockPosting بالكمية قبل وبعد
+    """
+    with transaction.atomic(savepoint=False):
+        _mark_inventory_stale()
+        return _decrease_stock(product_id, warehouse_id, quantity)
+
+
+def set_stock(product_id, warehouse_id, quantity):
+    """
+    تعيين كمية مطلقة للمخزون (تسوية الجرد)
+
+    تُرجع: StockPosting بالكمية قبل وبعد
+    """
+    with transaction.atomic(savepoint=False):
+        _mark_inventory_stale()
+        return _set_stock(product_id, warehouse_id, quantity)
+
+
+def post_movement(movement):
+    """
+    ترحيل حركة مخزون جديدة على أرصدة المخزون
+
+    تملأ الحقول quantity_before و quantity_after من السجل المحدث و unit_cost
+    من تقييم الحركة دون حفظ الحركة نفسها.
+
+    المعلمات:
+    movement (StockMovement): الحركة المراد ترحيلها
+
+    تُرجع: StockPosting للمخزن المستلم في حالة التحويل، وإلا None
+    """
+    product_id = movement.product_id
+    warehouse_id = movement.warehouse_id
+    destination_posting = None
+
+    with transaction.atomic(savepoint=False):
+        _mark_inventory_stale()
+        if movement.movement_type in INBOUND_MOVEMENTS:
+            posting = _increase_stock(product_id, warehouse_id, movement.quantity)
+        elif movement.movement_type in OUTBOUND_MOVEMENTS:
+            posting = _decrease_stock(product_id, warehouse_id, movement.quantity)
+            if movement.movement_type == 'transfer' and movement.destination_warehouse_id:
+                destination_posting = _increase_stock(
+                    product_id, movement.destination_warehouse_id, movement.quantity
+                )
+        elif movement.movement_type == 'adjustment':
+            posting = _set_stock(product_id, warehouse_id, movement.quantity)
+        else:
+            return None
+
+        movement.quantity_before = posting.quantity_before
+        movement.quantity_after = posting.quantity_after
+
+        from product.services.valuation import value_movements
+        quantities = {(product_id, warehouse_id): posting.quantity_before}
+        if destination_posting is not None:
+            quantities[(product_id, movement.destination_warehouse_id)] = destination_posting.quantity_before
+        value_movements([movement], quantities)
+    return destination_posting
+
+
+def reverse_movement(movement):
+    """
+    إلغاء تأثير حركة مخزون محذوفة على أرصدة المخزون
+
+    حركات التسوية لا تُعكس لأنها تعين كمية مطلقة.
+    """
+    product_id = movement.product_id
+    warehouse_id = movement.warehouse_id
+    quantities = {}
+
+    with transaction.atomic(savepoint=False):
+        _mark_inventory_stale()
+        if movement.movement_type in INBOUND_MOVEMENTS:
+            posting = _decrease_stock(product_id, warehouse_id, movement.quantity)
+        elif movement.movement_type in OUTBOUND_MOVEMENTS:
+            posting = _increase_stock(product_id, warehouse_id, movement.quantity)
+            if movement.movement_type == 'transfer' and movement.destination_warehouse_id:
+                destination_posting = _decrease_stock(product_id, movement.destination_warehouse_id, movement.quantity)
+                quantities[(product_id, movement.destination_warehouse_id)] = destination_posting.quantity_before
+        else:
+            return
+        quantities[(product_id, warehouse_id)] = posting.quantity_before
+
+        from product.services.valuation import value_reversal
+        value_reversal(movement, quantities)
+
+
+def _lock_stock_rows(keys):
+    """
+    قراءة كميات مجموعة سجلات مخزون مع قفلها، وإنشاء السجلات الناقصة بكمية صفر
+
+    تُرجع: قاموس {(المنتج، المخزن): [معرف السجل، الكمية، القيمة]}
+    """
+    product_ids = {product_id for product_id, _ in keys}
+    warehouse_ids = {warehouse_id for _, warehouse_id in keys}
+
+    def read():
+        rows = Stock.objects.select_for_update().filter(
+            product_id__in=product_ids, warehouse_id__in=warehouse_ids
+        ).values_list('pk', 'product_id', 'warehouse_id', 'quantity', 'total_value')
+        return {
+            (product_id, warehouse_id): [pk, quantity, total_value]
+            for pk, product_id, warehouse_id, quantity, total_value in rows
+            if (product_id, warehouse_id) in keys
+        }
+
+    rows = read()
+    missing = keys - set(rows)
+    if missing:
+        Stock.objects.bulk_create(
+            [Stock(product_id=product_id, warehouse_id=warehouse_id, quantity=0) for product_id, warehouse_id in missing],
+            ignore_conflicts=True,
+        )
+        rows = read()
+    return rows
+
+
+def _write_quantities(rows, changed):
+    """
+    كتابة الكميات والقيم الجديدة لعدة سجلات مخزون بعبارة UPDATE واحدة لكل دفعة
+    """
+    changed = list(changed)
+    if changed:
+        mark_stale('inventory')
+    now = timezone.now()
+    for start in range(0, len(changed), BULK_UPDATE_BATCH_SIZE):
+        batch = changed[start:start + BULK_UPDATE_BATCH_SIZE]
+        Stock.objects.filter(pk__in=[rows[key][0] for key in batch]).update(
+            quantity=Case(
+                *[When(pk=rows[key][0], then=Value(rows[key][1])) for key in batch],
+                output_field=IntegerField(),
+            ),
+            total_value=Case(
+                *[When(pk=rows[key][0], then=Value(rows[key][2])) for key in batch],
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            ),
+            updated_at=now,
+        )
+
+
+def _write_total_stock_deltas(deltas):
+    """
+    تطبيق فروق الكميات على إجمالي مخزون عدة منتجات بعبارة UPDATE واحدة لكل دفعة
+
+    المعلمات:
+    deltas (dict): {معرف المنتج: فرق الكمية}
+    """
+    changed = [product_id for product_id, delta in deltas.items() if delta]
+    for start in range(0, len(changed), BULK_UPDATE_BATCH_SIZE):
+        batch = changed[start:start + BULK_UPDATE_BATCH_SIZE]
+        Product.objects.filter(pk__in=batch).update(
+            total_stock=F('total_stock') + Case(
+                *[When(pk=product_id, then=Value(deltas[product_id])) for product_id in batch],
+                output_field=IntegerField(),
+            ),
+        )
+
+
+def post_movements(movements):
+    """
+    ترحيل مجموعة حركات مخزون جديدة بعدد ثابت من الاستعلامات
+
+    يتم قفل وقراءة كل سجلات المخزون المتأثرة باستعلام واحد، ثم حساب تأثير
+    الحركات بالترتيب في الذاكرة (مع عدم النزول تحت الصفر)، ثم كتابة الكميات
+    النهائية بعبارة UPDATE واحدة، ثم تقييم الحركات. تملأ quantity_before
+    و quantity_after و unit_cost لكل حركة دون حفظها.
+
+    المعلمات:
+    movements (list): حركات StockMovement غير محفوظة
+    """
+    keys = set()
+    for movement in movements:
+        keys.add((movement.product_id, movement.warehouse_id))
+        if movement.movement_type == 'transfer' and movement.destination_warehouse_id:
+            keys.add((movement.product_id, movement.destination_warehouse_id))
+    if not keys:
+        return
+
+    with transaction.atomic(savepoint=False):
+        rows = _lock_stock_rows(keys)
+        original = {key: row[1] for key, row in rows.items()}
+        changed = set()
+
+        def apply(key, quantity, mode):
+            before = rows[key][1]
+            if mode == 'in':
+                after = before + quantity
+            elif mode == 'out':
+                after = max(0, before - quantity)
+                if before < quantity:
+                    logger.warning(
+                        'Stock floored at zero for product %s in warehouse %s (requested %s, available %s)',
+                        key[0], key[1], quantity, before
+                    )
+            else:
+                after = quantity
+            rows[key][1] = after
+            changed.add(key)
+            return StockPosting(before, after)
+
+        for movement in movements:
+            key = (movement.product_id, movement.warehouse_id)
+            quantity = int(movement.quantity)
+            if movement.movement_type in INBOUND_MOVEMENTS:
+                posting = apply(key, quantity, 'in')
+            elif movement.movement_type in OUTBOUND_MOVEMENTS:
+                posting = apply(key, quantity, 'out')
+                if movement.movement_type == 'transfer' and movement.destination_warehouse_id:
+                    apply((movement.product_id, movement.destination_warehouse_id), quantity, 'in')
+            elif movement.movement_type == 'adjustment':
+                posting = apply(key, quantity, 'set')
+            else:
+                continue
+            movement.quantity_before = posting.quantity_before
+            movement.quantity_after = posting.quantity_after
+
+        from product.services.valuation import value_movements
+        values = value_movements(
+            movements,
+            {key: original[key] for key in changed},
+            {key: (rows[key][0], rows[key][2]) for key in changed},
+        )
+        for key, value in values.items():
+            rows[key][2] = value
+
+        _write_quantities(rows, changed)
+
+        deltas = {}
+        for key in changed:
+            deltas[key[0]] = deltas.get(key[0], 0) + rows[key][1] - original[key]
+        _write_total_stock_deltas(deltas)
+
+
+def create_movements(movements):
+    """
+    إنشاء وترحيل مجموعة حركات مخزون دفعة واحدة
+
+    بديل جماعي لحفظ كل حركة على حدة: ترقيم الحركات بحجز واحد من العداد،
+    ثم ترحيلها بـ post_movements، ثم إنشاؤها بـ bulk_create.
+
+    المعلمات:
+    movements (list): حركات StockMovement غير محفوظة
+
+    تُرجع: قائمة الحركات بعد الحفظ
+    """
+    if not movements:
+        return []
+
+    from product.services.numbering import allocate_numbers
+
+    with transaction.atomic():
+        unnumbered = [movement for movement in movements if not movement.number]
+        for movement, number in zip(unnumbered, allocate_numbers('stock_movement', len(unnumbered))):
+            movement.number = number
+
+        post_movements([movement for movement in movements if not movement._skip_update])
+        return StockMovement.objects.bulk_create(movements)
+
+
+def _total_stock_subquery():
+    totals = (
+        Stock.objects
+        .filter(product_id=OuterRef('pk'))
+        .order_by()
+        .values('product_id')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals, output_field=IntegerField()), Value(0), output_field=IntegerField())
+
+
+def verify_total_stock(product_ids=None):
+    """
+    مقارنة إجمالي مخزون المنتجات بمجموع كمياتها في المخازن
+
+    المعلمات:
+    product_ids (list): معرفات محددة (اختياري، الافتراضي الكل)
+
+    تُرجع: قائمة (المعرف، الإجمالي المخزن، مجموع المخازن) للمنتجات غير المتطابقة
+    """
+    products = Product.objects.all()
+    if product_ids:
+        products = products.filter(pk__in=product_ids)
+    rows = products.order_by('pk').annotate(stock_sum=_total_stock_subquery()).values_list(
+        'pk', 'total_stock', 'stock_sum'
+    )
+    return [(pk, total, stock_sum) for pk, total, stock_sum in rows if total != stock_sum]
+
+
+def rebuild_total_stock(product_ids=None):
+    """
+    إعادة حساب إجمالي مخزون المنتجات من المخازن بعبارة UPDATE واحدة
+
+    تُرجع: عدد المنتجات المحدثة
+    """
+    products = Product.objects.all()
+    if product_ids:
+        products = products.filter(pk__in=product_ids)
+    return products.update(total_stock=_total_stock_subquery())
@@ -0,0 +1,208 @@
+"""
+إعادة بناء أرصدة المخزون من حركات المخزون
+
+تُقرأ الحركات مرتبة بالوقت على دفعات، ويُحسب رصيد كل (منتج، مخزن) بعد كل
+حركة دفعة واحدة بتجميع ومجموع تراكمي (pandas) بنفس قواعد خدمة الترحيل:
+- الوارد يضيف الكمية، والصادر يخصمها مع عدم النزول تحت الصفر
+- التحويل يخصم من المخزن ويضيف إلى المخزن المستلم
+- التسوية تعين الكمية المطلقة
+
+عدم النزول تحت الصفر يُحسب بدون حلقة: الرصيد = المجموع التراكمي - أقل قيمة
+سالبة وصل إليها المجموع التراكمي حتى الحركة (منذ آخر تسوية).
+
+ثم تُكتب quantity_before و quantity_after للحركات المختلفة بـ bulk_update
+وكميات المخزون المختلفة بعبارات جماعية، ويُعاد تقييم الأرصدة المصححة
+(قيمة المخزون وطبقات تكلفة FIFO وتكلفة الصرف في الحركات) بخدمة valuation.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+from django.db.models import Q
+
+from core.dashboard_stats import mark_stale
+from product.models import Stock, StockMovement
+from product.services.stock import INBOUND_MOVEMENTS, OUTBOUND_MOVEMENTS, rebuild_total_stock
+from product.services.valuation import revalue_stock
+
+# فرق رصيد مخزن: الكمية الحالية والكمية المحسوبة من الحركات
+StockDiff = namedtuple('StockDiff', ['product_id', 'warehouse_id', 'quantity', 'rebuilt'])
+
+# نتيجة إعادة البناء: فروق المخزون وعدد الحركات التي صُححت كمياتها قبل وبعد
+StockRebuild = namedtuple('StockRebuild', ['stock_diffs', 'movements_updated'])
+
+MOVEMENT_COLUMNS = [
+    'id', 'product_id', 'warehouse_id', 'destination_warehouse_id',
+    'movement_type', 'quantity', 'quantity_before', 'quantity_after',
+]
+
+# أنواع الأعمدة (حتى يبقى الجدول رقمياً عند عدم وجود حركات)
+MOVEMENT_DTYPES = {
+    'id': 'int64', 'product_id': 'int64', 'warehouse_id': 'int64', 'destination_warehouse_id': 'Int64',
+    'movement_type': 'object', 'quantity': 'int64', 'quantity_before': 'int64', 'quantity_after': 'int64',
+}
+
+KEY = ['product_id', 'warehouse_id']
+
+
+def _read_movements(product_ids=None, warehouse_ids=None, batch_size=1000):
+    """
+    قراءة الحركات مرتبة بالوقت على دفعات في جدول pandas
+    """
+    movements = StockMovement.objects.order_by('timestamp', 'id')
+    if product_ids:
+        movements = movements.filter(product_id__in=product_ids)
+    if warehouse_ids:
+        movements = movements.filter(
+            Q(warehouse_id__in=warehouse_ids) | Q(destination_warehouse_id__in=warehouse_ids)
+        )
+    rows = movements.values_list(*MOVEMENT_COLUMNS).iterator(chunk_size=batch_size)
+    return pd.DataFrame.from_records(rows, columns=MOVEMENT_COLUMNS).astype(MOVEMENT_DTYPES)
+
+
+def _events(movements):
+    """
+    تحويل الحركات إلى أحداث على أرصدة المخازن
+
+    كل حركة حدث على مخزنها، والتحويل حدث إضافي على المخزن المستلم.
+    """
+    movement_type = movements['movement_type']
+    sign = np.select(
+        [movement_type.isin(INBOUND_MOVEMENTS), movement_type.isin(OUTBOUND_MOVEMENTS)],
+        [1, -1],
+        default=0,
+    )
+    source = movements[movement_type.isin(INBOUND_MOVEMENTS + OUTBOUND_MOVEMENTS + ('adjustment',))]
+    source = pd.DataFrame({
+        'order': source.index,
+        'id': source['id'],
+        'product_id': source['product_id'],
+        'warehouse_id': source['warehouse_id'],
+        'delta': np.where(source['movement_type'] == 'adjustment', source['quantity'],
+                          sign[source.index] * source['quantity']).astype('int64'),
+        'reset': (source['movement_type'] == 'adjustment').astype('int64'),
+        'is_source': True,
+    })
+
+    transfers = movements[(movement_type == 'transfer') & movements['destination_warehouse_id'].notna()]
+    destination = pd.DataFrame({
+        'order': transfers.index,
+        'id': transfers['id'],
+        'product_id': transfers['product_id'],
+        'warehouse_id': transfers['destination_warehouse_id'].astype('int64'),
+        'delta': transfers['quantity'],
+        'reset': 0,
+        'is_source': False,
+    })
+
+    events = pd.concat([source, destination], ignore_index=True)
+    return events.sort_values(['order', 'is_source'], ascending=[True, False], kind='stable')
+
+
+def _balances(events):
+    """
+    الرصيد قبل وبعد كل حدث لكل (منتج، مخزن)
+    """
+    events = events.copy()
+    events['segment'] = events.groupby(KEY)['reset'].cumsum()
+    groups = KEY + ['segment']
+    running = events.groupby(groups)['delta'].cumsum()
+    floor = running.groupby([events[column] for column in groups]).cummin().clip(upper=0)
+    events['after'] = (running - floor).astype('int64')
+    events['before'] = events.groupby(KEY)['after'].shift(fill_value=0).astype('int64')
+    return events
+
+
+def _stock_diffs(final, product_ids=None, warehouse_ids=None):
+    """
+    مقارنة كميات المخزون الحالية بالكميات المحسوبة
+
+    تُرجع: (قائمة StockDiff، قاموس {(المنتج، المخزن): معرف سجل المخزون})
+    """
+    stocks = Stock.objects.all()
+    if product_ids:
+        stocks = stocks.filter(product_id__in=product_ids)
+    if warehouse_ids:
+        stocks = stocks.filter(warehouse_id__in=warehouse_ids)
+
+    current, stock_ids = {}, {}
+    for pk, product_id, warehouse_id, quantity in stocks.values_list('pk', 'product_id', 'warehouse_id', 'quantity'):
+        current[(product_id, warehouse_id)] = quantity
+        stock_ids[(product_id, warehouse_id)] = pk
+
+    diffs = []
+    for key in sorted(set(current) | set(final)):
+        quantity, rebuilt = current.get(key), final.get(key, 0)
+        if quantity != rebuilt and not (quantity is None and rebuilt == 0):
+            diffs.append(StockDiff(key[0], key[1], quantity or 0, rebuilt))
+    return diffs, stock_ids
+
+
+def rebuild_stock(product_ids=None, warehouse_ids=None, batch_size=1000, dry_run=False):
+    """
+    إعادة حساب أرصدة المخزون وكميات الحركات قبل وبعد من حركات المخزون
+
+    المعلمات:
+    product_ids (list): حصر إعادة البناء في منتجات معينة (الافتراضي الكل)
+    warehouse_ids (list): حصر إعادة البناء في مخازن معينة (الافتراضي الكل)
+    batch_size (int): عدد السجلات في كل دفعة قراءة وتحديث
+    dry_run (bool): حساب الفروق بدون حفظ
+
+    تُرجع: StockRebuild بفروق المخزون وعدد الحركات المصححة
+    """
+    with transaction.atomic():
+        movements = _read_movements(product_ids, warehouse_ids, batch_size)
+        events = _balances(_events(movements))
+        if warehouse_ids:
+            events = events[events['warehouse_id'].isin(warehouse_ids)]
+
+        final = {
+            (int(product_id), int(warehouse_id)): int(quantity)
+            for (product_id, warehouse_id), quantity in events.groupby(KEY)['after'].last().items()
+        }
+        diffs, stock_ids = _stock_diffs(final, product_ids, warehouse_ids)
+
+        # الحركات التي تختلف كمياتها المخزنة قبل وبعد عن المحسوبة
+        source = events[events['is_source'].astype(bool)].merge(
+            movements[['id', 'quantity_before', 'quantity_after']], on='id'
+        )
+        changed = source[
+            (source['before'] != source['quantity_before']) | (source['after'] != source['quantity_after'])
+        ]
+
+        if dry_run:
+            return StockRebuild(diffs, len(changed))
+
+        StockMovement.objects.bulk_update(
+            [
+                StockMovement(pk=int(pk), quantity_before=int(before), quantity_after=int(after))
+                for pk, before, after in changed[['id', 'before', 'after']].itertuples(index=False)
+            ],
+            ['quantity_before', 'quantity_after'],
+            batch_size=batch_size,
+        )
+
+        existing = [diff for diff in diffs if (diff.product_id, diff.warehouse_id) in stock_ids]
+        Stock.objects.bulk_update(
+            [
+                Stock(pk=stock_ids[(diff.product_id, diff.warehouse_id)], quantity=diff.rebuilt)
+                for diff in existing
+            ],
+            ['quantity'],
+            batch_size=batch_size,
+        )
+        Stock.objects.bulk_create(
+            [
+                Stock(product_id=diff.product_id, warehouse_id=diff.warehouse_id, quantity=diff.rebuilt)
+                for diff in diffs if (diff.product_id, diff.warehouse_id) not in stock_ids
+            ],
+            batch_size=batch_size,
+        )
+
+        if diffs:
+            rebuild_total_stock(sorted({diff.product_id for diff in diffs}))
+            revalue_stock({(diff.product_id, diff.warehouse_id) for diff in diffs}, batch_size)
+            mark_stale('inventory')
+
+    return StockRebuild(diffs, len(changed))
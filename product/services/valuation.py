@@ -0,0 +1,445 @@
+"""
+خدمة تقييم المخزون
+
+تُقيم كل حركة مخزون عند ترحيلها بنفس ترتيب ترحيل الكميات، فتبقى قيمة كل
+(منتج، مخزن) محفوظة في Stock.total_value ومتوسط التكلفة = القيمة / الكمية
+بدون إعادة حساب من الحركات:
+- الوارد يضيف كميته بتكلفة الوحدة في الحركة (صافي سعر الشراء للمشتريات)،
+  وإن لم تُحدد فبمتوسط التكلفة الحالي أو سعر تكلفة المنتج إذا نفد المخزون
+- الصادر يخصم بمتوسط التكلفة، أو من أقدم طبقات التكلفة بطريقة FIFO،
+  وتُحفظ تكلفة الصرف للوحدة في الحركة (ومنها تكلفة البضاعة المباعة)
+- التحويل ينقل تكلفة الصرف من المخزن المرسل إلى المخزن المستلم
+- التسوية تضيف الزيادة بمتوسط التكلفة أو تخصم النقص
+
+طريقة التقييم من الإعداد INVENTORY_COSTING_METHOD ('average' أو 'fifo').
+الكمية الموجودة قبل تفعيل FIFO (بدون طبقات) تُعتبر الأقدم وتُصرف أولاً
+بمتوسط تكلفتها.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+
+from product.models import CostLayer, Product, Stock, StockMovement
+from product.services.stock import BULK_UPDATE_BATCH_SIZE, INBOUND_MOVEMENTS, OUTBOUND_MOVEMENTS
+
+# طرق التقييم المدعومة
+COSTING_METHODS = ('average', 'fifo')
+DEFAULT_COSTING_METHOD = 'average'
+
+ZERO = Decimal('0')
+
+# دقة قيمة المخزون وتكلفة الوحدة (حسب حقول النماذج)
+VALUE_PLACES = Decimal('0.01')
+COST_PLACES = Decimal('0.0001')
+
+
+def costing_method():
+    """
+    طريقة التقييم الحالية من الإعدادات
+    """
+    method = getattr(settings, 'INVENTORY_COSTING_METHOD', DEFAULT_COSTING_METHOD)
+    return method if method in COSTING_METHODS else DEFAULT_COSTING_METHOD
+
+
+class _Ledger:
+    """
+    كميات وقيم مجموعة (منتج، مخزن) في الذاكرة أثناء تقييم الحركات
+
+    تُقرأ القيم (وطبقات التكلفة المفتوحة مع قفلها حتى لا تصرف معاملتان نفس
+    الطبقة) باستعلام واحد، وتُكتب بعد تقييم كل الحركات بعبارات جماعية.
+    """
+
+    def __init__(self, quantities, stocks=None):
+        self.quantities = dict(quantities)
+        self.fifo = costing_method() == 'fifo'
+        self.changed = set()
+        self.new_layers = []
+        self.changed_layers = {}
+        self._cost_prices = None
+
+        product_ids = {product_id for product_id, _ in self.quantities}
+        warehouse_ids = {warehouse_id for _, warehouse_id in self.quantities}
+
+        if stocks is None:
+            stocks = {}
+            rows = Stock.objects.filter(
+                product_id__in=product_ids, warehouse_id__in=warehouse_ids
+            ).values_list('pk', 'product_id', 'warehouse_id', 'total_value')
+            for pk, product_id, warehouse_id, total_value in rows:
+                stocks[(product_id, warehouse_id)] = (pk, total_value)
+        self.stock_ids = {key: stocks[key][0] for key in self.quantities if key in stocks}
+        self.values = {key: stocks[key][1] for key in self.quantities if key in stocks}
+
+        self.layers = {}
+        if self.fifo:
+            layers = CostLayer.objects.select_for_update().filter(
+                product_id__in=product_ids, warehouse_id__in=warehouse_ids, remaining__gt=0
+            ).order_by('id')
+            for layer in layers:
+                key = (layer.product_id, layer.warehouse_id)
+                if key in self.quantities:
+                    self.layers.setdefault(key, []).append(layer)
+
+    def _cost_price(self, product_id):
+        # سعر تكلفة المنتج (يُقرأ مرة واحدة عند الحاجة فقط)
+        if self._cost_prices is None:
+            self._cost_prices = dict(Product.objects.filter(
+                pk__in={key[0] for key in self.quantities}
+            ).values_list('pk', 'cost_price'))
+        return self._cost_prices.get(product_id) or ZERO
+
+    def average(self, key):
+        """
+        متوسط تكلفة الوحدة الحالي، أو سعر تكلفة المنتج إذا نفد المخزون
+        """
+        quantity = self.quantities.get(key, 0)
+        if quantity > 0:
+            return self.values.get(key, ZERO) / quantity
+        return Decimal(self._cost_price(key[0]))
+
+    def receive(self, key, quantity, unit_cost=None):
+        """
+        إضافة كمية بتكلفة وحدة (الافتراضي متوسط التكلفة)
+
+        تُرجع: تكلفة الوحدة المستخدمة
+        """
+        unit_cost = (self.average(key) if unit_cost is None else Decimal(unit_cost)).quantize(COST_PLACES)
+        self.quantities[key] = self.quantities.get(key, 0) + quantity
+        self.values[key] = self.values.get(key, ZERO) + quantity * unit_cost
+        self.changed.add(key)
+        if self.fifo and quantity:
+            layer = CostLayer(
+                product_id=key[0], warehouse_id=key[1],
+                quantity=quantity, remaining=quantity, unit_cost=unit_cost,
+            )
+            self.layers.setdefault(key, []).append(layer)
+            self.new_layers.append(layer)
+        return unit_cost
+
+    def _consume_layers(self, key, issued, on_hand, value):
+        """
+        تكلفة صرف كمية من أقدم طبقات التكلفة (بعد الكمية غير المغطاة بطبقات)
+        """
+        layers = [layer for layer in self.layers.get(key, []) if layer.remaining > 0]
+        layered_quantity = sum(layer.remaining for layer in layers)
+        layered_value = sum((layer.remaining * layer.unit_cost for layer in layers), ZERO)
+
+        unlayered = max(on_hand - layered_quantity, 0)
+        taken = min(issued, unlayered)
+        cost = (value - layered_value) * taken / unlayered if taken else ZERO
+
+        remaining = issued - taken
+        for layer in layers:
+            if not remaining:
+                break
+            used = min(layer.remaining, remaining)
+            layer.remaining -= used
+            cost += used * layer.unit_cost
+            remaining -= used
+            if layer.pk:
+                self.changed_layers[layer.pk] = layer
+        return cost
+
+    def issue(self, key, quantity):
+        """
+        صرف كمية (مع عدم النزول تحت الصفر كترحيل الكميات)
+
+        الكمية غير المتوفرة تُحسب تكلفتها بمتوسط التكلفة دون أن تخصم من القيمة.
+
+        تُرجع: تكلفة الوحدة المصروفة
+        """
+        on_hand = self.quantities.get(key, 0)
+        value = self.values.get(key, ZERO)
+        issued = min(quantity, on_hand)
+        fallback = self.average(key)
+
+        if issued and issued == on_hand:
+            # صرف كل الكمية يصرف كل القيمة (بدون فروق تقريب)
+            cost = value
+            for layer in self.layers.get(key, []):
+                if layer.remaining:
+                    layer.remaining = 0
+                    if layer.pk:
+                        self.changed_layers[layer.pk] = layer
+        elif not issued:
+            cost = ZERO
+        elif self.fifo:
+            cost = self._consume_layers(key, issued, on_hand, value)
+        else:
+            cost = value * issued / on_hand
+
+        self.quantities[key] = on_hand - issued
+        self.values[key] = value - cost
+        self.changed.add(key)
+        if not quantity:
+            return fallback.quantize(COST_PLACES)
+        return ((cost + (quantity - issued) * fallback) / quantity).quantize(COST_PLACES)
+
+    def set_quantity(self, key, quantity):
+        """
+        تعيين كمية مطلقة (تسوية): الزيادة تضاف بمتوسط التكلفة والنقص يُصرف
+
+        تُرجع: تكلفة الوحدة للفرق
+        """
+        on_hand = self.quantities.get(key, 0)
+        if quantity >= on_hand:
+            return self.receive(key, quantity - on_hand)
+        return self.issue(key, on_hand - quantity)
+
+    def value(self, key):
+        """
+        القيمة الحالية مقربة لدقة حقل قيمة المخزون
+        """
+        return max(self.values.get(key, ZERO), ZERO).quantize(VALUE_PLACES)
+
+    def save(self, values=True):
+        """
+        كتابة القيم المتغيرة (إلا إذا كتبها المستدعي) وطبقات التكلفة بعبارات جماعية
+        """
+        changed = [key for key in self.changed if key in self.stock_ids] if values else []
+        for start in range(0, len(changed), BULK_UPDATE_BATCH_SIZE):
+            batch = changed[start:start + BULK_UPDATE_BATCH_SIZE]
+            Stock.objects.filter(pk__in=[self.stock_ids[key] for key in batch]).update(
+                total_value=Case(
+                    *[
+                        When(pk=self.stock_ids[key], then=Value(self.value(key)))
+                        for key in batch
+                    ],
+                    output_field=DecimalField(max_digits=14, decimal_places=2),
+                ),
+            )
+        if self.changed_layers:
+            CostLayer.objects.bulk_update(
+                list(self.changed_layers.values()), ['remaining'], batch_size=BULK_UPDATE_BATCH_SIZE
+            )
+        if self.new_layers:
+            CostLayer.objects.bulk_create(self.new_layers, batch_size=BULK_UPDATE_BATCH_SIZE)
+
+
+def value_movements(movements, quantities, stocks=None):
+    """
+    تقييم حركات مخزون مرحّلة وتحديث قيم المخزون
+
+    تُقيم الحركات بالترتيب ابتداءً من الكميات قبل أول حركة، وتُملأ تكلفة
+    الوحدة في كل حركة دون حفظها.
+
+    المعلمات:
+    movements (list): حركات StockMovement بعد ترحيل كمياتها
+    quantities (dict): {(المنتج، المخزن): الكمية قبل أول حركة}
+    stocks (dict): {(المنتج، المخزن): (معرف السجل، القيمة)} المقروءة مسبقاً؛
+        عند تمريرها لا تُكتب القيم ويكتبها المستدعي مع الكميات
+
+    تُرجع: قاموس {(المنتج، المخزن): القيمة الجديدة} للسجلات المتغيرة
+    """
+    if not quantities:
+        return {}
+    ledger = _Ledger(quantities, stocks)
+    for movement in movements:
+        key = (movement.product_id, movement.warehouse_id)
+        quantity = int(movement.quantity)
+        if movement.movement_type in INBOUND_MOVEMENTS:
+            movement.unit_cost = ledger.receive(key, quantity, movement.unit_cost)
+        elif movement.movement_type in OUTBOUND_MOVEMENTS:
+            movement.unit_cost = ledger.issue(key, quantity)
+            if movement.movement_type == 'transfer' and movement.destination_warehouse_id:
+                ledger.receive((movement.product_id, movement.destination_warehouse_id), quantity, movement.unit_cost)
+        elif movement.movement_type == 'adjustment':
+            movement.unit_cost = ledger.set_quantity(key, quantity)
+    ledger.save(values=stocks is None)
+    return {key: ledger.value(key) for key in ledger.changed}
+
+
+def value_reversal(movement, quantities):
+    """
+    إلغاء تأثير حركة محذوفة على قيم المخزون
+
+    الوارد المحذوف يُصرف بمتوسط التكلفة، والصادر المحذوف يُعاد بتكلفة صرفه.
+
+    المعلمات:
+    movement (StockMovement): الحركة المحذوفة
+    quantities (dict): {(المنتج، المخزن): الكمية قبل الإلغاء}
+    """
+    ledger = _Ledger(quantities)
+    key = (movement.product_id, movement.warehouse_id)
+    quantity = int(movement.quantity)
+    if movement.movement_type in INBOUND_MOVEMENTS:
+        ledger.issue(key, quantity)
+    elif movement.movement_type in OUTBOUND_MOVEMENTS:
+        ledger.receive(key, quantity, movement.unit_cost)
+        if movement.movement_type == 'transfer' and movement.destination_warehouse_id:
+            ledger.issue((movement.product_id, movement.destination_warehouse_id), quantity)
+    ledger.save()
+
+
+def _transfer_closure(movements, keys):
+    # التحويل من رصيد يُعاد تقييمه يغير قيمة المخزن المستلم، فيُعاد تقييمه أيضاً
+    keys = set(keys)
+    while True:
+        received = {
+            (movement.product_id, movement.destination_warehouse_id)
+            for movement in movements
+            if movement.movement_type == 'transfer' and movement.destination_warehouse_id
+            and (movement.product_id, movement.warehouse_id) in keys
+        }
+        if received <= keys:
+            return keys
+        keys |= received
+
+
+def revalue_stock(keys, batch_size=BULK_UPDATE_BATCH_SIZE):
+    """
+    إعادة تقييم أرصدة مخزون من حركاتها (بعد تصحيح كمياتها بإعادة البناء)
+
+    تُعاد قيمة كل (منتج، مخزن) من الصفر بإعادة تقييم حركاته بالترتيب، وتُحذف
+    طبقات التكلفة وتُعاد من الوارد بطريقة FIFO، وتُصحح تكلفة الصرف في الحركات.
+    الوارد يُقيم بتكلفته المسجلة، وكذلك التحويل الوارد من مخزن لا يُعاد تقييمه.
+
+    المعلمات:
+    keys (iterable): أزواج (المنتج، المخزن) المراد إعادة تقييمها
+    batch_size (int): عدد السجلات في كل دفعة تحديث
+
+    تُرجع: عدد الحركات التي تغيرت تكلفة وحدتها
+    """
+    keys = set(keys)
+    if not keys:
+        return 0
+
+    product_ids = {product_id for product_id, _ in keys}
+    movements = list(StockMovement.objects.filter(product_id__in=product_ids).order_by('timestamp', 'id').only(
+        'product_id', 'warehouse_id', 'destination_warehouse_id', 'movement_type', 'quantity', 'unit_cost',
+    ))
+    keys = _transfer_closure(movements, keys)
+    warehouse_ids = {warehouse_id for _, warehouse_id in keys}
+
+    layers = Q()
+    for product_id, warehouse_id in keys:
+        layers |= Q(product_id=product_id, warehouse_id=warehouse_id)
+    CostLayer.objects.filter(layers).delete()
+    stocks = {
+        (product_id, warehouse_id): (pk, ZERO)
+        for pk, product_id, warehouse_id in Stock.objects.filter(
+            product_id__in=product_ids, warehouse_id__in=warehouse_ids
+        ).values_list('pk', 'product_id', 'warehouse_id')
+        if (product_id, warehouse_id) in keys
+    }
+    ledger = _Ledger(dict.fromkeys(keys, 0), stocks)
+
+    changed = []
+    for movement in movements:
+        key = (movement.product_id, movement.warehouse_id)
+        destination = (movement.product_id, movement.destination_warehouse_id)
+        quantity = int(movement.quantity)
+        unit_cost = movement.unit_cost
+        if key in keys:
+            if movement.movement_type in INBOUND_MOVEMENTS:
+                unit_cost = ledger.receive(key, quantity, unit_cost)
+            elif movement.movement_type in OUTBOUND_MOVEMENTS:
+                unit_cost = ledger.issue(key, quantity)
+            elif movement.movement_type == 'adjustment':
+                unit_cost = ledger.set_quantity(key, quantity)
+        if movement.movement_type == 'transfer' and movement.destination_warehouse_id and destination in keys:
+            ledger.receive(destination, quantity, unit_cost)
+        if unit_cost != movement.unit_cost:
+            movement.unit_cost = unit_cost
+            changed.append(movement)
+
+    # الأرصدة التي لم تبق لها حركات تُكتب قيمتها صفراً
+    ledger.changed.update(keys)
+    ledger.save()
+    StockMovement.objects.bulk_update(changed, ['unit_cost'], batch_size=batch_size)
+    return len(changed)
+
+
+def inventory_valuation(warehouse_ids=None, product_ids=None):
+    """
+    تقييم المخزون الحالي لكل منتج باستعلام تجميع واحد على جدول المخزون
+
+    المعلمات:
+    warehouse_ids (list): حصر التقييم في مخازن معينة (اختياري)
+    product_ids (list): حصر التقييم في منتجات معينة (اختياري)
+
+    تُرجع: QuerySet بقيم product_id و product__name و product__sku و quantity و value
+    """
+    stocks = Stock.objects.filter(quantity__gt=0)
+    if warehouse_ids:
+        stocks = stocks.filter(warehouse_id__in=warehouse_ids)
+    if product_ids:
+        stocks = stocks.filter(product_id__in=product_ids)
+    return stocks.order_by().values('product_id', 'product__name', 'product__sku').annotate(
+        quantity=Sum('quantity'),
+        value=Sum('total_value'),
+    ).order_by('product__name')
+
+
+def inventory_value(warehouse_ids=None):
+    """
+    إجمالي كمية وقيمة المخزون
+
+    تُرجع: قاموس {'quantity': الكمية، 'value': القيمة}
+    """
+    stocks = Stock.objects.all()
+    if warehouse_ids:
+        stocks = stocks.filter(warehouse_id__in=warehouse_ids)
+    totals = stocks.aggregate(quantity=Sum('quantity'), value=Sum('total_value'))
+    return {'quantity': totals['quantity'] or 0, 'value': totals['value'] or ZERO}
+
+
+def _sale_movements(numbers):
+    return StockMovement.objects.filter(
+        document_type='sale', document_number__in=numbers, unit_cost__isnull=False,
+    ).order_by()
+
+
+def cogs_by_sale(sales):
+    """
+    تكلفة البضاعة المباعة لفواتير مبيعات من تكلفة صرف حركاتها باستعلام واحد
+
+    صادر الفاتورة يُضاف، ووارد تعديلها (إنقاص كمية أو حذف بند) يُطرح.
+
+    المعلمات:
+    sales (list): فواتير Sale
+
+    تُرجع: قاموس {معرف الفاتورة: التكلفة}
+    """
+    numbers = {sale.number: sale.pk for sale in sales}
+    cost = F('quantity') * F('unit_cost')
+    signed = Case(
+        When(movement_type__in=OUTBOUND_MOVEMENTS, then=cost),
+        When(movement_type__in=INBOUND_MOVEMENTS, then=-cost),
+        default=Value(ZERO),
+        output_field=DecimalField(max_digits=18, decimal_places=4),
+    )
+    rows = _sale_movements(numbers).values('document_number').annotate(cogs=Sum(signed))
+
+    result = {pk: ZERO for pk in numbers.values()}
+    for row in rows:
+        result[numbers[row['document_number']]] = (row['cogs'] or ZERO).quantize(VALUE_PLACES)
+    return result
+
+
+def sale_cogs(sale):
+    """
+    تكلفة البضاعة المباعة لفاتورة مبيعات
+    """
+    return cogs_by_sale([sale])[sale.pk]
+
+
+def sale_unit_costs(sale):
+    """
+    متوسط تكلفة صرف الوحدة لكل منتج في فاتورة مبيعات
+
+    تُستخدم لإعادة الكميات المرتجعة أو المحذوفة من الفاتورة للمخزون بتكلفة صرفها.
+
+    تُرجع: قاموس {معرف المنتج: تكلفة الوحدة}
+    """
+    rows = _sale_movements([sale.number]).filter(movement_type__in=OUTBOUND_MOVEMENTS).values(
+        'product_id'
+    ).annotate(
+        cost=Sum(F('quantity') * F('unit_cost'), output_field=DecimalField(max_digits=18, decimal_places=4)),
+        issued=Sum('quantity'),
+    )
+    return {
+        row['product_id']: (row['cost'] / row['issued']).quantize(COST_PLACES)
+        for row in rows if row['issued']
+    }
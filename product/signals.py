@@ -3,10 +3,14 @@ from django.dispatch import receiver
 from django.db import transaction
 from django.utils.text import slugify
 from django.utils import timezone
-from decimal import Decimal
-from .models import StockMovement, Stock, Product, ProductImage
+from .models import StockMovement, Product, ProductImage, Stock, Category, Brand
+from .services.inventory import invalidate_checkpoints
+from .services.lookup import invalidate_lookup_cache
+from .services.search import index_products, remove_products
+from .services.stock import rebuild_total_stock, reverse_movement
 from sale.models import Sale
 from purchase.models import Purchase
+from utils.signals import bulk_imported
 
 
 @receiver(pre_save, sender=Product)
@@ -21,6 +25,55 @@ def ensure_unique_sku(sender, instance, **kwargs):
         instance.sku = f"{base_slug}-{timestamp}"
 
 
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, raw=False, **kwargs):
+    """
+    تحديث نص البحث للمنتج عند حفظه
+    """
+    if raw:
+        return
+    index_products([instance.pk])
+
+
+@receiver(bulk_imported, sender=Product)
+def index_imported_products(sender, ids, **kwargs):
+    """
+    فهرسة المنتجات المستوردة جماعياً وإبطال ذاكرة البحث بالرموز
+    """
+    index_products(ids)
+    invalidate_lookup_cache()
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    """
+    إزالة المنتج المحذوف من جدول البحث
+    """
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_lookup_on_product_change(sender, instance, raw=False, **kwargs):
+    """
+    إبطال ذاكرة البحث بالباركود ورمز المنتج عند حفظ أو حذف منتج
+    """
+    if raw:
+        return
+    invalidate_lookup_cache()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Brand)
+def index_products_on_label_change(sender, instance, created, raw=False, **kwargs):
+    """
+    إعادة فهرسة منتجات الفئة أو العلامة التجارية عند تعديل اسمها
+    """
+    if created or raw:
+        return
+    index_products(instance.products.values_list('pk', flat=True))
+
+
 @receiver(post_save, sender=ProductImage)
 def ensure_single_primary_image(sender, instance, created, **kwargs):
     """
@@ -39,92 +92,34 @@ def ensure_single_primary_image(sender, instance, created, **kwargs):
             instance.save()
 
 
-@receiver(post_save, sender=StockMovement)
-def update_stock_on_movement(sender, instance, created, **kwargs):
-    """
-    تحديث المخزون بعد حفظ حركة المخزون
-    """
-    # تجنب تحديث المخزون عدة مرات لنفس الفاتورة
-    # نقوم بتحديث المخزون فقط عند إنشاء حركة جديدة
-    if created:
-        # تحقق ما إذا كان هناك متغير خاص بالأمان في الكوكيز - إذا كان موجودًا فلا تقم بتحديث المخزون
-        if hasattr(instance, '_skip_update') and instance._skip_update:
-            return
-        
-        # تأشير هذه الحركة لمنع تحديثها مرة أخرى
-        instance._skip_update = True
-        
-        # الحصول على المخزون الحالي أو إنشاء واحد جديد إذا لم يكن موجودًا
-        stock, created_stock = Stock.objects.get_or_create(
-            product=instance.product,
-            warehouse=instance.warehouse,
-            defaults={'quantity': Decimal('0')}
-        )
-        
-        # تحديث المخزون بناءً على نوع الحركة
-        if instance.movement_type == 'in':
-            # حركة إضافة للمخزون
-            stock.quantity += Decimal(instance.quantity)
-        elif instance.movement_type == 'out':
-            # حركة سحب من المخزون (لا تسمح بالقيم السالبة)
-            stock.quantity = max(Decimal('0'), stock.quantity - Decimal(instance.quantity))
-        elif instance.movement_type == 'transfer' and instance.destination_warehouse:
-            # حركة تحويل بين المخازن
-            # خفض المخزون من المخزن المصدر
-            stock.quantity = max(Decimal('0'), stock.quantity - Decimal(instance.quantity))
-            
-            # زيادة المخزون في المخزن الوجهة
-            dest_stock, dest_created = Stock.objects.get_or_create(
-                product=instance.product,
-                warehouse=instance.destination_warehouse,
-                defaults={'quantity': Decimal('0')}
-            )
-            dest_stock.quantity += Decimal(instance.quantity)
-            dest_stock.save()
-        elif instance.movement_type == 'adjustment':
-            # حركة تسوية المخزون (تحديد كمية مطلقة)
-            stock.quantity = Decimal(instance.quantity)
-        
-        # حفظ التغييرات على المخزون
-        stock.save()
-
-
 @receiver(post_delete, sender=StockMovement)
 def revert_stock_on_movement_delete(sender, instance, **kwargs):
     """
     إلغاء تأثير حركة المخزون عند حذفها
     """
-    try:
-        # البحث عن سجل المخزون المرتبط
-        stock = Stock.objects.get(product=instance.product, warehouse=instance.warehouse)
-        
-        if instance.movement_type == 'in':
-            # إلغاء تأثير الإضافة - خفض المخزون
-            stock.quantity = max(Decimal('0'), stock.quantity - Decimal(instance.quantity))
-        elif instance.movement_type == 'out':
-            # إلغاء تأثير السحب - زيادة المخزون
-            stock.quantity += Decimal(instance.quantity)
-        elif instance.movement_type == 'transfer':
-            # إلغاء تأثير التحويل
-            stock.quantity += Decimal(instance.quantity)
-            
-            # معالجة المخزن المستلم إذا كان موجودًا
-            if instance.destination_warehouse:
-                try:
-                    dest_stock = Stock.objects.get(
-                        product=instance.product, 
-                        warehouse=instance.destination_warehouse
-                    )
-                    dest_stock.quantity = max(Decimal('0'), dest_stock.quantity - Decimal(instance.quantity))
-                    dest_stock.save()
-                except Stock.DoesNotExist:
-                    pass
-        
-        # حفظ التغييرات على المخزون
-        stock.save()
-    except Stock.DoesNotExist:
-        # إذا لم يكن هناك سجل مخزون، فلا يوجد شيء للتعديل
-        pass
+    # الترحيل عند الإنشاء يتم في StockMovement.save عبر خدمة ترحيل المخزون
+    reverse_movement(instance)
+
+
+@receiver(post_save, sender=StockMovement)
+@receiver(post_delete, sender=StockMovement)
+def invalidate_checkpoints_on_movement_change(sender, instance, **kwargs):
+    """
+    حذف لقطات المخزون التي تغيرت بحفظ أو حذف حركة في شهر مغلق (مثل استعادة النسخ الاحتياطية)
+    """
+    invalidate_checkpoints(instance.timestamp)
+
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def sync_total_stock_on_stock_change(sender, instance, created=False, **kwargs):
+    """
+    إعادة حساب إجمالي مخزون المنتج عند حفظ أو حذف سجل مخزون مباشرة
+    """
+    # خدمة ترحيل المخزون تحدث الإجمالي بنفسها ولا تحفظ السجلات إلا عند إنشائها بكمية صفر
+    if created and not instance.quantity:
+        return
+    rebuild_total_stock([instance.product_id])
 
 
 @receiver(post_delete, sender=Sale)
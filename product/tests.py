@@ -1,3 +1,695 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from product.models import (
+    Brand, Category, Unit, Product, Warehouse, Stock, StockMovement, SerialNumber,
+    StockCheckpoint,
+)
+from product.services.stock import (
+    create_movements, increase_stock, decrease_stock, set_stock, verify_total_stock,
+)
+from product.services.inventory import (
+    build_checkpoints, checkpoint_watermark, quantities_as_of, quantity_as_of,
+)
+from product.services.stock_rebuild import rebuild_stock
+from product.services.lookup import _cache as lookup_cache, lookup_code, lookup_codes
+from product.services.search import fts_enabled, matching_products, rebuild_index, search_products
+from product.services.valuation import cogs_by_sale, inventory_valuation, inventory_value
+from product.services.numbering import allocate_number, peek_number, reset_local_cache
+
+User = get_user_model()
+
+
+class StockTestMixin:
+    """
+    بيانات أساسية مشتركة لاختبارات المخزون
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='stockuser',
+            email='stockuser@example.com',
+            password='testpassword123'
+        )
+        self.category = Category.objects.create(name='فئة')
+        self.unit = Unit.objects.create(name='قطعة', symbol='ق')
+        self.product = Product.objects.create(
+            name='منتج',
+            sku='SKU-001',
+            category=self.category,
+            unit=self.unit,
+            cost_price=10,
+            selling_price=15,
+            created_by=self.user
+        )
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+        self.other_warehouse = Warehouse.objects.create(name='المخزن الفرعي', code='SUB')
+
+    def create_movement(self, movement_type, quantity, **kwargs):
+        return StockMovement.objects.create(
+            product=self.product,
+            warehouse=kwargs.pop('warehouse', self.warehouse),
+            movement_type=movement_type,
+            quantity=quantity,
+            created_by=self.user,
+            **kwargs
+        )
+
+    def stock_quantity(self, warehouse=None):
+        return Stock.objects.get(product=self.product, warehouse=warehouse or self.warehouse).quantity
+
+
+class StockPostingServiceTest(StockTestMixin, TestCase):
+    """
+    اختبارات خدمة ترحيل المخزون
+    """
+
+    def test_increase_creates_missing_stock_row(self):
+        posting = increase_stock(self.product.pk, self.warehouse.pk, 5)
+        self.assertEqual(posting, (0, 5))
+        self.assertEqual(self.stock_quantity(), 5)
+
+    def test_decrease_is_floored_at_zero(self):
+        increase_stock(self.product.pk, self.warehouse.pk, 3)
+        posting = decrease_stock(self.product.pk, self.warehouse.pk, 2)
+        self.assertEqual(posting, (3, 1))
+        posting = decrease_stock(self.product.pk, self.warehouse.pk, 4)
+        self.assertEqual(posting, (1, 0))
+        self.assertEqual(self.stock_quantity(), 0)
+
+    def test_set_stock_returns_previous_quantity(self):
+        increase_stock(self.product.pk, self.warehouse.pk, 7)
+        self.assertEqual(set_stock(self.product.pk, self.warehouse.pk, 2), (7, 2))
+
+
+class StockMovementPostingTest(StockTestMixin, TestCase):
+    """
+    اختبارات ترحيل حركات المخزون عند الحفظ والحذف
+    """
+
+    def test_movement_is_posted_once(self):
+        movement = self.create_movement('in', 10)
+        self.assertEqual(self.stock_quantity(), 10)
+        self.assertEqual((movement.quantity_before, movement.quantity_after), (0, 10))
+
+        # إعادة حفظ الحركة لا تعيد ترحيلها
+        movement.notes = 'تعديل'
+        movement.save()
+        self.assertEqual(self.stock_quantity(), 10)
+
+        movement = self.create_movement('out', 4)
+        self.assertEqual(self.stock_quantity(), 6)
+        self.assertEqual((movement.quantity_before, movement.quantity_after), (10, 6))
+
+    def test_transfer_moves_between_warehouses(self):
+        self.create_movement('in', 10)
+        self.create_movement('transfer', 4, destination_warehouse=self.other_warehouse)
+        self.assertEqual(self.stock_quantity(), 6)
+        self.assertEqual(self.stock_quantity(self.other_warehouse), 4)
+
+    def test_transfer_marks_inventory_stats_once(self):
+        self.create_movement('in', 10)
+        with mock.patch('product.services.stock.mark_stale') as mark_stale:
+            self.create_movement('transfer', 4, destination_warehouse=self.other_warehouse)
+        mark_stale.assert_called_once_with('inventory')
+
+    def test_delete_reverses_movement(self):
+        self.create_movement('in', 10)
+        movement = self.create_movement('out', 3)
+        movement.delete()
+        self.assertEqual(self.stock_quantity(), 10)
+
+    def test_skip_update_does_not_post(self):
+        movement = StockMovement(
+            product=self.product,
+            warehouse=self.warehouse,
+            movement_type='in',
+            quantity=5,
+            created_by=self.user
+        )
+        movement._skip_update = True
+        movement.save()
+        self.assertFalse(Stock.objects.filter(product=self.product).exists())
+
+
+class TotalStockTest(StockTestMixin, TestCase):
+    """
+    اختبارات إجمالي مخزون المنتج المحدث مع كل تغيير في المخزون
+    """
+
+    def total_stock(self):
+        return Product.objects.values_list('total_stock', flat=True).get(pk=self.product.pk)
+
+    def test_single_postings_update_total(self):
+        self.create_movement('in', 10)
+        self.create_movement('transfer', 4, destination_warehouse=self.other_warehouse)
+        self.assertEqual(self.total_stock(), 10)
+        self.create_movement('out', 15)
+        self.assertEqual(self.total_stock(), 4)
+        self.create_movement('adjustment', 9, warehouse=self.other_warehouse)
+        self.assertEqual(self.total_stock(), 9)
+        self.assertEqual(verify_total_stock(), [])
+
+    def test_bulk_postings_update_total(self):
+        create_movements([
+            StockMovement(product=self.product, warehouse=self.warehouse, movement_type='in',
+                          quantity=8, created_by=self.user),
+            StockMovement(product=self.product, warehouse=self.other_warehouse, movement_type='in',
+                          quantity=5, created_by=self.user),
+            StockMovement(product=self.product, warehouse=self.warehouse, movement_type='out',
+                          quantity=3, created_by=self.user),
+        ])
+        self.assertEqual(self.total_stock(), 10)
+        self.assertEqual(verify_total_stock(), [])
+
+    def test_product_save_keeps_total(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        increase_stock(self.product.pk, self.warehouse.pk, 6)
+        stale.name = 'منتج معدل'
+        stale.save()
+        self.assertEqual(self.total_stock(), 6)
+
+    def test_reconcile_command_fixes_mismatch(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        increase_stock(self.product.pk, self.warehouse.pk, 6)
+        Product.objects.filter(pk=self.product.pk).update(total_stock=1)
+        out = StringIO()
+        call_command('reconcile_product_stock', '--fix', stdout=out)
+        self.assertIn('الإجمالي المخزن 1 ومجموع المخازن 6', out.getvalue())
+        self.assertEqual(self.total_stock(), 6)
+
+
+class StockRebuildTest(StockTestMixin, TestCase):
+    """
+    اختبارات إعادة بناء أرصدة المخزون من الحركات
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_movement('in', 10)
+        self.create_movement('out', 3)
+        self.create_movement('transfer', 4, destination_warehouse=self.other_warehouse)
+        self.create_movement('out', 10)
+        self.create_movement('adjustment', 7, warehouse=self.other_warehouse)
+        self.create_movement('in', 2, warehouse=self.other_warehouse)
+        self.posted = list(StockMovement.objects.order_by('id').values_list('quantity_before', 'quantity_after'))
+
+    def corrupt(self):
+        Stock.objects.update(quantity=50)
+        StockMovement.objects.update(quantity_before=0, quantity_after=0)
+
+    def test_rebuild_matches_live_posting(self):
+        self.assertEqual(rebuild_stock(), ([], 0))
+
+        self.corrupt()
+        result = rebuild_stock(dry_run=True)
+        self.assertEqual(result.stock_diffs, [
+            (self.product.pk, self.warehouse.pk, 50, 0),
+            (self.product.pk, self.other_warehouse.pk, 50, 9),
+        ])
+        self.assertEqual(result.movements_updated, 6)
+        self.assertEqual(self.stock_quantity(), 50)
+
+        rebuild_stock(batch_size=2)
+        self.assertEqual((self.stock_quantity(), self.stock_quantity(self.other_warehouse)), (0, 9))
+        self.assertEqual(
+            list(StockMovement.objects.order_by('id').values_list('quantity_before', 'quantity_after')),
+            self.posted,
+        )
+        self.assertEqual(Product.objects.get(pk=self.product.pk).total_stock, 9)
+
+    def test_rebuild_revalues_corrected_stock(self):
+        values = dict(Stock.objects.values_list('warehouse_id', 'total_value'))
+        costs = list(StockMovement.objects.order_by('id').values_list('unit_cost', flat=True))
+
+        self.corrupt()
+        Stock.objects.update(total_value=999)
+        StockMovement.objects.update(unit_cost=None)
+        rebuild_stock()
+
+        self.assertEqual(dict(Stock.objects.values_list('warehouse_id', 'total_value')), values)
+        self.assertEqual(list(StockMovement.objects.order_by('id').values_list('unit_cost', flat=True)), costs)
+
+    @override_settings(INVENTORY_COSTING_METHOD='fifo')
+    def test_rebuild_recreates_fifo_layers(self):
+        from product.models import CostLayer
+
+        self.corrupt()
+        CostLayer.objects.update(remaining=0)
+        rebuild_stock()
+        self.assertEqual(
+            list(CostLayer.objects.filter(remaining__gt=0).values_list('warehouse_id', 'remaining')),
+            [(self.other_warehouse.pk, 4), (self.other_warehouse.pk, 3), (self.other_warehouse.pk, 2)],
+        )
+
+    def test_rebuild_warehouse_subset(self):
+        self.corrupt()
+        result = rebuild_stock(warehouse_ids=[self.other_warehouse.pk])
+        self.assertEqual(len(result.stock_diffs), 1)
+        self.assertEqual((self.stock_quantity(), self.stock_quantity(self.other_warehouse)), (50, 9))
+
+    def test_command_dry_run(self):
+        from io import StringIO
+        from django.core.management import call_command
+
+        self.corrupt()
+        out = StringIO()
+        call_command('rebuild_stock', '--dry-run', '--product', str(self.product.pk), stdout=out)
+        self.assertIn('الكمية الحالية 50 والمحسوبة 9', out.getvalue())
+        self.assertEqual(self.stock_quantity(self.other_warehouse), 50)
+
+
+class InventoryValuationTest(StockTestMixin, TestCase):
+    """
+    اختبارات تقييم المخزون وتكلفة البضاعة المباعة
+    """
+
+    def stock_value(self, warehouse=None):
+        return Stock.objects.get(product=self.product, warehouse=warehouse or self.warehouse).total_value
+
+    def test_moving_average(self):
+        self.create_movement('in', 10, unit_cost=10)
+        self.create_movement('in', 10, unit_cost=20)
+        self.assertEqual(self.stock_value(), Decimal('300'))
+
+        movement = self.create_movement('out', 5)
+        self.assertEqual(movement.unit_cost, Decimal('15'))
+        self.assertEqual(self.stock_value(), Decimal('225'))
+
+        self.create_movement('transfer', 5, destination_warehouse=self.other_warehouse)
+        self.assertEqual(self.stock_value(), Decimal('150'))
+        self.assertEqual(self.stock_value(self.other_warehouse), Decimal('75'))
+
+        # التسوية تضيف الزيادة بمتوسط التكلفة
+        adjustment = self.create_movement('adjustment', 12)
+        self.assertEqual(adjustment.unit_cost, Decimal('15'))
+        self.assertEqual(self.stock_value(), Decimal('180'))
+
+        # صرف كل الكمية يصفر القيمة
+        self.create_movement('out', 20)
+        self.assertEqual(self.stock_value(), Decimal('0'))
+
+    def test_inbound_without_cost_uses_cost_price(self):
+        movement = self.create_movement('in', 4)
+        self.assertEqual(movement.unit_cost, Decimal('10'))
+        self.assertEqual(self.stock_value(), Decimal('40'))
+
+    @override_settings(INVENTORY_COSTING_METHOD='fifo')
+    def test_fifo_layers(self):
+        self.create_movement('in', 10, unit_cost=10)
+        self.create_movement('in', 10, unit_cost=20)
+        movement = self.create_movement('out', 15)
+        self.assertEqual(movement.unit_cost, Decimal('13.3333'))
+        self.assertEqual(self.stock_value(), Decimal('100'))
+        self.assertEqual(
+            list(self.product.cost_layers.order_by('id').values_list('remaining', flat=True)), [0, 5]
+        )
+
+    def test_bulk_posting_matches_single_posting(self):
+        def movement(movement_type, quantity, **kwargs):
+            return StockMovement(
+                product=self.product, warehouse=self.warehouse, movement_type=movement_type,
+                quantity=quantity, created_by=self.user, **kwargs
+            )
+
+        movements = create_movements([
+            movement('in', 10, unit_cost=10),
+            movement('in', 10, unit_cost=20),
+            movement('out', 5),
+            movement('transfer', 5, destination_warehouse=self.other_warehouse),
+        ])
+        self.assertEqual(movements[2].unit_cost, Decimal('15'))
+        self.assertEqual(self.stock_value(), Decimal('150'))
+        self.assertEqual(self.stock_value(self.other_warehouse), Decimal('75'))
+
+    def test_delete_restores_value(self):
+        self.create_movement('in', 10, unit_cost=10)
+        movement = self.create_movement('out', 4)
+        self.assertEqual(self.stock_value(), Decimal('60'))
+        movement.delete()
+        self.assertEqual(self.stock_value(), Decimal('100'))
+
+    def test_reports(self):
+        self.create_movement('in', 10, unit_cost=10)
+        self.create_movement('in', 10, unit_cost=20)
+        self.create_movement('out', 4, document_type='sale', document_number='S-1')
+        self.create_movement('in', 1, unit_cost=15, document_type='sale', document_number='S-1')
+
+        sale = SimpleNamespace(pk=1, number='S-1')
+        self.assertEqual(cogs_by_sale([sale]), {1: Decimal('45')})
+
+        rows = list(inventory_valuation())
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['quantity'], rows[0]['value']), (17, Decimal('255')))
+        self.assertEqual(inventory_value([self.other_warehouse.pk]), {'quantity': 0, 'value': 0})
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('product:inventory_valuation_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'SKU-001')
+
+
+class ProductSearchTest(StockTestMixin, TestCase):
+    """
+    اختبارات فهرس البحث في المنتجات
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.brand = Brand.objects.create(name='الأهرام')
+        self.pen = self.create_product('قَلَمٌ أزرق', 'PEN-01', barcode='6221234567890', brand=self.brand)
+        self.pencil = self.create_product('قلم رصاص', 'PEN-02')
+        self.eraser = self.create_product('ممحاة', 'ERS-01', is_active=False)
+
+    def create_product(self, name, sku, **kwargs):
+        return Product.objects.create(
+            name=name, sku=sku, category=self.category, unit=self.unit,
+            cost_price=1, selling_price=2, created_by=self.user, **kwargs
+        )
+
+    def names(self, query, **kwargs):
+        return [product.name for product in search_products(query, **kwargs).products]
+
+    def check_search(self):
+        # البحث بدون تشكيل وبصور الألف الموحدة
+        self.assertEqual(set(self.names('قلم')), {'قَلَمٌ أزرق', 'قلم رصاص'})
+        self.assertEqual(self.names('قلم ازرق'), ['قَلَمٌ أزرق'])
+        self.assertEqual(self.names('اهرام'), ['قَلَمٌ أزرق'])
+        self.assertEqual(self.names('6221234'), ['قَلَمٌ أزرق'])
+        self.assertEqual(self.names('pen-02'), ['قلم رصاص'])
+        self.assertEqual(self.names('ممحاه'), [])
+        self.assertEqual(self.names('ممحاه', active_only=False), ['ممحاة'])
+        self.assertEqual(self.names(''), [])
+
+        page = search_products('فئة', page_size=2)
+        self.assertEqual((page.total, len(page.products), page.has_next), (3, 2, True))
+        self.assertFalse(search_products('فئة', page=2, page_size=2).has_next)
+
+        self.assertEqual(
+            set(Product.objects.filter(matching_products('قلم')).values_list('pk', flat=True)),
+            {self.pen.pk, self.pencil.pk},
+        )
+
+    def test_fts_search(self):
+        self.assertTrue(fts_enabled())
+        self.check_search()
+
+    def test_fallback_search(self):
+        with mock.patch('product.services.search.fts_enabled', return_value=False):
+            self.check_search()
+
+    def test_index_follows_changes(self):
+        self.pencil.name = 'مسطرة'
+        self.pencil.save()
+        self.assertEqual(self.names('قلم'), ['قَلَمٌ أزرق'])
+
+        self.category.name = 'أدوات مكتبية'
+        self.category.save()
+        self.assertEqual(len(self.names('مكتبيه')), 3)
+
+        self.pen.delete()
+        self.assertEqual(self.names('ازرق'), [])
+
+        self.assertEqual(rebuild_index(), 3)  # منتج الاختبار الأساسي والقلم الرصاص والممحاة
+        self.assertEqual(self.names('مسطره'), ['مسطرة'])
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('product:product_search_api'), {'q': 'قلم', 'page_size': 1})
+        data = response.json()
+        self.assertEqual((data['total'], data['has_next']), (2, True))
+        self.assertEqual(len(data['results']), 1)
+        self.assertIn(data['results'][0]['sku'], {'PEN-01', 'PEN-02'})
+
+
+class ProductLookupTest(StockTestMixin, TestCase):
+    """
+    اختبارات البحث بالباركود ورمز المنتج لنقاط البيع
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        lookup_cache.clear()
+        self.product.barcode = '6221000000011'
+        self.product.save()
+        self.create_movement('in', 7)
+        self.create_movement('in', 3, warehouse=self.other_warehouse)
+
+    def test_lookup_by_barcode_and_sku(self):
+        results = lookup_codes([' 6221000000011 ', 'SKU-001', 'UNKNOWN', ''])
+        self.assertEqual(list(results), ['6221000000011', 'SKU-001', 'UNKNOWN'])
+        self.assertIsNone(results['UNKNOWN'])
+
+        product = results['6221000000011']
+        self.assertEqual(product['id'], self.product.pk)
+        self.assertEqual((product['selling_price'], product['tax_rate']), ('15.00', '0.00'))
+        self.assertEqual(product['total_stock'], 10)
+        self.assertEqual(
+            {row['warehouse_id']: row['quantity'] for row in product['stock']},
+            {self.warehouse.pk: 7, self.other_warehouse.pk: 3},
+        )
+        self.assertEqual(lookup_code('SKU-001', self.other_warehouse.pk)['total_stock'], 3)
+
+    def test_cached_lookup_reads_stock_only(self):
+        lookup_code('6221000000011')
+        with self.assertNumQueries(1):
+            product = lookup_code('6221000000011')
+        self.assertEqual(product['total_stock'], 10)
+
+    def test_product_change_invalidates_cache(self):
+        lookup_code('6221000000011')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.selling_price = 20
+            self.product.save()
+        self.assertEqual(lookup_code('6221000000011')['selling_price'], '20.00')
+
+    def test_cached_product_expires(self):
+        lookup_code('6221000000011')
+        # تعديل بدون إشارات لا يبطل الذاكرة، لكن المنتج المحفوظ لا يُستخدم بعد انتهاء عمره
+        Product.objects.filter(pk=self.product.pk).update(selling_price=25)
+        self.assertEqual(lookup_code('6221000000011')['selling_price'], '15.00')
+        with override_settings(PRODUCT_LOOKUP_CACHE_MAX_AGE=-1):
+            self.assertEqual(lookup_code('6221000000011')['selling_price'], '25.00')
+
+    def test_barcode_is_unique(self):
+        from django.db import IntegrityError
+
+        other = Product.objects.create(
+            name='منتج آخر', sku='SKU-002', barcode='', category=self.category, unit=self.unit,
+            cost_price=1, selling_price=2, created_by=self.user
+        )
+        self.assertIsNone(other.barcode)
+        other.barcode = self.product.barcode
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            other.save()
+
+    @override_settings(PRODUCT_LOOKUP_MAX_CODES=2)
+    def test_api(self):
+        import json
+
+        self.client.force_login(self.user)
+        url = reverse('product:product_lookup_api')
+        response = self.client.get(url, {'code': ['SKU-001', 'NOPE']})
+        data = response.json()
+        self.assertEqual(data['missing'], ['NOPE'])
+        self.assertEqual(data['results']['SKU-001']['total_stock'], 10)
+
+        response = self.client.post(
+            url, json.dumps({'codes': ['6221000000011'], 'warehouse': self.warehouse.pk}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.json()['results']['6221000000011']['total_stock'], 7)
+
+        response = self.client.post(url, json.dumps({'codes': ['a', 'b', 'c']}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class InventoryAsOfTest(StockTestMixin, TestCase):
+    """
+    اختبارات المخزون في تاريخ سابق
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.movement_at('in', 10, datetime.date(2024, 1, 10))
+        self.transfer = self.movement_at(
+            'transfer', 4, datetime.date(2024, 1, 20), destination_warehouse=self.other_warehouse
+        )
+        self.movement_at('out', 3, datetime.date(2024, 2, 5))
+        self.movement_at('adjustment', 20, datetime.date(2024, 2, 15))
+        self.movement_at('in', 1, datetime.date(2024, 2, 20))
+        self.movement_at('out', 2, datetime.date(2024, 3, 1), warehouse=self.other_warehouse)
+
+    def movement_at(self, movement_type, quantity, date, **kwargs):
+        movement = self.create_movement(movement_type, quantity, **kwargs)
+        timestamp = timezone.make_aware(datetime.datetime.combine(date, datetime.time(12)))
+        StockMovement.objects.filter(pk=movement.pk).update(timestamp=timestamp)
+        movement.timestamp = timestamp
+        return movement
+
+    def assert_quantities(self, as_of, main, sub):
+        quantities = quantities_as_of(as_of)
+        self.assertEqual(quantities.get((self.product.pk, self.warehouse.pk), 0), main)
+        self.assertEqual(quantities.get((self.product.pk, self.other_warehouse.pk), 0), sub)
+
+    def assert_history(self):
+        self.assert_quantities(datetime.date(2023, 12, 31), 0, 0)
+        self.assert_quantities(datetime.date(2024, 1, 31), 6, 4)
+        self.assert_quantities(datetime.date(2024, 2, 10), 3, 4)
+        self.assert_quantities(datetime.date(2024, 2, 29), 21, 4)
+        self.assert_quantities(datetime.date(2024, 3, 31), 21, 2)
+
+    def test_quantities_from_movements(self):
+        self.assert_history()
+        self.assertEqual(quantity_as_of(self.product.pk, self.warehouse.pk, datetime.date(2024, 2, 10)), 3)
+
+    def test_quantities_from_checkpoints(self):
+        self.assertEqual(build_checkpoints(datetime.date(2024, 2, 1)), 3)
+        self.assertEqual(checkpoint_watermark(), datetime.date(2024, 2, 1))
+        self.assert_history()
+        # اللقطة + تأثير حركات الفترة: عدد ثابت من الاستعلامات
+        with self.assertNumQueries(5):
+            quantities_as_of(datetime.date(2024, 3, 31))
+
+    def test_checkpoints_skip_months_without_movements(self):
+        self.movement_at('in', 5, datetime.date(2024, 6, 3))
+        self.assertEqual(build_checkpoints(datetime.date(2024, 7, 1)), 5)
+        self.assertEqual(
+            sorted(set(StockCheckpoint.objects.values_list('period', flat=True))),
+            [datetime.date(2024, 1, 1), datetime.date(2024, 2, 1), datetime.date(2024, 3, 1), datetime.date(2024, 6, 1)],
+        )
+        self.assertEqual(checkpoint_watermark(), datetime.date(2024, 6, 1))
+        self.assert_quantities(datetime.date(2024, 6, 30), 26, 2)
+
+    def test_changing_closed_month_invalidates_checkpoints(self):
+        build_checkpoints(datetime.date(2024, 2, 1))
+        self.transfer.delete()
+        self.assertIsNone(checkpoint_watermark())
+        self.assert_quantities(datetime.date(2024, 1, 31), 10, 0)
+
+    def test_report_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('product:stock_as_of_report'), {'date': '2024-01-31'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_quantity'], 10)
+        self.assertEqual(
+            [(row['warehouse'], row['quantity']) for row in response.context['stocks']],
+            [(self.warehouse, 6), (self.other_warehouse, 4)],
+        )
+
+
+class DocumentNumberingTest(StockTestMixin, TestCase):
+    """
+    اختبارات خدمة ترقيم المستندات
+    """
+
+    def setUp(self):
+        super().setUp()
+        reset_local_cache()
+
+    def test_gapless_numbers_are_sequential(self):
+        self.assertEqual(peek_number('sale'), 'SALE0001')
+        self.assertEqual(allocate_number('sale'), 'SALE0001')
+        self.assertEqual(allocate_number('sale'), 'SALE0002')
+        self.assertEqual(peek_number('sale'), 'SALE0003')
+
+    def test_gapless_number_is_released_on_rollback(self):
+        allocate_number('sale')
+        try:
+            with transaction.atomic():
+                self.assertEqual(allocate_number('sale'), 'SALE0002')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(allocate_number('sale'), 'SALE0002')
+
+    def test_counter_is_seeded_from_existing_documents(self):
+        movement = self.create_movement('in', 1)
+        StockMovement.objects.filter(pk=movement.pk).update(number='MOV0041')
+        SerialNumber.objects.filter(document_type='stock_movement').delete()
+        reset_local_cache()
+        self.assertEqual(peek_number('stock_movement'), 'MOV0042')
+        self.assertEqual(allocate_number('stock_movement'), 'MOV0042')
+
+    @override_settings(DOCUMENT_NUMBER_BLOCK_SIZE=10)
+    def test_block_mode_reserves_numbers_once(self):
+        numbers = [allocate_number('stock_movement') for _ in range(3)]
+        self.assertEqual(numbers, ['MOV0001', 'MOV0002', 'MOV0003'])
+        serial = SerialNumber.objects.get(document_type='stock_movement', year=timezone.now().year)
+        self.assertEqual(serial.last_number, 10)
+
+    @override_settings(DOCUMENT_NUMBER_BLOCK_SIZE=10)
+    def test_block_is_discarded_after_rollback(self):
+        try:
+            with transaction.atomic():
+                allocate_number('stock_movement')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        # المجموعة المحجوزة داخل المعاملة الملغاة لا يعاد استخدامها
+        self.assertEqual(allocate_number('stock_movement'), 'MOV0001')
+
+    def test_movement_receives_number_on_save(self):
+        first = self.create_movement('in', 1)
+        second = self.create_movement('in', 1)
+        self.assertTrue(first.number.startswith('MOV'))
+        self.assertNotEqual(first.number, second.number)
+
+
+class StockExportTest(StockTestMixin, TestCase):
+    """
+    اختبارات التصدير المتدفق لحركات المخزون والجرد
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.create_movement('in', 5, notes='توريد')
+        self.create_movement('transfer', 2, destination_warehouse=self.other_warehouse)
+        self.client.force_login(self.user)
+
+    def test_stock_movements_csv_is_streamed(self):
+        response = self.client.get(reverse('product:export_stock_movements'), {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0][:4], ['ID', 'المنتج', 'المخزن', 'النوع'])
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row[7] for row in rows[1:]}, {'', 'المخزن الفرعي'})
+
+    def test_stock_movements_xlsx(self):
+        response = self.client.get(reverse('product:export_stock_movements'), {'format': 'xlsx'})
+        workbook = openpyxl.load_workbook(io.BytesIO(b''.join(response.streaming_content)))
+        rows = list(workbook.active.iter_rows(values_only=True))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[1][1], 'منتج')
+
+    def test_rows_are_read_with_one_query(self):
+        from utils.export import ExportColumn, iter_export_rows
+        from product.views import stock_status_label
+
+        columns = [
+            ExportColumn('المنتج', 'product__name'),
+            ExportColumn('الحالة', ('quantity', 'product__min_stock', 'product__max_stock'), stock_status_label),
+        ]
+        with self.assertNumQueries(1):
+            rows = list(iter_export_rows(Stock.objects.order_by('warehouse_id'), columns, chunk_size=1))
+        self.assertEqual(rows, [['منتج', 'مخزون زائد'], ['منتج', 'مخزون زائد']])
+
+    def test_inventory_csv(self):
+        response = self.client.get(reverse('product:export_warehouse_inventory_all'))
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row[3] for row in rows[1:]], ['المخزن الرئيسي', 'المخزن الفرعي'])
@@ -43,10 +43,14 @@ urlpatterns = [
     
     # المخزون
     path('stock/', views.stock_list, name='stock_list'),
+    path('stock/as-of/', views.stock_as_of_report, name='stock_as_of_report'),
+    path('stock/valuation/', views.inventory_valuation_report, name='inventory_valuation_report'),
     path('stock/<int:pk>/', views.stock_detail, name='stock_detail'),
     path('stock/<int:pk>/adjust/', views.stock_adjust, name='stock_adjust'),
     path('products/stock/<int:pk>/', views.product_stock_view, name='product_stock_view'),
     path('api/stock/', views.get_stock_by_warehouse, name='get_stock_by_warehouse'),
+    path('api/search/', views.product_search_api, name='product_search_api'),
+    path('api/lookup/', views.product_lookup_api, name='product_lookup_api'),
     
     # مسارات حركات المخزون
     path('stock-movements/', views.stock_movement_list, name='stock_movement_list'),
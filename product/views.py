@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib import messages
 from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.db import transaction
 from django.db.models import Sum, Q, F
 from django.http import JsonResponse, HttpResponse
 from django.template.loader import render_to_string
@@ -17,12 +18,18 @@ from .forms import (
 from django.utils.translation import gettext_lazy as _
 from django.urls import reverse
 from django.utils import timezone
-import csv
+from django.utils.dateparse import parse_date
 from io import BytesIO
+from .services.inventory import quantities_as_of
+from .services.valuation import costing_method, inventory_valuation, inventory_value
+from .services.search import matching_products, search_products
+from .services.lookup import lookup_codes, max_codes
+from utils.export import ExportColumn, choices_display, stream_csv_response, stream_xlsx_response
 from xhtml2pdf import pisa
 from django.template.loader import get_template
 from django.views.decorators.http import require_POST
 from django.core.exceptions import ValidationError
+import json
 import logging
 from decimal import Decimal
 
@@ -38,6 +45,10 @@ except ImportError:
 logger = logging.getLogger(__name__)
 
 
+# الترتيبات المسموحة لقائمة المنتجات حسب إجمالي المخزون
+PRODUCT_STOCK_ORDERINGS = ('total_stock', '-total_stock')
+
+
 @login_required
 def product_list(request):
     """
@@ -45,15 +56,23 @@ def product_list(request):
     """
     # استرجاع كل المنتجات بطريقة بسيطة
     try:
-        products = Product.objects.select_related('category', 'brand', 'unit').prefetch_related('stocks').all()
+        # المخزون الحالي من إجمالي المخزون المخزن في المنتج دون تحميل سجلات المخزون
+        products = Product.objects.select_related('category', 'brand', 'unit').all()
         
-        # البحث البسيط
+        # البحث في فهرس المنتجات (الاسم والرمز والباركود والعلامة التجارية والفئة)
         search_query = request.GET.get('search', '')
         if search_query:
-            products = products.filter(name__icontains=search_query)
+            products = products.filter(matching_products(search_query))
         
         # تطبيق التصفية
         filter_form = ProductSearchForm(request.GET)
+        if filter_form.is_valid() and filter_form.cleaned_data.get('in_stock'):
+            products = products.filter(total_stock__gt=0)
+        
+        # الترتيب حسب إجمالي المخزون (مفهرس)
+        ordering = request.GET.get('ordering')
+        if ordering in PRODUCT_STOCK_ORDERINGS:
+            products = products.order_by(ordering, 'name')
         
         context = {
             'products': products,
@@ -890,6 +909,99 @@ def stock_list(request):
     return render(request, 'product/stock_list.html', context)
 
 
+@login_required
+def stock_as_of_report(request):
+    """
+    تقرير المخزون في تاريخ سابق (من لقطات المخزون وحركاته)
+    """
+    try:
+        as_of = parse_date(request.GET.get('date') or '') or timezone.localdate()
+    except ValueError:
+        as_of = timezone.localdate()
+    
+    warehouse_id = request.GET.get('warehouse')
+    product_id = request.GET.get('product')
+    warehouse_ids = [int(warehouse_id)] if warehouse_id and warehouse_id.isdigit() else None
+    product_ids = [int(product_id)] if product_id and product_id.isdigit() else None
+    
+    quantities = quantities_as_of(as_of, product_ids, warehouse_ids)
+    rows = sorted(key for key, quantity in quantities.items() if quantity)
+    
+    # ترقيم الصفحات ثم تحميل بيانات المنتجات والمخازن للصفحة الحالية فقط
+    paginator = Paginator(rows, 50)
+    page = request.GET.get('page')
+    try:
+        page_rows = paginator.page(page)
+    except PageNotAnInteger:
+        page_rows = paginator.page(1)
+    except EmptyPage:
+        page_rows = paginator.page(paginator.num_pages)
+    
+    products = Product.objects.select_related('unit').in_bulk({key[0] for key in page_rows})
+    warehouses_by_id = Warehouse.objects.in_bulk({key[1] for key in page_rows})
+    page_rows.object_list = [
+        {'product': products.get(key[0]), 'warehouse': warehouses_by_id.get(key[1]), 'quantity': quantities[key]}
+        for key in page_rows.object_list
+    ]
+    
+    context = {
+        'stocks': page_rows,
+        'as_of': as_of,
+        'total_quantity': sum(quantities[key] for key in rows),
+        'warehouses': Warehouse.objects.filter(is_active=True),
+        'products': Product.objects.filter(is_active=True),
+        'warehouse_id': warehouse_id,
+        'product_id': product_id,
+        'page_title': 'المخزون في تاريخ',
+        'page_icon': 'fas fa-history',
+        'breadcrumb_items': [
+            {'title': 'الرئيسية', 'url': reverse('core:dashboard'), 'icon': 'fas fa-home'},
+            {'title': 'المخزون', 'url': reverse('product:stock_list'), 'icon': 'fas fa-boxes'},
+            {'title': 'المخزون في تاريخ', 'active': True}
+        ],
+    }
+    
+    return render(request, 'product/stock_as_of.html', context)
+
+
+@login_required
+def inventory_valuation_report(request):
+    """
+    تقرير تقييم المخزون الحالي (الكمية والقيمة ومتوسط التكلفة لكل منتج)
+    """
+    warehouse_id = request.GET.get('warehouse')
+    warehouse_ids = [int(warehouse_id)] if warehouse_id and warehouse_id.isdigit() else None
+    
+    paginator = Paginator(inventory_valuation(warehouse_ids), 50)
+    page = request.GET.get('page')
+    try:
+        rows = paginator.page(page)
+    except PageNotAnInteger:
+        rows = paginator.page(1)
+    except EmptyPage:
+        rows = paginator.page(paginator.num_pages)
+    
+    for row in rows:
+        row['average_cost'] = row['value'] / row['quantity'] if row['quantity'] else 0
+    
+    context = {
+        'rows': rows,
+        'totals': inventory_value(warehouse_ids),
+        'costing_method': costing_method(),
+        'warehouses': Warehouse.objects.filter(is_active=True),
+        'warehouse_id': warehouse_id,
+        'page_title': 'تقييم المخزون',
+        'page_icon': 'fas fa-coins',
+        'breadcrumb_items': [
+            {'title': 'الرئيسية', 'url': reverse('core:dashboard'), 'icon': 'fas fa-home'},
+            {'title': 'المخزون', 'url': reverse('product:stock_list'), 'icon': 'fas fa-boxes'},
+            {'title': 'تقييم المخزون', 'active': True}
+        ],
+    }
+    
+    return render(request, 'product/inventory_valuation.html', context)
+
+
 @login_required
 def stock_detail(request, pk):
     """
@@ -923,7 +1035,7 @@ def stock_adjust(request, pk):
         quantity = request.POST.get('quantity', 0)
         notes = request.POST.get('notes', '')
         
-        # إنشاء حركة تسوية
+        # إنشاء حركة تسوية (تعين كمية المخزون عند حفظها)
         StockMovement.objects.create(
             product=stock.product,
             warehouse=stock.warehouse,
@@ -933,10 +1045,6 @@ def stock_adjust(request, pk):
             created_by=request.user
         )
         
-        # تحديث المخزون
-        stock.quantity = Decimal(quantity)
-        stock.save()
-        
         messages.success(request, f'تم تسوية المخزون بنجاح')
         return redirect('product:stock_detail', pk=stock.pk)
     
@@ -1115,32 +1223,7 @@ def stock_movement_delete(request, pk):
     related_objects = {}
     
     if request.method == 'POST':
-        # استرجاع معلومات المخزن والمنتج قبل الحذف
-        warehouse = movement.warehouse
-        product = movement.product
-        
-        # الغاء تأثير حركة المخزون
-        if movement.movement_type == 'in':
-            # إذا كانت حركة إضافة، نقوم بخصم الكمية
-            stock = Stock.objects.get(warehouse=warehouse, product=product)
-            stock.quantity -= Decimal(movement.quantity)
-            stock.save()
-        elif movement.movement_type == 'out':
-            # إذا كانت حركة سحب، نقوم بإضافة الكمية
-            stock = Stock.objects.get(warehouse=warehouse, product=product)
-            stock.quantity += Decimal(movement.quantity)
-            stock.save()
-        elif movement.movement_type == 'transfer' and movement.destination_warehouse:
-            # إذا كانت حركة تحويل، نقوم بعكس التحويل
-            source_stock = Stock.objects.get(warehouse=warehouse, product=product)
-            dest_stock = Stock.objects.get(warehouse=movement.destination_warehouse, product=product)
-            
-            source_stock.quantity += Decimal(movement.quantity)
-            dest_stock.quantity -= Decimal(movement.quantity)
-            
-            source_stock.save()
-            dest_stock.save()
-        
+        # إلغاء تأثير الحركة على المخزون يتم عبر إشارة الحذف
         # حذف حركة المخزون
         movement.delete()
         
@@ -1230,39 +1313,31 @@ def add_stock_movement(request):
                 'error': _('نوع الحركة غير صحيح. القيم المقبولة: in, out, adjustment, transfer')
             })
         
-        # الحصول على المخزون الحالي أو إنشاء سجل جديد
-        stock, created = Stock.objects.get_or_create(
-            product=product,
-            warehouse=warehouse,
-            defaults={'quantity': 0}
-        )
+        # قراءة المخزون الحالي للتحقق فقط (التحديث الفعلي يتم ذرياً عند حفظ الحركة)
+        available = Stock.objects.filter(
+            product=product, warehouse=warehouse
+        ).values_list('quantity', flat=True).first() or 0
+        destination_warehouse = None
         
-        # حفظ المخزون الحالي قبل التعديل
-        current_stock = stock.quantity
-        
-        # تنفيذ عملية المخزون
+        # التحقق من العملية وتجهيز رسالة النجاح
         if movement_type == 'in':
             # إضافة مخزون
-            stock.quantity += Decimal(quantity)
             message = _('تمت إضافة {} وحدة من {} إلى المخزون').format(quantity, product.name)
             
         elif movement_type == 'out':
             # سحب مخزون
-            if stock.quantity < Decimal(quantity):
+            if available < Decimal(quantity):
                 return JsonResponse({
                     'success': False, 
-                    'error': _('الكمية غير كافية في المخزون. المتاح حالياً: {}').format(stock.quantity)
+                    'error': _('الكمية غير كافية في المخزون. المتاح حالياً: {}').format(available)
                 })
             
-            stock.quantity -= Decimal(quantity)
             message = _('تم سحب {} وحدة من {} من المخزون').format(quantity, product.name)
             
         elif movement_type == 'adjustment':
             # تعديل المخزون (تعيين قيمة محددة)
-            old_quantity = stock.quantity
-            stock.quantity = Decimal(quantity)
             message = _('تم تعديل مخزون {} من {} إلى {}').format(
-                product.name, old_quantity, quantity
+                product.name, available, quantity
             )
             
         elif movement_type == 'transfer':
@@ -1290,63 +1365,50 @@ def add_stock_movement(request):
                 })
             
             # التحقق من كفاية المخزون
-            if stock.quantity < Decimal(quantity):
+            if available < Decimal(quantity):
                 return JsonResponse({
                     'success': False, 
-                    'error': _('الكمية غير كافية للتحويل. المتاح حالياً: {}').format(stock.quantity)
+                    'error': _('الكمية غير كافية للتحويل. المتاح حالياً: {}').format(available)
                 })
-                
-            # خصم من المخزن المصدر
-            stock.quantity -= Decimal(quantity)
-            
-            # إضافة إلى المخزن المستلم
-            dest_stock, created = Stock.objects.get_or_create(
-                product=product,
-                warehouse=destination_warehouse,
-                defaults={'quantity': Decimal('0')}
-            )
-            
-            dest_before = dest_stock.quantity
-            dest_stock.quantity += Decimal(quantity)
-            dest_stock.save()
             
             message = _('تم تحويل {} وحدة من {} من {} إلى {}').format(
                 quantity, product.name, warehouse.name, destination_warehouse.name
             )
         
-        # حفظ التغييرات
-        stock.save()
-        
-        # إنشاء سجل حركة المخزون
-        movement = StockMovement.objects.create(
-            product=product,
-            warehouse=warehouse,
-            movement_type=movement_type,
-            quantity=quantity,
-            quantity_before=current_stock,
-            quantity_after=stock.quantity,
-            reference_number=request.POST.get('reference_number', ''),
-            notes=request.POST.get('notes', ''),
-            created_by=request.user
-        )
-        
-        # إذا كانت حركة تحويل، حفظ المخزن المستلم
-        if movement_type == 'transfer' and 'destination_warehouse' in locals():
-            movement.destination_warehouse = destination_warehouse
-            movement.save()
-            
-            # إنشاء سجل حركة للمخزن المستلم
-            StockMovement.objects.create(
+        with transaction.atomic():
+            # إنشاء سجل حركة المخزون (يتم ترحيلها على المخزون عند الحفظ)
+            movement = StockMovement(
                 product=product,
-                warehouse=destination_warehouse,
-                movement_type='transfer_in',
+                warehouse=warehouse,
+                movement_type=movement_type,
                 quantity=quantity,
-                quantity_before=dest_before,
-                quantity_after=dest_stock.quantity,
+                destination_warehouse=destination_warehouse,
                 reference_number=request.POST.get('reference_number', ''),
-                notes=_('تحويل من مخزن {}').format(warehouse.name),
+                notes=request.POST.get('notes', ''),
                 created_by=request.user
             )
+            movement.save()
+            
+            # إذا كانت حركة تحويل، إنشاء سجل حركة للمخزن المستلم للعرض فقط
+            # (المخزن المستلم تم ترحيله مع حركة التحويل نفسها)
+            if destination_warehouse is not None:
+                dest_quantity = Stock.objects.filter(
+                    product=product, warehouse=destination_warehouse
+                ).values_list('quantity', flat=True).get()
+                incoming = StockMovement(
+                    product=product,
+                    warehouse=destination_warehouse,
+                    movement_type='transfer_in',
+                    quantity=quantity,
+                    unit_cost=movement.unit_cost,
+                    quantity_before=dest_quantity - int(quantity),
+                    quantity_after=dest_quantity,
+                    reference_number=request.POST.get('reference_number', ''),
+                    notes=_('تحويل من مخزن {}').format(warehouse.name),
+                    created_by=request.user
+                )
+                incoming._skip_update = True
+                incoming.save()
         
         # تسجيل الحركة في سجل النظام
         logger.info(
@@ -1362,7 +1424,7 @@ def add_stock_movement(request):
             'success': True, 
             'message': message,
             'movement_id': movement.id,
-            'current_stock': stock.quantity
+            'current_stock': movement.quantity_after
         })
         
     except ValidationError as e:
@@ -1380,16 +1442,26 @@ def add_stock_movement(request):
         })
 
 
+def stock_status_label(quantity, min_stock, max_stock):
+    """
+    حالة المخزون حسب الكمية والحدين الأدنى والأقصى للمنتج
+    """
+    if quantity <= 0:
+        return 'نفذ من المخزون'
+    if quantity < min_stock:
+        return 'مخزون منخفض'
+    if quantity > max_stock:
+        return 'مخزون زائد'
+    return 'مخزون جيد'
+
+
 @login_required
 def export_stock_movements(request):
     """
     تصدير حركات المخزون كملف CSV أو PDF
     """
     # الحصول على الحركات مع تطبيق الفلاتر
-    movements = StockMovement.objects.all().select_related(
-        'product', 'product__category', 'product__brand',
-        'warehouse', 'destination_warehouse', 'created_by'
-    ).order_by('-timestamp')
+    movements = StockMovement.objects.all().order_by('-timestamp')
     
     # تطبيق الفلاتر
     warehouse_id = request.GET.get('warehouse')
@@ -1418,41 +1490,34 @@ def export_stock_movements(request):
     # تحديد نوع التصدير
     export_format = request.GET.get('format', 'csv')
     
-    if export_format == 'csv':
-        # تصدير CSV
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="stock_movements.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow([
-            'ID', 'المنتج', 'المخزن', 'النوع', 'الكمية', 
-            'المخزون قبل', 'المخزون بعد', 'المخزن المستلم',
-            'رقم المرجع', 'ملاحظات', 'التاريخ'
-        ])
-        
-        for movement in movements:
-            writer.writerow([
-                movement.id,
-                movement.product.name,
-                movement.warehouse.name,
-                movement.get_movement_type_display(),
-                movement.quantity,
-                movement.quantity_before,
-                movement.quantity_after,
-                movement.destination_warehouse.name if movement.destination_warehouse else '',
-                movement.reference_number,
-                movement.notes,
-                movement.timestamp.strftime('%Y-%m-%d %H:%M')
-            ])
-        
-        return response
+    if export_format in ('csv', 'xlsx'):
+        # تصدير متدفق: القراءة على دفعات بدون تحميل كل الحركات في الذاكرة
+        columns = [
+            ExportColumn('ID', 'id'),
+            ExportColumn('المنتج', 'product__name'),
+            ExportColumn('المخزن', 'warehouse__name'),
+            ExportColumn('النوع', 'movement_type', choices_display(StockMovement.MOVEMENT_TYPES)),
+            ExportColumn('الكمية', 'quantity'),
+            ExportColumn('المخزون قبل', 'quantity_before'),
+            ExportColumn('المخزون بعد', 'quantity_after'),
+            ExportColumn('المخزن المستلم', 'destination_warehouse__name', lambda name: name or ''),
+            ExportColumn('رقم المرجع', 'reference_number'),
+            ExportColumn('ملاحظات', 'notes'),
+            ExportColumn('التاريخ', 'timestamp', lambda value: value.strftime('%Y-%m-%d %H:%M')),
+        ]
+        if export_format == 'xlsx':
+            return stream_xlsx_response(movements, columns, 'stock_movements.xlsx', sheet_name='Stock Movements')
+        return stream_csv_response(movements, columns, 'stock_movements.csv')
     
     elif export_format == 'pdf':
         # تصدير PDF
         # هنا سنستخدم HTML كوسيط لإنشاء PDF
         template = get_template('product/exports/stock_movements_pdf.html')
         context = {
-            'movements': movements,
+            'movements': movements.select_related(
+                'product', 'product__category', 'product__brand',
+                'warehouse', 'destination_warehouse', 'created_by'
+            ),
             'today': timezone.now(),
             'request': request,
         }
@@ -1480,7 +1545,7 @@ def export_warehouse_inventory_all(request):
     تصدير المخزون من جميع المخازن أو حسب التصفية
     """
     # جلب المخزون
-    stocks = Stock.objects.all().select_related('product', 'product__category', 'warehouse')
+    stocks = Stock.objects.order_by('warehouse_id', 'product_id')
     
     # التصفية حسب المخزن إذا تم تحديده
     warehouse_id = request.GET.get('warehouse')
@@ -1504,41 +1569,22 @@ def export_warehouse_inventory_all(request):
     # تحديد نوع التصدير
     export_format = request.GET.get('format', 'csv')
     
-    if export_format == 'csv':
-        # تصدير CSV
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = 'attachment; filename="inventory.csv"'
-        
-        writer = csv.writer(response)
-        writer.writerow([
-            'رقم المنتج', 'اسم المنتج', 'SKU', 'المخزن', 'الفئة', 'الكمية', 
-            'الحد الأدنى', 'الحد الأقصى', 'حالة المخزون'
-        ])
-        
-        for stock in stocks:
-            # تحديد حالة المخزون
-            if stock.quantity <= 0:
-                status = 'نفذ من المخزون'
-            elif stock.quantity < stock.product.min_stock:
-                status = 'مخزون منخفض'
-            elif stock.quantity > stock.product.max_stock:
-                status = 'مخزون زائد'
-            else:
-                status = 'مخزون جيد'
-            
-            writer.writerow([
-                stock.product.id,
-                stock.product.name,
-                stock.product.sku,
-                stock.warehouse.name,
-                stock.product.category.name if stock.product.category else '',
-                stock.quantity,
-                stock.product.min_stock,
-                stock.product.max_stock,
-                status
-            ])
-        
-        return response
+    if export_format in ('csv', 'xlsx'):
+        # تصدير متدفق: القراءة على دفعات بدون تحميل كل المخزون في الذاكرة
+        columns = [
+            ExportColumn('رقم المنتج', 'product_id'),
+            ExportColumn('اسم المنتج', 'product__name'),
+            ExportColumn('SKU', 'product__sku'),
+            ExportColumn('المخزن', 'warehouse__name'),
+            ExportColumn('الفئة', 'product__category__name', lambda name: name or ''),
+            ExportColumn('الكمية', 'quantity'),
+            ExportColumn('الحد الأدنى', 'product__min_stock'),
+            ExportColumn('الحد الأقصى', 'product__max_stock'),
+            ExportColumn('حالة المخزون', ('quantity', 'product__min_stock', 'product__max_stock'), stock_status_label),
+        ]
+        if export_format == 'xlsx':
+            return stream_xlsx_response(stocks, columns, 'inventory.xlsx', sheet_name='Inventory')
+        return stream_csv_response(stocks, columns, 'inventory.csv')
     
     # يمكن إضافة تصدير PDF هنا لاحقاً
     return redirect('product:stock_list')
@@ -1557,46 +1603,25 @@ def export_warehouse_inventory(request, warehouse_id=None):
             return export_warehouse_inventory_all(request)
     
     warehouse = get_object_or_404(Warehouse, pk=warehouse_id)
-    stocks = Stock.objects.filter(warehouse=warehouse).select_related('product')
+    stocks = Stock.objects.filter(warehouse=warehouse).order_by('product_id')
     
     # التصفية حسب المنتج إذا تم تحديده
     product_id = request.GET.get('product')
     if product_id and product_id.isdigit():
         stocks = stocks.filter(product_id=product_id)
     
-    # تصدير CSV
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="{warehouse.name}_inventory.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'رقم المنتج', 'اسم المنتج', 'SKU', 'الفئة', 'الكمية', 
-        'الحد الأدنى', 'الحد الأقصى', 'حالة المخزون'
-    ])
-    
-    for stock in stocks:
-        # تحديد حالة المخزون
-        if stock.quantity <= 0:
-            status = 'نفذ من المخزون'
-        elif stock.quantity < stock.product.min_stock:
-            status = 'مخزون منخفض'
-        elif stock.quantity > stock.product.max_stock:
-            status = 'مخزون زائد'
-        else:
-            status = 'مخزون جيد'
-        
-        writer.writerow([
-            stock.product.id,
-            stock.product.name,
-            stock.product.sku,
-            stock.product.category.name if stock.product.category else '',
-            stock.quantity,
-            stock.product.min_stock,
-            stock.product.max_stock,
-            status
-        ])
-    
-    return response
+    # تصدير CSV متدفق
+    columns = [
+        ExportColumn('رقم المنتج', 'product_id'),
+        ExportColumn('اسم المنتج', 'product__name'),
+        ExportColumn('SKU', 'product__sku'),
+        ExportColumn('الفئة', 'product__category__name', lambda name: name or ''),
+        ExportColumn('الكمية', 'quantity'),
+        ExportColumn('الحد الأدنى', 'product__min_stock'),
+        ExportColumn('الحد الأقصى', 'product__max_stock'),
+        ExportColumn('حالة المخزون', ('quantity', 'product__min_stock', 'product__max_stock'), stock_status_label),
+    ]
+    return stream_csv_response(stocks, columns, f'{warehouse.name}_inventory.csv')
 
 
 @login_required
@@ -1713,6 +1738,75 @@ def get_stock_by_warehouse(request):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+@login_required
+def product_search_api(request):
+    """
+    API البحث السريع في المنتجات (للإكمال التلقائي) مرتباً حسب الصلة
+    """
+    try:
+        page = int(request.GET.get('page') or 1)
+        page_size = int(request.GET.get('page_size') or 0) or None
+    except ValueError:
+        return JsonResponse({'error': 'رقم الصفحة غير صحيح'}, status=400)
+    
+    results = search_products(request.GET.get('q', ''), page=page, page_size=page_size)
+    return JsonResponse({
+        'results': [
+            {
+                'id': product.pk,
+                'name': product.name,
+                'sku': product.sku,
+                'barcode': product.barcode or '',
+                'category': product.category.name if product.category_id else '',
+                'brand': product.brand.name if product.brand_id else '',
+                'unit': product.unit.symbol if product.unit_id else '',
+                'selling_price': str(product.selling_price),
+                'total_stock': product.total_stock,
+            }
+            for product in results.products
+        ],
+        'total': results.total,
+        'page': results.page,
+        'page_size': results.page_size,
+        'has_next': results.has_next,
+    })
+
+
+@login_required
+def product_lookup_api(request):
+    """
+    API البحث بالباركود أو رمز المنتج لنقاط البيع
+
+    يقبل رمزاً أو أكثر (GET: code مكرر، POST: JSON {"codes": [...], "warehouse": id})
+    ويُرجع لكل رمز المنتج وسعره وضريبته ومخزونه في كل مخزن.
+    """
+    if request.method == 'POST':
+        try:
+            payload = json.loads(request.body or '{}')
+        except ValueError:
+            return JsonResponse({'error': 'بيانات الطلب غير صحيحة'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'بيانات الطلب غير صحيحة'}, status=400)
+        codes = payload.get('codes') or []
+        warehouse_id = payload.get('warehouse')
+    else:
+        codes = request.GET.getlist('code')
+        warehouse_id = request.GET.get('warehouse')
+    
+    if not isinstance(codes, list):
+        return JsonResponse({'error': 'قائمة الرموز غير صحيحة'}, status=400)
+    if len(codes) > max_codes():
+        return JsonResponse({'error': f'الحد الأقصى {max_codes()} رمز في الطلب الواحد'}, status=400)
+    if warehouse_id and not str(warehouse_id).isdigit():
+        return JsonResponse({'error': 'معرف المخزن غير صحيح'}, status=400)
+    
+    results = lookup_codes(codes, int(warehouse_id) if warehouse_id else None)
+    return JsonResponse({
+        'results': results,
+        'missing': [code for code, product in results.items() if product is None],
+    })
+
+
 @login_required
 def product_stock_view(request, pk):
     """
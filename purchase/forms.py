@@ -1,3 +1,5 @@
+import uuid
+
 from django import forms
 from django.core.exceptions import ValidationError
 from .models import Purchase, PurchaseItem, PurchasePayment, PurchaseOrder, PurchaseOrderItem, PurchaseReturn, PurchaseReturnItem
@@ -82,6 +84,9 @@ class PurchaseForm(forms.ModelForm):
         required=False
     )
     
+    # مفتاح يُولد مع كل نموذج جديد لمنع إنشاء الفاتورة مرتين عند إعادة الإرسال
+    idempotency_key = forms.CharField(widget=forms.HiddenInput, required=False, max_length=64)
+    
     class Meta:
         model = Purchase
         fields = ['supplier', 'warehouse', 'purchase_order', 'date', 'number', 'discount', 'payment_method', 'notes']
@@ -100,10 +105,19 @@ class PurchaseForm(forms.ModelForm):
         # تعيين طريقة الدفع "نقدي" بشكل افتراضي
         if not self.initial.get('payment_method'):
             self.initial['payment_method'] = 'cash'
+        
+        # رقم الفاتورة الجديدة يتم توليده تلقائياً
+        if not self.instance.pk:
+            self.fields['number'].required = False
+            if not self.is_bound:
+                self.initial.setdefault('idempotency_key', uuid.uuid4().hex)
     
     def clean_number(self):
+        # رقم الفاتورة الجديدة المعروض في النموذج للعرض فقط، ويتم حجزه من العداد عند الحفظ
+        if not self.instance.pk:
+            return ''
         number = self.cleaned_data.get('number')
-        if not self.instance.pk and Purchase.objects.filter(number=number).exists():
+        if Purchase.objects.filter(number=number).exclude(pk=self.instance.pk).exists():
             raise ValidationError('رقم الفاتورة موجود بالفعل')
         return number
     
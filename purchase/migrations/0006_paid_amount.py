@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:22
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_paid_amounts(apps, schema_editor):
+    """
+    حساب المبلغ المدفوع للفواتير الموجودة من دفعاتها
+    """
+    Purchase = apps.get_model('purchase', 'Purchase')
+    PurchasePayment = apps.get_model('purchase', 'PurchasePayment')
+    paid = PurchasePayment.objects.filter(purchase=OuterRef('pk')).order_by().values('purchase').annotate(
+        paid=Sum('amount')
+    ).values('paid')
+    Purchase.objects.update(paid_amount=Coalesce(
+        Subquery(paid, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        Value(Decimal('0')),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0005_purchase_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='المبلغ المدفوع'),
+        ),
+        migrations.RunPython(populate_paid_amounts, migrations.RunPython.noop),
+    ]
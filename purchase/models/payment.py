@@ -2,6 +2,8 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 
+from core.outbox import outbox
+
 class PurchasePayment(models.Model):
     """
     نموذج مدفوعات فواتير المشتريات
@@ -37,6 +39,6 @@ class PurchasePayment(models.Model):
         is_new = self.pk is None
         super().save(*args, **kwargs)
         
-        # تحديث حالة الدفع للفاتورة
+        # تحديث حالة الدفع للفاتورة (انظر core.outbox)
         if self.purchase:
-            self.purchase.update_payment_status() 
\ No newline at end of file
+            outbox.publish('purchase.payment_status', self.purchase)
\ No newline at end of file
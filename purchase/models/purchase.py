@@ -1,7 +1,11 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
-from django.utils import timezone
+
+from core.outbox import outbox
+from utils.balances import post_balance_entry
+from utils.payments import PaymentTotalsQuerySet, refresh_paid_amount
+from utils.returns import compute_return_statuses
 from django.urls import reverse
 
 class Purchase(models.Model):
@@ -30,12 +34,17 @@ class Purchase(models.Model):
     total = models.DecimalField(_('الإجمالي'), max_digits=12, decimal_places=2)
     payment_method = models.CharField(_('طريقة الدفع'), max_length=20, choices=PAYMENT_METHODS)
     payment_status = models.CharField(_('حالة الدفع'), max_length=20, choices=PAYMENT_STATUSES, default='unpaid')
+    paid_amount = models.DecimalField(_('المبلغ المدفوع'), max_digits=12, decimal_places=2, default=0, editable=False)
     notes = models.TextField(_('ملاحظات'), blank=True, null=True)
+    idempotency_key = models.CharField(_('مفتاح منع التكرار'), max_length=64, unique=True,
+                                       blank=True, null=True, editable=False)
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT,
                                  verbose_name=_('أنشئ بواسطة'), related_name='purchases_created')
     
+    objects = PaymentTotalsQuerySet.as_manager()
+    
     class Meta:
         verbose_name = _('فاتورة مشتريات')
         verbose_name_plural = _('فواتير المشتريات')
@@ -54,53 +63,31 @@ class Purchase(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.number:
-            # الحصول على الرقم التسلسلي
-            from product.models import SerialNumber
-            
-            # البحث عن آخر رقم مستخدم
-            last_purchase = Purchase.objects.order_by('-number').first()
-            if last_purchase:
-                try:
-                    last_number = int(last_purchase.number.replace('PUR', ''))
-                except ValueError:
-                    last_number = 0
-            else:
-                last_number = 0
-            
-            # إنشاء أو تحديث الرقم التسلسلي
-            serial = SerialNumber.objects.get_or_create(
-                document_type='purchase',
-                year=timezone.now().year,
-                defaults={
-                    'prefix': 'PUR',
-                    'last_number': last_number
-                }
-            )[0]
-            
-            # تحديث آخر رقم إذا كان أقل من الرقم الحالي
-            if serial.last_number <= last_number:
-                serial.last_number = last_number
-                serial.save()
-            
-            next_number = serial.get_next_number()
-            self.number = f"{serial.prefix}{next_number:04d}"
+            # حجز الرقم التالي من عداد المشتريات داخل معاملة الحفظ
+            from product.services.numbering import allocate_number
+            self.number = allocate_number('purchase')
+        
         super().save(*args, **kwargs)
         
-        # تحديث حالة الدفع بعد الحفظ
-        self.update_payment_status()
+        # تحديث حالة الدفع (مرة واحدة في نهاية outbox.atomic، انظر core.outbox)
+        outbox.publish('purchase.payment_status', self)
     
     @property
     def amount_paid(self):
         """
-        حساب المبلغ المدفوع
+        المبلغ المدفوع (من with_payment_totals إن وجد، وإلا من العمود المخزن)
         """
-        return self.payments.aggregate(models.Sum('amount'))['amount__sum'] or 0
+        if 'paid_total' in self.__dict__:
+            return self.paid_total
+        return self.paid_amount
     
     @property
     def amount_due(self):
         """
-        حساب المبلغ المتبقي
+        المبلغ المتبقي
         """
+        if 'due_total' in self.__dict__:
+            return self.due_total
         return self.total - self.amount_paid
     
     @property
@@ -114,6 +101,8 @@ class Purchase(models.Model):
         """
         تحديث حالة الدفع
         """
+        # قراءة المدفوع مرة واحدة من الدفعات، ثم تستخدم كل الحسابات التالية العمود المخزن
+        refresh_paid_amount(self)
         old_status = self.payment_status
         old_method = getattr(self, '_original_payment_method', self.payment_method)
         old_total = getattr(self, '_original_total', self.total)
@@ -126,48 +115,45 @@ class Purchase(models.Model):
             new_status = 'unpaid'
             
         # تحديث مديونية المورد بناءً على تغييرات حالة الدفع أو طريقة الدفع أو المبلغ الإجمالي
+        # يتم تجميع التغيير في قيمة واحدة وتسجيله كقيد في سجل رصيد المورد
         supplier = self.supplier
+        delta = 0
         if supplier:
             # إذا تغيرت طريقة الدفع من آجل إلى نقدي
             if old_method == 'credit' and self.payment_method == 'cash':
                 # إلغاء المديونية القديمة (المبلغ الكامل للفاتورة الآجلة)
-                supplier.balance -= old_total
+                delta -= old_total
                 
                 # إضافة المديونية الجديدة فقط إذا كانت الفاتورة النقدية غير مدفوعة بالكامل
                 if new_status != 'paid':
-                    supplier.balance += self.amount_due
-                
-                supplier.save(update_fields=['balance'])
+                    delta += self.amount_due
             
             # إذا تغيرت طريقة الدفع من نقدي إلى آجل
             elif old_method == 'cash' and self.payment_method == 'credit':
                 # إلغاء المديونية القديمة (قد تكون صفر إذا كانت مدفوعة بالكامل)
                 if old_status != 'paid':
                     amount_was_due = old_total - self.amount_paid
-                    supplier.balance -= amount_was_due
+                    delta -= amount_was_due
                 
                 # إضافة المديونية الجديدة (المبلغ الكامل للفاتورة الآجلة)
-                supplier.balance += self.total
-                supplier.save(update_fields=['balance'])
+                delta += self.total
                 
             # إذا تغير المبلغ الإجمالي (مع بقاء نفس طريقة الدفع)
             elif old_total != self.total:
                 # للفواتير الآجلة
                 if self.payment_method == 'credit':
                     # إلغاء المديونية القديمة وإضافة المديونية الجديدة
-                    supplier.balance -= old_total
-                    supplier.balance += self.total
-                    supplier.save(update_fields=['balance'])
+                    delta -= old_total
+                    delta += self.total
                 # للفواتير النقدية غير المدفوعة بالكامل
                 elif self.payment_method == 'cash' and new_status != 'paid':
                     # إلغاء المديونية القديمة (إذا كانت موجودة)
                     if old_status != 'paid':
                         amount_was_due = old_total - self.amount_paid
-                        supplier.balance -= amount_was_due
+                        delta -= amount_was_due
                     
                     # إضافة المديونية الجديدة
-                    supplier.balance += self.amount_due
-                    supplier.save(update_fields=['balance'])
+                    delta += self.amount_due
             
             # إذا تغيرت حالة الدفع فقط، بدون تغيير طريقة الدفع أو المبلغ
             elif old_status != new_status:
@@ -176,23 +162,23 @@ class Purchase(models.Model):
                     if old_status == 'unpaid' and new_status == 'partially_paid':
                         # إذا تغيرت من غير مدفوعة إلى مدفوعة جزئياً
                         # نضيف المبلغ المتبقي لمديونية المورد
-                        supplier.balance += self.amount_due
-                        supplier.save(update_fields=['balance'])
+                        delta += self.amount_due
                     elif old_status == 'partially_paid' and new_status == 'paid':
                         # إذا تغيرت من مدفوعة جزئياً إلى مدفوعة بالكامل
                         # نلغي المديونية المتبقية
                         amount_was_due = old_total - self.amount_paid
-                        supplier.balance -= amount_was_due
-                        supplier.save(update_fields=['balance'])
+                        delta -= amount_was_due
                     elif old_status == 'paid' and new_status in ['partially_paid', 'unpaid']:
                         # إذا تغيرت من مدفوعة بالكامل إلى غير مدفوعة بالكامل
                         # نضيف المبلغ المتبقي لمديونية المورد
-                        supplier.balance += self.amount_due
-                        supplier.save(update_fields=['balance'])
+                        delta += self.amount_due
+            
+            post_balance_entry(supplier, delta, 'purchase_update', self.number)
         
         # تحديث حالة الدفع في قاعدة البيانات
         if old_status != new_status:
             Purchase.objects.filter(pk=self.pk).update(payment_status=new_status)
+            self.payment_status = new_status
         
         # احفظ القيم الحالية للاستخدام في المرة التالية
         self._original_payment_method = self.payment_method
@@ -203,42 +189,20 @@ class Purchase(models.Model):
         """
         فحص إذا كانت الفاتورة مرتجعة (كليًا أو جزئيًا)
         """
-        confirmed_returns = self.returns.filter(status='confirmed')
-        return confirmed_returns.exists()
+        if '_return_status' in self.__dict__:
+            return self._return_status is not None
+        return self.returns.filter(status='confirmed').exists()
     
     @property
     def return_status(self):
         """
         حالة الإرجاع للفاتورة (كلي، جزئي، غير مرتجع)
-        """
-        confirmed_returns = self.returns.filter(status='confirmed')
         
-        if not confirmed_returns.exists():
-            return None
-        
-        # حساب إجمالي الكميات المشتراة
-        purchased_quantities = {}
-        for item in self.items.all():
-            purchased_quantities[item.id] = item.quantity
-            
-        # حساب إجمالي الكميات المرتجعة
-        returned_quantities = {}
-        for ret in confirmed_returns:
-            for item in ret.items.all():
-                purchase_item_id = item.purchase_item.id
-                if purchase_item_id in returned_quantities:
-                    returned_quantities[purchase_item_id] += item.quantity
-                else:
-                    returned_quantities[purchase_item_id] = item.quantity
-        
-        # فحص إذا كانت كل المنتجات مرتجعة بالكامل
-        for item_id, purchased_qty in purchased_quantities.items():
-            returned_qty = returned_quantities.get(item_id, 0)
-            if returned_qty < purchased_qty:
-                return 'partial'
-                
-        # إذا وصلنا إلى هنا فكل المنتجات مرتجعة بالكامل
-        return 'full'
+        تستخدم القيمة المرفقة من resolve_return_statuses عند عرض قائمة فواتير.
+        """
+        if '_return_status' in self.__dict__:
+            return self._return_status
+        return compute_return_statuses(type(self), [self.pk]).get(self.pk)
 
     def get_absolute_url(self):
         """
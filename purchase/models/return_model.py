@@ -1,7 +1,6 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
-from django.utils import timezone
 from django.urls import reverse
 
 class PurchaseReturn(models.Model):
@@ -47,31 +46,9 @@ class PurchaseReturn(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.number:
-            # الحصول على الرقم التسلسلي
-            from product.models import SerialNumber
-            
-            # البحث عن آخر رقم مستخدم
-            last_return = PurchaseReturn.objects.order_by('-number').first()
-            if last_return:
-                try:
-                    last_number = int(last_return.number.replace('PRET', ''))
-                except ValueError:
-                    last_number = 0
-            else:
-                last_number = 0
-            
-            # إنشاء أو تحديث الرقم التسلسلي
-            serial = SerialNumber.objects.get_or_create(
-                document_type='purchase_return',
-                year=timezone.now().year,
-                defaults={
-                    'prefix': 'PRET',
-                    'last_number': last_number
-                }
-            )[0]
-            
-            # توليد الرقم الجديد
-            self.number = serial.get_next_number()
+            # حجز الرقم التالي من عداد مرتجعات المشتريات داخل معاملة الحفظ
+            from product.services.numbering import allocate_number
+            self.number = allocate_number('purchase_return')
         
         super().save(*args, **kwargs)
 
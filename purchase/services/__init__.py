@@ -0,0 +1,7 @@
+"""
+خدمات المشتريات
+"""
+from purchase.services.receiving import (
+    PurchaseLine, parse_purchase_lines, find_duplicate, receive_purchase_items,
+    item_unit_cost,
+)
@@ -0,0 +1,145 @@
+"""
+خدمة استلام فواتير المشتريات
+
+تحفظ بنود الفاتورة وتضيفها للمخزون دفعة واحدة بعدد ثابت من الاستعلامات
+مهما كان عدد البنود:
+- جلب كل المنتجات باستعلام in_bulk واحد
+- إنشاء البنود بـ bulk_create
+- تحديث سعر الشراء للمنتجات المتغيرة بـ bulk_update
+- ترحيل حركات الوارد مجمعة لكل (منتج، مخزن) بتمريرة واحدة، بتكلفة الوحدة
+  الصافية لكل بند (بعد الخصم) لتقييم المخزون
+
+منع التكرار يتم بمفتاح idempotency_key على الفاتورة نفسها (فريد في قاعدة
+البيانات) بدلاً من البحث عن حركات سابقة بالرقم المرجعي.
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+
+from product.models import Product, StockMovement
+from product.services.stock import create_movements
+from purchase.models import Purchase, PurchaseItem
+
+# بند فاتورة مشتريات بعد التحقق من قيمه
+PurchaseLine = namedtuple('PurchaseLine', ['product_id', 'quantity', 'unit_price', 'discount'])
+
+
+def parse_purchase_lines(data):
+    """
+    قراءة بنود فاتورة المشتريات من بيانات النموذج المرسلة
+
+    المعلمات:
+    data (QueryDict): بيانات الطلب (product[] و quantity[] و unit_price[] و discount[])
+
+    تُرجع: قائمة PurchaseLine (مع تخطي الصفوف الفارغة)
+    """
+    product_ids = data.getlist('product[]')
+    quantities = data.getlist('quantity[]')
+    unit_prices = data.getlist('unit_price[]')
+    discounts = data.getlist('discount[]')
+
+    lines = []
+    for i in range(len(product_ids)):
+        if not product_ids[i]:  # تخطي الصفوف الفارغة
+            continue
+        discount = discounts[i] if i < len(discounts) else ''
+        lines.append(PurchaseLine(
+            product_id=int(product_ids[i]),
+            quantity=int(float(quantities[i])),
+            unit_price=Decimal(unit_prices[i]),
+            discount=Decimal(discount) if discount else Decimal('0'),
+        ))
+    return lines
+
+
+def find_duplicate(idempotency_key):
+    """
+    الفاتورة المنشأة مسبقاً بنفس مفتاح منع التكرار (إن وجدت)
+    """
+    if not idempotency_key:
+        return None
+    return Purchase.objects.filter(idempotency_key=idempotency_key).first()
+
+
+def _load_products(lines):
+    product_ids = {line.product_id for line in lines}
+    products = Product.objects.in_bulk(product_ids)
+    missing = product_ids - set(products)
+    if missing:
+        raise ValueError(f"المنتجات غير موجودة: {', '.join(str(pk) for pk in sorted(missing))}")
+    return products
+
+
+def _update_cost_prices(items, products):
+    """
+    تحديث سعر الشراء للمنتجات التي تغير سعرها (آخر سعر في الفاتورة)
+
+    بديل إشارة حفظ البند التي لا تعمل مع bulk_create.
+    """
+    last_prices = {item.product_id: item.unit_price for item in items}
+    changed = []
+    for product_id, unit_price in last_prices.items():
+        product = products[product_id]
+        if product.cost_price != unit_price:
+            product.cost_price = unit_price
+            changed.append(product)
+    if changed:
+        Product.objects.bulk_update(changed, ['cost_price'])
+    return changed
+
+
+def item_unit_cost(item):
+    """
+    تكلفة الوحدة الصافية لبند مشتريات (إجمالي البند بعد الخصم / الكمية)
+    """
+    if item.quantity:
+        return Decimal(item.total) / Decimal(item.quantity)
+    return item.unit_price
+
+
+def receive_purchase_items(purchase, lines, user):
+    """
+    إنشاء بنود فاتورة مشتريات جديدة وإضافتها للمخزون بعدد ثابت من الاستعلامات
+
+    المعلمات:
+    purchase (Purchase): الفاتورة بعد حفظها
+    lines (list): قائمة PurchaseLine
+    user (User): المستخدم المنفذ
+
+    تُرجع: قائمة البنود المنشأة
+    """
+    products = _load_products(lines)
+    main_reference = f"PURCHASE-{purchase.number}"
+
+    with transaction.atomic():
+        items = PurchaseItem.objects.bulk_create([
+            PurchaseItem(
+                purchase=purchase,
+                product=products[line.product_id],
+                quantity=line.quantity,
+                unit_price=line.unit_price,
+                discount=line.discount,
+                total=(Decimal(line.quantity) * line.unit_price) - line.discount,
+            )
+            for line in lines
+        ])
+        _update_cost_prices(items, products)
+
+        # حركة وارد لكل بند (الرقم المرجعي يحمل معرف البند)
+        create_movements([
+            StockMovement(
+                product_id=item.product_id,
+                warehouse_id=purchase.warehouse_id,
+                movement_type='in',
+                quantity=item.quantity,
+                unit_cost=item_unit_cost(item),
+                reference_number=f"{main_reference}-ITEM{item.id}",
+                document_type='purchase',
+                document_number=purchase.number,
+                notes=f'استلام من فاتورة المشتريات رقم {purchase.number}',
+                created_by=user,
+            )
+            for item in items
+        ])
+    return items
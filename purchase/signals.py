@@ -2,7 +2,10 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction
 from .models import PurchaseItem, PurchasePayment, Purchase, PurchaseReturn
+from core.outbox import outbox
 from product.models import StockMovement
+from utils.balances import post_balance_entry
+from utils.payments import paid_amount_subquery
 
 
 @receiver(post_save, sender=PurchaseItem)
@@ -43,19 +46,32 @@ def handle_deleted_purchase_item(sender, instance, **kwargs):
     pass
 
 
+@receiver(post_delete, sender=PurchasePayment)
+def refresh_paid_amount_on_payment_delete(sender, instance, **kwargs):
+    """
+    إعادة حساب المبلغ المدفوع المخزن في الفاتورة عند حذف دفعة
+    """
+    Purchase.objects.filter(pk=instance.purchase_id).update(paid_amount=paid_amount_subquery(Purchase))
+
+
+@outbox.subscribe('purchase.payment_status')
+def refresh_payment_status(purchase):
+    """
+    إعادة حساب المبلغ المدفوع وحالة الدفع ومديونية المورد مرة واحدة داخل معاملة المستند
+    (يُنشر الحدث من حفظ الفاتورة ومن حفظ كل دفعة لها)
+    """
+    purchase.update_payment_status()
+
+
 @receiver(post_save, sender=PurchasePayment)
-def update_payment_status_on_payment(sender, instance, created, **kwargs):
+def update_supplier_balance_on_payment(sender, instance, created, **kwargs):
     """
-    تحديث حالة الدفع عند تسجيل دفعة
+    تحديث رصيد المورد عند تسجيل دفعة
     """
     if created:
-        instance.purchase.update_payment_status()
-        
-        # تحديث رصيد المورد
         supplier = instance.purchase.supplier
         if supplier:
-            supplier.balance -= instance.amount
-            supplier.save(update_fields=['balance'])
+            post_balance_entry(supplier, -instance.amount, 'purchase_payment', instance.purchase.number)
 
 
 @receiver(post_save, sender=Purchase)
@@ -68,128 +84,66 @@ def update_supplier_balance_on_purchase(sender, instance, created, **kwargs):
         if supplier:
             # إذا كانت الفاتورة آجلة، أضف كامل المبلغ إلى رصيد المورد
             if instance.payment_method == 'credit':
-                supplier.balance += instance.total
-                supplier.save(update_fields=['balance'])
+                post_balance_entry(supplier, instance.total, 'purchase', instance.number)
             # إذا كانت الفاتورة نقدية وغير مدفوعة بالكامل، أضف المبلغ المتبقي إلى رصيد المورد
             elif instance.payment_method == 'cash' and instance.payment_status != 'paid':
                 # المبلغ المستحق = الإجمالي - المبلغ المدفوع
                 amount_due = instance.total - instance.amount_paid
                 if amount_due > 0:
-                    supplier.balance += amount_due
-                    supplier.save(update_fields=['balance'])
+                    post_balance_entry(supplier, amount_due, 'purchase', instance.number)
 
 
 @receiver(post_save, sender=Purchase)
-def update_supplier_balance_on_purchase_update(sender, instance, created, **kwargs):
+def create_financial_transaction_for_purchase(sender, instance, created, **kwargs):
     """
-    تحديث رصيد المورد عند تعديل فاتورة مشتريات موجودة
+    إنشاء معاملة مالية عند إنشاء فاتورة مشتريات جديدة
     """
-    # نتعامل فقط مع التعديلات وليس مع الإنشاء الجديد
-    if not created:
-        # نحتاج للتأكد من أن هناك فعلاً تغييرات في القيم المالية أو طريقة الدفع
-        # الحل بسيط هنا هو تحديث حالة الدفع للفاتورة، والتي ستقوم بالتعامل مع تحديث الرصيد عند اللزوم
-        instance.update_payment_status()
+    if created and instance.payment_status == 'paid':
+        outbox.publish('purchase.financial_posting', instance)
 
 
-@receiver(post_save, sender=Purchase)
-def create_financial_transaction_for_purchase(sender, instance, created, **kwargs):
+@outbox.subscribe('purchase.financial_posting')
+def post_purchase_transaction(instance):
     """
-    إنشاء معاملة مالية عند إنشاء فاتورة مشتريات جديدة
+    ترحيل المعاملة المالية لفاتورة المشتريات داخل معاملة إنشائها
     """
-    if created and instance.payment_status == 'paid':
-        try:
-            # استيراد النماذج المالية هنا لتجنب التعارض الدوري في الاستيرادات
-            from financial.models import Transaction, TransactionLine, Account
-            
-            # إيجاد أو إنشاء حساب المصروفات (المشتريات)
-            purchases_account, _ = Account.objects.get_or_create(
-                code='EXP001',
-                defaults={
-                    'name': 'مشتريات',
-                    'account_type': 'expense',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            
-            # إيجاد أو إنشاء حساب الموردين (ذمم دائنة)
-            suppliers_account, _ = Account.objects.get_or_create(
-                code='AP001',
-                defaults={
-                    'name': 'حسابات الموردين',
-                    'account_type': 'liability',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            
-            # إيجاد أو إنشاء حساب الصندوق
-            cash_account, _ = Account.objects.get_or_create(
-                code='CASH001',
-                defaults={
-                    'name': 'الصندوق',
-                    'account_type': 'asset',
-                    'type': 'cash',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            
-            with transaction.atomic():
-                # إنشاء معاملة مالية للفاتورة
-                financial_trans = Transaction.objects.create(
-                    account=purchases_account,
-                    transaction_type='expense',
-                    amount=instance.total,
-                    date=instance.date,
-                    description=f'فاتورة مشتريات رقم {instance.number} - {instance.supplier.name}',
-                    reference_number=instance.number,
-                    created_by=instance.created_by
-                )
-                
+    # استيراد الخدمات المالية هنا لتجنب التعارض الدوري في الاستيرادات
+    from financial.services import chart_of_accounts, credit, debit, post_transaction
+    
+    def post(accounts):
+        purchases_account = accounts['EXP001']
+
+        # دائن: حساب الموردين أو الصندوق (حسب طريقة الدفع)
+        if instance.payment_method == 'cash' and instance.payment_status == 'paid':
+            # دائن: الصندوق مع خصم المبلغ من رصيده
+            credit_line = credit(accounts['CASH001'], instance.total, f'دفع نقدي - فاتورة رقم {instance.number}')
+            credit_change = (credit_line.account_id, instance.total, 'subtract')
+        else:
+            # دائن: حساب الموردين (ذمم دائنة) مع زيادة رصيده
+            credit_line = credit(accounts['AP001'], instance.total, f'مشتريات آجلة - فاتورة رقم {instance.number}')
+            credit_change = (credit_line.account_id, instance.total, 'add')
+
+        return post_transaction(
+            [
                 # مدين: حساب المشتريات
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=purchases_account,
-                    debit=instance.total,
-                    credit=0,
-                    description=f'مشتريات - فاتورة رقم {instance.number}'
-                )
-                
-                # دائن: حساب الموردين أو الصندوق (حسب طريقة الدفع)
-                if instance.payment_method == 'cash' and instance.payment_status == 'paid':
-                    # دائن: الصندوق
-                    TransactionLine.objects.create(
-                        transaction=financial_trans,
-                        account=cash_account,
-                        debit=0,
-                        credit=instance.total,
-                        description=f'دفع نقدي - فاتورة رقم {instance.number}'
-                    )
-                    
-                    # تحديث رصيد الصندوق
-                    cash_account.update_balance(instance.total, 'subtract')
-                else:
-                    # دائن: حساب الموردين (ذمم دائنة)
-                    TransactionLine.objects.create(
-                        transaction=financial_trans,
-                        account=suppliers_account,
-                        debit=0,
-                        credit=instance.total,
-                        description=f'مشتريات آجلة - فاتورة رقم {instance.number}'
-                    )
-                    
-                    # تحديث رصيد حساب الموردين
-                    suppliers_account.update_balance(instance.total, 'add')
-                
-                # تحديث رصيد حساب المشتريات
-                purchases_account.update_balance(instance.total, 'add')
-                
-        except Exception as e:
-            # تسجيل الخطأ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error creating financial transaction for purchase {instance.number}: {str(e)}")
+                debit(purchases_account, instance.total, f'مشتريات - فاتورة رقم {instance.number}'),
+                credit_line,
+            ],
+            balance_changes=[
+                credit_change,
+                (purchases_account, instance.total, 'add'),
+            ],
+            account_id=purchases_account,
+            transaction_type='expense',
+            amount=instance.total,
+            date=instance.date,
+            description=f'فاتورة مشتريات رقم {instance.number} - {instance.supplier.name}',
+            reference_number=instance.number,
+            created_by=instance.created_by,
+        )
+
+    # حسابات المصروفات (المشتريات) والموردين (ذمم دائنة) والصندوق
+    chart_of_accounts.post(post, 'EXP001', 'AP001', 'CASH001', created_by=instance.created_by)
 
 
 @receiver(post_save, sender=PurchasePayment)
@@ -197,110 +151,54 @@ def create_financial_transaction_for_purchase_payment(sender, instance, created,
     """
     إنشاء معاملة مالية عند دفع فاتورة مشتريات
     """
-    print(f"PurchasePayment signal called: created={created}, has_transaction={instance.financial_transaction is not None}")
-    
     if created and not instance.financial_transaction:
-        try:
-            print(f"Creating financial transaction for purchase payment: {instance.id}")
-            
-            # استيراد النماذج المالية هنا لتجنب التعارض الدوري في الاستيرادات
-            from financial.models import Transaction, TransactionLine, Account
-            
-            # إيجاد أو إنشاء حساب الموردين
-            suppliers_account, _ = Account.objects.get_or_create(
-                code='AP001',
-                defaults={
-                    'name': 'حسابات الموردين',
-                    'account_type': 'liability',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            print(f"Suppliers account: {suppliers_account.id} - {suppliers_account.name}")
-            
-            # تحديد الحساب الذي سيتم السحب منه بناءً على طريقة الدفع
-            if instance.payment_method == 'cash':
-                payment_account, _ = Account.objects.get_or_create(
-                    code='CASH001',
-                    defaults={
-                        'name': 'الصندوق',
-                        'account_type': 'asset',
-                        'type': 'cash',
-                        'is_active': True,
-                        'created_by': instance.created_by
-                    }
-                )
-            elif instance.payment_method == 'bank_transfer':
-                payment_account, _ = Account.objects.get_or_create(
-                    code='BANK001',
-                    defaults={
-                        'name': 'البنك',
-                        'account_type': 'asset',
-                        'type': 'bank',
-                        'is_active': True,
-                        'created_by': instance.created_by
-                    }
-                )
-            else:
-                # افتراضي إذا كانت طريقة دفع أخرى
-                payment_account, _ = Account.objects.get_or_create(
-                    code='CASH001',
-                    defaults={
-                        'name': 'الصندوق',
-                        'account_type': 'asset',
-                        'type': 'cash',
-                        'is_active': True,
-                        'created_by': instance.created_by
-                    }
-                )
-            print(f"Payment account: {payment_account.id} - {payment_account.name}")
-            
-            with transaction.atomic():
-                # إنشاء معاملة مالية للدفعة
-                financial_trans = Transaction.objects.create(
-                    account=suppliers_account,
-                    transaction_type='expense',
-                    amount=instance.amount,
-                    date=instance.payment_date,
-                    description=f'دفعة لفاتورة رقم {instance.purchase.number} - {instance.purchase.supplier.name}',
-                    reference_number=instance.reference_number,
-                    created_by=instance.created_by
-                )
-                print(f"Created transaction: {financial_trans.id} - {financial_trans.amount}")
-                
+        outbox.publish('purchase_payment.financial_posting', instance)
+
+
+@outbox.subscribe('purchase_payment.financial_posting')
+def post_purchase_payment_transaction(instance):
+    """
+    ترحيل المعاملة المالية لدفعة فاتورة المشتريات داخل معاملة تسجيلها
+    """
+    # استيراد الخدمات المالية هنا لتجنب التعارض الدوري في الاستيرادات
+    from financial.services import (
+        chart_of_accounts, credit, debit, payment_account_code, post_transaction,
+    )
+    
+    # حساب الموردين والحساب الذي سيتم السحب منه بناءً على طريقة الدفع
+    payment_code = payment_account_code(instance.payment_method)
+
+    def post(accounts):
+        suppliers_account = accounts['AP001']
+        payment_account = accounts[payment_code]
+
+        # إنشاء معاملة مالية للدفعة
+        return post_transaction(
+            [
                 # مدين: حساب الموردين
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=suppliers_account,
-                    debit=instance.amount,
-                    credit=0,
-                    description=f'تسديد مستحقات - فاتورة رقم {instance.purchase.number}'
-                )
-                
+                debit(suppliers_account, instance.amount, f'تسديد مستحقات - فاتورة رقم {instance.purchase.number}'),
                 # دائن: حساب الصندوق/البنك
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=payment_account,
-                    debit=0,
-                    credit=instance.amount,
-                    description=f'دفع مستحقات - فاتورة رقم {instance.purchase.number}'
-                )
-                
-                # تحديث أرصدة الحسابات
-                suppliers_account.update_balance(instance.amount, 'subtract')
-                payment_account.update_balance(instance.amount, 'subtract')
-                
-                # ربط المعاملة المالية بالدفعة
-                instance.financial_transaction = financial_trans
-                instance.save(update_fields=['financial_transaction'])
-                print(f"Successfully linked transaction {financial_trans.id} to payment {instance.id}")
-                
-        except Exception as e:
-            # تسجيل الخطأ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
-            print(f"ERROR creating financial transaction: {str(e)}")
-            logger.error(f"Error creating financial transaction for purchase payment {instance.id}: {str(e)}")
+                credit(payment_account, instance.amount, f'دفع مستحقات - فاتورة رقم {instance.purchase.number}'),
+            ],
+            balance_changes=[
+                (suppliers_account, instance.amount, 'subtract'),
+                (payment_account, instance.amount, 'subtract'),
+            ],
+            account_id=suppliers_account,
+            transaction_type='expense',
+            amount=instance.amount,
+            date=instance.payment_date,
+            description=f'دفعة لفاتورة رقم {instance.purchase.number} - {instance.purchase.supplier.name}',
+            reference_number=instance.reference_number,
+            created_by=instance.created_by,
+        )
+
+    with transaction.atomic():
+        financial_trans = chart_of_accounts.post(post, 'AP001', payment_code, created_by=instance.created_by)
+
+        # ربط المعاملة المالية بالدفعة (بدون إعادة حفظ الدفعة ونشر أحداثها)
+        PurchasePayment.objects.filter(pk=instance.pk).update(financial_transaction=financial_trans)
+        instance.financial_transaction = financial_trans
 
 
 @receiver(post_save, sender=PurchaseReturn)
@@ -309,69 +207,51 @@ def create_financial_transaction_for_purchase_return(sender, instance, **kwargs)
     إنشاء معاملة مالية عند تأكيد مرتجع مشتريات
     """
     if instance.status == 'confirmed':
-        try:
-            # استيراد النماذج المالية هنا لتجنب التعارض الدوري في الاستيرادات
-            from financial.models import Transaction, TransactionLine, Account
-            
-            # إيجاد حسابات المشتريات والموردين والصندوق
-            purchases_account = Account.objects.filter(code='EXP001').first()
-            suppliers_account = Account.objects.filter(code='AP001').first()
-            cash_account = Account.objects.filter(code='CASH001').first()
-            
-            if not purchases_account or not suppliers_account or not cash_account:
-                raise Exception("لم يتم العثور على الحسابات اللازمة")
-            
-            with transaction.atomic():
-                # إنشاء معاملة مالية للمرتجع
-                financial_trans = Transaction.objects.create(
-                    account=purchases_account,
-                    transaction_type='income',
-                    amount=instance.total,
-                    date=instance.date,
-                    description=f'مرتجع مشتريات رقم {instance.number} - فاتورة رقم {instance.purchase.number}',
-                    reference_number=instance.number,
-                    created_by=instance.created_by
-                )
-                
-                # مدين: حساب الموردين أو الصندوق (حسب طريقة الدفع الأصلية)
-                if instance.purchase.payment_method == 'cash' and instance.purchase.payment_status == 'paid':
-                    # مدين: الصندوق (استرداد المبلغ نقدا)
-                    TransactionLine.objects.create(
-                        transaction=financial_trans,
-                        account=cash_account,
-                        debit=instance.total,
-                        credit=0,
-                        description=f'استرداد نقدي - مرتجع مشتريات رقم {instance.number}'
-                    )
-                    cash_account.update_balance(instance.total, 'add')
-                else:
-                    # مدين: حساب الموردين (تخفيض المستحق عليهم)
-                    TransactionLine.objects.create(
-                        transaction=financial_trans,
-                        account=suppliers_account,
-                        debit=instance.total,
-                        credit=0,
-                        description=f'استرداد - مرتجع مشتريات رقم {instance.number}'
-                    )
-                    suppliers_account.update_balance(instance.total, 'subtract')
-                
+        outbox.publish('purchase_return.financial_posting', instance)
+
+
+@outbox.subscribe('purchase_return.financial_posting')
+def post_purchase_return_transaction(instance):
+    """
+    ترحيل المعاملة المالية لمرتجع المشتريات داخل معاملة تأكيده
+    """
+    # استيراد الخدمات المالية هنا لتجنب التعارض الدوري في الاستيرادات
+    from financial.services import chart_of_accounts, credit, debit, post_transaction
+    
+    def post(accounts):
+        purchases_account = accounts['EXP001']
+
+        # مدين: حساب الموردين أو الصندوق (حسب طريقة الدفع الأصلية)
+        if instance.purchase.payment_method == 'cash' and instance.purchase.payment_status == 'paid':
+            # مدين: الصندوق (استرداد المبلغ نقدا)
+            debit_line = debit(accounts['CASH001'], instance.total, f'استرداد نقدي - مرتجع مشتريات رقم {instance.number}')
+            debit_change = (debit_line.account_id, instance.total, 'add')
+        else:
+            # مدين: حساب الموردين (تخفيض المستحق عليهم)
+            debit_line = debit(accounts['AP001'], instance.total, f'استرداد - مرتجع مشتريات رقم {instance.number}')
+            debit_change = (debit_line.account_id, instance.total, 'subtract')
+
+        return post_transaction(
+            [
+                debit_line,
                 # دائن: حساب المشتريات (تخفيض المشتريات)
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=purchases_account,
-                    debit=0,
-                    credit=instance.total,
-                    description=f'مرتجع مشتريات - فاتورة رقم {instance.purchase.number}'
-                )
-                
-                # تحديث رصيد حساب المشتريات
-                purchases_account.update_balance(instance.total, 'subtract')
-                
-        except Exception as e:
-            # تسجيل الخطأ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error creating financial transaction for purchase return {instance.number}: {str(e)}")
+                credit(purchases_account, instance.total, f'مرتجع مشتريات - فاتورة رقم {instance.purchase.number}'),
+            ],
+            balance_changes=[
+                debit_change,
+                (purchases_account, instance.total, 'subtract'),
+            ],
+            account_id=purchases_account,
+            transaction_type='income',
+            amount=instance.total,
+            date=instance.date,
+            description=f'مرتجع مشتريات رقم {instance.number} - فاتورة رقم {instance.purchase.number}',
+            reference_number=instance.number,
+            created_by=instance.created_by,
+        )
+
+    # حسابات المشتريات والموردين والصندوق (تُنشأ إن لم توجد كترحيل الفاتورة نفسها)
+    chart_of_accounts.post(post, 'EXP001', 'AP001', 'CASH001', created_by=instance.created_by)
 
 
 @receiver(post_delete, sender=Purchase)
@@ -383,12 +263,10 @@ def update_supplier_balance_on_purchase_delete(sender, instance, **kwargs):
     if supplier:
         # إذا كانت الفاتورة آجلة، قم بخصم كامل المبلغ من رصيد المورد
         if instance.payment_method == 'credit':
-            supplier.balance -= instance.total
-            supplier.save(update_fields=['balance'])
+            post_balance_entry(supplier, -instance.total, 'purchase_delete', instance.number)
         # إذا كانت الفاتورة نقدية وغير مدفوعة بالكامل، قم بخصم المبلغ المتبقي من رصيد المورد
         elif instance.payment_method == 'cash' and instance.payment_status != 'paid':
             # المبلغ المستحق = الإجمالي - المبلغ المدفوع
             amount_due = instance.total - instance.amount_paid
             if amount_due > 0:
-                supplier.balance -= amount_due
-                supplier.save(update_fields=['balance']) 
\ No newline at end of file
+                post_balance_entry(supplier, -amount_due, 'purchase_delete', instance.number) 
\ No newline at end of file
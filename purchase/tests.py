@@ -1,3 +1,132 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from product.models import Category, Unit, Product, Warehouse, Stock, StockMovement
+from purchase.models import Purchase
+from purchase.services import PurchaseLine, receive_purchase_items
+from supplier.models import Supplier
+
+User = get_user_model()
+
+
+class PurchaseReceivingTest(TestCase):
+    """
+    اختبارات خدمة استلام بنود فواتير المشتريات
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpassword123')
+        self.supplier = Supplier.objects.create(name='مورد', code='S-1')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+        category = Category.objects.create(name='فئة')
+        unit = Unit.objects.create(name='قطعة', symbol='ق')
+        self.products = [
+            Product.objects.create(
+                name=f'منتج {index}', sku=f'SKU-{index}', category=category, unit=unit,
+                cost_price=10, selling_price=15, created_by=self.user,
+            )
+            for index in range(60)
+        ]
+
+    def create_purchase(self):
+        return Purchase.objects.create(
+            date=datetime.date(2024, 1, 1), supplier=self.supplier, warehouse=self.warehouse,
+            subtotal=0, total=0, payment_method='cash', created_by=self.user,
+        )
+
+    def lines(self, count, quantity=3, unit_price='10'):
+        return [
+            PurchaseLine(product.pk, quantity, Decimal(unit_price), Decimal('0'))
+            for product in self.products[:count]
+        ]
+
+    def count_queries(self, lines):
+        purchase = self.create_purchase()
+        with CaptureQueriesContext(connection) as context:
+            receive_purchase_items(purchase, lines, self.user)
+        return len(context)
+
+    def test_queries_do_not_grow_with_lines(self):
+        # أول استلام ينشئ عداد ترقيم الحركات
+        self.count_queries(self.lines(1))
+        # كلا الاستلامين ينشئ أرصدة مخزون لمنتجات جديدة
+        queries = self.count_queries(self.lines(5))
+        self.assertEqual(self.count_queries(self.lines(50)), queries)
+
+    def test_items_stock_and_cost_prices(self):
+        purchase = self.create_purchase()
+        lines = self.lines(2) + [PurchaseLine(self.products[0].pk, 4, Decimal('12'), Decimal('2'))]
+        items = receive_purchase_items(purchase, lines, self.user)
+
+        self.assertEqual(purchase.items.count(), 3)
+        self.assertEqual(items[2].total, Decimal('46'))
+        stock = Stock.objects.get(product=self.products[0], warehouse=self.warehouse)
+        self.assertEqual(stock.quantity, 7)
+        self.assertEqual(StockMovement.objects.filter(document_number=purchase.number).count(), 3)
+
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].cost_price, Decimal('12'))
+
+    def post_form(self, key):
+        return self.client.post(reverse('purchase:purchase_create'), {
+            'supplier': self.supplier.pk,
+            'warehouse': self.warehouse.pk,
+            'date': '2024-01-01',
+            'discount': '0',
+            'payment_method': 'cash',
+            'subtotal': '60',
+            'total': '60',
+            'idempotency_key': key,
+            'product[]': [self.products[0].pk, self.products[1].pk, ''],
+            'quantity[]': ['2', '4', ''],
+            'unit_price[]': ['10', '10', ''],
+            'discount[]': ['0', '', ''],
+        })
+
+    def test_resubmitted_form_is_received_once(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('purchase:purchase_create'))
+        key = response.context['form'].initial['idempotency_key']
+
+        self.assertRedirects(self.post_form(key), reverse('purchase:purchase_list'), fetch_redirect_response=False)
+        self.assertRedirects(self.post_form(key), reverse('purchase:purchase_list'), fetch_redirect_response=False)
+
+        purchase = Purchase.objects.get()
+        self.assertEqual(purchase.idempotency_key, key)
+        self.assertEqual(purchase.items.count(), 2)
+        self.assertEqual(Stock.objects.get(product=self.products[1], warehouse=self.warehouse).quantity, 4)
+
+
+class PurchasePaymentTest(TestCase):
+    """
+    اختبارات تسجيل دفعات فواتير المشتريات
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpassword123')
+        self.supplier = Supplier.objects.create(name='مورد', code='S-1')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+        self.purchase = Purchase.objects.create(
+            date=datetime.date(2024, 1, 1), supplier=self.supplier, warehouse=self.warehouse,
+            subtotal=100, total=100, payment_method='credit', created_by=self.user,
+        )
+
+    def test_payment_view_posts_balance_once(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('purchase:purchase_add_payment', kwargs={'pk': self.purchase.pk}), {
+            'amount': '40', 'payment_date': '2024-01-02', 'payment_method': 'cash',
+        })
+        self.assertRedirects(
+            response, reverse('purchase:purchase_detail', kwargs={'pk': self.purchase.pk}),
+            fetch_redirect_response=False,
+        )
 
-# Create your tests here.
+        self.supplier.refresh_from_db()
+        self.assertEqual(self.supplier.balance, Decimal('60'))
+        self.assertEqual(self.supplier.balance_entries.filter(source='purchase_payment').count(), 1)
@@ -1,7 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.http import JsonResponse, HttpResponseRedirect
@@ -9,6 +9,10 @@ from django.urls import reverse
 from purchase.models import Purchase, PurchasePayment, PurchaseItem, PurchaseReturn, PurchaseReturnItem, PurchaseOrder, PurchaseOrderItem
 from .forms import PurchaseForm, PurchaseItemForm, PurchasePaymentForm, PurchaseReturnForm, PurchaseUpdateForm
 from product.models import Product, Stock, StockMovement
+from core.outbox import outbox
+from product.services.numbering import peek_number
+from utils.returns import resolve_return_statuses
+from purchase.services import parse_purchase_lines, find_duplicate, receive_purchase_items, item_unit_cost
 from decimal import Decimal
 import logging
 from django.db import models
@@ -26,7 +30,7 @@ def purchase_list(request):
     عرض قائمة فواتير المشتريات
     """
     # الاستعلام الأساسي مع ترتيب تنازلي حسب التاريخ ثم الرقم
-    purchases_query = Purchase.objects.all().order_by('-date', '-id')
+    purchases_query = Purchase.objects.select_related('supplier', 'warehouse').order_by('-date', '-id')
     
     # تصفية حسب المورد
     supplier = request.GET.get('supplier')
@@ -51,6 +55,8 @@ def purchase_list(request):
     paginator = Paginator(purchases_query, 25)  # 25 فاتورة في كل صفحة
     page = request.GET.get('page')
     purchases = paginator.get_page(page)
+    # حالة الإرجاع لكل فواتير الصفحة باستعلامين بدلاً من استعلامات لكل فاتورة
+    purchases.object_list = resolve_return_statuses(purchases.object_list)
     
     # إحصائيات للعرض في الصفحة
     paid_purchases_count = Purchase.objects.filter(payment_status='paid').count()
@@ -120,105 +126,43 @@ def purchase_create(request):
         form = PurchaseForm(request.POST)
         
         if form.is_valid():
+            idempotency_key = form.cleaned_data.get('idempotency_key') or None
+            if find_duplicate(idempotency_key):
+                # إعادة إرسال نفس النموذج: الفاتورة أنشئت بالفعل
+                messages.info(request, 'تم إنشاء هذه الفاتورة مسبقاً')
+                return redirect('purchase:purchase_list')
+            
             try:
-                with transaction.atomic():
+                with outbox.atomic():
                     # إنشاء فاتورة المشتريات
                     purchase = form.save(commit=False)
                     purchase.subtotal = Decimal(request.POST.get('subtotal', 0))
                     purchase.total = Decimal(request.POST.get('total', 0))
                     purchase.created_by = request.user
+                    purchase.idempotency_key = idempotency_key
                     purchase.save()
                     
-                    # إضافة بنود الفاتورة
-                    product_ids = request.POST.getlist('product[]')
-                    quantities = request.POST.getlist('quantity[]')
-                    unit_prices = request.POST.getlist('unit_price[]')
-                    discounts = request.POST.getlist('discount[]')
-                    
-                    # حذف جميع حركات المخزون المرتبطة بهذه الفاتورة أولاً للتأكد من عدم التكرار
-                    StockMovement.objects.filter(
-                        reference_number__startswith=f"PURCHASE-{purchase.number}"
-                    ).delete()
-                    
-                    # تعريف رقم المرجع الرئيسي
-                    main_reference = f"PURCHASE-{purchase.number}"
-                    
-                    for i in range(len(product_ids)):
-                        if product_ids[i]:  # تخطي الصفوف الفارغة
-                            product = get_object_or_404(Product, id=product_ids[i])
-                            quantity = int(float(quantities[i]))
-                            unit_price = Decimal(unit_prices[i])
-                            discount = Decimal(discounts[i]) if discounts[i] else Decimal('0')
-                            
-                            # إنشاء بند فاتورة
-                            item = PurchaseItem(
-                                purchase=purchase,
-                                product=product,
-                                quantity=quantity,
-                                unit_price=unit_price,
-                                discount=discount,
-                                total=(Decimal(quantity) * unit_price) - discount
-                            )
-                            item.save()
-                    
-                    # بعد إنشاء جميع البنود، قم بإنشاء حركات المخزون
-                    for item in purchase.items.all():
-                        # استخدام معرف البند في الرقم المرجعي بدلاً من معرف المنتج لضمان عدم التكرار
-                        reference_id = f"{main_reference}-ITEM{item.id}" 
-                        
-                        # تحقق من وجود حركة مخزون مسبقة بنفس الرقم المرجعي
-                        if not StockMovement.objects.filter(
-                            reference_number=reference_id
-                        ).exists():
-                            # الحصول على المخزون الحالي
-                            stock, created = Stock.objects.get_or_create(
-                                product=item.product,
-                                warehouse=purchase.warehouse,
-                                defaults={'quantity': Decimal('0')}
-                            )
-                            
-                            # تخزين قيمة المخزون قبل التحديث
-                            quantity_before = stock.quantity
-                            
-                            # تحديث المخزون يدوياً - تحويل قيمة العنصر إلى Decimal لتجنب خطأ عدم توافق الأنواع
-                            stock.quantity += Decimal(item.quantity)
-                            stock.save()
-                            
-                            # تخزين قيمة المخزون بعد التحديث
-                            quantity_after = stock.quantity
-                            
-                            # إنشاء حركة المخزون مع تعطيل التحديث التلقائي
-                            movement = StockMovement(
-                                product=item.product,
-                                warehouse=purchase.warehouse,
-                                movement_type='in',
-                                quantity=item.quantity,
-                                reference_number=reference_id,
-                                document_type='purchase',
-                                document_number=purchase.number,
-                                notes=f'استلام من فاتورة المشتريات رقم {purchase.number}',
-                                created_by=request.user,
-                                quantity_before=quantity_before,
-                                quantity_after=quantity_after
-                            )
-                            movement._skip_update = True  # تعطيل تحديث المخزون التلقائي
-                            movement.save()
+                    # إضافة بنود الفاتورة وإضافتها للمخزون دفعة واحدة
+                    receive_purchase_items(purchase, parse_purchase_lines(request.POST), request.user)
                     
                     messages.success(request, 'تم إنشاء فاتورة المشتريات بنجاح')
                     return redirect('purchase:purchase_list')
             
+            except IntegrityError:
+                # طلب متزامن بنفس المفتاح سبق هذا الطلب
+                if find_duplicate(idempotency_key):
+                    messages.info(request, 'تم إنشاء هذه الفاتورة مسبقاً')
+                    return redirect('purchase:purchase_list')
+                messages.error(request, 'حدث خطأ أثناء إنشاء الفاتورة')
             except Exception as e:
                 messages.error(request, f'حدث خطأ أثناء إنشاء الفاتورة: {str(e)}')
         else:
             messages.error(request, 'يرجى تصحيح الأخطاء الموجودة في النموذج')
     else:
-        # إنشاء رقم فاتورة مشتريات جديد
-        last_purchase = Purchase.objects.order_by('-id').first()
-        next_number = f"PUR{(last_purchase.id + 1 if last_purchase else 1):04d}"
-        
+        # الرقم المتوقع للفاتورة التالية (للعرض فقط، الرقم الفعلي يُحجز عند الحفظ)
         initial_data = {
             'date': timezone.now().date(),
-            'number': next_number,
+            'number': peek_number('purchase'),
         }
         form = PurchaseForm(initial=initial_data)
     
@@ -387,7 +331,7 @@ def purchase_update(request, pk):
         
         if form.is_valid():
             try:
-                with transaction.atomic():
+                with outbox.atomic():
                     updated_purchase = form.save(commit=False)
                     
                     # الحصول على قيمة الضريبة من النموذج (إذا كانت مقدمة) وتحويلها إلى Decimal
@@ -407,6 +351,7 @@ def purchase_update(request, pk):
                     
                     # إنشاء قاموس للكميات الجديدة
                     new_items = {}
+                    new_costs = {}
                     
                     # حفظ البنود
                     for i in range(len(product_ids)):
@@ -435,8 +380,9 @@ def purchase_update(request, pk):
                         )
                         
                         saved_item_ids.append(item.id)
-                        # حفظ الكمية الجديدة في القاموس
+                        # حفظ الكمية الجديدة وتكلفة الوحدة في القاموس
                         new_items[product.id] = quantity
+                        new_costs[product.id] = item_unit_cost(item)
                     
                     # حذف البنود الغير موجودة في النموذج
                     PurchaseItem.objects.filter(purchase=purchase).exclude(id__in=saved_item_ids).delete()
@@ -460,23 +406,15 @@ def purchase_update(request, pk):
                         if quantity_diff != 0:  # فقط إذا كان هناك تغيير في الكمية
                             product = Product.objects.get(id=product_id)
                             
-                            # الحصول على المخزون الحالي
-                            stock, created = Stock.objects.get_or_create(
-                                product=product,
-                                warehouse=updated_purchase.warehouse,
-                                defaults={'quantity': 0}
-                            )
-                            
-                            # تحديث المخزون يدوياً حسب اتجاه التغيير
+                            # إنشاء حركة مخزون حسب اتجاه التغيير (يتم ترحيلها عند الحفظ)
                             if quantity_diff > 0:  # إذا زادت الكمية، نضيف الزيادة للمخزون
-                                stock.quantity += quantity_diff
-                                
                                 # إنشاء حركة مخزون للإضافة
                                 StockMovement.objects.create(
                                     product=product,
                                     warehouse=updated_purchase.warehouse,
                                     movement_type='in',
                                     quantity=quantity_diff,
+                                    unit_cost=new_costs[product_id],
                                     reference_number=f"{main_reference}-EDIT-IN-{timezone.now().strftime('%Y%m%d%H%M%S')}",
                                     document_type='purchase',
                                     document_number=updated_purchase.number,
@@ -484,10 +422,6 @@ def purchase_update(request, pk):
                                     created_by=request.user
                                 )
                             else:  # إذا قلت الكمية، نخصم الفرق من المخزون
-                                stock.quantity -= abs(quantity_diff)
-                                if stock.quantity < 0:
-                                    stock.quantity = 0
-                                
                                 # إنشاء حركة مخزون للخصم
                                 StockMovement.objects.create(
                                     product=product,
@@ -500,28 +434,13 @@ def purchase_update(request, pk):
                                     notes=f'نقص كمية منتج في تعديل فاتورة مشتريات رقم {updated_purchase.number}',
                                     created_by=request.user
                                 )
-                            
-                            stock.save()
                     
                     # معالجة المنتجات المحذوفة (المنتجات الموجودة في البنود القديمة وليست في البنود الجديدة)
                     for product_id, original_quantity in original_items.items():
                         if product_id not in new_items:  # إذا كان المنتج موجود سابقًا وتم حذفه
                             product = Product.objects.get(id=product_id)
                             
-                            # الحصول على المخزون الحالي
-                            stock, created = Stock.objects.get_or_create(
-                                product=product,
-                                warehouse=updated_purchase.warehouse,
-                                defaults={'quantity': 0}
-                            )
-                            
-                            # خصم الكمية المحذوفة من المخزون
-                            stock.quantity -= original_quantity
-                            if stock.quantity < 0:
-                                stock.quantity = 0
-                            stock.save()
-                            
-                            # إنشاء حركة مخزون للخصم
+                            # إنشاء حركة مخزون للخصم (تخصم الكمية المحذوفة من المخزون)
                             StockMovement.objects.create(
                                 product=product,
                                 warehouse=updated_purchase.warehouse,
@@ -662,21 +581,10 @@ def add_payment(request, pk):
                 messages.warning(request, _('تم تقليل المبلغ إلى القيمة المستحقة المتبقية'))
                 payment.amount = purchase.amount_due
             
-            with transaction.atomic():
-                # حفظ الدفعة
+            with outbox.atomic():
+                # حفظ الدفعة (حالة دفع الفاتورة تُحدث مرة واحدة في نهاية الكتلة داخل نفس المعاملة،
+                # وقيد رصيد المورد يُسجل من إشارة حفظ الدفعة)
                 payment.save()
-                
-                # تحديث حالة فاتورة الشراء
-                purchase.refresh_from_db()
-                if purchase.amount_due <= 0:
-                    purchase.payment_status = 'paid'
-                elif purchase.amount_paid > 0:
-                    purchase.payment_status = 'partially_paid'
-                purchase.save()
-                
-                # تحديث رصيد المورد
-                purchase.supplier.balance -= payment.amount
-                purchase.supplier.save()
             
             messages.success(request, _('تم تسجيل الدفعة بنجاح'))
             return redirect('purchase:purchase_detail', pk=purchase.pk)
@@ -746,11 +654,7 @@ def purchase_return(request, pk):
                     purchase_return.tax = 0
                     purchase_return.total = 0
                     
-                    # تحديد رقم المرتجع
-                    if not purchase_return.number:
-                        from django.utils.crypto import get_random_string
-                        purchase_return.number = f"RET-{get_random_string(6).upper()}"
-                    
+                    # رقم المرتجع يتم حجزه من عداد مرتجعات المشتريات عند الحفظ
                     purchase_return.save()
                     
                     # إضافة بنود المرتجع
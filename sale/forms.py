@@ -37,10 +37,17 @@ class SaleForm(forms.ModelForm):
         # تعيين طريقة الدفع "نقدي" بشكل افتراضي
         if not self.initial.get('payment_method'):
             self.initial['payment_method'] = 'cash'
+        
+        # رقم الفاتورة الجديدة يتم توليده تلقائياً
+        if not self.instance.pk:
+            self.fields['number'].required = False
     
     def clean_number(self):
+        # رقم الفاتورة الجديدة المعروض في النموذج للعرض فقط، ويتم حجزه من العداد عند الحفظ
+        if not self.instance.pk:
+            return ''
         number = self.cleaned_data.get('number')
-        if not self.instance.pk and Sale.objects.filter(number=number).exists():
+        if Sale.objects.filter(number=number).exclude(pk=self.instance.pk).exists():
             raise ValidationError('رقم الفاتورة موجود بالفعل')
         return number
     
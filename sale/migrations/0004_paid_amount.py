@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:22
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_paid_amounts(apps, schema_editor):
+    """
+    حساب المبلغ المدفوع للفواتير الموجودة من دفعاتها
+    """
+    Sale = apps.get_model('sale', 'Sale')
+    SalePayment = apps.get_model('sale', 'SalePayment')
+    paid = SalePayment.objects.filter(sale=OuterRef('pk')).order_by().values('sale').annotate(
+        paid=Sum('amount')
+    ).values('paid')
+    Sale.objects.update(paid_amount=Coalesce(
+        Subquery(paid, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        Value(Decimal('0')),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sale', '0003_salepayment_financial_transaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='paid_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='المبلغ المدفوع'),
+        ),
+        migrations.RunPython(populate_paid_amounts, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
-from django.utils import timezone
+
+from core.outbox import outbox
+from utils.payments import PaymentTotalsQuerySet, refresh_paid_amount
+from utils.returns import compute_return_statuses
 
 
 class Sale(models.Model):
@@ -30,12 +33,15 @@ class Sale(models.Model):
     total = models.DecimalField(_('الإجمالي'), max_digits=12, decimal_places=2)
     payment_method = models.CharField(_('طريقة الدفع'), max_length=20, choices=PAYMENT_METHODS)
     payment_status = models.CharField(_('حالة الدفع'), max_length=20, choices=PAYMENT_STATUSES, default='unpaid')
+    paid_amount = models.DecimalField(_('المبلغ المدفوع'), max_digits=12, decimal_places=2, default=0, editable=False)
     notes = models.TextField(_('ملاحظات'), blank=True, null=True)
     created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
     updated_at = models.DateTimeField(_('تاريخ التحديث'), auto_now=True)
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT,
                                  verbose_name=_('أنشئ بواسطة'), related_name='sales_created')
     
+    objects = PaymentTotalsQuerySet.as_manager()
+    
     class Meta:
         verbose_name = _('فاتورة مبيعات')
         verbose_name_plural = _('فواتير المبيعات')
@@ -47,54 +53,31 @@ class Sale(models.Model):
     def save(self, *args, **kwargs):
         # حفظ الفاتورة
         if not self.number:
-            # الحصول على الرقم التسلسلي
-            from product.models import SerialNumber
-            
-            # البحث عن آخر رقم مستخدم
-            last_sale = Sale.objects.order_by('-number').first()
-            if last_sale:
-                try:
-                    last_number = int(last_sale.number.replace('SALE', ''))
-                except ValueError:
-                    last_number = 0
-            else:
-                last_number = 0
-            
-            # إنشاء أو تحديث الرقم التسلسلي
-            serial = SerialNumber.objects.get_or_create(
-                document_type='sale',
-                year=timezone.now().year,
-                defaults={
-                    'prefix': 'SALE',
-                    'last_number': last_number
-                }
-            )[0]
-            
-            # تحديث آخر رقم إذا كان أقل من الرقم الحالي
-            if serial.last_number <= last_number:
-                serial.last_number = last_number
-                serial.save()
-            
-            next_number = serial.get_next_number()
-            self.number = f"{serial.prefix}{next_number:04d}"
-            
+            # حجز الرقم التالي من عداد المبيعات داخل معاملة الحفظ
+            from product.services.numbering import allocate_number
+            self.number = allocate_number('sale')
+        
         super().save(*args, **kwargs)
         
-        # تحديث حالة الدفع بعد الحفظ
-        self.update_payment_status()
+        # تحديث حالة الدفع (مرة واحدة في نهاية outbox.atomic، انظر core.outbox)
+        outbox.publish('sale.payment_status', self)
     
     @property
     def amount_paid(self):
         """
-        حساب المبلغ المدفوع
+        المبلغ المدفوع (من with_payment_totals إن وجد، وإلا من العمود المخزن)
         """
-        return self.payments.aggregate(models.Sum('amount'))['amount__sum'] or 0
+        if 'paid_total' in self.__dict__:
+            return self.paid_total
+        return self.paid_amount
     
     @property
     def amount_due(self):
         """
-        حساب المبلغ المتبقي
+        المبلغ المتبقي
         """
+        if 'due_total' in self.__dict__:
+            return self.due_total
         return self.total - self.amount_paid
     
     @property
@@ -108,6 +91,8 @@ class Sale(models.Model):
         """
         تحديث حالة الدفع
         """
+        # قراءة المدفوع مرة واحدة من الدفعات، ثم تستخدم كل الحسابات التالية العمود المخزن
+        refresh_paid_amount(self)
         old_status = self.payment_status
         
         if self.is_fully_paid:
@@ -120,45 +105,24 @@ class Sale(models.Model):
         # تحديث فقط إذا تغيرت الحالة لتجنب التكرار اللانهائي
         if old_status != new_status:
             Sale.objects.filter(pk=self.pk).update(payment_status=new_status)
+            self.payment_status = new_status
     
     @property
     def is_returned(self):
         """
         فحص إذا كانت الفاتورة مرتجعة (كليًا أو جزئيًا)
         """
-        confirmed_returns = self.returns.filter(status='confirmed')
-        return confirmed_returns.exists()
+        if '_return_status' in self.__dict__:
+            return self._return_status is not None
+        return self.returns.filter(status='confirmed').exists()
     
     @property
     def return_status(self):
         """
         حالة الإرجاع للفاتورة (كلي، جزئي، غير مرتجع)
-        """
-        confirmed_returns = self.returns.filter(status='confirmed')
-        
-        if not confirmed_returns.exists():
-            return None
         
-        # حساب إجمالي الكميات المباعة
-        sold_quantities = {}
-        for item in self.items.all():
-            sold_quantities[item.id] = item.quantity
-            
-        # حساب إجمالي الكميات المرتجعة
-        returned_quantities = {}
-        for ret in confirmed_returns:
-            for item in ret.items.all():
-                sale_item_id = item.sale_item.id
-                if sale_item_id in returned_quantities:
-                    returned_quantities[sale_item_id] += item.quantity
-                else:
-                    returned_quantities[sale_item_id] = item.quantity
-        
-        # فحص إذا كانت كل المنتجات مرتجعة بالكامل
-        for item_id, sold_qty in sold_quantities.items():
-            returned_qty = returned_quantities.get(item_id, 0)
-            if returned_qty < sold_qty:
-                return 'partial'
-                
-        # إذا وصلنا إلى هنا فكل المنتجات مرتجعة بالكامل
-        return 'full' 
\ No newline at end of file
+        تستخدم القيمة المرفقة من resolve_return_statuses عند عرض قائمة فواتير.
+        """
+        if '_return_status' in self.__dict__:
+            return self._return_status
+        return compute_return_statuses(type(self), [self.pk]).get(self.pk) 
\ No newline at end of file
@@ -0,0 +1,6 @@
+"""
+خدمات المبيعات
+"""
+from sale.services.posting import (
+    SaleLine, parse_sale_lines, create_sale_items, update_sale_items,
+)
@@ -0,0 +1,247 @@
+"""
+خدمة ترحيل فواتير المبيعات
+
+تحفظ بنود الفاتورة وحركات المخزون الخاصة بها دفعة واحدة بدلاً من حفظ كل
+بند وكل حركة على حدة:
+- جلب كل المنتجات باستعلام in_bulk واحد
+- إنشاء البنود بـ bulk_create
+- ترحيل حركات المخزون لكل (منتج، مخزن) بتمريرة واحدة
+- عند التعديل يتم تطبيق الفرق فقط بين البنود القديمة والجديدة
+"""
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from product.models import Product, StockMovement
+from product.services.stock import create_movements
+from product.services.valuation import sale_unit_costs
+from sale.models import SaleItem
+
+# بند فاتورة بعد التحقق من قيمه
+SaleLine = namedtuple('SaleLine', ['product_id', 'quantity', 'unit_price', 'discount'])
+
+# الحقول التي يتم مقارنتها لمعرفة تغير البند عند التعديل
+ITEM_FIELDS = ('quantity', 'unit_price', 'discount', 'total')
+
+
+def parse_sale_lines(data):
+    """
+    قراءة بنود الفاتورة من بيانات النموذج المرسلة والتحقق من قيمها
+
+    المعلمات:
+    data (QueryDict): بيانات الطلب (product[] و quantity[] و unit_price[] و discount[])
+
+    تُرجع: قائمة SaleLine (مع تخطي الصفوف الفارغة)
+    """
+    product_ids = data.getlist('product[]')
+    quantities = data.getlist('quantity[]')
+    unit_prices = data.getlist('unit_price[]')
+    discounts = data.getlist('discount[]')
+
+    lines = []
+    for i in range(len(product_ids)):
+        if not product_ids[i]:  # تخطي الصفوف الفارغة
+            continue
+        try:
+            product_id = int(product_ids[i])
+
+            # التأكد من أن الكمية موجبة وأكبر من الصفر
+            quantity_val = float(quantities[i])
+            if quantity_val <= 0:
+                raise ValueError("يجب أن تكون الكمية أكبر من صفر")
+            quantity = max(1, int(quantity_val))  # التأكد من أن الكمية على الأقل 1
+
+            # التأكد من صحة سعر الوحدة
+            unit_price_val = unit_prices[i].strip() if isinstance(unit_prices[i], str) else unit_prices[i]
+            if not unit_price_val or float(unit_price_val) <= 0:
+                raise ValueError("يجب أن يكون سعر الوحدة أكبر من صفر")
+            unit_price = Decimal(unit_price_val)
+
+            # التأكد من صحة قيمة الخصم (تجنب القيم السالبة)
+            discount_value = discounts[i].strip() if i < len(discounts) and isinstance(discounts[i], str) else '0'
+            discount_value = discount_value or '0'
+            if float(discount_value) < 0:
+                discount_value = '0'
+            discount = Decimal(discount_value)
+        except (ValueError, TypeError, IndexError, ArithmeticError) as e:
+            raise ValueError(f"خطأ في تحويل قيم البند {i+1}: {str(e)}")
+
+        lines.append(SaleLine(product_id, quantity, unit_price, discount))
+    return lines
+
+
+def _load_products(lines):
+    """
+    جلب كل منتجات البنود باستعلام واحد
+    """
+    product_ids = {line.product_id for line in lines}
+    products = Product.objects.in_bulk(product_ids)
+    missing = product_ids - set(products)
+    if missing:
+        raise ValueError(f"المنتجات غير موجودة: {', '.join(str(pk) for pk in sorted(missing))}")
+    return products
+
+
+def _line_total(line):
+    return (Decimal(str(line.quantity)) * line.unit_price) - line.discount
+
+
+def _build_item(sale, product, line):
+    return SaleItem(
+        sale=sale,
+        product=product,
+        quantity=line.quantity,
+        unit_price=line.unit_price,
+        discount=line.discount,
+        total=_line_total(line),
+    )
+
+
+def _movement(sale, product_id, warehouse_id, movement_type, quantity, reference_number, notes, user,
+              unit_cost=None):
+    return StockMovement(
+        product_id=product_id,
+        warehouse_id=warehouse_id,
+        movement_type=movement_type,
+        quantity=quantity,
+        unit_cost=unit_cost,
+        reference_number=reference_number,
+        document_type='sale',
+        document_number=sale.number,
+        notes=notes,
+        created_by=user,
+    )
+
+
+def create_sale_items(sale, lines, user):
+    """
+    إنشاء بنود فاتورة جديدة وخصمها من المخزون بعدد ثابت من الاستعلامات
+
+    المعلمات:
+    sale (Sale): الفاتورة بعد حفظها
+    lines (list): قائمة SaleLine
+    user (User): المستخدم المنفذ
+
+    تُرجع: قائمة البنود المنشأة
+    """
+    products = _load_products(lines)
+    main_reference = f"SALE-{sale.number}"
+
+    with transaction.atomic():
+        items = SaleItem.objects.bulk_create([
+            _build_item(sale, products[line.product_id], line) for line in lines
+        ])
+
+        # حركة صادر لكل بند (الرقم المرجعي يحمل معرف البند لضمان عدم التكرار)
+        create_movements([
+            _movement(
+                sale, item.product_id, sale.warehouse_id, 'out', int(item.quantity),
+                f"{main_reference}-ITEM{item.id}", f'فاتورة مبيعات رقم {sale.number}', user,
+            )
+            for item in items
+        ])
+    return items
+
+
+def _quantities_by_key(items, warehouse_id):
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[(item.product_id, warehouse_id)] += int(item.quantity)
+    return quantities
+
+
+def update_sale_items(sale, lines, user, previous_warehouse_id=None):
+    """
+    تعديل بنود فاتورة بتطبيق الفرق فقط بين البنود القديمة والجديدة
+
+    البنود القديمة تُطابق مع الجديدة حسب المنتج: البنود غير المتغيرة تبقى كما هي،
+    والمتغيرة تُحدّث بـ bulk_update، والجديدة تُنشأ بـ bulk_create، والزائدة تُحذف.
+    حركات المخزون تُنشأ فقط لفرق الكمية لكل (منتج، مخزن).
+
+    المعلمات:
+    sale (Sale): الفاتورة بعد حفظ التعديل
+    lines (list): قائمة SaleLine الجديدة
+    user (User): المستخدم المنفذ
+    previous_warehouse_id (int): المخزن قبل التعديل (إذا تم تغييره)
+
+    تُرجع: قاموس بعدد البنود المنشأة والمحدثة والمحذوفة
+    """
+    products = _load_products(lines)
+    previous_warehouse_id = previous_warehouse_id or sale.warehouse_id
+
+    with transaction.atomic():
+        old_items = list(sale.items.order_by('pk'))
+        old_quantities = _quantities_by_key(old_items, previous_warehouse_id)
+
+        available = defaultdict(list)
+        for item in old_items:
+            available[item.product_id].append(item)
+
+        to_create, to_update, kept = [], [], []
+        for line in lines:
+            if available[line.product_id]:
+                item = available[line.product_id].pop(0)
+                new_values = (Decimal(line.quantity), line.unit_price, line.discount, _line_total(line))
+                if tuple(getattr(item, field) for field in ITEM_FIELDS) != new_values:
+                    item.quantity, item.unit_price, item.discount, item.total = new_values
+                    to_update.append(item)
+                kept.append(item)
+            else:
+                to_create.append(_build_item(sale, products[line.product_id], line))
+
+        to_delete = [item.pk for items in available.values() for item in items]
+        if to_delete:
+            SaleItem.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            SaleItem.objects.bulk_update(to_update, ITEM_FIELDS)
+        created = SaleItem.objects.bulk_create(to_create)
+
+        new_quantities = _quantities_by_key(kept + created, sale.warehouse_id)
+        create_movements(_difference_movements(
+            sale, old_quantities, new_quantities, user, sale_unit_costs(sale),
+        ))
+
+    return {'created': len(created), 'updated': len(to_update), 'deleted': len(to_delete)}
+
+
+def _difference_movements(sale, old_quantities, new_quantities, user, unit_costs=None):
+    """
+    حركات المخزون اللازمة لنقل الكميات من البنود القديمة إلى الجديدة
+
+    الكميات المعادة للمخزون تُقيم بتكلفة صرفها في الفاتورة (unit_costs).
+    """
+    unit_costs = unit_costs or {}
+    main_reference = f"SALE-{sale.number}"
+    stamp = timezone.now().strftime('%Y%m%d%H%M%S')
+    new_products = {product_id for product_id, _ in new_quantities}
+
+    movements = []
+    for key in sorted(set(old_quantities) | set(new_quantities)):
+        product_id, warehouse_id = key
+        quantity_diff = new_quantities.get(key, 0) - old_quantities.get(key, 0)
+        if quantity_diff > 0:
+            # زادت الكمية: نخصم الزيادة
+            movements.append(_movement(
+                sale, product_id, warehouse_id, 'out', quantity_diff,
+                f"{main_reference}-EDIT-OUT-{stamp}",
+                f'زيادة كمية منتج في تعديل فاتورة مبيعات رقم {sale.number}', user,
+            ))
+        elif quantity_diff < 0 and product_id in new_products:
+            # قلت الكمية: نعيد الفرق للمخزون
+            movements.append(_movement(
+                sale, product_id, warehouse_id, 'in', -quantity_diff,
+                f"{main_reference}-EDIT-IN-{stamp}",
+                f'نقص كمية منتج في تعديل فاتورة مبيعات رقم {sale.number}', user,
+                unit_costs.get(product_id),
+            ))
+        elif quantity_diff < 0:
+            # حُذف المنتج من الفاتورة: نعيد الكمية المحذوفة للمخزون
+            movements.append(_movement(
+                sale, product_id, warehouse_id, 'in', -quantity_diff,
+                f"{main_reference}-EDIT-DELETE-{stamp}",
+                f'حذف منتج من فاتورة مبيعات رقم {sale.number}', user,
+                unit_costs.get(product_id),
+            ))
+    return movements
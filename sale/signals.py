@@ -2,7 +2,10 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.db import transaction
 from .models import SaleItem, SalePayment, Sale, SaleReturn
+from core.outbox import outbox
 from product.models import StockMovement
+from utils.balances import post_balance_entry
+from utils.payments import paid_amount_subquery
 
 
 @receiver(post_save, sender=SaleItem)
@@ -37,19 +40,32 @@ def handle_deleted_sale_item(sender, instance, **kwargs):
     pass
 
 
+@receiver(post_delete, sender=SalePayment)
+def refresh_paid_amount_on_payment_delete(sender, instance, **kwargs):
+    """
+    إعادة حساب المبلغ المدفوع المخزن في الفاتورة عند حذف دفعة
+    """
+    Sale.objects.filter(pk=instance.sale_id).update(paid_amount=paid_amount_subquery(Sale))
+
+
+@outbox.subscribe('sale.payment_status')
+def refresh_payment_status(sale):
+    """
+    إعادة حساب المبلغ المدفوع وحالة الدفع مرة واحدة داخل معاملة المستند
+    (يُنشر الحدث من حفظ الفاتورة ومن حفظ كل دفعة لها)
+    """
+    sale.update_payment_status()
+
+
 @receiver(post_save, sender=SalePayment)
-def update_payment_status_on_payment(sender, instance, created, **kwargs):
+def update_customer_balance_on_payment(sender, instance, created, **kwargs):
     """
-    تحديث حالة الدفع عند تسجيل دفعة
+    تحديث رصيد العميل عند تسجيل دفعة
     """
     if created:
-        instance.sale.update_payment_status()
-        
-        # تحديث رصيد العميل
         customer = instance.sale.customer
         if customer:
-            customer.balance -= instance.amount
-            customer.save(update_fields=['balance'])
+            post_balance_entry(customer, -instance.amount, 'sale_payment', instance.sale.number)
 
 
 @receiver(post_save, sender=Sale)
@@ -60,8 +76,7 @@ def update_customer_balance_on_sale(sender, instance, created, **kwargs):
     if created and instance.payment_method == 'credit':
         customer = instance.customer
         if customer:
-            customer.balance += instance.total
-            customer.save(update_fields=['balance'])
+            post_balance_entry(customer, instance.total, 'sale', instance.number)
 
 
 @receiver(post_save, sender=Sale)
@@ -70,98 +85,47 @@ def create_financial_transaction_for_sale(sender, instance, created, **kwargs):
     إنشاء معاملة مالية عند إنشاء فاتورة مبيعات جديدة
     """
     if created and instance.payment_status == 'paid':
-        try:
-            # استيراد النماذج المالية هنا لتجنب التعارض الدوري في الاستيرادات
-            from financial.models import Transaction, TransactionLine, Account
-            
-            # إيجاد أو إنشاء حساب الإيراد من المبيعات
-            sales_account, _ = Account.objects.get_or_create(
-                code='INC002',
-                defaults={
-                    'name': 'إيرادات المبيعات',
-                    'account_type': 'income',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            
-            # إيجاد أو إنشاء حساب العملاء
-            customers_account, _ = Account.objects.get_or_create(
-                code='AR001',
-                defaults={
-                    'name': 'حسابات العملاء',
-                    'account_type': 'asset',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            
-            # إيجاد أو إنشاء حساب الصندوق
-            cash_account, _ = Account.objects.get_or_create(
-                code='CASH001',
-                defaults={
-                    'name': 'الصندوق',
-                    'account_type': 'asset',
-                    'type': 'cash',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            
-            with transaction.atomic():
-                # إنشاء معاملة مالية للفاتورة
-                financial_trans = Transaction.objects.create(
-                    account=sales_account,
-                    transaction_type='income',
-                    amount=instance.total,
-                    date=instance.date,
-                    description=f'فاتورة مبيعات رقم {instance.number} - {instance.customer.name}',
-                    reference_number=instance.number,
-                    created_by=instance.created_by
-                )
-                
-                # إذا كانت الفاتورة مدفوعة نقدًا
-                if instance.payment_method == 'cash' and instance.payment_status == 'paid':
-                    # مدين: الصندوق
-                    TransactionLine.objects.create(
-                        transaction=financial_trans,
-                        account=cash_account,
-                        debit=instance.total,
-                        credit=0,
-                        description=f'مبيعات نقدية - فاتورة رقم {instance.number}'
-                    )
-                else:
-                    # مدين: حساب العملاء (ذمم مدينة)
-                    TransactionLine.objects.create(
-                        transaction=financial_trans,
-                        account=customers_account,
-                        debit=instance.total,
-                        credit=0,
-                        description=f'مبيعات آجلة - فاتورة رقم {instance.number}'
-                    )
-                
+        outbox.publish('sale.financial_posting', instance)
+
+
+@outbox.subscribe('sale.financial_posting')
+def post_sale_transaction(instance):
+    """
+    ترحيل المعاملة المالية لفاتورة المبيعات داخل معاملة إنشائها
+    """
+    # استيراد الخدمات المالية هنا لتجنب التعارض الدوري في الاستيرادات
+    from financial.services import chart_of_accounts, credit, debit, post_transaction
+    
+    def post(accounts):
+        sales_account = accounts['INC002']
+
+        # مدين: الصندوق إذا كانت الفاتورة مدفوعة نقدًا، وإلا حساب العملاء (ذمم مدينة)
+        if instance.payment_method == 'cash' and instance.payment_status == 'paid':
+            debit_line = debit(accounts['CASH001'], instance.total, f'مبيعات نقدية - فاتورة رقم {instance.number}')
+        else:
+            debit_line = debit(accounts['AR001'], instance.total, f'مبيعات آجلة - فاتورة رقم {instance.number}')
+
+        return post_transaction(
+            [
+                debit_line,
                 # دائن: حساب إيرادات المبيعات
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=sales_account,
-                    debit=0,
-                    credit=instance.total,
-                    description=f'إيراد مبيعات - فاتورة رقم {instance.number}'
-                )
-                
-                # تحديث أرصدة الحسابات
-                if instance.payment_method == 'cash' and instance.payment_status == 'paid':
-                    cash_account.update_balance(instance.total, 'add')
-                else:
-                    customers_account.update_balance(instance.total, 'add')
-                    
-                sales_account.update_balance(instance.total, 'add')
-                
-        except Exception as e:
-            # تسجيل الخطأ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error creating financial transaction for sale {instance.number}: {str(e)}")
+                credit(sales_account, instance.total, f'إيراد مبيعات - فاتورة رقم {instance.number}'),
+            ],
+            balance_changes=[
+                (debit_line.account_id, instance.total, 'add'),
+                (sales_account, instance.total, 'add'),
+            ],
+            account_id=sales_account,
+            transaction_type='income',
+            amount=instance.total,
+            date=instance.date,
+            description=f'فاتورة مبيعات رقم {instance.number} - {instance.customer.name}',
+            reference_number=instance.number,
+            created_by=instance.created_by,
+        )
+
+    # حسابات الإيراد من المبيعات والعملاء والصندوق
+    chart_of_accounts.post(post, 'INC002', 'AR001', 'CASH001', created_by=instance.created_by)
 
 
 @receiver(post_save, sender=SalePayment)
@@ -169,110 +133,54 @@ def create_financial_transaction_for_payment(sender, instance, created, **kwargs
     """
     إنشاء معاملة مالية عند استلام دفعة من فاتورة مبيعات
     """
-    print(f"SalePayment signal called: created={created}, has_transaction={instance.financial_transaction is not None}")
-    
     if created and not instance.financial_transaction:
-        try:
-            print(f"Creating financial transaction for sale payment: {instance.id}")
-            
-            # استيراد النماذج المالية هنا لتجنب التعارض الدوري في الاستيرادات
-            from financial.models import Transaction, TransactionLine, Account
-            
-            # إيجاد أو إنشاء حساب العملاء
-            customers_account, _ = Account.objects.get_or_create(
-                code='AR001',
-                defaults={
-                    'name': 'حسابات العملاء',
-                    'account_type': 'asset',
-                    'is_active': True,
-                    'created_by': instance.created_by
-                }
-            )
-            print(f"Customers account: {customers_account.id} - {customers_account.name}")
-            
-            # تحديد الحساب الذي سيتم الإيداع فيه بناءً على طريقة الدفع
-            if instance.payment_method == 'cash':
-                payment_account, _ = Account.objects.get_or_create(
-                    code='CASH001',
-                    defaults={
-                        'name': 'الصندوق',
-                        'account_type': 'asset',
-                        'type': 'cash',
-                        'is_active': True,
-                        'created_by': instance.created_by
-                    }
-                )
-            elif instance.payment_method == 'bank_transfer':
-                payment_account, _ = Account.objects.get_or_create(
-                    code='BANK001',
-                    defaults={
-                        'name': 'البنك',
-                        'account_type': 'asset',
-                        'type': 'bank',
-                        'is_active': True,
-                        'created_by': instance.created_by
-                    }
-                )
-            else:
-                # افتراضي إذا كانت طريقة دفع أخرى
-                payment_account, _ = Account.objects.get_or_create(
-                    code='CASH001',
-                    defaults={
-                        'name': 'الصندوق',
-                        'account_type': 'asset',
-                        'type': 'cash',
-                        'is_active': True,
-                        'created_by': instance.created_by
-                    }
-                )
-            print(f"Payment account: {payment_account.id} - {payment_account.name}")
-            
-            with transaction.atomic():
-                # إنشاء معاملة مالية للدفعة
-                financial_trans = Transaction.objects.create(
-                    account=payment_account,
-                    transaction_type='income',
-                    amount=instance.amount,
-                    date=instance.payment_date,
-                    description=f'دفعة من فاتورة رقم {instance.sale.number} - {instance.sale.customer.name}',
-                    reference_number=instance.reference_number,
-                    created_by=instance.created_by
-                )
-                print(f"Created transaction: {financial_trans.id} - {financial_trans.amount}")
-                
+        outbox.publish('sale_payment.financial_posting', instance)
+
+
+@outbox.subscribe('sale_payment.financial_posting')
+def post_sale_payment_transaction(instance):
+    """
+    ترحيل المعاملة المالية لدفعة فاتورة المبيعات داخل معاملة تسجيلها
+    """
+    # استيراد الخدمات المالية هنا لتجنب التعارض الدوري في الاستيرادات
+    from financial.services import (
+        chart_of_accounts, credit, debit, payment_account_code, post_transaction,
+    )
+    
+    # حساب العملاء والحساب الذي سيتم الإيداع فيه بناءً على طريقة الدفع
+    payment_code = payment_account_code(instance.payment_method)
+
+    def post(accounts):
+        customers_account = accounts['AR001']
+        payment_account = accounts[payment_code]
+
+        # إنشاء معاملة مالية للدفعة
+        return post_transaction(
+            [
                 # مدين: حساب الصندوق/البنك
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=payment_account,
-                    debit=instance.amount,
-                    credit=0,
-                    description=f'استلام دفعة - فاتورة رقم {instance.sale.number}'
-                )
-                
+                debit(payment_account, instance.amount, f'استلام دفعة - فاتورة رقم {instance.sale.number}'),
                 # دائن: حساب العملاء
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=customers_account,
-                    debit=0,
-                    credit=instance.amount,
-                    description=f'تسديد دفعة - فاتورة رقم {instance.sale.number}'
-                )
-                
-                # تحديث أرصدة الحسابات
-                payment_account.update_balance(instance.amount, 'add')
-                customers_account.update_balance(instance.amount, 'subtract')
-                
-                # ربط المعاملة المالية بالدفعة
-                instance.financial_transaction = financial_trans
-                instance.save(update_fields=['financial_transaction'])
-                print(f"Successfully linked transaction {financial_trans.id} to payment {instance.id}")
-                
-        except Exception as e:
-            # تسجيل الخطأ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
-            print(f"ERROR creating financial transaction: {str(e)}")
-            logger.error(f"Error creating financial transaction for sale payment {instance.id}: {str(e)}")
+                credit(customers_account, instance.amount, f'تسديد دفعة - فاتورة رقم {instance.sale.number}'),
+            ],
+            balance_changes=[
+                (payment_account, instance.amount, 'add'),
+                (customers_account, instance.amount, 'subtract'),
+            ],
+            account_id=payment_account,
+            transaction_type='income',
+            amount=instance.amount,
+            date=instance.payment_date,
+            description=f'دفعة من فاتورة رقم {instance.sale.number} - {instance.sale.customer.name}',
+            reference_number=instance.reference_number,
+            created_by=instance.created_by,
+        )
+
+    with transaction.atomic():
+        financial_trans = chart_of_accounts.post(post, 'AR001', payment_code, created_by=instance.created_by)
+
+        # ربط المعاملة المالية بالدفعة (بدون إعادة حفظ الدفعة ونشر أحداثها)
+        SalePayment.objects.filter(pk=instance.pk).update(financial_transaction=financial_trans)
+        instance.financial_transaction = financial_trans
 
 
 @receiver(post_save, sender=SaleReturn)
@@ -281,63 +189,44 @@ def create_financial_transaction_for_return(sender, instance, **kwargs):
     إنشاء معاملة مالية عند تأكيد مرتجع مبيعات
     """
     if instance.status == 'confirmed':
-        try:
-            # استيراد النماذج المالية هنا لتجنب التعارض الدوري في الاستيرادات
-            from financial.models import Transaction, TransactionLine, Account
-            
-            # إيجاد حسابات المبيعات والعملاء والصندوق
-            sales_account = Account.objects.filter(code='INC002').first()
-            customers_account = Account.objects.filter(code='AR001').first()
-            cash_account = Account.objects.filter(code='CASH001').first()
-            
-            if not sales_account or not customers_account or not cash_account:
-                raise Exception("لم يتم العثور على الحسابات اللازمة")
-            
-            with transaction.atomic():
-                # إنشاء معاملة مالية للمرتجع
-                financial_trans = Transaction.objects.create(
-                    account=sales_account,
-                    transaction_type='expense',
-                    amount=instance.total,
-                    date=instance.date,
-                    description=f'مرتجع مبيعات رقم {instance.number} - فاتورة رقم {instance.sale.number}',
-                    reference_number=instance.number,
-                    created_by=instance.created_by
-                )
-                
+        outbox.publish('sale_return.financial_posting', instance)
+
+
+@outbox.subscribe('sale_return.financial_posting')
+def post_sale_return_transaction(instance):
+    """
+    ترحيل المعاملة المالية لمرتجع المبيعات داخل معاملة تأكيده
+    """
+    # استيراد الخدمات المالية هنا لتجنب التعارض الدوري في الاستيرادات
+    from financial.services import chart_of_accounts, credit, debit, post_transaction
+    
+    def post(accounts):
+        sales_account = accounts['INC002']
+
+        # دائن: حساب العملاء أو الصندوق (حسب طريقة الدفع الأصلية)
+        if instance.sale.payment_method == 'cash' and instance.sale.payment_status == 'paid':
+            account_to_credit = accounts['CASH001']
+        else:
+            account_to_credit = accounts['AR001']
+
+        return post_transaction(
+            [
                 # مدين: حساب إيرادات المبيعات (تخفيض الإيرادات)
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=sales_account,
-                    debit=instance.total,
-                    credit=0,
-                    description=f'مرتجع مبيعات - فاتورة رقم {instance.sale.number}'
-                )
-                
-                # دائن: حساب العملاء أو الصندوق (حسب طريقة الدفع الأصلية)
-                if instance.sale.payment_method == 'cash' and instance.sale.payment_status == 'paid':
-                    account_to_credit = cash_account
-                else:
-                    account_to_credit = customers_account
-                
-                TransactionLine.objects.create(
-                    transaction=financial_trans,
-                    account=account_to_credit,
-                    debit=0,
-                    credit=instance.total,
-                    description=f'مرتجع مبيعات - فاتورة رقم {instance.sale.number}'
-                )
-                
-                # تحديث أرصدة الحسابات
-                sales_account.update_balance(instance.total, 'subtract')
-                
-                if account_to_credit == cash_account:
-                    cash_account.update_balance(instance.total, 'subtract')
-                else:
-                    customers_account.update_balance(instance.total, 'subtract')
-                
-        except Exception as e:
-            # تسجيل الخطأ بدلاً من إيقاف العملية
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.error(f"Error creating financial transaction for return {instance.number}: {str(e)}") 
\ No newline at end of file
+                debit(sales_account, instance.total, f'مرتجع مبيعات - فاتورة رقم {instance.sale.number}'),
+                credit(account_to_credit, instance.total, f'مرتجع مبيعات - فاتورة رقم {instance.sale.number}'),
+            ],
+            balance_changes=[
+                (sales_account, instance.total, 'subtract'),
+                (account_to_credit, instance.total, 'subtract'),
+            ],
+            account_id=sales_account,
+            transaction_type='expense',
+            amount=instance.total,
+            date=instance.date,
+            description=f'مرتجع مبيعات رقم {instance.number} - فاتورة رقم {instance.sale.number}',
+            reference_number=instance.number,
+            created_by=instance.created_by,
+        )
+
+    # حسابات المبيعات والعملاء والصندوق (تُنشأ إن لم توجد كترحيل الفاتورة نفسها)
+    chart_of_accounts.post(post, 'INC002', 'AR001', 'CASH001', created_by=instance.created_by)
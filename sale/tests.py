@@ -1,3 +1,313 @@
+import datetime
+from decimal import Decimal
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from client.models import Customer
+from core.outbox import outbox
+from financial.models import Transaction
+from financial.services import chart_of_accounts
+from product.models import Category, Unit, Product, Warehouse, Stock, StockMovement
+from product.services.stock import rebuild_total_stock
+from sale.models import Sale, SaleItem, SalePayment, SaleReturn, SaleReturnItem
+from sale.services import SaleLine, create_sale_items, update_sale_items
+from utils.returns import resolve_return_statuses
+
+User = get_user_model()
+
+
+class SaleTestMixin:
+    """
+    منتجات ومخزون وعميل أساسي مشترك لاختبارات المبيعات
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='seller', password='testpassword123')
+        self.customer = Customer.objects.create(name='عميل', code='C-1')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+        category = Category.objects.create(name='فئة')
+        unit = Unit.objects.create(name='قطعة', symbol='ق')
+        self.products = [
+            Product.objects.create(
+                name=f'منتج {index}', sku=f'SKU-{index}', category=category, unit=unit,
+                cost_price=10, selling_price=15, created_by=self.user,
+            )
+            for index in range(60)
+        ]
+        Stock.objects.bulk_create([
+            Stock(product=product, warehouse=self.warehouse, quantity=100) for product in self.products
+        ])
+        # bulk_create لا يمر بخدمة ترحيل المخزون
+        rebuild_total_stock()
+
+    def create_sale(self):
+        return Sale.objects.create(
+            date=datetime.date(2024, 1, 1), customer=self.customer, warehouse=self.warehouse,
+            subtotal=0, total=0, payment_method='credit', created_by=self.user,
+        )
+
+    def lines(self, count, quantity=2):
+        return [SaleLine(product.pk, quantity, Decimal('15'), Decimal('0')) for product in self.products[:count]]
+
+    def stock(self, product, warehouse=None):
+        return Stock.objects.get(product=product, warehouse=warehouse or self.warehouse).quantity
+
+
+class SalePostingTest(SaleTestMixin, TestCase):
+    """
+    اختبارات خدمة ترحيل بنود فواتير المبيعات
+    """
+
+    def count_queries(self, lines):
+        sale = self.create_sale()
+        with CaptureQueriesContext(connection) as context:
+            create_sale_items(sale, lines, self.user)
+        return len(context)
+
+    def test_queries_do_not_grow_with_lines(self):
+        # أول ترحيل ينشئ عداد ترقيم الحركات
+        self.count_queries(self.lines(1))
+        queries = self.count_queries(self.lines(50))
+        self.assertEqual(queries, self.count_queries(self.lines(5)))
+        self.assertLessEqual(queries, 12)
+
+    def test_items_and_movements_are_posted(self):
+        sale = self.create_sale()
+        lines = self.lines(3) + [SaleLine(self.products[0].pk, 5, Decimal('15'), Decimal('1'))]
+        items = create_sale_items(sale, lines, self.user)
+
+        self.assertEqual(sale.items.count(), 4)
+        self.assertEqual(items[3].total, Decimal('74'))
+        self.assertEqual(self.stock(self.products[0]), 93)
+        movements = StockMovement.objects.filter(document_number=sale.number).order_by('pk')
+        self.assertEqual(
+            [(m.quantity_before, m.quantity_after) for m in movements if m.product_id == self.products[0].pk],
+            [(100, 98), (98, 93)],
+        )
+        self.assertTrue(all(m.number for m in movements))
+
+    def test_edit_applies_only_the_difference(self):
+        sale = self.create_sale()
+        create_sale_items(sale, self.lines(3), self.user)
+        kept = sale.items.get(product=self.products[0])
+
+        update_sale_items(sale, [
+            SaleLine(self.products[0].pk, 2, Decimal('15'), Decimal('0')),
+            SaleLine(self.products[1].pk, 5, Decimal('15'), Decimal('0')),
+            SaleLine(self.products[3].pk, 1, Decimal('15'), Decimal('0')),
+        ], self.user)
+
+        self.assertTrue(SaleItem.objects.filter(pk=kept.pk).exists())
+        self.assertEqual(sale.items.count(), 3)
+        self.assertEqual(
+            [self.stock(product) for product in self.products[:4]],
+            [98, 95, 100, 99],
+        )
+        edits = StockMovement.objects.filter(reference_number__contains='-EDIT-')
+        self.assertEqual(edits.count(), 3)
+
+    def test_edit_moves_stock_between_warehouses(self):
+        other = Warehouse.objects.create(name='المخزن الفرعي', code='SUB')
+        sale = self.create_sale()
+        create_sale_items(sale, self.lines(1), self.user)
+
+        sale.warehouse = other
+        sale.save()
+        update_sale_items(sale, self.lines(1), self.user, previous_warehouse_id=self.warehouse.pk)
+        self.assertEqual(self.stock(self.products[0]), 100)
+        self.assertEqual(self.stock(self.products[0], other), 0)
+
+    def test_create_view(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('sale:sale_create'), {
+            'customer': self.customer.pk,
+            'warehouse': self.warehouse.pk,
+            'date': '2024-01-01',
+            'discount': '0',
+            'payment_method': 'credit',
+            'subtotal': '45',
+            'total': '45',
+            'product[]': [self.products[0].pk, self.products[1].pk, ''],
+            'quantity[]': ['2', '1', ''],
+            'unit_price[]': ['15', '15', ''],
+            'discount[]': ['0', '0', ''],
+        })
+        sale = Sale.objects.get()
+        self.assertRedirects(response, reverse('sale:sale_detail', kwargs={'pk': sale.pk}), fetch_redirect_response=False)
+        self.assertEqual(sale.items.count(), 2)
+        self.assertEqual(self.stock(self.products[0]), 98)
+
+
+class PaymentTotalsTest(TestCase):
+    """
+    اختبارات إجماليات مدفوعات فواتير المبيعات
+    """
+
+    def setUp(self):
+        # معرفات الحسابات المحفوظة من اختبارات سابقة أُلغيت معاملاتها
+        cache.clear()
+        self.user = User.objects.create_user(username='cashier', password='testpassword123')
+        self.customer = Customer.objects.create(name='عميل', code='C-1')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+        self.sales = [
+            Sale.objects.create(
+                date=datetime.date(2024, 1, 1), customer=self.customer, warehouse=self.warehouse,
+                subtotal=100, total=100, payment_method='credit', created_by=self.user,
+            )
+            for _ in range(5)
+        ]
+
+    def pay(self, sale, amount):
+        return SalePayment.objects.create(
+            sale=sale, amount=Decimal(amount), payment_date=datetime.date(2024, 1, 2),
+            payment_method='cash', created_by=self.user, financial_transaction=None,
+        )
+
+    def test_paid_amount_follows_payments(self):
+        sale = self.sales[0]
+        first = self.pay(sale, '40')
+        self.pay(sale, '60')
+        sale.refresh_from_db()
+        self.assertEqual(sale.paid_amount, Decimal('100'))
+        self.assertEqual(sale.payment_status, 'paid')
+        self.assertTrue(sale.is_fully_paid)
+
+        first.delete()
+        sale.refresh_from_db()
+        self.assertEqual(sale.paid_amount, Decimal('60'))
+        self.assertEqual(sale.amount_due, Decimal('40'))
+
+    def test_annotated_totals_in_one_query(self):
+        self.pay(self.sales[0], '30')
+        self.pay(self.sales[1], '100')
+        # تجاوز العمود المخزن للتأكد من أن القيم المضافة هي المستخدمة
+        Sale.objects.update(paid_amount=0)
+
+        with self.assertNumQueries(1):
+            rows = [
+                (sale.amount_paid, sale.amount_due, sale.is_fully_paid)
+                for sale in Sale.objects.with_payment_totals().order_by('pk')
+            ]
+        self.assertEqual(rows[:3], [
+            (Decimal('30'), Decimal('70'), False),
+            (Decimal('100'), Decimal('0'), True),
+            (Decimal('0'), Decimal('100'), False),
+        ])
+
+    def test_payment_view_posts_balance_once(self):
+        sale = self.sales[0]
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('sale:sale_add_payment', kwargs={'pk': sale.pk}), {
+            'amount': '40', 'payment_date': '2024-01-02', 'payment_method': 'cash',
+        })
+        self.assertRedirects(response, reverse('sale:sale_detail', kwargs={'pk': sale.pk}), fetch_redirect_response=False)
+
+        # خمس فواتير آجلة بمبلغ 100 ودفعة واحدة بمبلغ 40
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('460'))
+        self.assertEqual(self.customer.balance_entries.filter(source='sale_payment').count(), 1)
+
+    def test_properties_do_not_query(self):
+        self.pay(self.sales[0], '25')
+        sale = Sale.objects.get(pk=self.sales[0].pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(sale.amount_paid, Decimal('25'))
+            self.assertEqual(sale.amount_due, Decimal('75'))
+
+
+class PostingFailureTest(TestCase):
+    """
+    اختبارات إلغاء المستند عند فشل ترحيل معاملته المالية
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cashier', password='testpassword123')
+        self.customer = Customer.objects.create(name='عميل', code='C-1')
+        self.warehouse = Warehouse.objects.create(name='المخزن الرئيسي', code='MAIN')
+
+    def failing_posting(self):
+        return mock.patch.object(chart_of_accounts, 'post', side_effect=RuntimeError('posting failed'))
+
+    def test_failed_sale_posting_rolls_back_sale(self):
+        with self.failing_posting(), self.assertRaises(RuntimeError), outbox.atomic():
+            Sale.objects.create(
+                date=datetime.date(2024, 1, 1), customer=self.customer, warehouse=self.warehouse,
+                subtotal=100, total=100, payment_method='cash', payment_status='paid', created_by=self.user,
+            )
+        self.assertFalse(Sale.objects.exists())
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_failed_payment_posting_rolls_back_payment(self):
+        sale = Sale.objects.create(
+            date=datetime.date(2024, 1, 1), customer=self.customer, warehouse=self.warehouse,
+            subtotal=100, total=100, payment_method='credit', created_by=self.user,
+        )
+        self.client.force_login(self.user)
+        with self.failing_posting(), self.assertRaises(RuntimeError):
+            self.client.post(reverse('sale:sale_add_payment', kwargs={'pk': sale.pk}), {
+                'amount': '40', 'payment_date': '2024-01-02', 'payment_method': 'cash',
+            })
+
+        self.assertFalse(SalePayment.objects.exists())
+        sale.refresh_from_db()
+        self.assertEqual((sale.paid_amount, sale.payment_status), (Decimal('0'), 'unpaid'))
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.balance, Decimal('100'))
+
+
+class ReturnStatusTest(SaleTestMixin, TestCase):
+    """
+    اختبارات حساب حالة الإرجاع لمجموعة فواتير
+    """
+
+    def return_items(self, sale, quantities, status='confirmed'):
+        sale_return = SaleReturn.objects.create(
+            date=datetime.date(2024, 1, 5), sale=sale, warehouse=self.warehouse,
+            subtotal=0, total=0, status=status, created_by=self.user,
+        )
+        for item in sale.items.order_by('pk'):
+            quantity = quantities.get(item.product_id)
+            if quantity:
+                SaleReturnItem.objects.create(
+                    sale_return=sale_return, sale_item=item, product_id=item.product_id,
+                    quantity=quantity, unit_price=item.unit_price, reason='تالف',
+                )
+
+    def test_statuses_for_a_page(self):
+        full, partial, draft, plain = [self.create_sale() for _ in range(4)]
+        for sale in (full, partial, draft, plain):
+            create_sale_items(sale, self.lines(2), self.user)
+
+        first, second = self.products[0].pk, self.products[1].pk
+        self.return_items(full, {first: 2})
+        self.return_items(full, {second: 2})
+        self.return_items(partial, {first: 2, second: 1})
+        self.return_items(draft, {first: 2, second: 2}, status='draft')
+
+        sales = list(Sale.objects.filter(pk__in=[full.pk, partial.pk, draft.pk, plain.pk]).order_by('pk'))
+        with self.assertNumQueries(2):
+            resolve_return_statuses(sales)
+        with self.assertNumQueries(0):
+            self.assertEqual([sale.return_status for sale in sales], ['full', 'partial', None, None])
+            self.assertEqual([sale.is_returned for sale in sales], [True, True, False, False])
+
+        # بدون قيمة مرفقة تُحسب الحالة للفاتورة الواحدة
+        self.assertEqual(Sale.objects.get(pk=partial.pk).return_status, 'partial')
+
+    def test_list_view(self):
+        self.client.force_login(self.user)
+        sale = self.create_sale()
+        create_sale_items(sale, self.lines(1), self.user)
+        self.return_items(sale, {self.products[0].pk: 2})
 
-# Create your tests here.
+        response = self.client.get(reverse('sale:sale_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['sales'][0].return_status, 'full')
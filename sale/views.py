@@ -8,13 +8,17 @@ from django.http import JsonResponse, HttpResponseRedirect
 from django.urls import reverse
 from sale.models import Sale, SaleItem, SalePayment, SaleReturn, SaleReturnItem
 from .forms import SaleForm, SaleItemForm, SalePaymentForm, SaleReturnForm
-from product.models import Product, Stock, StockMovement, Warehouse, SerialNumber
+from product.models import Product, StockMovement, Warehouse
+from core.outbox import outbox
+from product.services.numbering import peek_number
+from utils.returns import resolve_return_statuses
+from sale.services import parse_sale_lines, create_sale_items, update_sale_items
+from product.services.valuation import sale_cogs, sale_unit_costs
 from django.db.models import Sum, F, Value, IntegerField
 from django.db.models.functions import Coalesce
 from django.http import HttpResponse
 from django.template.loader import get_template
 import logging
-import random
 from client.models import Customer
 import datetime
 from decimal import Decimal
@@ -29,7 +33,7 @@ def sale_list(request):
     عرض قائمة فواتير المبيعات
     """
     # الاستعلام الأساسي مع ترتيب تنازلي حسب التاريخ ثم الرقم
-    sales_query = Sale.objects.all().order_by('-date', '-id')
+    sales_query = Sale.objects.select_related('customer', 'warehouse').order_by('-date', '-id')
     
     # تصفية حسب العميل
     customer = request.GET.get('customer')
@@ -54,6 +58,8 @@ def sale_list(request):
     paginator = Paginator(sales_query, 25)  # 25 فاتورة في كل صفحة
     page = request.GET.get('page')
     sales = paginator.get_page(page)
+    # حالة الإرجاع لكل فواتير الصفحة باستعلامين بدلاً من استعلامات لكل فاتورة
+    sales.object_list = resolve_return_statuses(sales.object_list)
     
     # إحصائيات للعرض في الصفحة
     paid_sales_count = Sale.objects.filter(payment_status='paid').count()
@@ -124,126 +130,18 @@ def sale_create(request):
         
         if form.is_valid():
             try:
-                with transaction.atomic():
+                with outbox.atomic():
                     # إنشاء فاتورة المبيعات
                     sale = form.save(commit=False)
                     sale.subtotal = Decimal(request.POST.get('subtotal', '0'))
                     sale.total = Decimal(request.POST.get('total', '0'))
                     sale.created_by = request.user
                     
-                    # التأكد من وجود رقم للفاتورة
-                    if not sale.number:
-                        # الحصول على الرقم التسلسلي
-                        try:
-                            logger.info("جاري محاولة إنشاء رقم تسلسلي جديد للفاتورة")
-                            serial, created = SerialNumber.objects.get_or_create(
-                                document_type='sale',
-                                year=timezone.now().year,
-                                defaults={
-                                    'prefix': 'SALE',
-                                    'last_number': 0
-                                }
-                            )
-                            next_number = serial.get_next_number()
-                            sale.number = f"{serial.prefix}{next_number:04d}"
-                            logger.info(f"تم إنشاء رقم فاتورة جديد: {sale.number}")
-                        except Exception as e:
-                            logger.error(f"خطأ في إنشاء رقم الفاتورة: {str(e)}")
-                            # في حالة فشل إنشاء الرقم التسلسلي، قم بإنشاء رقم عشوائي
-                            import random
-                            random_num = random.randint(10000, 99999)
-                            sale.number = f"SALE{random_num}"
-                            logger.info(f"تم إنشاء رقم فاتورة عشوائي: {sale.number}")
-                    
+                    # رقم الفاتورة يتم حجزه من عداد المبيعات عند الحفظ داخل نفس المعاملة
                     sale.save()
                     
-                    # إضافة بنود الفاتورة
-                    product_ids = request.POST.getlist('product[]')
-                    quantities = request.POST.getlist('quantity[]')
-                    unit_prices = request.POST.getlist('unit_price[]')
-                    discounts = request.POST.getlist('discount[]')
-                    
-                    # حذف جميع حركات المخزون المرتبطة بهذه الفاتورة أولاً للتأكد من عدم التكرار
-                    StockMovement.objects.filter(
-                        reference_number__startswith=f"SALE-{sale.number}"
-                    ).delete()
-                    
-                    # تعريف رقم المرجع الرئيسي
-                    main_reference = f"SALE-{sale.number}"
-                    
-                    for i in range(len(product_ids)):
-                        if product_ids[i]:  # تخطي الصفوف الفارغة
-                            product = get_object_or_404(Product, id=product_ids[i])
-                            try:
-                                # التأكد من تحويل كل القيم إلى الأنواع المناسبة
-                                quantity_val = float(quantities[i])
-                                # التأكد من أن الكمية موجبة وأكبر من الصفر
-                                if quantity_val <= 0:
-                                    raise ValueError("يجب أن تكون الكمية أكبر من صفر")
-                                
-                                quantity = max(1, int(quantity_val))  # التأكد من أن الكمية على الأقل 1
-                                
-                                # التأكد من صحة سعر الوحدة
-                                unit_price_val = unit_prices[i].strip() if isinstance(unit_prices[i], str) else unit_prices[i]
-                                if not unit_price_val or float(unit_price_val) <= 0:
-                                    raise ValueError("يجب أن يكون سعر الوحدة أكبر من صفر")
-                                unit_price = Decimal(unit_price_val)
-                                
-                                # التأكد من صحة قيمة الخصم
-                                discount_value = discounts[i].strip() if isinstance(discounts[i], str) else discounts[i]
-                                discount_value = discount_value if discount_value else '0'
-                                if float(discount_value) < 0:
-                                    discount_value = '0'  # تجنب القيم السالبة في الخصم
-                                discount = Decimal(discount_value)
-                                
-                                # إنشاء بند فاتورة
-                                item = SaleItem(
-                                    sale=sale,
-                                    product=product,
-                                    quantity=quantity,
-                                    unit_price=unit_price,
-                                    discount=discount,
-                                    total=(Decimal(str(quantity)) * unit_price) - discount
-                                )
-                                item.save()
-                            except (ValueError, TypeError) as e:
-                                raise ValueError(f"خطأ في تحويل قيم البند {i+1}: {str(e)}")
-                    
-                    # بعد إنشاء جميع البنود، قم بإنشاء حركات المخزون
-                    for item in sale.items.all():
-                        # استخدام معرف البند في الرقم المرجعي بدلاً من معرف المنتج لضمان عدم التكرار
-                        reference_id = f"{main_reference}-ITEM{item.id}" 
-                        
-                        # تحقق من وجود حركة مخزون مسبقة بنفس الرقم المرجعي
-                        if not StockMovement.objects.filter(
-                            reference_number=reference_id
-                        ).exists():
-                            # الحصول على المخزون الحالي
-                            stock, created = Stock.objects.get_or_create(
-                                product=item.product,
-                                warehouse=sale.warehouse,
-                                defaults={'quantity': 0}
-                            )
-                            
-                            # تخزين قيمة المخزون قبل التحديث
-                            quantity_before = stock.quantity
-                            
-                            # تحديث المخزون يدوياً
-                            stock.quantity -= item.quantity
-                            stock.save()
-                            
-                            # إنشاء حركة مخزون
-                            StockMovement.objects.create(
-                                product=item.product,
-                                warehouse=sale.warehouse,
-                                movement_type='out',
-                                quantity=item.quantity,
-                                reference_number=reference_id,
-                                document_type='sale',
-                                document_number=sale.number,
-                                notes=f'فاتورة مبيعات رقم {sale.number}',
-                                created_by=request.user
-                            )
+                    # إضافة بنود الفاتورة وخصمها من المخزون دفعة واحدة
+                    create_sale_items(sale, parse_sale_lines(request.POST), request.user)
                     
                     messages.success(request, 'تم إنشاء فاتورة المبيعات بنجاح')
                     return redirect('sale:sale_detail', pk=sale.pk)
@@ -257,32 +155,10 @@ def sale_create(request):
         }
         form = SaleForm(initial=initial_data)
     
-    # محاولة الحصول على الرقم التسلسلي التالي للفاتورة
+    # الرقم المتوقع للفاتورة التالية (للعرض فقط، الرقم الفعلي يُحجز عند الحفظ)
     next_sale_number = None
     try:
-        # إنشاء مستند SerialNumber ليتم الحصول على رقم جديد منه
-        serial, created = SerialNumber.objects.get_or_create(
-            document_type='sale',
-            year=timezone.now().year,
-            defaults={
-                'prefix': 'SALE',
-                'last_number': 0
-            }
-        )
-        
-        # الحصول على الرقم التالي للفاتورة بدون حفظ (لعرض فقط)
-        last_sale = Sale.objects.order_by('-id').first()
-        last_number = 0
-        
-        if last_sale and last_sale.number:
-            try:
-                last_number = int(last_sale.number.replace('SALE', ''))
-            except (ValueError, AttributeError):
-                pass
-                
-        next_number = max(serial.last_number, last_number) + 1
-        next_sale_number = f"{serial.prefix}{next_number:04d}"
-        logger.info(f"الرقم التالي للفاتورة الجديدة: {next_sale_number}")
+        next_sale_number = peek_number('sale')
     except Exception as e:
         logger.error(f"خطأ في الحصول على الرقم التالي للفاتورة: {str(e)}")
     
@@ -338,9 +214,12 @@ def sale_detail(request, pk):
     عرض تفاصيل فاتورة المبيعات
     """
     sale = get_object_or_404(Sale, pk=pk)
+    cogs = sale_cogs(sale)
     
     context = {
         'sale': sale,
+        'cogs': cogs,
+        'gross_profit': sale.total - cogs,
         'title': 'تفاصيل فاتورة المبيعات',
         'page_title': f'فاتورة مبيعات - {sale.number}',
         'page_icon': 'fas fa-file-invoice-dollar',
@@ -369,157 +248,25 @@ def sale_edit(request, pk):
         messages.error(request, 'لا يمكن تعديل الفاتورة لأنها تحتوي على مرتجعات مؤكدة')
         return redirect('sale:sale_detail', pk=sale.pk)
     
-    # حفظ البنود الحالية للفاتورة قبل التعديل للاستفادة منها لاحقاً
-    original_items = {}
-    for item in sale.items.all():
-        original_items[item.product_id] = item.quantity
+    # المخزن الحالي للفاتورة قبل التعديل (لإعادة الكميات إليه إذا تم تغييره)
+    original_warehouse_id = sale.warehouse_id
     
     if request.method == 'POST':
         form = SaleForm(request.POST, instance=sale)
         if form.is_valid():
             try:
-                with transaction.atomic():
+                with outbox.atomic():
                     # تحديث بيانات الفاتورة (باستثناء البنود)
                     updated_sale = form.save(commit=False)
                     updated_sale.subtotal = Decimal(request.POST.get('subtotal', '0'))
                     updated_sale.total = Decimal(request.POST.get('total', '0'))
                     updated_sale.save()
                     
-                    # حذف عناصر الفاتورة (سيتم إعادة إنشائها)
-                    sale.items.all().delete()
-                    
-                    # إضافة بنود الفاتورة الجديدة
-                    product_ids = request.POST.getlist('product[]')
-                    quantities = request.POST.getlist('quantity[]')
-                    unit_prices = request.POST.getlist('unit_price[]')
-                    discounts = request.POST.getlist('discount[]')
-                    
-                    # تعريف رقم المرجع الرئيسي
-                    main_reference = f"SALE-{updated_sale.number}"
-                    
-                    for i in range(len(product_ids)):
-                        if product_ids[i]:  # تخطي الصفوف الفارغة
-                            product = get_object_or_404(Product, id=product_ids[i])
-                            try:
-                                # التأكد من تحويل كل القيم إلى الأنواع المناسبة
-                                quantity_val = float(quantities[i])
-                                # التأكد من أن الكمية موجبة وأكبر من الصفر
-                                if quantity_val <= 0:
-                                    raise ValueError("يجب أن تكون الكمية أكبر من صفر")
-                                
-                                quantity = max(1, int(quantity_val))  # التأكد من أن الكمية على الأقل 1
-                                
-                                # التأكد من صحة سعر الوحدة
-                                unit_price_val = unit_prices[i].strip() if isinstance(unit_prices[i], str) else unit_prices[i]
-                                if not unit_price_val or float(unit_price_val) <= 0:
-                                    raise ValueError("يجب أن يكون سعر الوحدة أكبر من صفر")
-                                unit_price = Decimal(unit_price_val)
-                                
-                                # التأكد من صحة قيمة الخصم
-                                discount_value = discounts[i].strip() if isinstance(discounts[i], str) else discounts[i]
-                                discount_value = discount_value if discount_value else '0'
-                                if float(discount_value) < 0:
-                                    discount_value = '0'  # تجنب القيم السالبة في الخصم
-                                discount = Decimal(discount_value)
-                                
-                                # إنشاء بند فاتورة
-                                item = SaleItem(
-                                    sale=updated_sale,
-                                    product=product,
-                                    quantity=quantity,
-                                    unit_price=unit_price,
-                                    discount=discount,
-                                    total=(Decimal(str(quantity)) * unit_price) - discount
-                                )
-                                item.save()
-                            except (ValueError, TypeError) as e:
-                                raise ValueError(f"خطأ في تحويل قيم البند {i+1}: {str(e)}")
-                    
-                    # بعد إنشاء جميع البنود، قم بإنشاء حركات المخزون للاختلافات فقط
-                    # إنشاء قاموس للكميات الجديدة
-                    new_items = {}
-                    for item in updated_sale.items.all():
-                        new_items[item.product_id] = item.quantity
-                    
-                    # معالجة المنتجات المضافة أو التي تغيرت كميتها
-                    for product_id, new_quantity in new_items.items():
-                        original_quantity = original_items.get(product_id, 0)
-                        quantity_diff = new_quantity - original_quantity
-                        
-                        if quantity_diff != 0:  # فقط إذا كان هناك تغيير في الكمية
-                            product = Product.objects.get(id=product_id)
-                            
-                            # الحصول على المخزون الحالي
-                            stock, created = Stock.objects.get_or_create(
-                                product=product,
-                                warehouse=updated_sale.warehouse,
-                                defaults={'quantity': 0}
-                            )
-                            
-                            # تحديث المخزون يدوياً حسب اتجاه التغيير
-                            if quantity_diff > 0:  # إذا زادت الكمية، نخصم الزيادة
-                                stock.quantity -= quantity_diff
-                                if stock.quantity < 0:
-                                    stock.quantity = 0
-                                
-                                # إنشاء حركة مخزون للخصم
-                                StockMovement.objects.create(
-                                    product=product,
-                                    warehouse=updated_sale.warehouse,
-                                    movement_type='out',
-                                    quantity=quantity_diff,
-                                    reference_number=f"{main_reference}-EDIT-OUT-{timezone.now().strftime('%Y%m%d%H%M%S')}",
-                                    document_type='sale',
-                                    document_number=updated_sale.number,
-                                    notes=f'زيادة كمية منتج في تعديل فاتورة مبيعات رقم {updated_sale.number}',
-                                    created_by=request.user
-                                )
-                            else:  # إذا قلت الكمية، نعيد الفرق للمخزون
-                                stock.quantity += abs(quantity_diff)
-                                
-                                # إنشاء حركة مخزون للإضافة
-                                StockMovement.objects.create(
-                                    product=product,
-                                    warehouse=updated_sale.warehouse,
-                                    movement_type='in',
-                                    quantity=abs(quantity_diff),
-                                    reference_number=f"{main_reference}-EDIT-IN-{timezone.now().strftime('%Y%m%d%H%M%S')}",
-                                    document_type='sale',
-                                    document_number=updated_sale.number,
-                                    notes=f'نقص كمية منتج في تعديل فاتورة مبيعات رقم {updated_sale.number}',
-                                    created_by=request.user
-                                )
-                            
-                            stock.save()
-                    
-                    # معالجة المنتجات المحذوفة (المنتجات الموجودة في البنود القديمة وليست في البنود الجديدة)
-                    for product_id, original_quantity in original_items.items():
-                        if product_id not in new_items:  # إذا كان المنتج موجود سابقًا وتم حذفه
-                            product = Product.objects.get(id=product_id)
-                            
-                            # الحصول على المخزون الحالي
-                            stock, created = Stock.objects.get_or_create(
-                                product=product,
-                                warehouse=updated_sale.warehouse,
-                                defaults={'quantity': 0}
-                            )
-                            
-                            # إعادة الكمية المحذوفة للمخزون
-                            stock.quantity += original_quantity
-                            stock.save()
-                            
-                            # إنشاء حركة مخزون للإضافة
-                            StockMovement.objects.create(
-                                product=product,
-                                warehouse=updated_sale.warehouse,
-                                movement_type='in',
-                                quantity=original_quantity,
-                                reference_number=f"{main_reference}-EDIT-DELETE-{timezone.now().strftime('%Y%m%d%H%M%S')}",
-                                document_type='sale',
-                                document_number=updated_sale.number,
-                                notes=f'حذف منتج من فاتورة مبيعات رقم {updated_sale.number}',
-                                created_by=request.user
-                            )
+                    # تطبيق الفرق فقط بين البنود القديمة والجديدة وحركات المخزون الخاصة به
+                    update_sale_items(
+                        updated_sale, parse_sale_lines(request.POST), request.user,
+                        previous_warehouse_id=original_warehouse_id,
+                    )
                     
                     messages.success(request, 'تم تعديل فاتورة المبيعات بنجاح')
                     return redirect('sale:sale_detail', pk=updated_sale.pk)
@@ -625,21 +372,10 @@ def add_payment(request, pk):
                 messages.warning(request, _('تم تقليل المبلغ إلى القيمة المستحقة المتبقية'))
                 payment.amount = sale.amount_due
             
-            with transaction.atomic():
-                # حفظ الدفعة
+            with outbox.atomic():
+                # حفظ الدفعة (حالة دفع الفاتورة تُحدث مرة واحدة في نهاية الكتلة داخل نفس المعاملة،
+                # وقيد رصيد العميل يُسجل من إشارة حفظ الدفعة)
                 payment.save()
-                
-                # تحديث حالة فاتورة المبيعات
-                sale.refresh_from_db()
-                if sale.amount_due <= 0:
-                    sale.payment_status = 'paid'
-                elif sale.amount_paid > 0:
-                    sale.payment_status = 'partially_paid'
-                sale.save()
-                
-                # تحديث رصيد العميل
-                sale.customer.balance -= payment.amount
-                sale.customer.save()
             
             messages.success(request, _('تم تسجيل الدفعة بنجاح'))
             return redirect('sale:sale_detail', pk=sale.pk)
@@ -692,6 +428,9 @@ def sale_return(request, pk):
                     return_quantities = request.POST.getlist('return_quantity')
                     return_reasons = request.POST.getlist('return_reason')
                     
+                    # المرتجع يعود للمخزون بتكلفة صرفه في الفاتورة
+                    unit_costs = sale_unit_costs(sale)
+                    
                     subtotal = 0
                     for i in range(len(item_ids)):
                         if item_ids[i] and int(return_quantities[i]) > 0:
@@ -723,6 +462,7 @@ def sale_return(request, pk):
                                 warehouse=sale_return.warehouse,
                                 movement_type='return_in',
                                 quantity=return_quantity,
+                                unit_cost=unit_costs.get(sale_item.product_id),
                                 reference_number=f"RETURN-SALE-{sale_return.number}-ITEM{return_item.id}",
                                 document_type='sale_return',
                                 document_number=sale_return.number,
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def seed_opening_entries(apps, schema_editor):
+    """
+    قيد افتتاحي لكل مورد رصيده الحالي غير صفري حتى يطابق مجموع القيود الرصيد المخزن
+    """
+    Supplier = apps.get_model('supplier', 'Supplier')
+    SupplierBalanceEntry = apps.get_model('supplier', 'SupplierBalanceEntry')
+    SupplierBalanceEntry.objects.bulk_create([
+        SupplierBalanceEntry(supplier_id=pk, amount=balance, source='opening')
+        for pk, balance in Supplier.objects.exclude(balance=0).values_list('pk', 'balance').iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('supplier', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SupplierBalanceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='قيمة التغيير')),
+                ('source', models.CharField(max_length=50, verbose_name='المصدر')),
+                ('reference', models.CharField(blank=True, default='', max_length=100, verbose_name='المرجع')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاريخ الإنشاء')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_entries', to='supplier.supplier', verbose_name='المورد')),
+            ],
+            options={
+                'verbose_name': 'قيد رصيد المورد',
+                'verbose_name_plural': 'قيود أرصدة الموردين',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.RunPython(seed_opening_entries, migrations.RunPython.noop),
+    ]
@@ -31,10 +31,42 @@ class Supplier(models.Model):
         verbose_name_plural = _('الموردين')
         ordering = ['name']
     
+    def save(self, *args, **kwargs):
+        # الرصيد يتغير فقط عبر قيود سجل الرصيد (F-expression)، فلا يُكتب من نسخة قديمة عند حفظ باقي البيانات
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'balance'
+            ]
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return self.name
 
 
+class SupplierBalanceEntry(models.Model):
+    """
+    قيد في سجل رصيد المورد (سجل إضافة فقط)
+    
+    كل تغيير في رصيد المورد يُسجل كقيد بقيمة التغيير، والرصيد المخزن في المورد
+    يساوي دائماً مجموع قيوده.
+    """
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, verbose_name=_('المورد'),
+                                 related_name='balance_entries')
+    amount = models.DecimalField(_('قيمة التغيير'), max_digits=12, decimal_places=2)
+    source = models.CharField(_('المصدر'), max_length=50)
+    reference = models.CharField(_('المرجع'), max_length=100, blank=True, default='')
+    created_at = models.DateTimeField(_('تاريخ الإنشاء'), auto_now_add=True)
+    
+    class Meta:
+        verbose_name = _('قيد رصيد المورد')
+        verbose_name_plural = _('قيود أرصدة الموردين')
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.supplier} - {self.amount} - {self.source}"
+
+
 class SupplierPayment(models.Model):
     """
     نموذج لتسجيل المدفوعات المدفوعة للموردين
@@ -9,6 +9,8 @@ from django.urls import reverse
 from .models import Supplier, SupplierPayment
 from .forms import SupplierForm, SupplierPaymentForm
 from purchase.models import Purchase, PurchaseItem
+from utils.balances import post_balance_entry
+from utils.statements import supplier_statement, statement_filters
 
 
 @login_required
@@ -187,7 +189,7 @@ def supplier_detail(request, pk):
     payments = supplier.payments.all().order_by('-payment_date')
     
     # جلب فواتير الشراء المرتبطة بالمورد
-    purchases = Purchase.objects.filter(supplier=supplier).order_by('-date')
+    purchases = Purchase.objects.filter(supplier=supplier).with_payment_totals().order_by('-date')
     purchases_count = purchases.count()
     
     # حساب إجمالي المشتريات
@@ -212,44 +214,9 @@ def supplier_detail(request, pk):
     
     total_payments = payments.aggregate(total=Sum('amount'))['total'] or 0
     
-    # تجهيز بيانات المعاملات لكشف الحساب
-    transactions = []
-    
-    # إضافة فواتير الشراء
-    for purchase in purchases:
-        transactions.append({
-            'date': purchase.date,
-            'reference': purchase.number,
-            'type': 'purchase',
-            'description': f'فاتورة شراء رقم {purchase.number}',
-            'debit': purchase.total,
-            'credit': 0,
-            'balance': 0  # سيتم حسابه لاحقاً
-        })
-    
-    # إضافة المدفوعات
-    for payment in payments:
-        transactions.append({
-            'date': payment.payment_date,
-            'reference': payment.reference_number,
-            'type': 'payment',
-            'description': f'دفعة {payment.get_payment_method_display()}',
-            'debit': 0,
-            'credit': payment.amount,
-            'balance': 0  # سيتم حسابه لاحقاً
-        })
-    
-    # ترتيب المعاملات حسب التاريخ (من الأقدم للأحدث)
-    transactions.sort(key=lambda x: x['date'])
-    
-    # حساب الرصيد التراكمي
-    running_balance = 0
-    for transaction in transactions:
-        running_balance = running_balance + transaction['debit'] - transaction['credit']
-        transaction['balance'] = running_balance
-    
-    # عكس ترتيب المعاملات (من الأحدث للأقدم) للعرض
-    transactions.reverse()
+    # كشف الحساب: صفحة من الحركات والرصيد التراكمي محسوب في قاعدة البيانات
+    filters = statement_filters(request.GET)
+    statement = supplier_statement(supplier, **filters)
     
     context = {
         'supplier': supplier,
@@ -260,7 +227,10 @@ def supplier_detail(request, pk):
         'products_count': products_count,
         'total_payments': total_payments,
         'last_transaction_date': last_transaction_date,
-        'transactions': transactions,
+        'transactions': statement.entries,
+        'statement': statement,
+        'statement_from': filters['date_from'],
+        'statement_to': filters['date_to'],
         'page_title': f'بيانات المورد: {supplier.name}',
         'page_icon': 'fas fa-truck',
         'breadcrumb_items': [
@@ -291,8 +261,7 @@ def supplier_payment_add(request, supplier_id=None):
             with transaction.atomic():
                 payment.save()
                 # تحديث رصيد المورد
-                payment.supplier.balance -= payment.amount
-                payment.supplier.save()
+                post_balance_entry(payment.supplier, -payment.amount, 'payment', payment.reference_number)
                 
             messages.success(request, _('تم إضافة الدفعة بنجاح'))
             
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخر نشاط'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import RegexValidator
@@ -31,6 +32,7 @@ class User(AbstractUser):
     user_type = models.CharField(_('نوع المستخدم'), max_length=20, choices=USER_TYPES, default='sales_rep')
     status = models.CharField(_('الحالة'), max_length=10, choices=USER_STATUS, default='active')
     address = models.TextField(_('العنوان'), blank=True, null=True)
+    last_activity = models.DateTimeField(_('آخر نشاط'), blank=True, null=True)
     
     class Meta:
         verbose_name = _('مستخدم')
@@ -64,7 +66,8 @@ class ActivityLog(models.Model):
     action = models.CharField(_('الإجراء'), max_length=255)
     model_name = models.CharField(_('اسم النموذج'), max_length=100, blank=True, null=True)
     object_id = models.PositiveIntegerField(_('معرف الكائن'), blank=True, null=True)
-    timestamp = models.DateTimeField(_('التوقيت'), auto_now_add=True)
+    # وقت النشاط نفسه (يُمرر صراحة عند الكتابة المؤجلة من core.activity)
+    timestamp = models.DateTimeField(_('التوقيت'), default=timezone.now, editable=False)
     ip_address = models.GenericIPAddressField(_('عنوان IP'), blank=True, null=True)
     user_agent = models.TextField(_('متصفح المستخدم'), blank=True, null=True)
     extra_data = models.JSONField(_('بيانات إضافية'), blank=True, null=True)
@@ -11,6 +11,14 @@ import io
 import random
 import string
 from django.core.files.uploadedfile import SimpleUploadedFile
+from datetime import timedelta
+from unittest import mock
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+from core.activity import ActivityBuffer, ActivityEvent
+from core.middleware import ActivityTrackingMiddleware
+from users.models import ActivityLog
 
 User = get_user_model()
 
@@ -375,3 +383,83 @@ class UserProfileTest(TestCase):
         # في حالة عدم وجود حقل للصورة، نتحقق فقط من نجاح الاستجابة
         else:
             self.assertTrue(True, "لا يوجد حقل للصورة في نموذج المستخدم، لكن الاستجابة كانت ناجحة")
+
+
+class ActivityBufferTest(TestCase):
+    """
+    اختبارات المخزن المؤقت لأحداث النشاط
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='activityuser', email='activity@example.com', password='testpass123'
+        )
+        self.other = User.objects.create_user(
+            username='otheruser', email='other@example.com', password='testpass123'
+        )
+
+    def event(self, user, path, timestamp):
+        return ActivityEvent(user.pk, path, 'GET', '127.0.0.1', 'tests', timestamp)
+
+    def test_flush_bulk_creates_and_coalesces_last_activity(self):
+        buffer = ActivityBuffer(max_size=100, batch_size=50)
+        now = timezone.now()
+        buffer.add(self.event(self.user, '/a/', now - timedelta(minutes=2)))
+        buffer.add(self.event(self.user, '/b/', now))
+        buffer.add(self.event(self.other, '/c/', now - timedelta(minutes=1)))
+
+        # الكتابة: إنشاء السجلات دفعة واحدة وتحديث آخر نشاط بعبارة واحدة
+        with self.assertNumQueries(4):
+            self.assertEqual(buffer.flush(), 3)
+
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        # توقيت السجل هو وقت الطلب وليس وقت الكتابة المؤجلة
+        self.assertEqual(
+            list(ActivityLog.objects.filter(user=self.user).values_list('timestamp', flat=True)),
+            [now, now - timedelta(minutes=2)],
+        )
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.user.last_activity, now)
+        self.assertEqual(self.other.last_activity, now - timedelta(minutes=1))
+        self.assertEqual(buffer.metrics()['flushed'], 3)
+        self.assertEqual(buffer.metrics()['pending'], 0)
+
+    def test_full_buffer_drops_oldest_events(self):
+        buffer = ActivityBuffer(max_size=2, batch_size=10)
+        now = timezone.now()
+        for path in ('/a/', '/b/', '/c/'):
+            buffer.add(self.event(self.user, path, now))
+
+        self.assertEqual(buffer.metrics()['dropped'], 1)
+        buffer.flush()
+        self.assertEqual(
+            sorted(ActivityLog.objects.values_list('extra_data__url', flat=True)), ['/b/', '/c/']
+        )
+
+    def test_middleware_buffers_without_writing(self):
+        request = RequestFactory().get('/dashboard/')
+        request.user = self.user
+        middleware = ActivityTrackingMiddleware(get_response=lambda r: HttpResponse())
+        buffer = ActivityBuffer(max_size=100, batch_size=50)
+
+        # المسار غير المتزامن: الحدث في المخزن فقط حتى يكتبه العامل
+        with mock.patch('core.activity.activity_buffer', buffer), \
+                mock.patch.object(buffer, 'start') as start, self.assertNumQueries(0):
+            middleware(request)
+        start.assert_called_once_with()
+        self.assertIsNotNone(request.user.last_activity)
+        self.assertFalse(ActivityLog.objects.exists())
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertTrue(ActivityLog.objects.filter(user=self.user, action='GET /dashboard/').exists())
+
+    @override_settings(ACTIVITY_BUFFER_ASYNC=False)
+    def test_middleware_flushes_when_not_async(self):
+        request = RequestFactory().get('/dashboard/')
+        request.user = self.user
+        middleware = ActivityTrackingMiddleware(get_response=lambda r: HttpResponse())
+
+        middleware(request)
+        self.assertIsNotNone(request.user.last_activity)
+        self.assertTrue(ActivityLog.objects.filter(user=self.user, action='GET /dashboard/').exists())
@@ -0,0 +1,99 @@
+"""
+سجل أرصدة العملاء والموردين
+
+كل تغيير في رصيد عميل أو مورد يُسجل كقيد في سجل إضافة فقط
+(related_name='balance_entries')، ويُطبق على الرصيد المخزن بعبارة UPDATE
+واحدة باستخدام F-expression داخل نفس المعاملة، فلا تضيع التحديثات
+المتزامنة كما في القراءة ثم التعديل ثم الحفظ:
+- post_balance_entry: تسجيل قيد وتطبيقه على الرصيد
+- verify_balances: مقارنة الرصيد المخزن بمجموع القيود
+- rebuild_balances: إعادة حساب الرصيد المخزن من القيود
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# اسم العلاقة العكسية من العميل أو المورد إلى قيود رصيده
+ENTRIES_RELATED_NAME = 'balance_entries'
+
+AMOUNT_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def _entries(party_model):
+    relation = party_model._meta.get_field(ENTRIES_RELATED_NAME)
+    return relation.related_model, relation.field.name
+
+
+def post_balance_entry(party, amount, source, reference=''):
+    """
+    تسجيل تغيير في رصيد عميل أو مورد
+
+    المعلمات:
+    party (Customer | Supplier): صاحب الرصيد
+    amount (Decimal): قيمة التغيير (موجبة تزيد الرصيد وسالبة تنقصه)
+    source (str): مصدر التغيير (مثل 'sale' أو 'payment')
+    reference (str): رقم المستند المرتبط
+
+    تُرجع: القيد المنشأ أو None إذا كانت القيمة صفراً
+    """
+    amount = Decimal(str(amount or 0))
+    if not amount:
+        return None
+
+    entry_model, fk_name = _entries(type(party))
+    with transaction.atomic():
+        entry = entry_model.objects.create(**{
+            fk_name: party,
+            'amount': amount,
+            'source': source,
+            'reference': str(reference or '')[:100],
+        })
+        type(party).objects.filter(pk=party.pk).update(balance=F('balance') + amount)
+
+    # القيمة في الكائن تقريبية إذا سُجلت قيود متزامنة، والقيمة الصحيحة في قاعدة البيانات
+    party.balance = (party.balance or Decimal('0')) + amount
+    return entry
+
+
+def _ledger_subquery(party_model):
+    entry_model, fk_name = _entries(party_model)
+    totals = (
+        entry_model.objects
+        .filter(**{fk_name: OuterRef('pk')})
+        .order_by()
+        .values(fk_name)
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return Coalesce(Subquery(totals, output_field=AMOUNT_FIELD), Value(Decimal('0')), output_field=AMOUNT_FIELD)
+
+
+def verify_balances(party_model, party_ids=None):
+    """
+    مقارنة الرصيد المخزن بمجموع القيود
+
+    المعلمات:
+    party_model: نموذج صاحب الرصيد (Customer أو Supplier)
+    party_ids (list): معرفات محددة (اختياري، الافتراضي الكل)
+
+    تُرجع: قائمة (المعرف، الرصيد المخزن، مجموع القيود) للأرصدة غير المتطابقة
+    """
+    parties = party_model.objects.all()
+    if party_ids:
+        parties = parties.filter(pk__in=party_ids)
+    rows = parties.order_by('pk').annotate(ledger=_ledger_subquery(party_model)).values_list('pk', 'balance', 'ledger')
+    return [(pk, balance, ledger) for pk, balance, ledger in rows if balance != ledger]
+
+
+def rebuild_balances(party_model, party_ids=None):
+    """
+    إعادة حساب الرصيد المخزن من القيود بعبارة UPDATE واحدة
+
+    تُرجع: عدد السجلات المحدثة
+    """
+    parties = party_model.objects.all()
+    if party_ids:
+        parties = parties.filter(pk__in=party_ids)
+    return parties.update(balance=_ledger_subquery(party_model))
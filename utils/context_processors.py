@@ -6,7 +6,7 @@ def common_variables(request):
     """
     إضافة متغيرات مشتركة للاستخدام في جميع القوالب
     """
-    from django.apps import apps
+    from core.page_chrome import entity_counts
     
     # متغيرات التاريخ
     current_date = timezone.now()
@@ -28,32 +28,11 @@ def common_variables(request):
     # الحصول على أسماء جميع التطبيقات المثبتة
     installed_apps = [app.split('.')[-1] for app in settings.INSTALLED_APPS if not app.startswith('django.') and not app.startswith('crispy_')]
     
-    # الحصول على قائمة النماذج الرئيسية
+    # الحصول على أعداد النماذج الرئيسية من الذاكرة المؤقتة (بدون استعلام في كل طلب)،
+    # وتظهر أخطاء الذاكرة المؤقتة بدلاً من عرض أعداد فارغة
     main_models = {}
     if request.user.is_authenticated:
-        try:
-            if 'product' in installed_apps:
-                Product = apps.get_model('product', 'Product')
-                main_models['products_count'] = Product.objects.count()
-                
-            if 'client' in installed_apps:
-                Customer = apps.get_model('client', 'Customer')
-                main_models['customers_count'] = Customer.objects.count()
-                
-            if 'supplier' in installed_apps:
-                Supplier = apps.get_model('supplier', 'Supplier')
-                main_models['suppliers_count'] = Supplier.objects.count()
-                
-            if 'sale' in installed_apps:
-                Sale = apps.get_model('sale', 'Sale')
-                main_models['sales_count'] = Sale.objects.count()
-                
-            if 'purchase' in installed_apps:
-                Purchase = apps.get_model('purchase', 'Purchase')
-                main_models['purchases_count'] = Purchase.objects.count()
-        except Exception:
-            # تجاهل أي استثناءات (مثلاً إذا لم يكن هناك جدول أو صلاحيات)
-            pass
+        main_models = entity_counts()
     
     # إرجاع السياق
     return {
@@ -80,40 +59,10 @@ def user_permissions(request):
     if not request.user.is_authenticated:
         return {'user_perms': {}}
     
-    # قائمة بجميع الإجراءات الشائعة للنماذج
-    common_actions = ['view', 'add', 'change', 'delete']
-    
-    # قائمة بالنماذج الشائعة
-    common_models = [
-        'user', 'group', 'permission',
-        'customer', 'supplier',
-        'product', 'category', 'brand',
-        'sale', 'saleinvoice', 'payment',
-        'purchase', 'purchaseinvoice',
-        'expense', 'expensecategory',
-        'report', 'settings',
-    ]
-    
-    # إنشاء قاموس بجميع الصلاحيات المحتملة
-    user_perms = {}
-    user = request.user
-    
-    # إضافة الصلاحيات العامة
-    user_perms['is_staff'] = user.is_staff
-    user_perms['is_superuser'] = user.is_superuser
+    from core.page_chrome import user_permission_map
     
-    # إضافة الصلاحيات التفصيلية
-    if not user.is_superuser:  # المدير العام لديه جميع الصلاحيات
-        for model in common_models:
-            for action in common_actions:
-                perm_codename = f"{action}_{model}"
-                user_perms[perm_codename] = user.has_perm(f"app_label.{perm_codename}")
-    else:
-        # المدير العام لديه جميع الصلاحيات
-        for model in common_models:
-            for action in common_actions:
-                perm_codename = f"{action}_{model}"
-                user_perms[perm_codename] = True
+    # خريطة الصلاحيات تُحسب مرة واحدة لكل مستخدم حتى تتغير صلاحياته
+    user_perms = user_permission_map(request.user)
     
     return {'user_perms': user_perms}
 
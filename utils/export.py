@@ -1,6 +1,10 @@
 import xlsxwriter
 import io
-from django.http import HttpResponse
+import operator
+import tempfile
+from decimal import Decimal
+from django.db.models import QuerySet
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
@@ -15,6 +19,11 @@ import datetime
 from io import BytesIO
 from django.utils.translation import gettext as _
 
+# عدد الصفوف المقروءة من قاعدة البيانات في كل دفعة أثناء التصدير المتدفق
+DEFAULT_EXPORT_CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
 
 def export_to_excel(data, fields, headers=None, sheet_name='Sheet1'):
     """
@@ -377,40 +386,10 @@ class ExcelExporter:
         self.add_headers(headers)
         
         # إضافة صفوف البيانات
-        for obj in queryset:
-            row_data = []
-            for field in fields:
-                # التحقق من وجود دالة تعليق
-                if annotations and field in annotations:
-                    # استخدام دالة التعليق للحصول على القيمة
-                    value = annotations[field](obj)
-                else:
-                    # محاولة الحصول على القيمة بطريقة عادية
-                    try:
-                        # التحقق من وجود خاصية أو طريقة بهذا الاسم
-                        if hasattr(obj, field):
-                            attr = getattr(obj, field)
-                            # إذا كانت دالة، استدعها
-                            if callable(attr):
-                                value = attr()
-                            else:
-                                value = attr
-                        else:
-                            # قد يكون اسم حقل في علاقة متداخلة، مثل user.email
-                            parts = field.split('.')
-                            value = obj
-                            for part in parts:
-                                if value is None:
-                                    break
-                                value = getattr(value, part)
-                                if callable(value):
-                                    value = value()
-                    except:
-                        value = "N/A"
-                
-                row_data.append(value)
-            
-            self.add_data([row_data])
+        # تجهيز دوال قراءة الحقول مرة واحدة بدلاً من فحص كل خلية
+        accessors = [compile_accessor(field, annotations) for field in fields]
+        for obj in iterate_objects(queryset):
+            self.add_data([[accessor(obj) for accessor in accessors]])
         
         return self
     
@@ -548,43 +527,16 @@ class CSVExporter:
         
         # إضافة صفوف البيانات
         data_rows = []
-        for obj in queryset:
+        # تجهيز دوال قراءة الحقول مرة واحدة بدلاً من فحص كل خلية
+        accessors = [compile_accessor(field, annotations) for field in fields]
+        for obj in iterate_objects(queryset):
             row_data = []
-            for field in fields:
-                # التحقق من وجود دالة تعليق
-                if annotations and field in annotations:
-                    # استخدام دالة التعليق للحصول على القيمة
-                    value = annotations[field](obj)
-                else:
-                    # محاولة الحصول على القيمة بطريقة عادية
-                    try:
-                        # التحقق من وجود خاصية أو طريقة بهذا الاسم
-                        if hasattr(obj, field):
-                            attr = getattr(obj, field)
-                            # إذا كانت دالة، استدعها
-                            if callable(attr):
-                                value = attr()
-                            else:
-                                value = attr
-                        else:
-                            # قد يكون اسم حقل في علاقة متداخلة، مثل user.email
-                            parts = field.split('.')
-                            value = obj
-                            for part in parts:
-                                if value is None:
-                                    break
-                                value = getattr(value, part)
-                                if callable(value):
-                                    value = value()
-                    except:
-                        value = "N/A"
-                
+            for accessor in accessors:
+                value = accessor(obj)
                 # تحويل التاريخ والوقت إلى سلسلة نصية
                 if isinstance(value, (datetime.date, datetime.datetime)):
                     value = value.isoformat()
-                
                 row_data.append(value)
-            
             data_rows.append(row_data)
         
         self.add_data(data_rows)
@@ -680,4 +632,232 @@ def export_queryset_to_csv(queryset, filename=None, fields=None, headers=None, a
     HttpResponse: استجابة HTTP تحتوي على ملف CSV
     """
     exporter = CSVExporter(filename=filename)
-    return exporter.add_queryset(queryset, fields=fields, headers=headers, annotations=annotations).save() 
\ No newline at end of file
+    return exporter.add_queryset(queryset, fields=fields, headers=headers, annotations=annotations).save() 
+
+
+def iterate_objects(queryset, chunk_size=None):
+    """
+    المرور على كائنات مجموعة استعلام على دفعات بدون تخزين النتائج في ذاكرة الاستعلام
+
+    تُقبل أيضاً القوائم وأي كائن قابل للتكرار كما هو.
+    """
+    if isinstance(queryset, QuerySet):
+        return queryset.iterator(chunk_size=chunk_size or DEFAULT_EXPORT_CHUNK_SIZE)
+    return queryset
+
+
+def compile_accessor(field, annotations=None):
+    """
+    تجهيز دالة قراءة قيمة حقل من كائن مرة واحدة قبل المرور على الصفوف
+
+    المعلمات:
+    field (str): اسم الحقل أو الخاصية أو المسار المتداخل مثل user.email
+    annotations (dict): قاموس بدالات الحصول على البيانات المشتقة
+
+    تُرجع: دالة تستقبل الكائن وتُرجع القيمة (أو "N/A" إذا تعذرت القراءة)
+    """
+    if annotations and field in annotations:
+        return annotations[field]
+
+    parts = field.split('.')
+
+    def accessor(obj):
+        value = obj
+        try:
+            for part in parts:
+                if value is None:
+                    break
+                value = getattr(value, part)
+                # إذا كانت دالة، استدعها
+                if callable(value):
+                    value = value()
+        except Exception:
+            return "N/A"
+        return value
+
+    return accessor
+
+
+class ExportColumn:
+    """
+    عمود في التصدير المتدفق يُقرأ من values_list
+
+    المعلمات:
+    header (str): عنوان العمود
+    source (str | tuple): اسم الحقل بصيغة الاستعلام (مثل product__name) أو عدة حقول
+    transform (callable): دالة تحويل تستقبل قيمة الحقل (أو قيم الحقول بالترتيب)
+    """
+
+    def __init__(self, header, source, transform=None):
+        self.header = header
+        self.sources = (source,) if isinstance(source, str) else tuple(source)
+        self.transform = transform
+
+    def compile(self, positions):
+        """
+        تجهيز دالة قراءة قيمة العمود من صف values_list حسب مواقع الحقول
+        """
+        indexes = [positions[source] for source in self.sources]
+        transform = self.transform
+        if len(indexes) == 1:
+            index = indexes[0]
+            if transform is None:
+                return operator.itemgetter(index)
+            return lambda row: transform(row[index])
+        getter = operator.itemgetter(*indexes)
+        if transform is None:
+            return getter
+        return lambda row: transform(*getter(row))
+
+
+def choices_display(choices, default=''):
+    """
+    دالة تحويل قيمة حقل اختيارات إلى الاسم المعروض بدون الرجوع للكائن
+    """
+    labels = {key: str(label) for key, label in choices}
+    return lambda value: labels.get(value, default if value is None else value)
+
+
+def iter_export_rows(queryset, columns, chunk_size=None):
+    """
+    قراءة صفوف التصدير على دفعات باستخدام values_list و iterator
+
+    المعلمات:
+    queryset (QuerySet): مجموعة الاستعلام (بعد التصفية والترتيب)
+    columns (list): قائمة ExportColumn
+    chunk_size (int): عدد الصفوف في كل دفعة قراءة
+
+    تُرجع: مولد قوائم القيم لكل صف
+    """
+    fields = []
+    for column in columns:
+        for source in column.sources:
+            if source not in fields:
+                fields.append(source)
+    positions = {field: index for index, field in enumerate(fields)}
+    accessors = [column.compile(positions) for column in columns]
+
+    chunk_size = chunk_size or DEFAULT_EXPORT_CHUNK_SIZE
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield [accessor(row) for accessor in accessors]
+
+
+class _Echo:
+    """
+    كائن كتابة يُرجع السطر بدلاً من تخزينه، لاستخدام csv.writer مع الاستجابة المتدفقة
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv_response(queryset, columns, filename, chunk_size=None):
+    """
+    تصدير مجموعة استعلام كملف CSV متدفق بذاكرة محدودة مهما كان عدد الصفوف
+
+    المعلمات:
+    queryset (QuerySet): مجموعة الاستعلام
+    columns (list): قائمة ExportColumn
+    filename (str): اسم الملف
+    chunk_size (int): عدد الصفوف في كل دفعة قراءة
+
+    تُرجع: StreamingHttpResponse
+    """
+    writer = csv.writer(_Echo())
+
+    def content():
+        yield writer.writerow([column.header for column in columns])
+        for row in iter_export_rows(queryset, columns, chunk_size):
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(content(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_xlsx(output, queryset, columns, sheet_name='Sheet1', chunk_size=None):
+    """
+    كتابة مجموعة استعلام في ملف Excel بوضع الذاكرة الثابتة (constant_memory)
+
+    كل صف يُكتب إلى القرص فور اكتماله، فلا يحتفظ xlsxwriter بالورقة في الذاكرة.
+
+    المعلمات:
+    output (str | file): مسار الملف أو ملف مفتوح للكتابة الثنائية
+    queryset (QuerySet): مجموعة الاستعلام
+    columns (list): قائمة ExportColumn
+    sheet_name (str): اسم ورقة العمل
+    chunk_size (int): عدد الصفوف في كل دفعة قراءة
+
+    تُرجع: عدد صفوف البيانات المكتوبة
+    """
+    workbook = xlsxwriter.Workbook(output, {
+        'constant_memory': True,
+        'remove_timezone': True,
+        'tmpdir': tempfile.gettempdir(),
+    })
+    worksheet = workbook.add_worksheet(sheet_name)
+
+    header_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#4F81BD',
+        'font_color': 'white',
+        'align': 'center',
+        'valign': 'vcenter',
+        'border': 1
+    })
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+    datetime_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm'})
+    number_format = workbook.add_format({'num_format': '#,##0.00'})
+
+    # دالة الكتابة حسب نوع القيمة تُحدد مرة واحدة لكل نوع
+    writers = {
+        datetime.datetime: lambda r, c, v: worksheet.write_datetime(r, c, v, datetime_format),
+        datetime.date: lambda r, c, v: worksheet.write_datetime(r, c, v, date_format),
+        Decimal: lambda r, c, v: worksheet.write_number(r, c, v, number_format),
+        float: lambda r, c, v: worksheet.write_number(r, c, v, number_format),
+        int: worksheet.write_number,
+        bool: worksheet.write_boolean,
+        type(None): worksheet.write_blank,
+    }
+    write_string = worksheet.write_string
+
+    for col, column in enumerate(columns):
+        worksheet.set_column(col, col, max(15, len(str(column.header)) + 2))
+        worksheet.write_string(0, col, str(column.header), header_format)
+
+    row_num = 0
+    for row_num, row in enumerate(iter_export_rows(queryset, columns, chunk_size), start=1):
+        for col, value in enumerate(row):
+            write = writers.get(type(value))
+            if write is None:
+                write_string(row_num, col, str(value))
+            elif value is None:
+                write(row_num, col, None)
+            else:
+                write(row_num, col, value)
+
+    workbook.close()
+    return row_num
+
+
+def stream_xlsx_response(queryset, columns, filename, sheet_name='Sheet1', chunk_size=None):
+    """
+    تصدير مجموعة استعلام كملف Excel يُكتب في ملف مؤقت ثم يُرسل على دفعات
+
+    المعلمات:
+    queryset (QuerySet): مجموعة الاستعلام
+    columns (list): قائمة ExportColumn
+    filename (str): اسم الملف
+    sheet_name (str): اسم ورقة العمل
+    chunk_size (int): عدد الصفوف في كل دفعة قراءة
+
+    تُرجع: FileResponse (يُحذف الملف المؤقت عند إغلاق الاستجابة)
+    """
+    output = tempfile.TemporaryFile()
+    try:
+        write_xlsx(output, queryset, columns, sheet_name, chunk_size)
+    except Exception:
+        output.close()
+        raise
+    output.seek(0)
+    return FileResponse(output, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
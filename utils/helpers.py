@@ -237,6 +237,38 @@ def is_arabic_text(text):
     
     return bool(arabic_pattern.search(text))
 
+# التشكيل وعلامات القرآن والتطويل
+ARABIC_DIACRITICS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]')
+
+# توحيد صور الحروف المتشابهة والأرقام العربية الهندية
+ARABIC_LETTER_FORMS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ی': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+    'ک': 'ك',
+    **{digit: str(index) for index, digit in enumerate('٠١٢٣٤٥٦٧٨٩')},
+    **{digit: str(index) for index, digit in enumerate('۰۱۲۳۴۵۶۷۸۹')},
+})
+
+def normalize_arabic(text):
+    """
+    توحيد النص العربي للبحث
+    
+    يزيل التشكيل والتطويل، ويوحد صور الألف والياء والتاء المربوطة والأرقام،
+    ويحول الأحرف اللاتينية إلى صغيرة ويختصر المسافات.
+    
+    المعلمات:
+    text (str): النص المراد توحيده
+    
+    تُرجع: النص بعد التوحيد
+    """
+    if not text:
+        return ''
+    
+    text = ARABIC_DIACRITICS.sub('', str(text)).translate(ARABIC_LETTER_FORMS)
+    return ' '.join(text.lower().split())
+
 def calculate_age(birth_date):
     """
     حساب العمر بناءً على تاريخ الميلاد
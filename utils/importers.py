@@ -9,11 +9,27 @@ import os
 import tempfile
 import datetime
 from io import BytesIO, StringIO
-from django.db.models import Model
+from django.conf import settings
+from django.db.models import Model, Q
 from django.db.utils import IntegrityError
+from django.utils import timezone
+
+from utils.signals import bulk_imported
 
 logger = logging.getLogger(__name__)
 
+# عدد الصفوف في كل دفعة استيراد جماعي
+DEFAULT_IMPORT_CHUNK_SIZE = 1000
+
+# أنواع الحقول التي يتم التحقق منها كأرقام أو تواريخ قبل الاستيراد
+NUMERIC_FIELD_TYPES = (
+    'IntegerField', 'BigIntegerField', 'SmallIntegerField', 'PositiveIntegerField',
+    'PositiveSmallIntegerField', 'PositiveBigIntegerField', 'DecimalField', 'FloatField',
+    'ForeignKey', 'AutoField', 'BigAutoField',
+)
+DATE_FIELD_TYPES = ('DateField', 'DateTimeField')
+TEXT_FIELD_TYPES = ('CharField', 'TextField', 'SlugField', 'EmailField', 'URLField')
+
 
 def import_from_excel(file, field_mapping=None, required_fields=None):
     """
@@ -134,47 +150,358 @@ def process_imported_data(records, field_mapping=None, required_fields=None):
     return processed_data
 
 
-@transaction.atomic
-def bulk_create_from_import(model_class, data, unique_fields=None):
+def bulk_create_from_import(model_class, data, unique_fields=None, chunk_size=None):
     """
-    إنشاء سجلات بشكل جماعي من البيانات المستوردة
+    إنشاء وتحديث سجلات بشكل جماعي من البيانات المستوردة
     
     المعلمات:
     model_class (Model): فئة النموذج للإنشاء
     data (list): قائمة بالبيانات للإنشاء
     unique_fields (list): قائمة بالحقول الفريدة للتحقق من التكرار
+    chunk_size (int): عدد الصفوف في كل دفعة
     
     تُرجع: (عدد السجلات المنشأة، عدد السجلات المحدثة، عدد الأخطاء)
     """
-    created_count = 0
-    updated_count = 0
-    error_count = 0
+    report = bulk_upsert(model_class, data, unique_fields, chunk_size=chunk_size)
+    return report.created, report.updated, len(report.errors)
+
+
+class ImportReport:
+    """
+    تقرير الاستيراد الجماعي: الإجماليات وتقرير كل دفعة والأخطاء برقم الصف
+    """
     
-    for item in data:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = []
+        self.chunks = []
+        self.created_objects = []
+        self.updated_objects = []
+    
+    def add_error(self, row, error, data=None):
+        self.errors.append({'row': row, 'error': error, 'data': data})
+    
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'errors': len(self.errors),
+            'chunks': self.chunks,
+        }
+
+
+def _lookup_value(field, value):
+    # توحيد نوع قيمة المفتاح مع قيمة قاعدة البيانات (مثلاً "12" و 12)
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        return value
+
+
+def _existing_keys(model_class, unique_fields, keys):
+    """
+    معرفات السجلات الموجودة لمجموعة مفاتيح باستعلام IN واحد
+
+    تُرجع: قاموس {المفتاح: المعرف}
+    """
+    if not keys:
+        return {}
+    
+    if len(unique_fields) == 1:
+        queryset = model_class.objects.filter(**{f'{unique_fields[0]}__in': [key[0] for key in keys]})
+    else:
+        condition = Q()
+        for key in keys:
+            condition |= Q(**dict(zip(unique_fields, key)))
+        queryset = model_class.objects.filter(condition)
+    
+    fields = [model_class._meta.get_field(name) for name in unique_fields]
+    existing = {}
+    for pk, *values in queryset.values_list('pk', *unique_fields).iterator():
+        existing[tuple(_lookup_value(field, value) for field, value in zip(fields, values))] = pk
+    return existing
+
+
+def _non_editable_fields(model_class):
+    # الحقول غير القابلة للتعديل (مثل total_stock) تديرها خدماتها ولا يكتبها الاستيراد
+    names = set()
+    for field in model_class._meta.concrete_fields:
+        if not field.editable:
+            names.update((field.name, field.attname))
+    return names
+
+
+def _editable_values(values, non_editable):
+    if not non_editable.intersection(values):
+        return values
+    return {name: value for name, value in values.items() if name not in non_editable}
+
+
+def _apply_rows_one_by_one(model_class, creates, updates, report):
+    """
+    تطبيق صفوف دفعة فشلت كتابتها الجماعية صفاً صفاً لعزل الصفوف التالفة
+    """
+    non_editable = _non_editable_fields(model_class)
+    for row_number, values in creates:
+        values = _editable_values(values, non_editable)
         try:
-            # إذا تم تحديد حقول فريدة، تحقق من وجود السجل
-            if unique_fields:
-                filters = {field: item[field] for field in unique_fields if field in item}
-                if filters:
-                    obj, created = model_class.objects.update_or_create(
-                        defaults=item,
-                        **filters
-                    )
-                    if created:
-                        created_count += 1
-                    else:
-                        updated_count += 1
-                    continue
-            
-            # إنشاء سجل جديد
-            model_class.objects.create(**item)
-            created_count += 1
+            with transaction.atomic():
+                report.created_objects.append(model_class.objects.create(**values))
+            report.created += 1
+        except (ValidationError, IntegrityError, ValueError, TypeError) as e:
+            report.add_error(row_number, str(e), values)
+    
+    for row_number, pk, values in updates:
+        values = _editable_values(values, non_editable)
+        try:
+            with transaction.atomic():
+                model_class.objects.filter(pk=pk).update(**values)
+            report.updated_objects.append(model_class(pk=pk, **values))
+            report.updated += 1
+        except (ValidationError, IntegrityError, ValueError, TypeError) as e:
+            report.add_error(row_number, str(e), values)
+
+
+def _write_chunk(model_class, creates, updates, report):
+    """
+    كتابة دفعة واحدة: إنشاء جماعي ثم تحديث جماعي لكل مجموعة صفوف لها نفس الحقول
+    """
+    non_editable = _non_editable_fields(model_class)
+    with transaction.atomic():
+        created_objects = model_class.objects.bulk_create([
+            model_class(**_editable_values(values, non_editable)) for _, values in creates
+        ])
+        
+        # حقول تاريخ التحديث التلقائي لا تُحدَّث في bulk_update إلا بتعيينها صراحة
+        auto_now = {
+            field.name: timezone.now()
+            for field in model_class._meta.concrete_fields if getattr(field, 'auto_now', False)
+        }
+        groups = {}
+        for _, pk, values in updates:
+            values = {**_editable_values(values, non_editable), **auto_now}
+            groups.setdefault(tuple(sorted(values)), []).append(model_class(pk=pk, **values))
+        updated_objects = []
+        for fields, objects in groups.items():
+            fields = [field for field in fields if field != model_class._meta.pk.name]
+            if fields:
+                model_class.objects.bulk_update(objects, fields)
+            updated_objects.extend(objects)
+    
+    report.created += len(created_objects)
+    report.updated += len(updated_objects)
+    report.created_objects.extend(created_objects)
+    report.updated_objects.extend(updated_objects)
+
+
+def bulk_upsert(model_class, rows, unique_fields=None, update_existing=True, chunk_size=None, progress=None):
+    """
+    محرك الاستيراد الجماعي: إنشاء أو تحديث الصفوف على دفعات
+    
+    لكل دفعة يتم البحث عن السجلات الموجودة لكل المفاتيح الفريدة باستعلام IN واحد،
+    ثم تقسيم الصفوف إلى مجموعة إنشاء ومجموعة تحديث وكتابتهما باستخدام
+    bulk_create و bulk_update داخل معاملة خاصة بالدفعة. إذا فشلت الكتابة الجماعية
+    لدفعة يُعاد تطبيقها صفاً صفاً لتسجيل الصفوف التالفة فقط.
+    
+    ملاحظة: الكتابة الجماعية لا تستدعي save() ولا ترسل إشارات الحفظ، لذلك
+    تُحول النصوص الفارغة في الحقول الفريدة التي تقبل NULL إلى NULL (كما يفعل
+    save() للباركود)، وتُرسل الإشارة bulk_imported بمعرفات السجلات المستوردة
+    لتحدث التطبيقات بياناتها المشتقة (مثل فهرس بحث المنتجات). ولا تُكتب الحقول
+    غير القابلة للتعديل (editable=False) حتى لو وردت في الصفوف.
+    
+    المعلمات:
+    model_class (Model): فئة النموذج المستهدف
+    rows (list): قائمة قواميس الحقول، أو قائمة أزواج (رقم الصف، القاموس)
+    unique_fields (list): الحقول الفريدة لتحديد السجلات الموجودة
+    update_existing (bool): تحديث السجلات الموجودة (وإلا يتم تخطيها)
+    chunk_size (int): عدد الصفوف في كل دفعة
+    progress (callable): دالة تُستدعى بتقرير كل دفعة بعد كتابتها
+    
+    تُرجع: ImportReport
+    """
+    chunk_size = chunk_size or getattr(settings, 'IMPORT_CHUNK_SIZE', DEFAULT_IMPORT_CHUNK_SIZE)
+    unique_fields = list(unique_fields or [])
+    key_fields = [model_class._meta.get_field(name) for name in unique_fields]
+    report = ImportReport()
+    
+    numbered = [row if isinstance(row, tuple) else (index + 1, row) for index, row in enumerate(rows)]
+    nullable_unique = _nullable_unique_fields(model_class)
+    if nullable_unique:
+        numbered = [(row_number, _blank_to_null(values, nullable_unique)) for row_number, values in numbered]
+    
+    # الصف الأخير في الملف هو المعتمد عند تكرار نفس المفتاح
+    last_row_for_key = {}
+    for row_number, values in numbered:
+        key = _row_key(key_fields, values)
+        if key is not None:
+            last_row_for_key[key] = row_number
+    
+    for start in range(0, len(numbered), chunk_size):
+        chunk = numbered[start:start + chunk_size]
+        created_before, updated_before, errors_before = report.created, report.updated, len(report.errors)
+        skipped_before = report.skipped
+        
+        keyed = []
+        creates = []
+        for row_number, values in chunk:
+            key = _row_key(key_fields, values)
+            if key is None:
+                creates.append((row_number, values))
+            elif last_row_for_key[key] != row_number:
+                report.add_error(row_number, f'صف مكرر لنفس المفتاح {dict(zip(unique_fields, key))}', values)
+            else:
+                keyed.append((row_number, key, values))
         
-        except Exception as e:
-            logger.error(f"خطأ في إنشاء سجل: {str(e)}")
-            error_count += 1
+        existing = _existing_keys(model_class, unique_fields, [key for _, key, _ in keyed])
+        updates = []
+        for row_number, key, values in keyed:
+            pk = existing.get(key)
+            if pk is None:
+                creates.append((row_number, values))
+            elif update_existing:
+                updates.append((row_number, pk, values))
+            else:
+                report.skipped += 1
+        
+        try:
+            _write_chunk(model_class, creates, updates, report)
+        except (ValidationError, IntegrityError, ValueError, TypeError) as e:
+            logger.warning('فشل الاستيراد الجماعي للدفعة %s، إعادة المحاولة صفاً صفاً: %s', start // chunk_size + 1, e)
+            _apply_rows_one_by_one(model_class, creates, updates, report)
+        
+        chunk_report = {
+            'chunk': start // chunk_size + 1,
+            'rows': len(chunk),
+            'created': report.created - created_before,
+            'updated': report.updated - updated_before,
+            'skipped': report.skipped - skipped_before,
+            'errors': len(report.errors) - errors_before,
+        }
+        report.chunks.append(chunk_report)
+        if progress:
+            progress(chunk_report)
     
-    return created_count, updated_count, error_count
+    if report.created:
+        # الإنشاء الجماعي لا يرسل إشارات الحفظ التي تبطل أعداد الكيانات المخزنة
+        from core.page_chrome import invalidate_entity_count
+        invalidate_entity_count(model_class)
+    
+    if (report.created_objects or report.updated_objects) and bulk_imported.has_listeners(model_class):
+        bulk_imported.send(
+            sender=model_class, ids=_imported_ids(model_class, unique_fields, key_fields, report),
+        )
+    
+    return report
+
+
+def _nullable_unique_fields(model_class):
+    return [
+        field.name for field in model_class._meta.concrete_fields
+        if field.unique and field.null and not field.primary_key
+    ]
+
+
+def _blank_to_null(values, field_names):
+    # النص الفارغ في حقل فريد يتعارض مع الصفوف الأخرى الفارغة، أما NULL فلا
+    blank = [
+        name for name in field_names
+        if isinstance(values.get(name), str) and not values[name].strip()
+    ]
+    if not blank:
+        return values
+    return {**values, **dict.fromkeys(blank, None)}
+
+
+def _imported_ids(model_class, unique_fields, key_fields, report):
+    """
+    معرفات السجلات المنشأة والمحدثة في الاستيراد
+
+    بعض قواعد البيانات (MySQL) لا تُرجع معرفات الإنشاء الجماعي، فتُقرأ
+    بالمفاتيح الفريدة باستعلام IN واحد.
+    """
+    ids, keys = [], []
+    for obj in report.created_objects + report.updated_objects:
+        if obj.pk is not None:
+            ids.append(obj.pk)
+            continue
+        key = _row_key(key_fields, {field.name: getattr(obj, field.attname) for field in key_fields})
+        if key is not None:
+            keys.append(key)
+    ids.extend(_existing_keys(model_class, unique_fields, keys).values())
+    return ids
+
+
+def _row_key(key_fields, values):
+    if not key_fields:
+        return None
+    key = []
+    for field in key_fields:
+        value = values.get(field.name)
+        if value is None or value == '':
+            return None
+        key.append(_lookup_value(field, value))
+    return tuple(key)
+
+
+def validate_dataframe(df, model_class=None, required_fields=None):
+    """
+    التحقق من صحة إطار البيانات بعمليات على الأعمدة كاملة قبل الوصول لقاعدة البيانات
+    
+    يتم فحص الحقول المطلوبة، والحقول الرقمية والتواريخ، وأطوال الحقول النصية
+    حسب تعريف النموذج.
+    
+    المعلمات:
+    df (DataFrame): إطار البيانات بأسماء حقول النموذج
+    model_class (Model): النموذج لاستخراج أنواع الحقول
+    required_fields (list): الحقول المطلوبة
+    
+    تُرجع: (قناع الصفوف الصالحة Series، قائمة الأخطاء برقم الصف)
+    """
+    valid = pd.Series(True, index=df.index)
+    errors = []
+    
+    def reject(mask, field, message):
+        mask = mask & valid
+        for index in df.index[mask]:
+            errors.append({
+                'row': df.index.get_loc(index) + 1,
+                'field': field,
+                'value': df.at[index, field] if field in df.columns else None,
+                'error': message,
+            })
+        valid[mask] = False
+    
+    def empty(column):
+        return column.isna() | (column.astype(str).str.strip() == '')
+    
+    for field in required_fields or []:
+        if field not in df.columns:
+            reject(pd.Series(True, index=df.index), field, f'العمود {field} غير موجود')
+        else:
+            reject(empty(df[field]), field, 'حقل مطلوب')
+    
+    if model_class is not None:
+        for field in model_class._meta.concrete_fields:
+            name = field.attname if field.attname in df.columns else field.name
+            if name not in df.columns:
+                continue
+            column = df[name]
+            present = ~empty(column)
+            internal_type = field.get_internal_type()
+            
+            if internal_type in NUMERIC_FIELD_TYPES:
+                reject(present & pd.to_numeric(column, errors='coerce').isna(), name, 'قيمة رقمية غير صالحة')
+            elif internal_type in DATE_FIELD_TYPES:
+                parsed = pd.to_datetime(column.where(present), errors='coerce')
+                reject(present & parsed.isna(), name, 'تاريخ غير صالح')
+            elif getattr(field, 'max_length', None) and internal_type in ('CharField', 'SlugField', 'EmailField'):
+                reject(present & (column.astype(str).str.len() > field.max_length), name,
+                       f'الطول الأقصى {field.max_length} حرف')
+    
+    return valid, errors
 
 
 def validate_import_data(data, validators=None):
@@ -421,7 +748,7 @@ class PandasImporter(BaseImporter):
     استيراد البيانات باستخدام pandas
     """
     
-    def __init__(self, model_class=None, mapping=None, validators=None, unique_fields=None):
+    def __init__(self, model_class=None, mapping=None, validators=None, unique_fields=None, required_fields=None):
         """
         تهيئة المستورد
         
@@ -430,9 +757,12 @@ class PandasImporter(BaseImporter):
         mapping (dict): تعيين الأعمدة للحقول
         validators (dict): دوال التحقق من صحة البيانات
         unique_fields (list): حقول التفرد لتحديد الكائنات الموجودة
+        required_fields (list): الحقول المطلوبة في كل صف
         """
         super().__init__(model_class, mapping, validators)
         self.unique_fields = unique_fields or ['id']
+        self.required_fields = required_fields or []
+        self.report = None
         self.df = None
     
     @classmethod
@@ -582,12 +912,42 @@ class PandasImporter(BaseImporter):
             self.skipped_count += 1
             return None
     
-    def import_all(self, update_existing=True):
+    def validate_data(self):
+        """
+        التحقق من صحة كل الصفوف دفعة واحدة على إطار البيانات
+        
+        تُرجع:
+        Series: قناع الصفوف الصالحة
+        """
+        # إعادة تسمية الأعمدة إلى أسماء الحقول للتحقق حسب تعريف النموذج
+        mapped = self.df.rename(columns=self.mapping)
+        mapped = mapped.loc[:, ~mapped.columns.duplicated()]
+        valid, errors = validate_dataframe(mapped, self.model_class, self.required_fields)
+        self.errors.extend(errors)
+        return valid
+    
+    def _drop_empty_values(self, data):
+        # القيم الفارغة في الحقول غير النصية تُترك للقيمة الافتراضية للحقل
+        cleaned = {}
+        for name, value in data.items():
+            if value == '':
+                try:
+                    field = self.model_class._meta.get_field(name)
+                except Exception:
+                    field = None
+                if field is not None and field.get_internal_type() not in TEXT_FIELD_TYPES:
+                    continue
+            cleaned[name] = value
+        return cleaned
+    
+    def import_all(self, update_existing=True, chunk_size=None, progress=None):
         """
-        استيراد جميع البيانات
+        استيراد جميع البيانات باستخدام محرك الاستيراد الجماعي
         
         المعلمات:
         update_existing (bool): تحديث الكائنات الموجودة
+        chunk_size (int): عدد الصفوف في كل دفعة
+        progress (callable): دالة تُستدعى بتقرير كل دفعة بعد كتابتها
         
         تُرجع:
         tuple: (الكائنات المنشأة, الكائنات المحدثة, الأخطاء)
@@ -602,38 +962,35 @@ class PandasImporter(BaseImporter):
         self.clean_data()
         self.preprocess_data()
         
-        # تحويل DataFrame إلى قائمة من القواميس
-        data = self.df.to_dict('records')
+        # التحقق من الصفوف على إطار البيانات قبل الوصول لقاعدة البيانات
+        valid = self.validate_data()
+        self.skipped_count += int((~valid).sum())
         
-        created_objects = []
-        updated_objects = []
+        rows = []
+        for row_number, row_data in enumerate(self.df.to_dict('records'), start=1):
+            if not valid.iloc[row_number - 1]:
+                continue
+            processed_data = self.process_row(row_data)
+            if not processed_data:
+                self.skipped_count += 1
+                continue
+            rows.append((row_number, self._drop_empty_values(processed_data)))
         
-        # استخدام المعاملة لضمان سلامة البيانات
-        with transaction.atomic():
-            for row_data in data:
-                processed_data = self.process_row(row_data)
-                if not processed_data:
-                    self.skipped_count += 1
-                    continue
-                
-                # البحث عن كائن موجود
-                existing_obj = self.find_existing_object(processed_data)
-                
-                if existing_obj and update_existing:
-                    # تحديث الكائن الموجود
-                    updated_obj = self.update_object(existing_obj, processed_data)
-                    if updated_obj:
-                        updated_objects.append(updated_obj)
-                elif not existing_obj:
-                    # إنشاء كائن جديد
-                    new_obj = self.create_object(processed_data)
-                    if new_obj:
-                        created_objects.append(new_obj)
-                else:
-                    # تخطي الكائن الموجود
-                    self.skipped_count += 1
+        report = bulk_upsert(
+            self.model_class,
+            rows,
+            unique_fields=self.unique_fields,
+            update_existing=update_existing,
+            chunk_size=chunk_size,
+            progress=progress,
+        )
+        self.report = report
+        self.created_count += report.created
+        self.updated_count += report.updated
+        self.skipped_count += report.skipped + len(report.errors)
+        self.errors.extend(report.errors)
         
-        return created_objects, updated_objects, self.errors
+        return report.created_objects, report.updated_objects, self.errors
 
 
 def import_excel_to_model(file_path, model_class, mapping=None, validators=None, unique_fields=None, update_existing=True):
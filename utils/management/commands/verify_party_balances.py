@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from client.models import Customer
+from supplier.models import Supplier
+from utils.balances import rebuild_balances, verify_balances
+
+PARTY_MODELS = {
+    'customer': Customer,
+    'supplier': Supplier,
+}
+
+
+class Command(BaseCommand):
+    help = 'التحقق من تطابق أرصدة العملاء والموردين مع سجل قيود الأرصدة وإصلاحها'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--party', choices=sorted(PARTY_MODELS), action='append', dest='parties',
+                            help='نوع صاحب الرصيد (يمكن تكراره، الافتراضي الكل)')
+        parser.add_argument('--fix', action='store_true',
+                            help='إعادة حساب الأرصدة غير المتطابقة من القيود')
+
+    def handle(self, *args, **options):
+        mismatched = 0
+        for name in options['parties'] or sorted(PARTY_MODELS):
+            model = PARTY_MODELS[name]
+            rows = verify_balances(model)
+            mismatched += len(rows)
+            for pk, balance, ledger in rows:
+                self.stdout.write(f'{name} {pk}: الرصيد المخزن {balance} ومجموع القيود {ledger}')
+
+            if rows and options['fix']:
+                rebuild_balances(model, [pk for pk, _, _ in rows])
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS('كل الأرصدة مطابقة لسجل القيود'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'تم إصلاح {mismatched} رصيد'))
+        else:
+            self.stdout.write(self.style.WARNING(f'يوجد {mismatched} رصيد غير مطابق (استخدم --fix للإصلاح)'))
@@ -0,0 +1,78 @@
+"""
+إجماليات مدفوعات الفواتير
+
+فواتير المبيعات والمشتريات تحسب المبلغ المدفوع من دفعاتها المرتبطة
+(related_name='payments'). بدلاً من استعلام aggregate لكل فاتورة:
+- with_payment_totals: تضيف المدفوع والمتبقي لكل فاتورة باستعلام فرعي واحد
+- paid_amount: عمود مخزن في الفاتورة يُعاد حسابه بعبارة UPDATE واحدة عند كل
+  كتابة على دفعاتها، فتقرأه خصائص النموذج بدون أي استعلام
+"""
+from decimal import Decimal
+
+from django.db import models
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+# اسم العلاقة العكسية من الفاتورة إلى دفعاتها
+PAYMENTS_RELATED_NAME = 'payments'
+
+AMOUNT_FIELD = DecimalField(max_digits=12, decimal_places=2)
+
+
+def paid_amount_subquery(invoice_model):
+    """
+    استعلام فرعي بمجموع دفعات الفاتورة الخارجية (صفر إذا لم توجد دفعات)
+    """
+    relation = invoice_model._meta.get_field(PAYMENTS_RELATED_NAME)
+    fk_name = relation.field.name
+    payments = (
+        relation.related_model.objects
+        .filter(**{fk_name: OuterRef('pk')})
+        .order_by()
+        .values(fk_name)
+        .annotate(paid=Sum('amount'))
+        .values('paid')
+    )
+    return Coalesce(Subquery(payments, output_field=AMOUNT_FIELD), Value(Decimal('0')), output_field=AMOUNT_FIELD)
+
+
+class PaymentTotalsQuerySet(models.QuerySet):
+    """
+    استعلام فواتير يدعم إضافة إجماليات المدفوعات
+    """
+
+    def with_payment_totals(self):
+        """
+        إضافة paid_total و due_total لكل فاتورة باستعلام فرعي واحد
+
+        خصائص amount_paid و amount_due و is_fully_paid تستخدم هذه القيم عند وجودها.
+        """
+        return self.annotate(
+            paid_total=paid_amount_subquery(self.model),
+        ).annotate(
+            due_total=F('total') - F('paid_total'),
+        )
+
+
+def refresh_paid_amount(invoice):
+    """
+    إعادة حساب عمود paid_amount للفاتورة من دفعاتها
+
+    يتم الحساب والكتابة في عبارة UPDATE واحدة حتى لا تضيع دفعة متزامنة،
+    ثم تُحدّث قيمة العمود في الكائن نفسه.
+
+    المعلمات:
+    invoice (Sale | Purchase): الفاتورة
+
+    تُرجع: المبلغ المدفوع بعد التحديث
+    """
+    model = type(invoice)
+    invoices = model.objects.filter(pk=invoice.pk)
+    invoices.update(paid_amount=paid_amount_subquery(model))
+    paid_amount = invoices.values_list('paid_amount', flat=True).first()
+    if paid_amount is not None:
+        invoice.paid_amount = paid_amount
+    # إزالة القيمة المضافة من with_payment_totals حتى لا تُقرأ قيمة قديمة
+    invoice.__dict__.pop('paid_total', None)
+    invoice.__dict__.pop('due_total', None)
+    return invoice.paid_amount
@@ -0,0 +1,94 @@
+"""
+حالة إرجاع الفواتير
+
+فواتير المبيعات والمشتريات تُعتبر مرتجعة عند وجود مرتجع مؤكد لها:
+- 'full': كل بنود الفاتورة مرتجعة بالكامل
+- 'partial': يوجد بند لم تُرجع كل كميته
+- None: لا يوجد مرتجع مؤكد
+
+تُحسب الحالة لمجموعة فواتير (صفحة من القائمة مثلاً) باستعلامين مجمعين
+بدلاً من المرور على بنود كل فاتورة وبنود كل مرتجع لها.
+"""
+from django.db.models import Q, Sum
+from django.db.models.functions import Coalesce
+
+# حالة المرتجع المحتسبة
+CONFIRMED_STATUS = 'confirmed'
+
+
+def _relations(document_model):
+    """
+    أسماء العلاقات بين الفاتورة وبنودها ومرتجعاتها وبنود المرتجعات
+    """
+    returns = document_model._meta.get_field('returns')
+    items = document_model._meta.get_field('items')
+    item_model = items.related_model
+    return_items = item_model._meta.get_field('return_items')
+    return_fk = next(
+        field.name for field in return_items.related_model._meta.concrete_fields
+        if field.is_relation and field.related_model is returns.related_model
+    )
+    return {
+        'return_model': returns.related_model,
+        'return_document': returns.field.name,
+        'item_model': item_model,
+        'item_document': items.field.name,
+        'return_status': f'return_items__{return_fk}__status',
+    }
+
+
+def compute_return_statuses(document_model, document_ids):
+    """
+    حساب حالة الإرجاع لمجموعة فواتير
+
+    المعلمات:
+    document_model: نموذج الفاتورة (Sale أو Purchase)
+    document_ids (list): معرفات الفواتير
+
+    تُرجع: قاموس {معرف الفاتورة: 'full' أو 'partial'} للفواتير المرتجعة فقط
+    """
+    if not document_ids:
+        return {}
+    relations = _relations(document_model)
+
+    # الفواتير التي لها مرتجع مؤكد
+    returned_ids = set(relations['return_model'].objects.filter(**{
+        f"{relations['return_document']}__in": list(document_ids),
+        'status': CONFIRMED_STATUS,
+    }).values_list(relations['return_document'], flat=True))
+    if not returned_ids:
+        return {}
+
+    # الكمية المرتجعة لكل بند من بنود هذه الفواتير
+    items = relations['item_model'].objects.filter(**{
+        f"{relations['item_document']}__in": returned_ids,
+    }).order_by().values_list('pk', relations['item_document'], 'quantity').annotate(
+        returned=Coalesce(Sum('return_items__quantity', filter=Q(**{relations['return_status']: CONFIRMED_STATUS})), 0),
+    )
+
+    statuses = dict.fromkeys(returned_ids, 'full')
+    for _, document_id, quantity, returned in items:
+        if returned < quantity:
+            statuses[document_id] = 'partial'
+    return statuses
+
+
+def resolve_return_statuses(documents):
+    """
+    إرفاق حالة الإرجاع بمجموعة فواتير من نفس النوع
+
+    خاصية return_status في كل فاتورة تستخدم القيمة المرفقة بدلاً من الاستعلام.
+
+    المعلمات:
+    documents (iterable): الفواتير (صفحة من القائمة مثلاً)
+
+    تُرجع: قائمة الفواتير نفسها
+    """
+    documents = list(documents)
+    if not documents:
+        return documents
+
+    statuses = compute_return_statuses(type(documents[0]), [document.pk for document in documents])
+    for document in documents:
+        document._return_status = statuses.get(document.pk)
+    return documents
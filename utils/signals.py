@@ -0,0 +1,8 @@
+"""
+إشارات الأدوات المساعدة
+"""
+from django.dispatch import Signal
+
+# تُرسل بعد الاستيراد الجماعي (utils.importers.bulk_upsert) لأن الكتابة الجماعية
+# لا ترسل إشارات الحفظ، والمرسل هو النموذج والمعامل ids معرفات السجلات المنشأة والمحدثة
+bulk_imported = Signal()
@@ -0,0 +1,305 @@
+"""
+كشوف حسابات العملاء والموردين
+
+يجمع الكشف الفواتير والمرتجعات المؤكدة والمدفوعات في استعلام واحد
+(UNION ALL)، ويحسب الرصيد التراكمي داخل قاعدة البيانات بدلاً من تحميل كل
+الحركات في الذاكرة وترتيبها:
+- الصفحة تُقرأ بترقيم المفاتيح (keyset) من الأحدث للأقدم، فلا يُحمّل إلا حجم الصفحة
+- الرصيد قبل أقدم حركة في الصفحة باستعلام تجميعي واحد، ثم دالة نافذة
+  (SUM ... OVER) على حركات الصفحة فقط
+- يمكن تحديد فترة، ويُحسب الرصيد الافتتاحي لما قبلها باستعلام تجميعي واحد
+"""
+import datetime
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, DecimalField, F, IntegerField, Value
+from django.utils.dateparse import parse_date
+
+# عدد الحركات في صفحة الكشف
+DEFAULT_STATEMENT_PAGE_SIZE = 50
+
+AMOUNT_FIELD = DecimalField(max_digits=12, decimal_places=2)
+CENT = Decimal('0.01')
+
+# أعمدة الحركة الموحدة في كل مصادر الكشف
+ENTRY_COLUMNS = (
+    'entry_kind', 'entry_order', 'entry_id', 'entry_date',
+    'entry_reference', 'entry_method', 'entry_debit', 'entry_credit',
+)
+
+# مصدر حركات في الكشف
+# kind: نوع الحركة، order: ترتيبها بين حركات نفس اليوم، side: debit أو credit
+# describe: دالة تُرجع وصف الحركة من (الرقم المرجعي، طريقة الدفع)
+StatementSource = namedtuple('StatementSource', [
+    'kind', 'order', 'queryset', 'date_field', 'amount_field', 'side',
+    'reference_field', 'method_field', 'describe',
+])
+
+# صفحة من كشف الحساب
+# entries: الحركات من الأحدث للأقدم، opening_balance: الرصيد قبل بداية الفترة،
+# next_cursor: مفتاح الصفحة التالية (الأقدم) أو None
+Statement = namedtuple('Statement', ['entries', 'opening_balance', 'next_cursor'])
+
+
+def _branch(source, **date_filter):
+    """
+    استعلام حركات مصدر واحد بالأعمدة الموحدة
+    """
+    zero = Value(Decimal('0'), output_field=AMOUNT_FIELD)
+    amount = F(source.amount_field)
+    method = F(source.method_field) if source.method_field else Value('', output_field=CharField())
+    queryset = source.queryset.filter(**{
+        f'{source.date_field}__{lookup}': value for lookup, value in date_filter.items()
+    })
+    return queryset.order_by().annotate(
+        entry_kind=Value(source.kind, output_field=CharField()),
+        entry_order=Value(source.order, output_field=IntegerField()),
+        entry_id=F('pk'),
+        entry_date=F(source.date_field),
+        entry_reference=F(source.reference_field),
+        entry_method=method,
+        entry_debit=amount if source.side == 'debit' else zero,
+        entry_credit=amount if source.side == 'credit' else zero,
+    ).values(*ENTRY_COLUMNS)
+
+
+def _union_sql(sources, **date_filter):
+    parts, params = [], []
+    for source in sources:
+        sql, branch_params = _branch(source, **date_filter).query.sql_with_params()
+        parts.append(sql)
+        params.extend(branch_params)
+    return ' UNION ALL '.join(parts), params
+
+
+def _to_decimal(value):
+    if value is None:
+        return Decimal('0')
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _to_date(value):
+    if isinstance(value, str):
+        return parse_date(value[:10])
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
+
+
+def encode_cursor(entry):
+    """
+    مفتاح الصفحة التالية من آخر حركة في الصفحة الحالية
+    """
+    return f"{entry['date'].isoformat()}_{entry['order']}_{entry['id']}"
+
+
+def decode_cursor(cursor):
+    """
+    قراءة مفتاح الصفحة (التاريخ، الترتيب، المعرف) أو None إذا كان غير صالح
+    """
+    try:
+        date, order, pk = cursor.split('_')
+        date = parse_date(date)
+        if date is None:
+            return None
+        return date, int(order), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _before_key(key):
+    """
+    شرط الحركات الأقدم من مفتاح (التاريخ، الترتيب، المعرف)
+    """
+    sql = (
+        '(entries.entry_date < %s OR (entries.entry_date = %s AND (entries.entry_order < %s'
+        ' OR (entries.entry_order = %s AND entries.entry_id < %s))))'
+    )
+    key_date = connection.ops.adapt_datefield_value(key[0])
+    return sql, [key_date, key_date, key[1], key[1], key[2]]
+
+
+def _sum_balance(sources, where='', where_params=(), **date_filter):
+    union_sql, params = _union_sql(sources, **date_filter)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT SUM(entries.entry_debit - entries.entry_credit) FROM ({union_sql}) entries {where}',
+            params + list(where_params),
+        )
+        return _to_decimal(cursor.fetchone()[0])
+
+
+def opening_balance(sources, date_from):
+    """
+    الرصيد قبل بداية الفترة (مجموع المدين ناقص الدائن لكل الحركات السابقة)
+    """
+    return _sum_balance(sources, lt=date_from)
+
+
+def balance_before(sources, key):
+    """
+    الرصيد قبل حركة (مجموع المدين ناقص الدائن لكل الحركات الأقدم من مفتاحها)
+    """
+    condition, condition_params = _before_key(key)
+    return _sum_balance(sources, f'WHERE {condition}', condition_params, lte=key[0])
+
+
+def build_statement(sources, date_from=None, date_to=None, cursor=None, limit=None):
+    """
+    صفحة من كشف حساب مكون من عدة مصادر حركات
+
+    المعلمات:
+    sources (list): قائمة StatementSource
+    date_from (date): بداية الفترة (اختياري)
+    date_to (date): نهاية الفترة (اختياري)
+    cursor (str): مفتاح الصفحة من encode_cursor (اختياري، الصفحة الأولى هي الأحدث)
+    limit (int): عدد الحركات في الصفحة
+
+    تُرجع: Statement
+    """
+    limit = limit or getattr(settings, 'STATEMENT_PAGE_SIZE', DEFAULT_STATEMENT_PAGE_SIZE)
+    date_filter = {'lte': date_to} if date_to else {}
+    union_sql, params = _union_sql(sources, **date_filter)
+
+    # حركات الصفحة فقط، والرصيد التراكمي بدالة النافذة على حركات الصفحة
+    conditions, outer_params = [], []
+    if date_from:
+        conditions.append('entries.entry_date >= %s')
+        outer_params.append(connection.ops.adapt_datefield_value(date_from))
+    key = decode_cursor(cursor) if cursor else None
+    if key:
+        condition, condition_params = _before_key(key)
+        conditions.append(condition)
+        outer_params.extend(condition_params)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    sql = (
+        f'SELECT page.*, SUM(page.entry_debit - page.entry_credit) OVER ('
+        f'ORDER BY page.entry_date, page.entry_order, page.entry_id '
+        f'ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS balance FROM ('
+        f'SELECT {", ".join(f"entries.{column}" for column in ENTRY_COLUMNS)} '
+        f'FROM ({union_sql}) entries {where} '
+        f'ORDER BY entries.entry_date DESC, entries.entry_order DESC, entries.entry_id DESC '
+        f'LIMIT %s'
+        f') page '
+        f'ORDER BY page.entry_date DESC, page.entry_order DESC, page.entry_id DESC'
+    )
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params + outer_params + [limit + 1])
+        rows = db_cursor.fetchall()
+
+    # الرصيد قبل أقدم حركة مقروءة باستعلام تجميعي (بدون نافذة على كل التاريخ)
+    start_balance = Decimal('0')
+    if rows:
+        _, order, pk, date = rows[-1][:4]
+        start_balance = balance_before(sources, (_to_date(date), order, pk))
+
+    descriptions = {source.kind: source.describe for source in sources}
+    entries = []
+    for kind, order, pk, date, reference, method, debit, credit, balance in rows[:limit]:
+        entries.append({
+            'id': pk,
+            'order': order,
+            'type': kind,
+            'date': _to_date(date),
+            'reference': reference,
+            'description': descriptions[kind](reference, method),
+            'debit': _to_decimal(debit),
+            'credit': _to_decimal(credit),
+            'balance': start_balance + _to_decimal(balance),
+        })
+
+    next_cursor = encode_cursor(entries[-1]) if len(rows) > limit else None
+    return Statement(
+        entries=entries,
+        opening_balance=opening_balance(sources, date_from) if date_from else Decimal('0'),
+        next_cursor=next_cursor,
+    )
+
+
+def _payment_description(payment_model):
+    methods = dict(payment_model.PAYMENT_METHODS)
+    return lambda reference, method: f'دفعة {methods.get(method, method)}'
+
+
+def customer_statement(customer, **kwargs):
+    """
+    كشف حساب عميل: فواتير البيع (مدين) والمرتجعات المؤكدة والمدفوعات (دائن)
+
+    المعلمات:
+    customer (Customer): العميل
+    kwargs: معلمات build_statement (date_from و date_to و cursor و limit)
+
+    تُرجع: Statement
+    """
+    from client.models import CustomerPayment
+    from sale.models import Sale, SaleReturn
+
+    return build_statement([
+        StatementSource(
+            'invoice', 0, Sale.objects.filter(customer=customer), 'date', 'total', 'debit',
+            'number', None, lambda reference, method: f'فاتورة بيع رقم {reference}',
+        ),
+        StatementSource(
+            'return', 1, SaleReturn.objects.filter(sale__customer=customer, status='confirmed'),
+            'date', 'total', 'credit', 'number', None,
+            lambda reference, method: f'مرتجع مبيعات رقم {reference}',
+        ),
+        StatementSource(
+            'payment', 2, CustomerPayment.objects.filter(customer=customer), 'payment_date', 'amount',
+            'credit', 'reference_number', 'payment_method', _payment_description(CustomerPayment),
+        ),
+    ], **kwargs)
+
+
+def supplier_statement(supplier, **kwargs):
+    """
+    كشف حساب مورد: فواتير الشراء (مدين) والمرتجعات المؤكدة والمدفوعات (دائن)
+
+    المعلمات:
+    supplier (Supplier): المورد
+    kwargs: معلمات build_statement (date_from و date_to و cursor و limit)
+
+    تُرجع: Statement
+    """
+    from purchase.models import Purchase, PurchaseReturn
+    from supplier.models import SupplierPayment
+
+    return build_statement([
+        StatementSource(
+            'purchase', 0, Purchase.objects.filter(supplier=supplier), 'date', 'total', 'debit',
+            'number', None, lambda reference, method: f'فاتورة شراء رقم {reference}',
+        ),
+        StatementSource(
+            'return', 1, PurchaseReturn.objects.filter(purchase__supplier=supplier, status='confirmed'),
+            'date', 'total', 'credit', 'number', None,
+            lambda reference, method: f'مرتجع مشتريات رقم {reference}',
+        ),
+        StatementSource(
+            'payment', 2, SupplierPayment.objects.filter(supplier=supplier), 'payment_date', 'amount',
+            'credit', 'reference_number', 'payment_method', _payment_description(SupplierPayment),
+        ),
+    ], **kwargs)
+
+
+def _parse_date_param(value):
+    try:
+        return parse_date(value or '')
+    except ValueError:
+        return None
+
+
+def statement_filters(data):
+    """
+    قراءة معلمات الكشف من بيانات الطلب (statement_from و statement_to و statement_before)
+
+    تُرجع: قاموس بمعلمات build_statement
+    """
+    return {
+        'date_from': _parse_date_param(data.get('statement_from')),
+        'date_to': _parse_date_param(data.get('statement_to')),
+        'cursor': data.get('statement_before') or None,
+    }
@@ -58,6 +58,17 @@ class HelperFunctionsTest(TestCase):
         slug = arabic_slugify(mixed_text)
         self.assertTrue('123' in slug)
     
+    def test_normalize_arabic(self):
+        """
+        اختبار توحيد النص العربي للبحث
+        """
+        from utils.helpers import normalize_arabic
+        
+        self.assertEqual(normalize_arabic('أَحْمَد  إسلام آمال'), 'احمد اسلام امال')
+        self.assertEqual(normalize_arabic('مكتبة على الـــبحر'), 'مكتبه علي البحر')
+        self.assertEqual(normalize_arabic('SKU-Ab ١٢٣'), 'sku-ab 123')
+        self.assertEqual(normalize_arabic(None), '')
+    
     def test_generate_random_code(self):
         """
         اختبار توليد كود عشوائي
@@ -503,4 +514,123 @@ class LogsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertTrue('logs' in response.context)
         self.assertIsNotNone(response.context['logs'])
-        self.assertEqual(len(response.context['logs']), 2) 
\ No newline at end of file
+        self.assertEqual(len(response.context['logs']), 2) 
+
+class BulkImportTest(TestCase):
+    """
+    اختبارات محرك الاستيراد الجماعي
+    """
+
+    def setUp(self):
+        from client.models import Customer
+
+        Customer.objects.create(name='عميل قديم', code='C-1', credit_limit=100)
+        Customer.objects.create(name='عميل آخر', code='C-2')
+
+    def make_importer(self, rows):
+        import pandas as pd
+        from client.models import Customer
+        from utils.importers import PandasImporter
+
+        return PandasImporter.from_dataframe(
+            pd.DataFrame(rows),
+            model_class=Customer,
+            mapping={'الاسم': 'name', 'الكود': 'code', 'الحد': 'credit_limit'},
+            unique_fields=['code'],
+            required_fields=['name', 'code'],
+        )
+
+    def test_rows_are_split_into_creates_and_updates(self):
+        from client.models import Customer
+
+        importer = self.make_importer([
+            {'الاسم': 'عميل معدل', 'الكود': 'C-1', 'الحد': 500},
+            {'الاسم': 'عميل جديد', 'الكود': 'C-3', 'الحد': ''},
+            {'الاسم': 'عميل جديد 2', 'الكود': 'C-4', 'الحد': 50},
+            {'الاسم': 'بدون كود', 'الكود': '', 'الحد': 10},
+            {'الاسم': 'حد خاطئ', 'الكود': 'C-5', 'الحد': 'abc'},
+        ])
+        reports = []
+        created, updated, errors = importer.import_all(chunk_size=2, progress=reports.append)
+
+        self.assertEqual((len(created), len(updated)), (2, 1))
+        self.assertEqual(importer.get_stats()['skipped'], 2)
+        self.assertEqual(sorted(error['row'] for error in errors), [4, 5])
+        self.assertEqual([report['rows'] for report in reports], [2, 1])
+
+        self.assertEqual(Customer.objects.get(code='C-1').name, 'عميل معدل')
+        self.assertEqual(Customer.objects.get(code='C-1').credit_limit, 500)
+        self.assertEqual(Customer.objects.get(code='C-3').credit_limit, 0)
+        self.assertFalse(Customer.objects.filter(code='C-5').exists())
+
+    def test_queries_do_not_grow_with_rows(self):
+        from client.models import Customer
+        from utils.importers import bulk_upsert
+
+        rows = [{'name': f'عميل {i}', 'code': f'C-{i}'} for i in range(1, 201)]
+        # عدد ثابت من الاستعلامات لكل دفعة مهما كان عدد الصفوف فيها
+        with self.assertNumQueries(11):
+            report = bulk_upsert(Customer, rows, unique_fields=['code'], chunk_size=100)
+        self.assertEqual((report.created, report.updated), (198, 2))
+        self.assertEqual(Customer.objects.count(), 200)
+
+    def test_duplicate_keys_keep_last_row(self):
+        from client.models import Customer
+        from utils.importers import bulk_create_from_import
+
+        rows = [{'name': 'أول', 'code': 'C-9'}, {'name': 'ثاني', 'code': 'C-9'}]
+        self.assertEqual(bulk_create_from_import(Customer, rows, ['code']), (1, 0, 1))
+        self.assertEqual(Customer.objects.get(code='C-9').name, 'ثاني')
+
+    def test_product_import_indexes_products(self):
+        from product.models import Category, Product, Unit
+        from product.services.lookup import lookup_code
+        from product.services.search import search_products
+        from utils.importers import bulk_upsert
+
+        user = User.objects.create_user(username='importer', password='testpassword123')
+        category = Category.objects.create(name='مشروبات')
+        unit = Unit.objects.create(name='قطعة', symbol='ق')
+        Product.objects.create(
+            name='شاي', sku='P-1', category=category, unit=unit,
+            cost_price=5, selling_price=8, created_by=user,
+        )
+        self.assertEqual(lookup_code('P-1')['selling_price'], '8.00')
+
+        # total_stock غير قابل للتعديل فيتجاهله الاستيراد
+        common = {
+            'category_id': category.pk, 'unit_id': unit.pk, 'cost_price': 5, 'created_by_id': user.pk,
+            'total_stock': 99,
+        }
+        rows = [
+            {'name': 'شاي أخضر', 'sku': 'P-1', 'barcode': '', 'selling_price': 9, **common},
+            {'name': 'قهوة', 'sku': 'P-2', 'barcode': '', 'selling_price': 12, **common},
+            {'name': 'كاكاو', 'sku': 'P-3', 'barcode': ' ', 'selling_price': 15, **common},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            report = bulk_upsert(Product, rows, unique_fields=['sku'])
+
+        # الباركود الفارغ يُحفظ NULL فلا تتعارض الصفوف مع قيد التفرد
+        self.assertEqual((report.created, report.updated, report.errors), (2, 1, []))
+        self.assertEqual(Product.objects.filter(barcode__isnull=True).count(), 3)
+        self.assertFalse(Product.objects.exclude(total_stock=0).exists())
+        self.assertEqual([product.sku for product in search_products('قهوه').products], ['P-2'])
+        self.assertEqual([product.sku for product in search_products('اخضر').products], ['P-1'])
+        self.assertEqual(lookup_code('P-1')['selling_price'], '9.00')
+
+    def test_imported_signal_reports_ids(self):
+        from client.models import Customer
+        from utils.importers import bulk_upsert
+        from utils.signals import bulk_imported
+
+        received = []
+
+        def receiver(sender, ids, **kwargs):
+            received.append((sender, sorted(ids)))
+
+        bulk_imported.connect(receiver, sender=Customer)
+        self.addCleanup(bulk_imported.disconnect, receiver, sender=Customer)
+        bulk_upsert(Customer, [{'name': 'معدل', 'code': 'C-1'}, {'name': 'جديد', 'code': 'C-7'}], unique_fields=['code'])
+
+        ids = sorted(Customer.objects.filter(code__in=['C-1', 'C-7']).values_list('pk', flat=True))
+        self.assertEqual(received, [(Customer, ids)])